@@ -95,8 +95,9 @@ class JSONAnnotator(metaclass=abc.ABCMeta):
     # Requested text length limit (0 for no limit)
     __TEXT_LENGTH_LIMIT = 50 * 1024
 
-    # Store / fetch JSON annotations using Bzip2 compression
-    __USE_BZIP = True
+    # Store JSON annotations using Zstandard compression (fast to decompress for small JSON objects); annotations stored
+    # with Bzip2 or Gzip earlier get their compression method detected on fetch
+    __COMPRESSION_METHOD = KeyValueStore.Compression.ZSTD
 
     __slots__ = [
         '__postgresql_store',
@@ -109,11 +110,7 @@ class JSONAnnotator(metaclass=abc.ABCMeta):
         if kvs_table_name is None or len(kvs_table_name) == 0:
             fatal_error("Annotator's key-value store table name is not set.")
 
-        compression_method = KeyValueStore.Compression.GZIP
-        if self.__USE_BZIP:
-            compression_method = KeyValueStore.Compression.BZIP2
-
-        self.__postgresql_store = PostgreSQLStore(table=kvs_table_name, compression_method=compression_method)
+        self.__postgresql_store = PostgreSQLStore(table=kvs_table_name, compression_method=self.__COMPRESSION_METHOD)
 
         log.debug("Will read / write annotator results to PostgreSQL table: %s" % kvs_table_name)
 
@@ -442,6 +439,8 @@ class JSONAnnotator(metaclass=abc.ABCMeta):
               )
         """, {'stories_id': stories_id, 'tag_sets_names': list(unique_tag_sets_names)})
 
+        tags_ids = []
+
         for tag in tags:
             tag_sets_name = self.__strip_linebreaks_and_whitespace(tag.tag_sets_name)
             tags_name = self.__strip_linebreaks_and_whitespace(tag.tags_name)
@@ -488,18 +487,19 @@ class JSONAnnotator(metaclass=abc.ABCMeta):
                 }).hash()
             tags_id = int(db_tag['tags_id'])
 
-            # Assign story to tag (if no such mapping exists yet)
-            #
-            # (partitioned table's INSERT trigger will take care of conflicts)
-            #
-            # Not using db.create() because it tests last_inserted_id, and on duplicates there would be no such
-            # "last_inserted_id" set.
-            db.query("""
-                INSERT INTO stories_tags_map (stories_id, tags_id)
-                VALUES (%(stories_id)s, %(tags_id)s)
-            """, {
-                'stories_id': stories_id,
-                'tags_id': tags_id,
-            })
+            if tags_id not in tags_ids:
+                tags_ids.append(tags_id)
+
+        # Assign story to tags (if no such mapping exists yet)
+        #
+        # (partitioned table's INSERT trigger will take care of conflicts)
+        #
+        # Not using db.create() because it tests last_inserted_id, and on duplicates there would be no such
+        # "last_inserted_id" set.
+        db.insert_many(
+            table='stories_tags_map',
+            rows=[{'stories_id': stories_id, 'tags_id': tags_id} for tags_id in tags_ids],
+            returning=False,
+        )
 
         db.commit()
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+
+"""Measure throughput of the extraction pipeline's stages on a corpus of stored HTML pages.
+
+Every HTML page gets run through extract_content(), html_strip(), language_code_for_text(),
+split_text_to_sentences() and _clean_sentences(). Every stage gets benchmarked in its own fresh process so that its
+peak RSS can be measured separately. Results get printed as JSON, e.g.:
+
+    {
+        "documents": 26,
+        "stages": {
+            "extract_content": {
+                "documents": 26,
+                "chars": 2180102,
+                "seconds": 1.02,
+                "docs_per_sec": 25.5,
+                "chars_per_sec": 2137354.9,
+                "p50_latency_ms": 35.1,
+                "p99_latency_ms": 95.3,
+                "max_latency_ms": 97.0,
+                "peak_rss_kb": 81234,
+                "peak_rss_increase_kb": 10240
+            },
+            ...
+        }
+    }
+
+Usage:
+
+    python3 -m mediawords.benchmark_extraction --rounds 3 [--no-test-data] [--output results.json] [corpus_dir ...]
+
+HTML pages get read from crawler test data under t/data (unless --no-test-data is set) and from every "*.htm*" file
+found in the corpus directories.
+"""
+
+import argparse
+import concurrent.futures
+import glob
+import json
+import math
+import multiprocessing
+import os
+import resource
+import time
+from typing import Any, Callable, Dict, List
+
+from mediawords.dbi.downloads import extract_content
+# noinspection PyProtectedMember
+from mediawords.story_vectors import _get_sentences_from_story_text, _clean_sentences
+from mediawords.test.data import get_path_to_data_files
+from mediawords.util.identify_language import language_code_for_text
+from mediawords.util.parse_html import html_strip
+
+# Pipeline stages in the order they're run in
+STAGES = [
+    'extract_content',
+    'html_strip',
+    'language_code_for_text',
+    'split_text_to_sentences',
+    'clean_sentences',
+]
+
+
+def __run_extract_content(html: str) -> Any:
+    return extract_content(html)
+
+
+def __run_html_strip(extracted_html: str) -> Any:
+    return html_strip(extracted_html)
+
+
+def __run_language_code_for_text(text: str) -> Any:
+    return language_code_for_text(text)
+
+
+def __run_split_text_to_sentences(text_and_language: tuple) -> Any:
+    text, language_code = text_and_language
+    return _get_sentences_from_story_text(story_text=text, story_lang=language_code)
+
+
+def __run_clean_sentences(sentences: List[str]) -> Any:
+    return _clean_sentences(sentences)
+
+
+def __stage_function(stage: str) -> Callable[[Any], Any]:
+    return {
+        'extract_content': __run_extract_content,
+        'html_strip': __run_html_strip,
+        'language_code_for_text': __run_language_code_for_text,
+        'split_text_to_sentences': __run_split_text_to_sentences,
+        'clean_sentences': __run_clean_sentences,
+    }[stage]
+
+
+def __input_length(stage_input: Any) -> int:
+    """Return number of characters in a stage's input."""
+    if isinstance(stage_input, str):
+        return len(stage_input)
+    elif isinstance(stage_input, tuple):
+        return len(stage_input[0])
+    else:
+        return sum(len(x) for x in stage_input)
+
+
+def __percentile(sorted_values: List[float], percentile: float) -> float:
+    """Return nearest-rank percentile of sorted values."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(math.ceil(percentile / 100.0 * len(sorted_values))))
+    return sorted_values[rank - 1]
+
+
+def _benchmark_stage(stage: str, stage_inputs: List[Any], rounds: int) -> Dict[str, Any]:
+    """Run a single stage on all inputs (expected to be run in a fresh process); return its statistics."""
+    function = __stage_function(stage)
+
+    start_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    best_seconds = None
+    best_latencies = None
+
+    for _ in range(rounds):
+        latencies = []
+        round_start_time = time.time()
+        for stage_input in stage_inputs:
+            start_time = time.time()
+            function(stage_input)
+            latencies.append(time.time() - start_time)
+        round_seconds = time.time() - round_start_time
+
+        if best_seconds is None or round_seconds < best_seconds:
+            best_seconds = round_seconds
+            best_latencies = latencies
+
+    peak_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    chars = sum(__input_length(stage_input) for stage_input in stage_inputs)
+    sorted_latencies = sorted(best_latencies)
+
+    return {
+        'documents': len(stage_inputs),
+        'chars': chars,
+        'seconds': best_seconds,
+        'docs_per_sec': len(stage_inputs) / best_seconds if best_seconds else 0.0,
+        'chars_per_sec': chars / best_seconds if best_seconds else 0.0,
+        'p50_latency_ms': __percentile(sorted_latencies, 50) * 1000,
+        'p99_latency_ms': __percentile(sorted_latencies, 99) * 1000,
+        'max_latency_ms': (sorted_latencies[-1] if sorted_latencies else 0.0) * 1000,
+        'peak_rss_kb': peak_rss_kb,
+        'peak_rss_increase_kb': peak_rss_kb - start_rss_kb,
+    }
+
+
+def corpus_paths(corpus_dirs: List[str], include_test_data: bool = True) -> List[str]:
+    """Return paths to HTML files of test data and of the corpus directories."""
+    paths = []
+
+    if include_test_data:
+        paths += sorted(glob.glob(os.path.join(get_path_to_data_files(subdirectory='crawler'), '*', '*.html')))
+
+    for corpus_dir in corpus_dirs:
+        paths += sorted(glob.glob(os.path.join(corpus_dir, '**', '*.htm*'), recursive=True))
+
+    return paths
+
+
+def benchmark_extraction(htmls: List[str], rounds: int = 3) -> Dict[str, Any]:
+    """Run every HTML page through the extraction pipeline; return statistics of every stage."""
+
+    # Run the pipeline once to prepare inputs of every stage
+    stage_inputs = {stage: [] for stage in STAGES}
+    for html in htmls:
+        stage_inputs['extract_content'].append(html)
+        extracted = extract_content(html)
+
+        stage_inputs['html_strip'].append(extracted['extracted_html'])
+        text = extracted['extracted_text']
+
+        stage_inputs['language_code_for_text'].append(text)
+        language_code = language_code_for_text(text)
+
+        stage_inputs['split_text_to_sentences'].append((text, language_code,))
+        sentences = _get_sentences_from_story_text(story_text=text, story_lang=language_code)
+
+        stage_inputs['clean_sentences'].append(sentences)
+
+    stages = {}
+    for stage in STAGES:
+        # Fresh process for every stage for peak RSS to be of that stage only
+        with concurrent.futures.ProcessPoolExecutor(
+                max_workers=1,
+                mp_context=multiprocessing.get_context('spawn'),
+        ) as executor:
+            stages[stage] = executor.submit(_benchmark_stage, stage, stage_inputs[stage], rounds).result()
+
+    return {
+        'documents': len(htmls),
+        'rounds': rounds,
+        'stages': stages,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure throughput of the extraction pipeline's stages.")
+    parser.add_argument('--rounds', type=int, default=3, help="Number of rounds to run every stage for.")
+    parser.add_argument('--no-test-data', action='store_true', help="Don't include crawler test data.")
+    parser.add_argument('--output', type=str, default=None, help="File to write JSON results to (default: STDOUT).")
+    parser.add_argument('corpus_dirs', nargs='*', help="Directories with stored HTML pages.")
+    args = parser.parse_args()
+
+    htmls = []
+    for path in corpus_paths(corpus_dirs=args.corpus_dirs, include_test_data=not args.no_test_data):
+        with open(path, mode='r', encoding='utf-8', errors='replace') as f:
+            htmls.append(f.read())
+
+    if not htmls:
+        parser.error("No HTML pages found.")
+
+    results = benchmark_extraction(htmls=htmls, rounds=args.rounds)
+
+    results_json = json.dumps(results, indent=4, sort_keys=True)
+    if args.output:
+        with open(args.output, mode='w', encoding='utf-8') as f:
+            f.write(results_json + "\n")
+    else:
+        print(results_json)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+"""Compare throughput of advisory lock and lock-free sentence deduplication with many workers inserting sentences of
+stories from the same medium concurrently.
+
+Creates a test medium with stories, so run it against a disposable database only.
+
+Usage:
+
+    python3 -m mediawords.benchmark_sentence_dedup --label test --workers 8 --stories 100 --sentences 50
+"""
+
+import argparse
+import multiprocessing
+import time
+from typing import Dict, List, Optional
+
+from mediawords.db import connect_to_db
+# noinspection PyProtectedMember
+from mediawords.story_vectors import _insert_story_sentences, _delete_stories_sentences
+from mediawords.test.db.create import create_test_medium, create_test_feed, create_test_story
+
+
+def __story_sentences(stories_id: int, sentence_count: int, shared_ratio: float) -> List[str]:
+    """Return sentences of a story, "shared_ratio" of which are the same boilerplate sentences in every story."""
+    shared_count = int(sentence_count * shared_ratio)
+
+    sentences = ['This is a boilerplate sentence number {} of the medium.'.format(x) for x in range(shared_count)]
+    sentences += [
+        'This is a unique sentence number {} of story {}.'.format(x, stories_id)
+        for x in range(sentence_count - shared_count)
+    ]
+
+    return sentences
+
+
+def __insert_worker(label: Optional[str],
+                    stories: List[dict],
+                    sentence_count: int,
+                    shared_ratio: float,
+                    lock_free_dedup: bool) -> None:
+    """Insert sentences of every story in its own transaction."""
+    db = connect_to_db(label=label)
+
+    for story in stories:
+        db.begin()
+        _insert_story_sentences(
+            db=db,
+            story=story,
+            sentences=__story_sentences(
+                stories_id=story['stories_id'],
+                sentence_count=sentence_count,
+                shared_ratio=shared_ratio,
+            ),
+            lock_free_dedup=lock_free_dedup,
+        )
+        db.commit()
+
+    db.disconnect()
+
+
+def benchmark_sentence_dedup(label: Optional[str],
+                             worker_count: int,
+                             story_count: int,
+                             sentence_count: int,
+                             shared_ratio: float) -> Dict[str, float]:
+    """Return wall clock time (in seconds) of inserting sentences of all stories with both deduplication modes."""
+
+    db = connect_to_db(label=label)
+
+    medium = create_test_medium(db, 'sentence dedup benchmark')
+    feed = create_test_feed(db, 'sentence dedup benchmark', medium)
+    stories = []
+    for x in range(story_count):
+        story = create_test_story(db, label='sentence dedup benchmark {}'.format(x), feed=feed)
+        story['language'] = 'en'
+        stories.append(story)
+
+    timings = {}
+
+    for mode, lock_free_dedup in [('advisory_lock', False), ('lock_free', True)]:
+        _delete_stories_sentences(db=db, stories=stories)
+
+        workers = []
+        for worker_number in range(worker_count):
+            worker = multiprocessing.Process(target=__insert_worker, kwargs={
+                'label': label,
+                'stories': stories[worker_number::worker_count],
+                'sentence_count': sentence_count,
+                'shared_ratio': shared_ratio,
+                'lock_free_dedup': lock_free_dedup,
+            })
+            workers.append(worker)
+
+        start_time = time.time()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        timings[mode] = time.time() - start_time
+
+    _delete_stories_sentences(db=db, stories=stories)
+    db.disconnect()
+
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare advisory lock and lock-free sentence deduplication.")
+    parser.add_argument('--label', type=str, default='test', help="Label of a disposable database to connect to.")
+    parser.add_argument('--workers', type=int, default=8, help="Number of concurrent workers.")
+    parser.add_argument('--stories', type=int, default=100, help="Number of stories to insert sentences of.")
+    parser.add_argument('--sentences', type=int, default=50, help="Number of sentences in every story.")
+    parser.add_argument('--shared', type=float, default=0.2,
+                        help="Ratio of boilerplate sentences that are the same in every story.")
+    args = parser.parse_args()
+
+    timings = benchmark_sentence_dedup(
+        label=args.label,
+        worker_count=args.workers,
+        story_count=args.stories,
+        sentence_count=args.sentences,
+        shared_ratio=args.shared,
+    )
+
+    print("%-15s %10s %15s" % ('Mode', 'Time (s)', 'Stories / s'))
+    for mode in ['advisory_lock', 'lock_free']:
+        print("%-15s %10.2f %15.1f" % (mode, timings[mode], args.stories / timings[mode]))
+
+
+if __name__ == '__main__':
+    main()
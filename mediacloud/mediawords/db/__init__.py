@@ -1,6 +1,10 @@
+import contextlib
+import functools
+import os
 import typing
 
 from mediawords.db.handler import DatabaseHandler
+from mediawords.db.replicas import ReplicaRouter
 from mediawords.test.db.environment import using_test_database
 
 from mediawords.util.config import get_config as py_get_config
@@ -15,23 +19,8 @@ class McConnectToDBException(Exception):
     pass
 
 
-def connect_to_db(
-        label: typing.Optional[str] = None,
-        do_not_check_schema_version: bool = False,
-        is_template: bool = False) -> DatabaseHandler:
-    """Connect to PostgreSQL.
-
-    Arguments:
-    label - db config section label for mediawords.yml
-    do_no_check_schema_version - if false, throw an error if the versions in mediawords.ym and the db do not match
-    is_template - if true, connect to a db called <db_name>_template instead of <db_name>
-
-    """
-    label = decode_str_from_bytes_if_needed(label)
-
-    # If this is Catalyst::Test run, force the label to the test database
-    if using_test_database():
-        label = 'test'
+def __database_settings(label: typing.Optional[str]) -> dict:
+    """Return connection settings from mediawords.yml for a label (or the default ones if label is None)."""
 
     config = py_get_config()
 
@@ -62,6 +51,12 @@ def connect_to_db(
     if 'host' not in settings or 'db' not in settings:
         raise McConnectToDBException("Settings are incomplete ('db' and 'host' must both be set).")
 
+    return settings
+
+
+def __connect_with_settings(settings: dict, do_not_check_schema_version: bool, is_template: bool) -> DatabaseHandler:
+    """Connect to PostgreSQL using connection settings from mediawords.yml."""
+
     host = settings['host']
     port = int(settings['port'])
     username = settings['user']
@@ -93,9 +88,210 @@ def connect_to_db(
     if ret is None:
         raise McConnectToDBException("Error while connecting to the database.")
 
+    _set_session_settings(db=ret)
+
+    return ret
+
+
+def __connect_to_replica(label: str) -> DatabaseHandler:
+    """Connect to a read replica labeled "label" in mediawords.yml."""
+    settings = __database_settings(label=label)
+
+    # Replica has the same schema as the primary which has been checked already
+    return __connect_with_settings(settings=settings, do_not_check_schema_version=True, is_template=False)
+
+
+def __replica_router(settings: dict) -> typing.Optional[ReplicaRouter]:
+    """Return router to the read replicas listed in connection settings, or None if there are no replicas."""
+
+    replica_labels = settings.get('replicas', None)
+    if not replica_labels:
+        return None
+
+    if isinstance(replica_labels, str):
+        replica_labels = [replica_labels]
+
+    # Replicas get connected to lazily, on the first query routed to them
+    connectors = [functools.partial(__connect_to_replica, label=replica_label) for replica_label in replica_labels]
+
+    return ReplicaRouter(
+        connectors=connectors,
+        max_lag=float(settings.get('replica_max_lag', ReplicaRouter.DEFAULT_MAX_LAG)),
+        lag_check_interval=float(settings.get('replica_lag_check_interval', ReplicaRouter.DEFAULT_LAG_CHECK_INTERVAL)),
+    )
+
+
+def connect_to_db(
+        label: typing.Optional[str] = None,
+        do_not_check_schema_version: bool = False,
+        is_template: bool = False) -> DatabaseHandler:
+    """Connect to PostgreSQL.
+
+    If the connection settings list labels of read replicas under "replicas", read-only queries might get routed to
+    them (see DatabaseHandler.set_replica_router()).
+
+    Arguments:
+    label - db config section label for mediawords.yml
+    do_no_check_schema_version - if false, throw an error if the versions in mediawords.ym and the db do not match
+    is_template - if true, connect to a db called <db_name>_template instead of <db_name>
+
+    """
+    label = decode_str_from_bytes_if_needed(label)
+
+    # If this is Catalyst::Test run, force the label to the test database
+    if using_test_database():
+        label = 'test'
+
+    settings = __database_settings(label=label)
+
+    ret = __connect_with_settings(
+        settings=settings,
+        do_not_check_schema_version=do_not_check_schema_version,
+        is_template=is_template,
+    )
+
+    if not is_template:
+        replica_router = __replica_router(settings=settings)
+        if replica_router is not None:
+            ret.set_replica_router(
+                replica_router=replica_router,
+                route_all_selects=bool(settings.get('route_all_selects_to_replicas', False)),
+            )
+
+    return ret
+
+
+def _set_session_settings(db: DatabaseHandler) -> None:
+    """Set session settings configured in mediawords.yml for a fresh (or just reset) connection."""
+    config = py_get_config()
+
     if 'db_statement_timeout' in config['mediawords']:
         db_statement_timeout = config['mediawords']['db_statement_timeout']
 
-        ret.query('SET statement_timeout TO %(db_statement_timeout)s' % {'db_statement_timeout': db_statement_timeout})
+        db.query('SET statement_timeout TO %(db_statement_timeout)s' % {'db_statement_timeout': db_statement_timeout})
 
-    return ret
+
+class _DatabaseConnectionPool(object):
+    """Per-process pool of idle database connections with the same connection settings."""
+
+    # Max. number of idle connections to keep in a single pool
+    __MAX_IDLE_CONNECTIONS = 4
+
+    __slots__ = [
+        '__label',
+        '__is_template',
+
+        # PID of the process that the pool was created in
+        '__pid',
+
+        # Idle connections (last returned connection at the end)
+        '__idle_connections',
+
+        # Whether the schema version has been checked for the first connection of the pool
+        '__schema_version_checked',
+    ]
+
+    def __init__(self, label: typing.Optional[str], is_template: bool):
+        self.__label = label
+        self.__is_template = is_template
+        self.__pid = os.getpid()
+        self.__idle_connections = []
+        self.__schema_version_checked = False
+
+    def get(self) -> DatabaseHandler:
+        """Return healthy idle connection or connect to the database."""
+
+        while len(self.__idle_connections) > 0:
+            db = self.__idle_connections.pop()
+            if db.is_healthy():
+                return db
+            else:
+                log.warning("Discarding unhealthy pooled database connection.")
+                try:
+                    db.disconnect()
+                except Exception as ex:
+                    log.debug("Unable to disconnect from unhealthy connection: %s" % str(ex))
+
+        db = connect_to_db(
+            label=self.__label,
+            do_not_check_schema_version=self.__schema_version_checked,
+            is_template=self.__is_template,
+        )
+
+        # If schema is not up-to-date, connect_to_db() dies and we don't get to set the flag here
+        self.__schema_version_checked = True
+
+        return db
+
+    def put(self, db: DatabaseHandler) -> None:
+        """Reset the connection's session state and return it to the pool (or disconnect if the pool is full)."""
+
+        if os.getpid() != self.__pid:
+            # Connection got inherited from the parent process, don't touch the parent's socket
+            return
+
+        try:
+            db.reset_session()
+            _set_session_settings(db=db)
+        except Exception as ex:
+            log.warning("Unable to reset session of pooled database connection, disconnecting: %s" % str(ex))
+            try:
+                db.disconnect()
+            except Exception as ex:
+                log.debug("Unable to disconnect: %s" % str(ex))
+            return
+
+        if len(self.__idle_connections) >= self.__MAX_IDLE_CONNECTIONS:
+            db.disconnect()
+        else:
+            self.__idle_connections.append(db)
+
+
+# Connection pools of the current process, keyed by (PID, label, whether template DB is used, whether test DB is used)
+__connection_pools = {}
+
+
+def __connection_pool(label: typing.Optional[str], is_template: bool) -> _DatabaseConnectionPool:
+    """Return connection pool of the current process for the connection settings."""
+    global __connection_pools
+
+    pool_key = (os.getpid(), label, is_template, using_test_database(),)
+
+    if pool_key not in __connection_pools:
+
+        # Forget about pools inherited from the parent process
+        __connection_pools = {key: pool for key, pool in __connection_pools.items() if key[0] == os.getpid()}
+
+        __connection_pools[pool_key] = _DatabaseConnectionPool(label=label, is_template=is_template)
+
+    return __connection_pools[pool_key]
+
+
+@contextlib.contextmanager
+def pooled_connection_to_db(
+        label: typing.Optional[str] = None,
+        is_template: bool = False) -> typing.Generator[DatabaseHandler, None, None]:
+    """Get a connection from the process-wide connection pool, return it to the pool afterwards.
+
+    Short-lived users (e.g. jobs) should use this instead of connect_to_db() to avoid connecting to PostgreSQL (and
+    checking the schema version) every time:
+
+        with pooled_connection_to_db() as db:
+            db.query(...)
+
+    The connection's session state (open transactions, run-time parameters, temporary tables, advisory locks) gets
+    reset when it is returned to the pool, so don't disconnect() the connection yourself.
+
+    Arguments:
+    label - db config section label for mediawords.yml
+    is_template - if true, connect to a db called <db_name>_template instead of <db_name>
+    """
+    label = decode_str_from_bytes_if_needed(label)
+
+    pool = __connection_pool(label=label, is_template=is_template)
+
+    db = pool.get()
+    try:
+        yield db
+    finally:
+        pool.put(db)
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+"""Compare attach_child_query()'s array parameter and temporary table strategies across ID set sizes.
+
+Usage:
+
+    python3 -m mediawords.db.benchmark_attach_child_query --sizes 10,100,1000,10000,100000
+"""
+
+import argparse
+import time
+from typing import Dict, List
+
+from mediawords.db import connect_to_db
+from mediawords.db.handler import DatabaseHandler
+
+# Large enough value to make attach_child_query() always use an array parameter
+__ALWAYS_ARRAY_MAX_IDS = 2 ** 31
+
+
+def __time_attach_child_query(db: DatabaseHandler, ids: List[int], rounds: int) -> float:
+    """Return best time (in seconds) of attaching children to parents with given IDs."""
+    best_time = None
+
+    for _ in range(rounds):
+        parents = [{'parent_id': parent_id} for parent_id in ids]
+
+        start_time = time.time()
+        db.attach_child_query(
+            data=parents,
+            child_query='SELECT parent_id, child_name FROM _benchmark_children',
+            child_field='child_name',
+            id_column='parent_id',
+            single=True,
+        )
+        elapsed_time = time.time() - start_time
+
+        if best_time is None or elapsed_time < best_time:
+            best_time = elapsed_time
+
+    return best_time
+
+
+def benchmark_attach_child_query(db: DatabaseHandler,
+                                 sizes: List[int],
+                                 child_count: int = 1000000,
+                                 rounds: int = 3) -> Dict[int, Dict[str, float]]:
+    """Return best time (in seconds) of both attach_child_query() strategies for every ID set size."""
+
+    db.query("""
+        CREATE TEMPORARY TABLE _benchmark_children AS
+            SELECT i AS parent_id, 'Child #' || i AS child_name
+            FROM generate_series(1, %(child_count)s) AS i
+    """, {'child_count': child_count})
+    db.query("CREATE INDEX _benchmark_children_parent_id ON _benchmark_children (parent_id)")
+    db.query("ANALYZE _benchmark_children")
+
+    timings = {}
+
+    try:
+        for size in sizes:
+            # Spread IDs over the whole table
+            step = max(1, child_count // size)
+            ids = list(range(1, child_count + 1, step))[:size]
+
+            db.set_attach_child_query_max_array_ids(__ALWAYS_ARRAY_MAX_IDS)
+            array_time = __time_attach_child_query(db=db, ids=ids, rounds=rounds)
+
+            db.set_attach_child_query_max_array_ids(0)
+            temporary_table_time = __time_attach_child_query(db=db, ids=ids, rounds=rounds)
+
+            timings[size] = {
+                'array': array_time,
+                'temporary_table': temporary_table_time,
+            }
+
+    finally:
+        db.query("DROP TABLE _benchmark_children")
+
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare attach_child_query() strategies across ID set sizes.")
+    parser.add_argument('--sizes', type=str, default='10,100,1000,10000,100000',
+                        help="Comma-separated list of ID set sizes.")
+    parser.add_argument('--children', type=int, default=1000000, help="Number of child rows to create.")
+    parser.add_argument('--rounds', type=int, default=3, help="Number of rounds to run for every size.")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+
+    db = connect_to_db()
+
+    timings = benchmark_attach_child_query(db=db, sizes=sizes, child_count=args.children, rounds=args.rounds)
+
+    print("%10s %14s %18s" % ('IDs', 'array (ms)', 'temp. table (ms)'))
+    for size in sizes:
+        print("%10d %14.2f %18.2f" % (
+            size, timings[size]['array'] * 1000, timings[size]['temporary_table'] * 1000,
+        ))
+
+    db.disconnect()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,8 @@
+import datetime
+import decimal
+import struct
 import tempfile
+from typing import Any, Iterable, List, Optional
 
 import psycopg2
 from psycopg2.extras import DictCursor
@@ -14,6 +18,219 @@ class McCopyFromException(McDatabaseHandlerException):
     pass
 
 
+class McEncodeCopyTextValueException(McCopyFromException):
+    """encode_copy_text_value() exception."""
+    pass
+
+
+class McEncodeCopyBinaryValueException(McCopyFromException):
+    """encode_copy_binary_value() exception."""
+    pass
+
+
+# NULL marker of COPY's TEXT format
+COPY_TEXT_NULL = '\\N'
+
+
+def __escape_copy_text(value: str) -> str:
+    """Escape backslashes, tabs and line breaks for a value to be used in COPY's TEXT format."""
+    return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def __array_element(value: Any) -> str:
+    """Encode value as an element of PostgreSQL's array literal (before escaping it for COPY)."""
+    if value is None:
+        return 'NULL'
+    if isinstance(value, (list, tuple)):
+        return '{%s}' % ','.join(__array_element(x) for x in value)
+
+    value = __copy_text_value(value)
+    return '"%s"' % value.replace('\\', '\\\\').replace('"', '\\"')
+
+
+def __copy_text_value(value: Any) -> str:
+    """Encode non-NULL value to a string understood by PostgreSQL, don't escape it yet."""
+
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    elif isinstance(value, (int, float, decimal.Decimal)):
+        return str(value)
+    elif isinstance(value, str):
+        return value
+    elif isinstance(value, (datetime.date, datetime.time, datetime.datetime)):
+        return value.isoformat()
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        # BYTEA in hex format
+        return '\\x%s' % bytes(value).hex()
+    elif isinstance(value, (list, tuple)):
+        return '{%s}' % ','.join(__array_element(x) for x in value)
+    else:
+        raise McEncodeCopyTextValueException("Unsupported value type '%s' for value '%s'" % (type(value), str(value)))
+
+
+def encode_copy_text_value(value: Any) -> str:
+    """Encode a Python value into a single column value of COPY's TEXT format (NULL marker included)."""
+    if value is None:
+        return COPY_TEXT_NULL
+    return __escape_copy_text(__copy_text_value(value))
+
+
+def encode_copy_text_row(values: List[Any]) -> str:
+    """Encode a list of Python values into a single (newline-terminated) line of COPY's TEXT format."""
+    return '\t'.join(encode_copy_text_value(value) for value in values) + '\n'
+
+
+# Signature, flags field and header extension area length of COPY's BINARY format
+COPY_BINARY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('!ii', 0, 0)
+
+# File trailer of COPY's BINARY format
+COPY_BINARY_TRAILER = struct.pack('!h', -1)
+
+# Field length of NULL values in COPY's BINARY format
+__COPY_BINARY_NULL = struct.pack('!i', -1)
+
+# PostgreSQL's DATE / TIMESTAMP epoch
+__POSTGRESQL_EPOCH_DATE = datetime.date(2000, 1, 1)
+__POSTGRESQL_EPOCH_TIMESTAMP = datetime.datetime(2000, 1, 1)
+
+
+def __binary_date(value: datetime.date) -> bytes:
+    if isinstance(value, datetime.datetime):
+        value = value.date()
+    return struct.pack('!i', (value - __POSTGRESQL_EPOCH_DATE).days)
+
+
+def __binary_timestamp(value: datetime.datetime) -> bytes:
+    if value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    delta = value - __POSTGRESQL_EPOCH_TIMESTAMP
+    return struct.pack('!q', (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds)
+
+
+# Column type OID -> encoder of a non-NULL value in COPY's BINARY format
+__COPY_BINARY_ENCODERS = {
+    16: lambda value: b'\x01' if value else b'\x00',  # BOOLEAN
+    17: lambda value: bytes(value),  # BYTEA
+    19: lambda value: value.encode('utf-8'),  # NAME
+    20: lambda value: struct.pack('!q', value),  # BIGINT
+    21: lambda value: struct.pack('!h', value),  # SMALLINT
+    23: lambda value: struct.pack('!i', value),  # INT
+    25: lambda value: value.encode('utf-8'),  # TEXT
+    26: lambda value: struct.pack('!I', value),  # OID
+    700: lambda value: struct.pack('!f', value),  # REAL
+    701: lambda value: struct.pack('!d', value),  # DOUBLE PRECISION
+    1042: lambda value: value.encode('utf-8'),  # CHAR(n)
+    1043: lambda value: value.encode('utf-8'),  # VARCHAR(n)
+    1082: __binary_date,  # DATE
+    1114: __binary_timestamp,  # TIMESTAMP
+    1184: __binary_timestamp,  # TIMESTAMP WITH TIME ZONE (naive values are assumed to be in UTC)
+}
+
+
+def copy_binary_type_is_supported(type_code: int) -> bool:
+    """Return True if values of a column type (OID) can be encoded with encode_copy_binary_value()."""
+    return type_code in __COPY_BINARY_ENCODERS
+
+
+def encode_copy_binary_value(value: Any, type_code: int) -> bytes:
+    """Encode a Python value into a single field of COPY's BINARY format (field length included)."""
+    if value is None:
+        return __COPY_BINARY_NULL
+
+    encoder = __COPY_BINARY_ENCODERS.get(type_code, None)
+    if encoder is None:
+        raise McEncodeCopyBinaryValueException("Unsupported column type %d" % type_code)
+
+    try:
+        data = encoder(value)
+    except Exception as ex:
+        raise McEncodeCopyBinaryValueException(
+            "Unable to encode value '%s' of type '%s' for column type %d: %s" % (
+                str(value), type(value), type_code, str(ex),
+            ))
+
+    return struct.pack('!i', len(data)) + data
+
+
+def encode_copy_binary_row(values: List[Any], type_codes: List[int]) -> bytes:
+    """Encode a list of Python values into a single tuple of COPY's BINARY format."""
+    return struct.pack('!h', len(values)) + b''.join(
+        encode_copy_binary_value(value=value, type_code=type_code) for value, type_code in zip(values, type_codes)
+    )
+
+
+class CopyRowsReader(object):
+    """File-like object to be passed to cursor.copy_expert() which encodes rows from an iterable in COPY's TEXT (or
+    BINARY) format as they're being read, so that rows get streamed to PostgreSQL in large chunks without being written
+    to a temporary file first."""
+
+    __slots__ = [
+        '__rows',
+        '__column_count',
+
+        # Column type OIDs if encoding in COPY's BINARY format; None for TEXT format
+        '__binary_type_codes',
+
+        '__buffer',
+        '__finished',
+
+        # Number of rows read so far
+        'row_count',
+    ]
+
+    def __init__(self, rows: Iterable[Any], column_count: int, binary_type_codes: Optional[List[int]] = None):
+        if column_count < 1:
+            raise McCopyFromException("Column count must be positive.")
+        if binary_type_codes is not None and len(binary_type_codes) != column_count:
+            raise McCopyFromException("Column type count doesn't match column count.")
+
+        self.__rows = iter(rows)
+        self.__column_count = column_count
+        self.__binary_type_codes = binary_type_codes
+        self.__finished = False
+        self.row_count = 0
+
+        if binary_type_codes is not None:
+            self.__buffer = bytearray(COPY_BINARY_HEADER)
+        else:
+            self.__buffer = bytearray()
+
+    def __encode_row(self, row: Any) -> bytes:
+        if len(row) != self.__column_count:
+            raise McCopyFromException("Row #%d has %d values while %d columns are being copied: %s" % (
+                self.row_count, len(row), self.__column_count, str(row),
+            ))
+
+        if self.__binary_type_codes is not None:
+            return encode_copy_binary_row(values=row, type_codes=self.__binary_type_codes)
+        else:
+            return encode_copy_text_row(row).encode('utf-8')
+
+    def read(self, size: int = -1) -> bytes:
+        """Return up to "size" bytes of encoded rows; empty string after all rows have been read."""
+
+        while not self.__finished and (size < 0 or len(self.__buffer) < size):
+            try:
+                row = next(self.__rows)
+            except StopIteration:
+                self.__finished = True
+                if self.__binary_type_codes is not None:
+                    self.__buffer += COPY_BINARY_TRAILER
+                break
+
+            self.__buffer += self.__encode_row(row)
+            self.row_count += 1
+
+        if size < 0 or size >= len(self.__buffer):
+            chunk = bytes(self.__buffer)
+            self.__buffer = bytearray()
+        else:
+            chunk = bytes(self.__buffer[:size])
+            del self.__buffer[:size]
+
+        return chunk
+
+
 # FIXME writes everything to a temporary file first, does the actual copying in end()
 class CopyFrom(object):
     """COPY FROM helper."""
@@ -1,5 +1,7 @@
+import decimal
+import re
 import tempfile
-from typing import Union
+from typing import Any, List, Optional, Union
 
 import psycopg2
 from psycopg2.extras import DictCursor
@@ -15,6 +17,87 @@ class McCopyToException(McDatabaseHandlerException):
     pass
 
 
+class McDecodeCopyTextRowException(McCopyToException):
+    """decode_copy_text_row() exception."""
+    pass
+
+
+# Backslash escape sequences of COPY's TEXT format
+__COPY_TEXT_ESCAPE_REGEX = re.compile(r'\\(?:x([0-9a-fA-F]{1,2})|([0-7]{1,3})|(.))')
+
+__COPY_TEXT_ESCAPES = {
+    'b': '\b',
+    'f': '\f',
+    'n': '\n',
+    'r': '\r',
+    't': '\t',
+    'v': '\v',
+}
+
+
+def __unescape_copy_text_match(match) -> str:
+    (hex_code, octal_code, character) = match.groups()
+    if hex_code is not None:
+        return chr(int(hex_code, 16))
+    if octal_code is not None:
+        return chr(int(octal_code, 8))
+    return __COPY_TEXT_ESCAPES.get(character, character)
+
+
+def __unescape_copy_text(value: str) -> str:
+    """Unescape a single column value of COPY's TEXT format."""
+    if '\\' not in value:
+        return value
+    return __COPY_TEXT_ESCAPE_REGEX.sub(__unescape_copy_text_match, value)
+
+
+# Column type OID -> decoder of a column value; values of other types are returned as strings
+__COPY_TEXT_DECODERS = {
+    16: lambda value: value == 't',  # BOOLEAN
+    17: lambda value: bytes.fromhex(value[2:]),  # BYTEA (hex format)
+    20: int,  # BIGINT
+    21: int,  # SMALLINT
+    23: int,  # INT
+    26: int,  # OID
+    700: float,  # REAL
+    701: float,  # DOUBLE PRECISION
+    1700: decimal.Decimal,  # NUMERIC
+}
+
+
+def decode_copy_text_value(value: str, type_code: Optional[int] = None) -> Any:
+    """Decode a single column value of COPY's TEXT format into a Python value.
+
+    Numbers, booleans and BYTEA values of known column types (OIDs) get converted to their Python counterparts; dates,
+    timestamps and values of other types are returned as strings, just like DatabaseResult.hashes() does."""
+    if value == '\\N':
+        return None
+
+    value = __unescape_copy_text(value)
+
+    decoder = __COPY_TEXT_DECODERS.get(type_code, None)
+    if decoder is not None:
+        value = decoder(value)
+
+    return value
+
+
+def decode_copy_text_row(line: str, type_codes: Optional[List[int]] = None) -> tuple:
+    """Decode a single line of COPY's TEXT format into a tuple of Python values."""
+    values = line.rstrip('\n').split('\t')
+
+    if type_codes is None:
+        return tuple(decode_copy_text_value(value) for value in values)
+
+    if len(values) != len(type_codes):
+        raise McDecodeCopyTextRowException("Line has %d values while %d were expected: %s" % (
+            len(values), len(type_codes), line,
+        ))
+
+    return tuple(decode_copy_text_value(value=value, type_code=type_code)
+                 for value, type_code in zip(values, type_codes))
+
+
 # FIXME reads everything to a temporary file in a constructor, gives back line by line afterwards
 class CopyTo(object):
     """COPY TO helper. Implements iterator methods too."""
@@ -0,0 +1,68 @@
+import datetime
+import struct
+
+import pytest
+
+from mediawords.db.copy.copy_from import (
+    COPY_BINARY_HEADER,
+    COPY_BINARY_TRAILER,
+    CopyRowsReader,
+    encode_copy_binary_value,
+    encode_copy_text_row,
+    McCopyFromException,
+    McEncodeCopyBinaryValueException,
+)
+
+
+def test_encode_copy_text_row():
+    assert encode_copy_text_row([1, None, 'a\tb\\c\nd', True, datetime.date(2018, 1, 2)]) == (
+        "1\t\\N\ta\\tb\\\\c\\nd\tt\t2018-01-02\n"
+    )
+    assert encode_copy_text_row([b'\x00\xff', [1, None, 'a"b']]) == '\\\\x00ff\t{"1",NULL,"a\\\\"b"}\n'
+
+
+def test_encode_copy_binary_value():
+    assert encode_copy_binary_value(None, 23) == struct.pack('!i', -1)
+    assert encode_copy_binary_value(42, 23) == struct.pack('!ii', 4, 42)
+    assert encode_copy_binary_value(42, 20) == struct.pack('!iq', 8, 42)
+    assert encode_copy_binary_value('ф', 25) == struct.pack('!i', 2) + 'ф'.encode('utf-8')
+    assert encode_copy_binary_value(datetime.date(2000, 1, 2), 1082) == struct.pack('!ii', 4, 1)
+    assert encode_copy_binary_value(datetime.datetime(2000, 1, 1, 0, 0, 1), 1114) == struct.pack('!iq', 8, 1000000)
+    assert encode_copy_binary_value(
+        datetime.datetime(2000, 1, 1, 1, 0, 0, tzinfo=datetime.timezone(datetime.timedelta(hours=1))),
+        1184,
+    ) == struct.pack('!iq', 8, 0)
+
+    # Unsupported column type
+    with pytest.raises(McEncodeCopyBinaryValueException):
+        encode_copy_binary_value('{}', 3802)
+
+    # Value doesn't match column type
+    with pytest.raises(McEncodeCopyBinaryValueException):
+        encode_copy_binary_value('2000-01-01', 1082)
+
+
+def test_copy_rows_reader():
+    rows = ((i, 'row %d' % i,) for i in range(1000))
+    reader = CopyRowsReader(rows=rows, column_count=2)
+
+    data = b''
+    while True:
+        chunk = reader.read(100)
+        if not chunk:
+            break
+        assert len(chunk) <= 100
+        data += chunk
+
+    assert reader.row_count == 1000
+    lines = data.decode('utf-8').split('\n')
+    assert lines[0] == "0\trow 0"
+    assert lines[999] == "999\trow 999"
+    assert lines[1000] == ''
+
+    reader = CopyRowsReader(rows=[(1,)], column_count=1, binary_type_codes=[23])
+    assert reader.read() == COPY_BINARY_HEADER + struct.pack('!hii', 1, 4, 1) + COPY_BINARY_TRAILER
+
+    reader = CopyRowsReader(rows=[(1, 2,)], column_count=1)
+    with pytest.raises(McCopyFromException):
+        reader.read()
@@ -0,0 +1,25 @@
+import decimal
+
+import pytest
+
+from mediawords.db.copy.copy_to import decode_copy_text_row, decode_copy_text_value, McDecodeCopyTextRowException
+
+
+def test_decode_copy_text_value():
+    assert decode_copy_text_value('\\N') is None
+    assert decode_copy_text_value('\\\\N') == '\\N'
+    assert decode_copy_text_value('a\\tb\\\\c\\nd\\x41\\101') == 'a\tb\\c\ndAA'
+    assert decode_copy_text_value('42', 20) == 42
+    assert decode_copy_text_value('4.5', 701) == 4.5
+    assert decode_copy_text_value('4.50', 1700) == decimal.Decimal('4.50')
+    assert decode_copy_text_value('t', 16) is True
+    assert decode_copy_text_value('\\\\x00ff', 17) == b'\x00\xff'
+    assert decode_copy_text_value('2018-01-02', 1082) == '2018-01-02'
+
+
+def test_decode_copy_text_row():
+    assert decode_copy_text_row("1\t\\N\tfoo\n") == ('1', None, 'foo',)
+    assert decode_copy_text_row("1\t\\N\tfoo\n", [23, 23, 25]) == (1, None, 'foo',)
+
+    with pytest.raises(McDecodeCopyTextRowException):
+        decode_copy_text_row("1\t2\n", [23])
@@ -53,6 +53,16 @@ class McUniqueConstraintException(McDatabaseHandlerException):
     pass
 
 
+class McInsertManyException(McDatabaseHandlerException):
+    """insert_many() exception."""
+    pass
+
+
+class McAttachChildQueryException(McDatabaseHandlerException):
+    """attach_child_query() exception."""
+    pass
+
+
 class McFindOrCreateException(McDatabaseHandlerException):
     """find_or_create() exception."""
     pass
@@ -113,19 +113,17 @@ def __print_table_csv_to_stdout(db: DatabaseHandler, table: str) -> None:
 
     csv_writer = csv.writer(sys.stdout, delimiter="\t", escapechar="\\", quoting=csv.QUOTE_NONE)
 
-    res = db.query("SELECT * FROM %(table)s ORDER BY %(primary_key_column)s" % {
+    # Stream rows from a server-side cursor to not load the whole table into memory
+    rows = db.query_iter("SELECT * FROM %(table)s ORDER BY %(primary_key_column)s" % {
         'table': table,
         'primary_key_column': primary_key_column,
     })
 
     postgresql_null_value = '\\N'
     postgresql_end_of_data = r'\.'
-    while True:
-        row = res.array()
-        if row is None:
-            break
-        else:
-            csv_writer.writerow([postgresql_null_value if val is None else val for val in row])
+    for row in rows:
+        values = [row[column_name] for column_name in column_names]
+        csv_writer.writerow([postgresql_null_value if val is None else val for val in values])
 
     print(postgresql_end_of_data)
 
@@ -1,20 +1,27 @@
+import contextlib
 import os
 import re
-from typing import Callable, Union, List, Dict, Any
+import time
+from typing import Callable, Union, List, Dict, Any, Iterable, Iterator, Optional
 
 import psycopg2
 import psycopg2.extras
 from psycopg2.extensions import adapt as psycopg2_adapt
 
-from mediawords.db.copy.copy_from import CopyFrom
-from mediawords.db.copy.copy_to import CopyTo
+from mediawords.db.copy.copy_from import (
+    CopyFrom, CopyRowsReader, McCopyFromException, copy_binary_type_is_supported,
+)
+from mediawords.db.copy.copy_to import CopyTo, McCopyToException, decode_copy_text_row
 from mediawords.db.exceptions.handler import (
     McConnectException, McDatabaseHandlerException, McSchemaIsUpToDateException, McQueryException,
     McPrimaryKeyColumnException, McFindByIDException, McRequireByIDException, McUpdateByIDException,
     McDeleteByIDException, McCreateException, McFindOrCreateException, McBeginException,
-    McQuoteException, McUniqueConstraintException)
+    McQuoteException, McUniqueConstraintException, McInsertManyException, McAttachChildQueryException)
+from mediawords.db.profiler import AbstractQueryProfiler, default_query_profiler
+from mediawords.db.replicas import ReplicaRouter, statement_is_routable, statement_is_write
 from mediawords.db.result.result import DatabaseResult
 from mediawords.db.schema.version import schema_version_from_lines
+from mediawords.db.statement_cache import StatementCache
 
 from mediawords.util.config import get_config as py_get_config  # MC_REWRITE_TO_PYTHON: rename back to get_config()
 from mediawords.util.log import create_logger
@@ -45,6 +52,21 @@ class DatabaseHandler(object):
     # "Double percentage sign" marker (see handler's quote() for explanation)
     __DOUBLE_PERCENTAGE_SIGN_MARKER = "<DOUBLE PERCENTAGE SIGN: " + random_string(length=16) + ">"
 
+    # Default number of rows to fetch at once from a server-side cursor in query_iter()
+    __DEFAULT_QUERY_ITER_BATCH_SIZE = 1000
+
+    # Row count starting from which insert_many() COPYs rows into a temporary table instead of doing a multi-row INSERT
+    __INSERT_MANY_COPY_MIN_ROWS = 1000
+
+    # Chunk size to stream to COPY FROM in copy_rows_from()
+    __COPY_ROWS_CHUNK_SIZE = 1024 * 1024
+
+    # Default max. number of IDs that attach_child_query() passes as an array parameter instead of a temporary table
+    __DEFAULT_ATTACH_CHILD_QUERY_MAX_ARRAY_IDS = 10000
+
+    # Temporary table (reused within a session) for attach_child_query() IDs that don't fit into an array parameter
+    __ATTACH_CHILD_QUERY_IDS_TABLE = '_tmp_attach_child_query_ids'
+
     # Whether or not "deadlock_timeout" was checked
     # * lowercase because it's not a constant
     # * class variable because we don't need to do it on every connect_to_db())
@@ -68,6 +90,27 @@ class DatabaseHandler(object):
         '__conn',
         '__db',
 
+        # Cache of queries rewritten to psycopg2's format (and maybe prepared server-side)
+        '__statement_cache',
+
+        # Per-statement query profiler (None if profiling is disabled)
+        '__profiler',
+
+        # Max. number of IDs that attach_child_query() passes as an array parameter
+        '__attach_child_query_max_array_ids',
+
+        # Read replicas to route read-only queries to (None if there are none)
+        '__replica_router',
+
+        # Whether to route all SELECTs run outside of transactions to replicas
+        '__route_all_selects',
+
+        # Nesting depth of read_only() blocks
+        '__read_only_depth',
+
+        # Time of the last data modifying statement run on the primary
+        '__last_write_time',
+
     ]
 
     def __init__(self,
@@ -93,6 +136,21 @@ class DatabaseHandler(object):
         self.__conn = None
         self.__db = None
 
+        prepare_threshold = None
+        config = py_get_config()
+        if 'db_prepare_threshold' in config['mediawords']:
+            prepare_threshold = config['mediawords']['db_prepare_threshold']
+        self.__statement_cache = StatementCache(prepare_threshold=prepare_threshold)
+
+        self.__profiler = default_query_profiler()
+
+        self.__attach_child_query_max_array_ids = DatabaseHandler.__DEFAULT_ATTACH_CHILD_QUERY_MAX_ARRAY_IDS
+
+        self.__replica_router = None
+        self.__route_all_selects = False
+        self.__read_only_depth = 0
+        self.__last_write_time = 0.0
+
         self.__connect(
             host=host,
             port=port,
@@ -181,12 +239,51 @@ class DatabaseHandler(object):
 
     def disconnect(self) -> None:
         """Disconnect from the database."""
+        if self.__replica_router is not None:
+            self.__replica_router.disconnect()
+
         self.__db.close()
         self.__db = None
 
         self.__conn.close()
         self.__db = None
 
+    def is_healthy(self) -> bool:
+        """Return True if the connection is still open and usable."""
+        if self.__conn is None or self.__conn.closed:
+            return False
+
+        try:
+            self.__db.execute('SELECT 1')
+            self.__db.fetchall()
+        except psycopg2.Error as ex:
+            log.warning("Database connection is not healthy: %s" % str(ex))
+            return False
+
+        return True
+
+    def reset_session(self) -> None:
+        """Reset session state so that the connection could be reused by someone else.
+
+        Rolls back any open transaction, resets run-time parameters (e.g. "enable_seqscan", "work_mem") to their
+        defaults, closes server-side cursors, drops temporary tables and releases advisory locks. Server-side prepared
+        statements are kept."""
+
+        if self.__conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            log.warning("Rolling back unfinished transaction before resetting session.")
+            self.__db.execute('ROLLBACK')
+        self.__in_manual_transaction = False
+
+        self.__db.execute("""
+            RESET ALL;
+            CLOSE ALL;
+            UNLISTEN *;
+            DISCARD TEMP;
+            SELECT pg_advisory_unlock_all();
+        """)
+
+        self.__print_warnings = True
+
     # noinspection PyMethodMayBeStatic
     def dbh(self) -> None:
         raise McDatabaseHandlerException("Please don't use internal database handler directly")
@@ -302,10 +399,161 @@ class DatabaseHandler(object):
         if len(query_params) > 2:
             raise McQueryException("psycopg2's execute() accepts at most 2 parameters.")
 
+        if self.__replica_router is not None:
+            replica = self.__replica_for_query(query=query_params[0])
+            if replica is not None:
+                return replica.query(*query_params)
+
+            if statement_is_write(query_params[0]):
+                self.__last_write_time = time.time()
+
         return DatabaseResult(cursor=self.__db,
                               query_args=query_params,
                               double_percentage_sign_marker=DatabaseHandler.__DOUBLE_PERCENTAGE_SIGN_MARKER,
-                              print_warnings=self.__print_warnings)
+                              statement_cache=self.__statement_cache,
+                              # Failed PREPARE would abort the transaction
+                              may_prepare=not self.in_transaction(),
+                              print_warnings=self.__print_warnings,
+                              profiler=self.__profiler)
+
+    def statement_cache_stats(self) -> Dict[str, int]:
+        """Return rewritten query cache hit / miss and prepared statement counters."""
+        return self.__statement_cache.stats()
+
+    def set_prepare_threshold(self, prepare_threshold: Optional[int]) -> None:
+        """Set execution count after which statements get promoted to server-side prepared statements; None to never
+        prepare statements.
+
+        Prepared statements get their parameter types inferred once, so queries which rely on parameter type
+        being different on every run (e.g. "SELECT %(value)s") might return differently typed results."""
+        self.__statement_cache.set_prepare_threshold(prepare_threshold)
+
+    def set_replica_router(self, replica_router: Optional[ReplicaRouter], route_all_selects: bool = False) -> None:
+        """Set read replicas to route read-only queries to; None to run all queries on the primary.
+
+        Queries get routed to a replica (if there's one that's not lagging behind by more than the router's max. lag)
+        only if they're plain SELECTs run outside of transactions, and only if:
+
+        * they're run within a read_only() block, or
+        * query_iter() gets called with "read_only" set, or
+        * "route_all_selects" is True.
+
+        To not read stale data after writing it, queries are kept on the primary for max. lag seconds after every data
+        modifying statement run through this handler. Temporary tables don't exist on replicas, so SELECTs from them
+        shouldn't be routed."""
+        if self.__replica_router is not None and self.__replica_router is not replica_router:
+            self.__replica_router.disconnect()
+
+        self.__replica_router = replica_router
+        self.__route_all_selects = route_all_selects
+
+    @contextlib.contextmanager
+    def read_only(self):
+        """Route SELECTs run within the block to a read replica (if available):
+
+            with db.read_only():
+                stories = db.query('SELECT * FROM stories WHERE media_id = %(a)s', {'a': media_id}).hashes()
+        """
+        self.__read_only_depth += 1
+        try:
+            yield
+        finally:
+            self.__read_only_depth -= 1
+
+    def __replica_for_query(self, query: str, read_only: bool = False) -> Optional['DatabaseHandler']:
+        """Return replica to run the query on, or None if the query is to be run on the primary."""
+
+        if self.__replica_router is None or self.in_transaction():
+            return None
+
+        if not (read_only or self.__read_only_depth > 0 or self.__route_all_selects):
+            return None
+
+        if not statement_is_routable(query):
+            return None
+
+        # Replicas might not have caught up with our own recent writes
+        if time.time() - self.__last_write_time <= self.__replica_router.max_lag():
+            return None
+
+        return self.__replica_router.replica()
+
+    def query_profiler(self) -> Optional[AbstractQueryProfiler]:
+        """Return query profiler in use, or None if queries are not being profiled."""
+        return self.__profiler
+
+    def set_query_profiler(self, profiler: Optional[AbstractQueryProfiler]) -> None:
+        """Set query profiler to report every executed statement to; None to disable profiling."""
+        self.__profiler = profiler
+
+    def query_iter(self,
+                   *query_params,
+                   batch_size: int = __DEFAULT_QUERY_ITER_BATCH_SIZE,
+                   as_tuples: bool = False,
+                   read_only: bool = False) -> Iterator[Union[Dict[str, Any], tuple]]:
+        """Run the (SELECT) query with a server-side cursor, yield dicts of returned rows, keyed by column name (or
+        plain tuples with DATE / TIMESTAMP values left as datetime objects if "as_tuples" is True).
+
+        If "read_only" is True, the query might get run on a read replica (see set_replica_router()).
+
+        Accepts the same query and parameter forms as query(). Rows are fetched "batch_size" at a time so that memory
+        usage stays flat regardless of how many rows the query returns:
+
+            for row in db.query_iter('SELECT * FROM story_sentences WHERE stories_id > %(a)s', {'a': 1}):
+                ...
+
+        Outside of a manually started transaction, the cursor is declared WITH HOLD so that it outlives the implicit
+        per-statement transaction; other queries can be run on the handler while iterating over the result.
+        """
+
+        # MC_REWRITE_TO_PYTHON: remove after porting queries to named parameter style
+        query_params = convert_dbd_pg_arguments_to_psycopg2_format(*query_params)
+
+        if len(query_params) == 0:
+            raise McQueryException("Query is unset.")
+        if len(query_params) > 2:
+            raise McQueryException("psycopg2's execute() accepts at most 2 parameters.")
+
+        batch_size = int(batch_size)
+        if batch_size < 1:
+            raise McQueryException("Batch size must be positive.")
+
+        if self.__replica_router is not None:
+            replica = self.__replica_for_query(query=query_params[0], read_only=read_only)
+            if replica is not None:
+                yield from replica.query_iter(*query_params, batch_size=batch_size, as_tuples=as_tuples)
+                return
+
+        cursor = self.__conn.cursor(
+            name='_query_iter_%s' % random_string(length=16).lower(),
+            # Plain cursor returns tuples without building a DictRow for every row
+            cursor_factory=None if as_tuples else psycopg2.extras.DictCursor,
+            withhold=not self.in_transaction(),
+        )
+        cursor.itersize = batch_size
+
+        try:
+            result = DatabaseResult(cursor=cursor,
+                                    query_args=query_params,
+                                    double_percentage_sign_marker=DatabaseHandler.__DOUBLE_PERCENTAGE_SIGN_MARKER,
+                                    statement_cache=self.__statement_cache,
+                                    print_warnings=self.__print_warnings,
+                                    profiler=self.__profiler)
+
+            if as_tuples:
+                rows = result.tuples_iter(batch_size=batch_size)
+            else:
+                rows = result.hashes_iter(batch_size=batch_size)
+
+            for row in rows:
+                yield row
+
+        finally:
+            try:
+                cursor.close()
+            except psycopg2.Error as ex:
+                # Transaction might have been aborted by the time we get to close the cursor
+                log.warning("Unable to close server-side cursor: %s" % str(ex))
 
     def __get_current_work_mem(self) -> str:
         current_work_mem = self.query("SHOW work_mem").flat()[0]
@@ -649,6 +897,185 @@ class DatabaseHandler(object):
 
         return inserted_row
 
+    def insert_many(self,
+                    table: str,
+                    rows: List[Dict[str, Any]],
+                    on_conflict: Optional[str] = None,
+                    returning: Union[bool, str] = True) -> List[Any]:
+        """Insert multiple rows into the table in as few round trips as possible.
+
+        All rows must have the same set of keys (columns). Small batches get inserted with a single multi-row
+        "INSERT ... VALUES"; big batches get COPied into a temporary table first and then inserted with
+        "INSERT ... SELECT".
+
+        Arguments:
+        table - table (or an updatable view) to insert the rows into
+        rows - list of dicts to insert
+        on_conflict - optional conflict action to append after "ON CONFLICT", e.g. "(url) DO NOTHING"
+        returning - True to return the primary key column of every inserted row, column name to return a different
+                    column, False to not return anything
+
+        Return:
+        List of "returning" column values of the inserted rows in the input order; if "on_conflict" causes some rows
+        to be skipped, those rows won't have a value in the list.
+        """
+
+        table = decode_object_from_bytes_if_needed(table)
+        rows = decode_object_from_bytes_if_needed(rows)
+        on_conflict = decode_object_from_bytes_if_needed(on_conflict)
+        returning = decode_object_from_bytes_if_needed(returning)
+
+        if rows is None:
+            raise McInsertManyException("Rows to INSERT are None.")
+        if len(rows) == 0:
+            return []
+
+        columns = list(rows[0].keys())
+        if len(columns) == 0:
+            raise McInsertManyException("Rows to INSERT are empty.")
+
+        for row in rows:
+            if len(row) != len(columns) or not all(column in row for column in columns):
+                raise McInsertManyException("All rows must have the same columns as the first one (%s): %s" % (
+                    str(columns), str(row),
+                ))
+
+        if returning is True:
+            returning_column = self.primary_key_column(table)
+        elif returning is False or returning is None:
+            returning_column = None
+        else:
+            returning_column = returning
+
+        sql_on_conflict = "ON CONFLICT %s" % on_conflict if on_conflict else ""
+        sql_returning = "RETURNING %s" % returning_column if returning_column else ""
+
+        try:
+            if len(rows) < DatabaseHandler.__INSERT_MANY_COPY_MIN_ROWS:
+                returned_values = self.__insert_many_values(
+                    table=table,
+                    columns=columns,
+                    rows=rows,
+                    sql_on_conflict=sql_on_conflict,
+                    sql_returning=sql_returning,
+                )
+            else:
+                returned_values = self.__insert_many_copy(
+                    table=table,
+                    columns=columns,
+                    rows=rows,
+                    sql_on_conflict=sql_on_conflict,
+                    sql_returning=sql_returning,
+                )
+        except Exception as ex:
+            if 'duplicate key value violates unique constraint' in str(ex):
+                raise McUniqueConstraintException("Unable to INSERT %(count)d rows into '%(table)s': %(exception)s" % {
+                    'count': len(rows),
+                    'table': table,
+                    'exception': str(ex),
+                })
+            else:
+                raise McInsertManyException("Unable to INSERT %(count)d rows into '%(table)s': %(exception)s" % {
+                    'count': len(rows),
+                    'table': table,
+                    'exception': str(ex),
+                })
+
+        if not returning_column:
+            return []
+
+        return returned_values
+
+    def __insert_many_values(self,
+                             table: str,
+                             columns: List[str],
+                             rows: List[Dict[str, Any]],
+                             sql_on_conflict: str,
+                             sql_returning: str) -> List[Any]:
+        """Insert rows using a single multi-row "INSERT ... VALUES"; return RETURNING values if any."""
+
+        # "%s" to be resolved by execute_values(), not Python
+        sql = "INSERT INTO %(table)s (%(columns)s) VALUES %%s %(on_conflict)s %(returning)s" % {
+            'table': table,
+            'columns': ', '.join(columns),
+            'on_conflict': sql_on_conflict,
+            'returning': sql_returning,
+        }
+
+        # "%(key)s" to be resolved by psycopg2, not Python
+        template = '(%s)' % ', '.join('%(' + column + ')s' for column in columns)
+
+        self.__last_write_time = time.time()
+
+        # Single page so that all RETURNING rows can be fetched afterwards
+        psycopg2.extras.execute_values(self.__db, sql, rows, template=template, page_size=len(rows))
+
+        if not sql_returning:
+            return []
+
+        return [row[0] for row in self.__db.fetchall()]
+
+    def __insert_many_copy(self,
+                           table: str,
+                           columns: List[str],
+                           rows: List[Dict[str, Any]],
+                           sql_on_conflict: str,
+                           sql_returning: str) -> List[Any]:
+        """Insert rows by COPYing them to a temporary table and then running "INSERT ... SELECT"; return RETURNING
+        values if any."""
+
+        temp_table = '_tmp_insert_many_%s' % random_string(length=16)
+        ordinal_column = '_insert_many_ordinal'
+
+        # Copy column types (but not the defaults or constraints) of the target table
+        self.query("""
+            CREATE TEMPORARY TABLE %(temp_table)s AS
+                SELECT %(columns)s, 0::BIGINT AS %(ordinal_column)s
+                FROM %(table)s
+                LIMIT 0
+        """ % {
+            'temp_table': temp_table,
+            'columns': ', '.join(columns),
+            'ordinal_column': ordinal_column,
+            'table': table,
+        })
+
+        try:
+            self.copy_rows_from(
+                table=temp_table,
+                columns=columns + [ordinal_column],
+                rows=([row[column] for column in columns] + [ordinal] for ordinal, row in enumerate(rows)),
+            )
+
+            # Ordered by ordinal so that RETURNING values come back in the input order
+            result = self.query("""
+                INSERT INTO %(table)s (%(columns)s)
+                    SELECT %(columns)s
+                    FROM %(temp_table)s
+                    ORDER BY %(ordinal_column)s
+                %(on_conflict)s
+                %(returning)s
+            """ % {
+                'table': table,
+                'columns': ', '.join(columns),
+                'temp_table': temp_table,
+                'ordinal_column': ordinal_column,
+                'on_conflict': sql_on_conflict,
+                'returning': sql_returning,
+            })
+
+            returned_values = result.flat() if sql_returning else []
+
+        except Exception as ex:
+            # Within a transaction, the temporary table will get rolled back together with the failed transaction
+            if not self.in_transaction():
+                self.query("DROP TABLE IF EXISTS %s" % temp_table)
+            raise ex
+
+        self.query("DROP TABLE %s" % temp_table)
+
+        return returned_values
+
     def select(self, table: str, what_to_select: str, condition_hash: dict = None) -> DatabaseResult:
         """SELECT chosen columns from the table that match given conditions."""
 
@@ -867,6 +1294,8 @@ class DatabaseHandler(object):
         """Return COPY FROM helper object."""
         sql = decode_object_from_bytes_if_needed(sql)
 
+        self.__last_write_time = time.time()
+
         return CopyFrom(cursor=self.__db, sql=sql)
 
     def copy_to(self, sql: str) -> CopyTo:
@@ -875,6 +1304,85 @@ class DatabaseHandler(object):
 
         return CopyTo(cursor=self.__db, sql=sql)
 
+    def copy_rows_from(self,
+                       table: str,
+                       columns: List[str],
+                       rows: Iterable[Union[tuple, list]],
+                       binary: bool = False) -> int:
+        """COPY rows (tuples or lists of values in the order of "columns") from an iterable to the table; return the
+        number of rows copied.
+
+        Values get escaped and streamed to PostgreSQL in large chunks as the iterable is being consumed, so "rows" can
+        be a generator of any length. If "binary" is True, COPY's BINARY format is used, which is faster to parse for
+        the server but requires values to be of the exact Python type matching the column type (e.g. datetime.date
+        for DATE columns)."""
+
+        table = decode_object_from_bytes_if_needed(table)
+        columns = decode_object_from_bytes_if_needed(columns)
+
+        if not table:
+            raise McCopyFromException("Table is unset.")
+        if not columns:
+            raise McCopyFromException("Columns are unset.")
+
+        binary_type_codes = None
+        copy_format = 'TEXT'
+        if binary:
+            binary_type_codes = self.query("SELECT %(columns)s FROM %(table)s LIMIT 0" % {
+                'columns': ', '.join(columns),
+                'table': table,
+            }).column_types()
+            for (column, type_code) in zip(columns, binary_type_codes):
+                if not copy_binary_type_is_supported(type_code):
+                    raise McCopyFromException("Column '%s' of type %d can't be copied in BINARY format." % (
+                        column, type_code,
+                    ))
+            copy_format = 'BINARY'
+
+        sql = "COPY %(table)s (%(columns)s) FROM STDIN WITH (FORMAT %(format)s)" % {
+            'table': table,
+            'columns': ', '.join(columns),
+            'format': copy_format,
+        }
+
+        reader = CopyRowsReader(rows=rows, column_count=len(columns), binary_type_codes=binary_type_codes)
+
+        self.__last_write_time = time.time()
+
+        try:
+            self.__db.copy_expert(sql=sql, file=reader, size=DatabaseHandler.__COPY_ROWS_CHUNK_SIZE)
+        except psycopg2.Warning as ex:
+            log.warning('Warning while running COPY FROM query: %s' % str(ex))
+        except McCopyFromException as ex:
+            raise ex
+        except Exception as ex:
+            raise McCopyFromException('COPY FROM query failed: %s' % str(ex))
+
+        return reader.row_count
+
+    def copy_rows_to(self, sql: str) -> Iterator[tuple]:
+        """COPY results of a SELECT query out of the database, yield them as tuples.
+
+        Numbers, booleans and BYTEA values get converted to their Python counterparts; dates, timestamps and other
+        values are returned as strings (like hashes() does). The query is not allowed to have any parameters."""
+
+        sql = decode_object_from_bytes_if_needed(sql)
+
+        if not sql:
+            raise McCopyToException("SQL is unset.")
+
+        sql = sql.strip().rstrip(';')
+
+        # Query's column types
+        type_codes = self.query("SELECT * FROM (%s) AS copy_rows_to LIMIT 0" % sql).column_types()
+
+        copy = self.copy_to("COPY (%s) TO STDOUT WITH (FORMAT TEXT)" % sql)
+        try:
+            for line in copy:
+                yield decode_copy_text_row(line=line, type_codes=type_codes)
+        finally:
+            copy.end()
+
     def get_temporary_ids_table(self, ids: List[int], ordered: bool = False) -> str:
         """Get the name of a temporary table that contains all of the IDs in "ids" as an "id BIGINT" field.
 
@@ -894,10 +1402,34 @@ class DatabaseHandler(object):
         sql += "id BIGINT)"
         self.query(sql)
 
-        copy = self.copy_from("COPY %s (id) FROM STDIN" % table_name)
-        for single_id in ids:
-            copy.put_line("%d\n" % int(single_id))
-        copy.end()
+        self.copy_rows_from(table=table_name, columns=['id'], rows=((int(single_id),) for single_id in ids))
+
+        self.query("ANALYZE %s" % table_name)
+
+        return table_name
+
+    def set_attach_child_query_max_array_ids(self, max_array_ids: int) -> None:
+        """Set max. number of IDs for attach_child_query() to pass as an array parameter; larger sets of IDs get copied
+        to a temporary table instead."""
+        max_array_ids = int(max_array_ids)
+        if max_array_ids < 0:
+            raise McAttachChildQueryException("Max. array IDs can't be negative.")
+        self.__attach_child_query_max_array_ids = max_array_ids
+
+    def __attach_child_query_ids_table(self, ids: List[int]) -> str:
+        """Fill the session's temporary table of attach_child_query() IDs with "ids" and return its name.
+
+        Unlike get_temporary_ids_table(), the table is reused (truncated) on every call instead of a new table getting
+        created every time."""
+
+        table_name = DatabaseHandler.__ATTACH_CHILD_QUERY_IDS_TABLE
+
+        # Might have been rolled back together with the transaction in which it was created, or discarded by
+        # reset_session()
+        self.query("CREATE TEMPORARY TABLE IF NOT EXISTS %s (id BIGINT)" % table_name)
+        self.query("TRUNCATE %s" % table_name)
+
+        self.copy_rows_from(table=table_name, columns=['id'], rows=((int(single_id),) for single_id in ids))
 
         self.query("ANALYZE %s" % table_name)
 
@@ -943,20 +1475,36 @@ class DatabaseHandler(object):
             parent_lookup[parent_id] = parent
             ids.append(parent_id)
 
-        ids_table = self.get_temporary_ids_table(ids=ids)
-        sql = """
-            -- noinspection SqlResolve
-            SELECT q.*
-            FROM ( %(child_query)s ) AS q
+        if len(ids) <= self.__attach_child_query_max_array_ids:
+            # Small and medium sets of IDs are cheaper to pass as a single array parameter than to COPY to a temporary
+            # table and ANALYZE it
+            sql = """
+                -- noinspection SqlResolve
+                SELECT q.*
+                FROM ( %(child_query)s ) AS q
                 -- Limit rows returned by "child_query" to only IDs from "ids"
-                INNER JOIN %(ids_table)s AS ids
-                    ON q.%(id_column)s = ids.id
-        """ % {
-            'child_query': child_query,
-            'ids_table': ids_table,
-            'id_column': id_column,
-        }
-        children = self.query(sql).hashes()
+                WHERE q.%(id_column)s = ANY(%%(ids)s::BIGINT[])
+            """ % {
+                'child_query': child_query,
+                'id_column': id_column,
+            }
+            children = self.query(sql, {'ids': [int(parent_id) for parent_id in ids]}).hashes()
+
+        else:
+            ids_table = self.__attach_child_query_ids_table(ids=ids)
+            sql = """
+                -- noinspection SqlResolve
+                SELECT q.*
+                FROM ( %(child_query)s ) AS q
+                    -- Limit rows returned by "child_query" to only IDs from "ids"
+                    INNER JOIN %(ids_table)s AS ids
+                        ON q.%(id_column)s = ids.id
+            """ % {
+                'child_query': child_query,
+                'ids_table': ids_table,
+                'id_column': id_column,
+            }
+            children = self.query(sql).hashes()
 
         # if we're appending lists, make sure each parent row has an empty list
         if not single:
@@ -0,0 +1,379 @@
+"""Per-statement SQL query profiling."""
+
+import abc
+import atexit
+import functools
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from mediawords.util.config import get_config as py_get_config
+from mediawords.util.log import create_logger
+
+log = create_logger(__name__)
+
+
+class McQueryProfilerException(Exception):
+    """Query profiler exception."""
+    pass
+
+
+class AbstractQueryProfiler(object, metaclass=abc.ABCMeta):
+    """Abstract SQL query profiler that gets notified about every statement run by the database handler."""
+
+    @abc.abstractmethod
+    def record_query(self, query: str, duration: float, rows: int) -> None:
+        """Record a successfully executed query.
+
+        Arguments:
+        query - query as passed to psycopg2 (with placeholders, without parameters)
+        duration - time it took to execute the query, in seconds
+        rows - number of rows returned or affected; -1 if unknown
+        """
+        raise NotImplementedError("Abstract method.")
+
+    @abc.abstractmethod
+    def record_fetch(self, query: str, fetched_bytes: int) -> None:
+        """Record approximate size of the result data fetched by the caller."""
+        raise NotImplementedError("Abstract method.")
+
+    # noinspection PyMethodMayBeStatic,PyUnusedLocal
+    def wants_explain(self, query: str, duration: float) -> bool:
+        """Return True if the profiler would like to get EXPLAIN (ANALYZE, BUFFERS) output for the query."""
+        return False
+
+    def record_explain(self, query: str, plan: str) -> None:
+        """Record EXPLAIN (ANALYZE, BUFFERS) output for the query, or plain EXPLAIN output for queries that might have
+        side effects when run once again."""
+        pass
+
+
+# Matches 'quoted literals', E'escaped literals' and $$dollar quoted literals$$
+__LITERAL_REGEX = re.compile(r"E?'(?:[^'\\]|''|\\.)*'|\$\$.*?\$\$", flags=re.S)
+
+# Matches numbers that are not a part of an identifier
+__NUMBER_REGEX = re.compile(r'(?<![\w$])-?\d+(?:\.\d+)?(?![\w$])')
+
+# Matches psycopg2's placeholders
+__PLACEHOLDER_REGEX = re.compile(r'%\(.*?\)s|%s')
+
+# Matches lists of normalized values, e.g. "IN (?, ?, ?)"
+__VALUE_LIST_REGEX = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+
+# Matches SQL comments
+__COMMENT_REGEX = re.compile(r'--[^\n]*|/\*.*?\*/', flags=re.S)
+
+
+@functools.lru_cache(maxsize=4096)
+def normalize_query(query: str) -> str:
+    """Normalize query for aggregating statistics: remove comments, replace literals, numbers and parameter placeholders
+    with '?', collapse lists of values and whitespace."""
+
+    query = __COMMENT_REGEX.sub(' ', query)
+    query = __LITERAL_REGEX.sub('?', query)
+    query = __PLACEHOLDER_REGEX.sub('?', query)
+    query = __NUMBER_REGEX.sub('?', query)
+    query = __VALUE_LIST_REGEX.sub('(...)', query)
+    query = ' '.join(query.split())
+
+    return query
+
+
+class _StatementStats(object):
+    """Statistics of a single normalized statement."""
+
+    # Max. number of latency samples to keep for calculating percentiles
+    __MAX_SAMPLES = 1024
+
+    __slots__ = [
+        'calls',
+        'total_seconds',
+        'max_seconds',
+        'rows',
+        'fetched_bytes',
+        'explain',
+        '__samples',
+    ]
+
+    def __init__(self):
+        self.calls = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.rows = 0
+        self.fetched_bytes = 0
+        self.explain = None
+        self.__samples = []
+
+    def add_call(self, duration: float, rows: int) -> None:
+        self.calls += 1
+        self.total_seconds += duration
+        self.max_seconds = max(self.max_seconds, duration)
+        if rows > 0:
+            self.rows += rows
+
+        # Reservoir sampling to keep percentiles representative over the whole run
+        if len(self.__samples) < self.__MAX_SAMPLES:
+            self.__samples.append(duration)
+        else:
+            index = random.randrange(self.calls)
+            if index < self.__MAX_SAMPLES:
+                self.__samples[index] = duration
+
+    def percentile(self, percentile: float) -> float:
+        """Return latency percentile (0 < percentile <= 100), in seconds."""
+        if not self.__samples:
+            return 0.0
+        samples = sorted(self.__samples)
+        index = max(0, int(math.ceil(percentile / 100.0 * len(samples))) - 1)
+        return samples[index]
+
+
+class QueryProfiler(AbstractQueryProfiler):
+    """Profiler that aggregates call counts, latencies, rows and fetched bytes per normalized statement, and
+    periodically dumps them as JSON and Prometheus text files."""
+
+    # Max. number of normalized statements to keep statistics for
+    __DEFAULT_MAX_STATEMENTS = 1000
+
+    # How often to dump statistics (in seconds)
+    __DEFAULT_DUMP_INTERVAL = 60
+
+    # Only SELECTs are safe to EXPLAIN ANALYZE as the statement gets executed once again
+    __EXPLAINABLE_REGEX = re.compile(r'^\s*(?:SELECT|WITH)\b', flags=re.I)
+    __DATA_MODIFYING_REGEX = re.compile(r'\b(?:INSERT|UPDATE|DELETE)\b', flags=re.I)
+
+    __slots__ = [
+        '__dump_directory',
+        '__dump_interval',
+        '__explain_threshold',
+        '__max_statements',
+
+        # Normalized statement -> _StatementStats
+        '__statements',
+
+        # Count of calls that didn't fit into "max_statements"
+        '__dropped_calls',
+
+        '__last_dump_time',
+        '__lock',
+    ]
+
+    def __init__(self,
+                 dump_directory: Optional[str] = None,
+                 dump_interval: int = __DEFAULT_DUMP_INTERVAL,
+                 explain_threshold: Optional[float] = None,
+                 max_statements: int = __DEFAULT_MAX_STATEMENTS):
+        """Constructor.
+
+        Arguments:
+        dump_directory - directory to periodically write "db_profile-<pid>.json" and "db_profile-<pid>.prom" to; None
+                         to not dump statistics automatically
+        dump_interval - how often to dump statistics, in seconds
+        explain_threshold - capture EXPLAIN (ANALYZE, BUFFERS) of SELECTs that took longer than this many seconds;
+                            None to never capture query plans
+        max_statements - max. number of normalized statements to keep statistics for
+        """
+        if max_statements < 1:
+            raise McQueryProfilerException("Max. statements must be positive.")
+
+        self.__dump_directory = dump_directory
+        self.__dump_interval = dump_interval
+        self.__explain_threshold = explain_threshold
+        self.__max_statements = max_statements
+
+        self.__statements = {}
+        self.__dropped_calls = 0
+        self.__last_dump_time = time.time()
+        self.__lock = threading.Lock()
+
+    def record_query(self, query: str, duration: float, rows: int) -> None:
+        normalized_query = normalize_query(query)
+
+        with self.__lock:
+            stats = self.__statements.get(normalized_query, None)
+            if stats is None:
+                if len(self.__statements) >= self.__max_statements:
+                    self.__dropped_calls += 1
+                    return
+                stats = _StatementStats()
+                self.__statements[normalized_query] = stats
+
+            stats.add_call(duration=duration, rows=rows)
+
+        if self.__dump_directory is not None and time.time() - self.__last_dump_time >= self.__dump_interval:
+            self.dump()
+
+    def record_fetch(self, query: str, fetched_bytes: int) -> None:
+        normalized_query = normalize_query(query)
+
+        with self.__lock:
+            stats = self.__statements.get(normalized_query, None)
+            if stats is not None:
+                stats.fetched_bytes += fetched_bytes
+
+    def wants_explain(self, query: str, duration: float) -> bool:
+        if self.__explain_threshold is None or duration < self.__explain_threshold:
+            return False
+
+        if not self.__EXPLAINABLE_REGEX.match(query) or self.__DATA_MODIFYING_REGEX.search(query):
+            return False
+
+        # Capture plan only once per statement to not double the load of slow queries
+        stats = self.__statements.get(normalize_query(query), None)
+        return stats is not None and stats.explain is None
+
+    def record_explain(self, query: str, plan: str) -> None:
+        with self.__lock:
+            stats = self.__statements.get(normalize_query(query), None)
+            if stats is not None:
+                stats.explain = plan
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """Return per-statement statistics, most time consuming statements first."""
+        with self.__lock:
+            statements = []
+            for normalized_query, stats in self.__statements.items():
+                statements.append({
+                    'statement_id': hashlib.md5(normalized_query.encode('utf-8', errors='replace')).hexdigest()[:16],
+                    'statement': normalized_query,
+                    'calls': stats.calls,
+                    'total_seconds': stats.total_seconds,
+                    'mean_seconds': stats.total_seconds / stats.calls if stats.calls else 0.0,
+                    'p50_seconds': stats.percentile(50),
+                    'p99_seconds': stats.percentile(99),
+                    'max_seconds': stats.max_seconds,
+                    'rows': stats.rows,
+                    'fetched_bytes': stats.fetched_bytes,
+                    'explain': stats.explain,
+                })
+
+        return sorted(statements, key=lambda x: x['total_seconds'], reverse=True)
+
+    def reset(self) -> None:
+        """Forget all collected statistics."""
+        with self.__lock:
+            self.__statements = {}
+            self.__dropped_calls = 0
+
+    def to_json(self) -> str:
+        """Return statistics as JSON."""
+        return json.dumps({
+            'pid': os.getpid(),
+            'timestamp': time.time(),
+            'dropped_calls': self.__dropped_calls,
+            'statements': self.stats(),
+        }, indent=2)
+
+    def to_prometheus(self) -> str:
+        """Return statistics in Prometheus text exposition format."""
+
+        def __escape_label(value: str) -> str:
+            return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+        metrics = [
+            ('mediawords_db_statement_calls_total', 'counter', 'Number of times the statement was executed.', 'calls'),
+            ('mediawords_db_statement_rows_total', 'counter', 'Rows returned or affected by the statement.', 'rows'),
+            ('mediawords_db_statement_fetched_bytes_total', 'counter',
+             'Approximate size of the result data fetched for the statement.', 'fetched_bytes'),
+            ('mediawords_db_statement_max_seconds', 'gauge', 'Slowest execution of the statement.', 'max_seconds'),
+        ]
+
+        statements = self.stats()
+
+        lines = []
+        for (metric, metric_type, description, key) in metrics:
+            lines.append('# HELP %s %s' % (metric, description))
+            lines.append('# TYPE %s %s' % (metric, metric_type))
+            for statement in statements:
+                lines.append('%s{statement_id="%s",statement="%s"} %s' % (
+                    metric,
+                    statement['statement_id'],
+                    __escape_label(statement['statement'][:200]),
+                    repr(statement[key]),
+                ))
+
+        metric = 'mediawords_db_statement_duration_seconds'
+        lines.append('# HELP %s Execution time of the statement.' % metric)
+        lines.append('# TYPE %s summary' % metric)
+        for statement in statements:
+            labels = 'statement_id="%s"' % statement['statement_id']
+            lines.append('%s{%s,quantile="0.5"} %s' % (metric, labels, repr(statement['p50_seconds'])))
+            lines.append('%s{%s,quantile="0.99"} %s' % (metric, labels, repr(statement['p99_seconds'])))
+            lines.append('%s_sum{%s} %s' % (metric, labels, repr(statement['total_seconds'])))
+            lines.append('%s_count{%s} %d' % (metric, labels, statement['calls']))
+
+        return "\n".join(lines) + "\n"
+
+    def dump(self, directory: Optional[str] = None) -> None:
+        """Write "db_profile-<pid>.json" and "db_profile-<pid>.prom" to the directory (or the configured one)."""
+
+        if directory is None:
+            directory = self.__dump_directory
+        if directory is None:
+            raise McQueryProfilerException("Dump directory is not set.")
+
+        self.__last_dump_time = time.time()
+
+        os.makedirs(directory, exist_ok=True)
+
+        for (extension, contents) in [('json', self.to_json()), ('prom', self.to_prometheus())]:
+            path = os.path.join(directory, 'db_profile-%d.%s' % (os.getpid(), extension))
+
+            # Write to a temporary file first so that readers never see a half-written file
+            (fd, temp_path) = tempfile.mkstemp(dir=directory, prefix='.db_profile-')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(contents)
+            os.replace(temp_path, path)
+
+
+# Process-wide profiler created from configuration: (PID, profiler)
+__default_query_profiler = None
+
+
+def default_query_profiler() -> Optional[QueryProfiler]:
+    """Return process-wide query profiler if it's enabled in mediawords.yml, None otherwise.
+
+    Profiler gets enabled by the "db_profiler" section under "mediawords":
+
+        db_profiler:
+            dump_directory: /var/tmp/mediacloud-db-profile
+            dump_interval: 60
+            explain_threshold: 10
+    """
+    global __default_query_profiler
+
+    pid = os.getpid()
+    if __default_query_profiler is not None and __default_query_profiler[0] == pid:
+        return __default_query_profiler[1]
+
+    profiler = None
+
+    config = py_get_config()
+    if config['mediawords'].get('db_profiler', None):
+        profiler_config = config['mediawords']['db_profiler']
+
+        profiler = QueryProfiler(
+            dump_directory=profiler_config.get('dump_directory', None),
+            dump_interval=int(profiler_config.get('dump_interval', 60)),
+            explain_threshold=profiler_config.get('explain_threshold', None),
+        )
+
+        if profiler_config.get('dump_directory', None):
+            def __dump_on_exit():
+                try:
+                    profiler.dump()
+                except Exception as ex:
+                    log.warning("Unable to dump query profile: %s" % str(ex))
+
+            atexit.register(__dump_on_exit)
+
+    __default_query_profiler = (pid, profiler,)
+
+    return profiler
@@ -0,0 +1,223 @@
+"""Routing of read-only queries to PostgreSQL read replicas."""
+
+import re
+import time
+from typing import Any, Callable, List, Optional
+
+from mediawords.db.exceptions.handler import McDatabaseHandlerException
+from mediawords.util.log import create_logger
+
+log = create_logger(__name__)
+
+
+class McReplicaRouterException(McDatabaseHandlerException):
+    """Replica router exception."""
+    pass
+
+
+# Statements that might be run on a replica: plain SELECTs (leading comments allowed) without row locks
+__ROUTABLE_STATEMENT_REGEX = re.compile(r'^\s*(?:--[^\n]*\n\s*)*(?:SELECT|WITH)\b', flags=re.I)
+__NOT_ROUTABLE_STATEMENT_REGEX = re.compile(
+    r'\bFOR\s+(?:NO\s+KEY\s+)?(?:UPDATE|SHARE)\b|\b(?:INSERT|UPDATE|DELETE)\b|\bINTO\b|\bnextval\s*\(|\bsetval\s*\(|'
+    r'\bpg_(?:try_)?advisory',
+    flags=re.I,
+)
+
+# Statements after which the replicas might not have the primary's data anymore
+__WRITE_STATEMENT_REGEX = re.compile(
+    r'^\s*(?:--[^\n]*\n\s*)*(?:INSERT|UPDATE|DELETE|COPY|CREATE|ALTER|DROP|TRUNCATE|COMMIT|END)\b',
+    flags=re.I,
+)
+
+# Anything that looks like a function call ("name(") in a statement
+__FUNCTION_CALL_REGEX = re.compile(r'([a-z_][a-z0-9_$]*)\s*\(', flags=re.I)
+
+# String literals and comments which might contain something that looks like a function call
+__STRING_LITERAL_OR_COMMENT_REGEX = re.compile(r"'(?:[^']|'')*'|--[^\n]*")
+
+# SQL keywords and type names that might be followed by a parenthesis, and built-in functions that don't write
+# anything; calls to any other function (e.g. media_stats_flush_sentence_deltas()) might write so statements that
+# make them never get run on a replica
+__STABLE_FUNCTIONS = frozenset([
+    # Keywords
+    'all', 'and', 'any', 'array', 'as', 'between', 'by', 'case', 'cast', 'distinct', 'else', 'except', 'exists',
+    'filter', 'from', 'having', 'in', 'intersect', 'is', 'join', 'lateral', 'like', 'ilike', 'limit', 'not', 'offset',
+    'on', 'or', 'over', 'row', 'select', 'some', 'then', 'union', 'using', 'values', 'when', 'where', 'with', 'within',
+
+    # Type names
+    'bit', 'char', 'character', 'decimal', 'interval', 'numeric', 'time', 'timestamp', 'timestamptz', 'varbit',
+    'varchar',
+
+    # Aggregate and window functions
+    'array_agg', 'avg', 'bool_and', 'bool_or', 'count', 'dense_rank', 'lag', 'lead', 'max', 'min', 'rank',
+    'row_number', 'string_agg', 'sum',
+
+    # Conditional, string, date and array functions
+    'abs', 'array_length', 'array_to_string', 'btrim', 'ceil', 'coalesce', 'date_part', 'date_trunc', 'extract',
+    'floor', 'greatest', 'least', 'left', 'length', 'lower', 'ltrim', 'md5', 'now', 'nullif', 'regexp_replace',
+    'replace', 'right', 'round', 'rtrim', 'split_part', 'substr', 'substring', 'to_char', 'to_date', 'trim', 'unnest',
+    'upper',
+])
+
+
+def __calls_unknown_functions(query: str) -> bool:
+    """Return True if the statement calls functions (or something that looks like them) that are not known to be
+    free of side effects."""
+    query = __STRING_LITERAL_OR_COMMENT_REGEX.sub(' ', query)
+    return any(name.lower() not in __STABLE_FUNCTIONS for name in __FUNCTION_CALL_REGEX.findall(query))
+
+
+def statement_is_routable(query: str) -> bool:
+    """Return True if the statement is a read-only SELECT that could be run on a replica.
+
+    SELECTs that call functions other than a few known built-in ones are not routable as the function might write."""
+    if not __ROUTABLE_STATEMENT_REGEX.match(query):
+        return False
+    if __NOT_ROUTABLE_STATEMENT_REGEX.search(query):
+        return False
+    return not __calls_unknown_functions(query)
+
+
+def statement_is_write(query: str) -> bool:
+    """Return True if the statement (most likely) modifies data; SELECTs that are not routable might write too (e.g.
+    by calling a function that writes)."""
+    if __WRITE_STATEMENT_REGEX.match(query):
+        return True
+    return bool(__ROUTABLE_STATEMENT_REGEX.match(query)) and not statement_is_routable(query)
+
+
+class ReplicaRouter(object):
+    """Pool of lazily connected read replicas; picks a replica that is lagging behind the primary by no more than
+    "max_lag" seconds."""
+
+    # Default max. replication lag (in seconds) of a replica to still route queries to it
+    DEFAULT_MAX_LAG = 30
+
+    # Default interval (in seconds) between replication lag checks of a single replica
+    DEFAULT_LAG_CHECK_INTERVAL = 5
+
+    # How long (in seconds) to not try using a replica that failed to connect or to report its lag
+    __FAILURE_RETRY_INTERVAL = 60
+
+    __slots__ = [
+        # Callables that connect to every replica and return DatabaseHandler
+        '__connectors',
+
+        '__max_lag',
+        '__lag_check_interval',
+
+        # Replicas' DatabaseHandler instances (None if not connected yet)
+        '__replicas',
+
+        # Last measured replication lag of every replica
+        '__lags',
+
+        # Time of the last lag check (or failure) of every replica
+        '__checked_at',
+
+        # Time until which a replica is not to be used due to a failure
+        '__failed_until',
+
+        # Index of the replica to try first next time (for round-robin)
+        '__next_replica',
+    ]
+
+    def __init__(self,
+                 connectors: List[Callable[[], Any]],
+                 max_lag: float = DEFAULT_MAX_LAG,
+                 lag_check_interval: float = DEFAULT_LAG_CHECK_INTERVAL):
+        """Constructor.
+
+        Arguments:
+        connectors - list of callables that connect to every replica and return a DatabaseHandler
+        max_lag - max. replication lag (in seconds) of a replica to still route queries to it
+        lag_check_interval - interval (in seconds) between replication lag checks of a single replica
+        """
+        if not connectors:
+            raise McReplicaRouterException("No replicas to route queries to.")
+        if max_lag < 0:
+            raise McReplicaRouterException("Max. lag can't be negative.")
+
+        self.__connectors = list(connectors)
+        self.__max_lag = max_lag
+        self.__lag_check_interval = lag_check_interval
+
+        self.__replicas = [None] * len(connectors)
+        self.__lags = [None] * len(connectors)
+        self.__checked_at = [0.0] * len(connectors)
+        self.__failed_until = [0.0] * len(connectors)
+        self.__next_replica = 0
+
+    def max_lag(self) -> float:
+        """Return max. replication lag (in seconds) of a replica to still route queries to it."""
+        return self.__max_lag
+
+    def __replication_lag(self, index: int) -> float:
+        """Return (cached) replication lag of a connected replica, in seconds."""
+
+        now = time.time()
+        if self.__lags[index] is not None and now - self.__checked_at[index] < self.__lag_check_interval:
+            return self.__lags[index]
+
+        # Idle primary doesn't generate any WAL so the last replayed transaction's timestamp can get old even if the
+        # replica is fully caught up; treat a replica that has replayed everything it has received as lag-free
+        lag = self.__replicas[index].query("""
+            SELECT CASE
+                WHEN NOT pg_is_in_recovery() THEN 0
+                WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                ELSE COALESCE(EXTRACT(EPOCH FROM NOW() - pg_last_xact_replay_timestamp()), 0)
+            END AS lag
+        """).flat()[0]
+
+        self.__lags[index] = float(lag)
+        self.__checked_at[index] = now
+
+        return self.__lags[index]
+
+    def replica(self) -> Optional[Any]:
+        """Return DatabaseHandler of a replica that's fresh enough to route queries to, or None if there's none."""
+
+        replica_count = len(self.__connectors)
+
+        for offset in range(replica_count):
+            index = (self.__next_replica + offset) % replica_count
+
+            if self.__failed_until[index] > time.time():
+                continue
+
+            try:
+                if self.__replicas[index] is None:
+                    self.__replicas[index] = self.__connectors[index]()
+
+                lag = self.__replication_lag(index)
+
+            except Exception as ex:
+                log.warning("Read replica #%d is unavailable: %s" % (index, str(ex)))
+                self.__disconnect_replica(index)
+                self.__failed_until[index] = time.time() + self.__FAILURE_RETRY_INTERVAL
+                continue
+
+            if lag > self.__max_lag:
+                log.debug("Read replica #%d is lagging by %.1f seconds, skipping." % (index, lag))
+                continue
+
+            self.__next_replica = (index + 1) % replica_count
+            return self.__replicas[index]
+
+        return None
+
+    def __disconnect_replica(self, index: int) -> None:
+        replica = self.__replicas[index]
+        self.__replicas[index] = None
+        self.__lags[index] = None
+
+        if replica is not None:
+            try:
+                replica.disconnect()
+            except Exception as ex:
+                log.debug("Unable to disconnect from read replica #%d: %s" % (index, str(ex)))
+
+    def disconnect(self) -> None:
+        """Disconnect from all replicas."""
+        for index in range(len(self.__replicas)):
+            self.__disconnect_replica(index)
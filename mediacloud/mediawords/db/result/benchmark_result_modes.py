@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+"""Compare per-row cost of DatabaseResult's result modes.
+
+Usage:
+
+    python3 -m mediawords.db.result.benchmark_result_modes --rows 1000000
+"""
+
+import argparse
+import time
+from typing import Dict
+
+from mediawords.db import connect_to_db
+from mediawords.db.handler import DatabaseHandler
+
+# Rows with an integer, a short text and a timestamp column, similar to what story lists look like
+__BENCHMARK_QUERY = """
+    SELECT i AS stories_id,
+           'Story title #' || i AS title,
+           NOW() + (i * INTERVAL '1 second') AS publish_date
+    FROM generate_series(1, %(rows)s) AS i
+"""
+
+__RESULT_MODES = {
+    'hashes': lambda result: result.hashes(),
+    'tuples': lambda result: result.tuples(),
+    'records': lambda result: result.records(),
+    'columnar': lambda result: result.columnar(),
+    'columnar (numpy)': lambda result: result.columnar(numpy_arrays=True),
+}
+
+
+def benchmark_result_modes(db: DatabaseHandler, rows: int, rounds: int = 3) -> Dict[str, float]:
+    """Return best per-row cost (in microseconds) of fetching "rows" rows in every result mode, query time included."""
+
+    per_row_costs = {}
+
+    for (mode, fetch) in __RESULT_MODES.items():
+        best_time = None
+
+        for _ in range(rounds):
+            start_time = time.time()
+            result = db.query(__BENCHMARK_QUERY, {'rows': rows})
+            fetch(result)
+            elapsed_time = time.time() - start_time
+
+            if best_time is None or elapsed_time < best_time:
+                best_time = elapsed_time
+
+        per_row_costs[mode] = best_time / rows * 1000000
+
+    return per_row_costs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare per-row cost of DatabaseResult's result modes.")
+    parser.add_argument('--rows', type=int, default=1000000, help="Number of rows to fetch.")
+    parser.add_argument('--rounds', type=int, default=3, help="Number of rounds to run for every mode.")
+    args = parser.parse_args()
+
+    db = connect_to_db()
+
+    per_row_costs = benchmark_result_modes(db=db, rows=args.rows, rounds=args.rounds)
+
+    hashes_cost = per_row_costs['hashes']
+    for (mode, cost) in per_row_costs.items():
+        print("%-20s %8.3f us / row (%.2fx of hashes())" % (mode, cost, cost / hashes_cost))
+
+    db.disconnect()
+
+
+if __name__ == '__main__':
+    main()
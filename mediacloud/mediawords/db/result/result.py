@@ -1,43 +1,64 @@
+import collections
 import datetime
+import functools
 import itertools
 import pprint
-import re
 import textwrap
 import time
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Iterator, Optional
 
 import psycopg2
 from psycopg2.extras import DictCursor
 
 from mediawords.db.exceptions.result import McDatabaseResultException, McDatabaseResultTextException
+from mediawords.db.profiler import AbstractQueryProfiler
+from mediawords.db.replicas import statement_is_routable
+from mediawords.db.statement_cache import StatementCache
 from mediawords.util.log import create_logger
 from mediawords.util.perl import decode_object_from_bytes_if_needed
 
 log = create_logger(__name__)
 
 
+@functools.lru_cache(maxsize=256)
+def _record_class(column_names: tuple) -> type:
+    """Return (cached) namedtuple class for the column names; invalid or duplicate names get renamed to _<index>."""
+    return collections.namedtuple('DatabaseRecord', column_names, rename=True)
+
+
 class DatabaseResult(object):
     """Wrapper around SQL query result."""
 
     __cursor = None  # psycopg2 cursor
+    __profiler = None  # query profiler, if any
+    __profiled_query = None  # query as passed to psycopg2, for recording fetched bytes with the profiler
 
     def __init__(self,
                  cursor: DictCursor,
                  query_args: tuple,
                  double_percentage_sign_marker: str,
-                 print_warnings: bool = True):
+                 statement_cache: StatementCache,
+                 may_prepare: bool = False,
+                 print_warnings: bool = True,
+                 profiler: Optional[AbstractQueryProfiler] = None):
 
         # MC_REWRITE_TO_PYTHON: 'query_args' should be decoded from 'bytes' at this point
 
+        self.__profiler = profiler
+
         self.__execute(cursor=cursor,
                        query_args=query_args,
                        double_percentage_sign_marker=double_percentage_sign_marker,
+                       statement_cache=statement_cache,
+                       may_prepare=may_prepare,
                        print_warnings=print_warnings)
 
     def __execute(self,
                   cursor: DictCursor,
                   query_args: tuple,
                   double_percentage_sign_marker: str,
+                  statement_cache: StatementCache,
+                  may_prepare: bool,
                   print_warnings: bool) -> None:
         """Execute statement, set up cursor to results."""
 
@@ -48,6 +69,8 @@ class DatabaseResult(object):
         if len(query_args[0]) == 0:
             raise McDatabaseResultException('Query is empty or undefined.')
 
+        query_time = None
+
         try:
 
             if len(query_args) == 1:
@@ -58,23 +81,47 @@ class DatabaseResult(object):
                 # to execute().
                 query_args = (query_args[0], {},)
 
-            query = query_args[0]
-
-            # Duplicate '%' everywhere except for psycopg2 parameter placeholders ('%s' and '%(...)s')
-            query = re.sub(r'%(?!(s|\(.*?\)s?))', '%%', query)
-
-            # Replace percentage signs coming from quote()d strings with double percentage signs
-            query = query.replace(double_percentage_sign_marker, '%%')
+            # Duplicate '%' everywhere except for psycopg2 parameter placeholders ('%s' and '%(...)s') and replace
+            # percentage signs coming from quote()d strings with double percentage signs; rewritten queries get cached
+            statement = statement_cache.statement(
+                raw_query=query_args[0],
+                double_percentage_sign_marker=double_percentage_sign_marker,
+            )
 
             query_args_list = list(query_args)
-            query_args_list[0] = query
+            query_args_list[0] = statement.query
             query_args = tuple(query_args_list)
 
-            log.debug("Running query: %s" % str(query_args))
+            if cursor.name is None:
+                # Might get promoted to server-side prepared statement
+                execute_args = statement_cache.execute_args(
+                    cursor=cursor,
+                    statement=statement,
+                    query_params=query_args[1],
+                    may_prepare=may_prepare,
+                )
+            else:
+                # Server-side (named) cursors can't be DECLAREd for EXECUTE
+                execute_args = query_args
+
+            log.debug("Running query: %s" % str(execute_args))
 
             t = time.time()
 
-            cursor.execute(*query_args)
+            if execute_args[0] is statement.query:
+                cursor.execute(*execute_args)
+            else:
+                try:
+                    cursor.execute(*execute_args)
+                except (psycopg2.ProgrammingError, psycopg2.DataError) as ex:
+                    # Parameter types inferred at PREPARE time might not fit the current parameters
+                    if not may_prepare:
+                        # Within a transaction, can't retry
+                        raise ex
+
+                    log.warning("Prepared statement failed, will run the query as is: %s" % str(ex))
+                    statement_cache.unprepare(statement)
+                    cursor.execute(*query_args)
 
             query_time = time.time() - t
             if (query_time >= 1):
@@ -123,6 +170,72 @@ class DatabaseResult(object):
 
         self.__cursor = cursor  # Cursor now holds results
 
+        if self.__profiler is not None and query_time is not None:
+            self.__profile_query(query_args=query_args, query_time=query_time)
+
+    def __profile_query(self, query_args: tuple, query_time: float) -> None:
+        """Report executed query to the profiler, capture EXPLAIN (ANALYZE, BUFFERS) of the query if asked to (or plain
+        EXPLAIN if it's not safe to run the query once again)."""
+
+        query = query_args[0]
+
+        try:
+            self.__profiler.record_query(query=query, duration=query_time, rows=self.__cursor.rowcount)
+            self.__profiled_query = query
+
+            if not self.__profiler.wants_explain(query=query, duration=query_time):
+                return
+
+            # Server-side cursors' queries haven't been run completely yet, and EXPLAIN ANALYZE failing within a
+            # transaction would abort the transaction
+            if self.__cursor.name is not None:
+                return
+            connection = self.__cursor.connection
+            if connection.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                return
+
+            # EXPLAIN ANALYZE runs the statement once again, so statements that might have side effects (take advisory
+            # or row locks, call nextval() or any other function that isn't a known side effect-free built-in one, ...)
+            # get only their plan explained
+            if statement_is_routable(query):
+                explain = 'EXPLAIN (ANALYZE, BUFFERS) '
+            else:
+                explain = 'EXPLAIN '
+
+            # Separate cursor to not lose the results held by the current one
+            explain_cursor = connection.cursor()
+            try:
+                explain_cursor.execute(explain + query, query_args[1])
+                plan = "\n".join([row[0] for row in explain_cursor.fetchall()])
+            finally:
+                explain_cursor.close()
+
+            self.__profiler.record_explain(query=query, plan=plan)
+
+        except Exception as ex:
+            log.warning("Unable to profile query: %s" % str(ex))
+
+    def __profile_fetch(self, rows: List[Any]) -> None:
+        """Report approximate size of the fetched rows to the profiler."""
+
+        if self.__profiler is None or self.__profiled_query is None:
+            return
+
+        fetched_bytes = 0
+        for row in rows:
+            if row is None:
+                continue
+            for value in row:
+                if isinstance(value, (str, bytes, bytearray, memoryview)):
+                    fetched_bytes += len(value)
+                else:
+                    fetched_bytes += 8
+
+        try:
+            self.__profiler.record_fetch(query=self.__profiled_query, fetched_bytes=fetched_bytes)
+        except Exception as ex:
+            log.warning("Unable to profile fetched rows: %s" % str(ex))
+
     @staticmethod
     def __convert_datetime_objects_to_strings(item: Any) -> Any:
         """Covert all datetime objects to strings to be consistent what Perl code will be receiving.
@@ -142,6 +255,11 @@ class DatabaseResult(object):
         column_names = [desc[0] for desc in self.__cursor.description]
         return column_names
 
+    def column_types(self) -> List[int]:
+        """Return a list of column type OIDs."""
+        column_types = [desc[1] for desc in self.__cursor.description]
+        return column_types
+
     def rows(self) -> int:
         """Return the number of rows affected by the last row affecting command, or -1 if the number of rows is not
         known or not available."""
@@ -151,6 +269,7 @@ class DatabaseResult(object):
     def array(self) -> List[Any]:
         """Return a list of a single row."""
         row_tuple = self.__cursor.fetchone()
+        self.__profile_fetch([row_tuple])
         if row_tuple is not None:
             row = list(row_tuple)
 
@@ -163,6 +282,7 @@ class DatabaseResult(object):
     def hash(self) -> Dict[str, Any]:
         """Return a dict of a single row, keyed by column name"""
         row_tuple = self.__cursor.fetchone()
+        self.__profile_fetch([row_tuple])
         if row_tuple is not None:
             row = dict(row_tuple)
 
@@ -175,6 +295,7 @@ class DatabaseResult(object):
     def flat(self) -> List[Any]:
         """Return a flattened list of all returned (remaining) rows."""
         all_rows = self.__cursor.fetchall()
+        self.__profile_fetch(all_rows)
         flat_rows = list(itertools.chain.from_iterable(all_rows))
 
         flat_rows = [self.__convert_datetime_objects_to_strings(item) for item in flat_rows]
@@ -184,7 +305,9 @@ class DatabaseResult(object):
     def hashes(self) -> List[Dict[str, Any]]:
         """Return a list of dicts of all returned (remaining) rows, keyed by column name."""
         rows = []
-        for row in self.__cursor.fetchall():
+        all_rows = self.__cursor.fetchall()
+        self.__profile_fetch(all_rows)
+        for row in all_rows:
             row = dict(row)
 
             row = {k: self.__convert_datetime_objects_to_strings(v) for k, v in row.items()}
@@ -193,6 +316,85 @@ class DatabaseResult(object):
 
         return rows
 
+    def hashes_iter(self, batch_size: int = 1000) -> Iterator[Dict[str, Any]]:
+        """Yield dicts of all returned (remaining) rows, keyed by column name, fetching "batch_size" rows at a time.
+
+        Useful with server-side (named) cursors as only a single batch of rows is kept in memory at any given time."""
+        if batch_size < 1:
+            raise McDatabaseResultException("Batch size must be positive.")
+
+        while True:
+            batch = self.__cursor.fetchmany(batch_size)
+            if not batch:
+                break
+
+            self.__profile_fetch(batch)
+
+            for row in batch:
+                row = dict(row)
+
+                row = {k: self.__convert_datetime_objects_to_strings(v) for k, v in row.items()}
+
+                yield row
+
+    def tuples(self) -> List[tuple]:
+        """Return a list of tuples of all returned (remaining) rows.
+
+        Unlike hashes(), DATE / TIMESTAMP values are returned as datetime objects, so this is meant for Python-only
+        callers for which per-row overhead matters."""
+        all_rows = self.__cursor.fetchall()
+        self.__profile_fetch(all_rows)
+        return [tuple(row) for row in all_rows]
+
+    def tuples_iter(self, batch_size: int = 1000) -> Iterator[tuple]:
+        """Yield tuples of all returned (remaining) rows, fetching "batch_size" rows at a time; DATE / TIMESTAMP values
+        are returned as datetime objects."""
+        if batch_size < 1:
+            raise McDatabaseResultException("Batch size must be positive.")
+
+        while True:
+            batch = self.__cursor.fetchmany(batch_size)
+            if not batch:
+                break
+
+            self.__profile_fetch(batch)
+
+            for row in batch:
+                yield tuple(row)
+
+    def records(self) -> List[tuple]:
+        """Return a list of namedtuples of all returned (remaining) rows, with fields named after columns; DATE /
+        TIMESTAMP values are returned as datetime objects.
+
+        Column names that are not valid Python identifiers (or are duplicate) get renamed to "_<column index>"."""
+        record_class = _record_class(tuple(self.columns()))
+        all_rows = self.__cursor.fetchall()
+        self.__profile_fetch(all_rows)
+        return [record_class._make(row) for row in all_rows]
+
+    def columnar(self, numpy_arrays: bool = False) -> Dict[str, Any]:
+        """Return a dict of all returned (remaining) rows, keyed by column name, with column values as lists (or NumPy
+        arrays if "numpy_arrays" is True); DATE / TIMESTAMP values are returned as datetime objects."""
+        column_names = self.columns()
+        if len(set(column_names)) != len(column_names):
+            raise McDatabaseResultException("Column names are not unique: %s" % str(column_names))
+
+        all_rows = self.__cursor.fetchall()
+        self.__profile_fetch(all_rows)
+
+        if len(all_rows):
+            columns = [list(column) for column in zip(*all_rows)]
+        else:
+            columns = [[] for _ in column_names]
+
+        if numpy_arrays:
+            # Imported here to not make every database user load NumPy
+            import numpy
+
+            columns = [numpy.array(column) for column in columns]
+
+        return dict(zip(column_names, columns))
+
     def text(self, text_type: str = 'neat') -> str:
         """Return a string of all returned (remaining) rows with a simple text representation of the data."""
 
@@ -0,0 +1,316 @@
+import collections
+import re
+from typing import Any, Dict, List, Optional, Union
+
+from psycopg2.extras import DictCursor
+
+from mediawords.db.exceptions.handler import McDatabaseHandlerException
+from mediawords.util.log import create_logger
+
+log = create_logger(__name__)
+
+
+class McStatementCacheException(McDatabaseHandlerException):
+    """Statement cache exception."""
+    pass
+
+
+class CachedStatement(object):
+    """Query rewritten to psycopg2's format, together with its server-side prepared statement details (if any)."""
+
+    # Matches literal '%%' and psycopg2's '%s' / '%(name)s' placeholders
+    __PLACEHOLDER_REGEX = re.compile(r'%%|%\((?P<name>.*?)\)s|%s')
+
+    # Only plain DML statements are worth (and safe) to PREPARE
+    __PREPARABLE_STATEMENT_REGEX = re.compile(
+        r'^\s*(?:--[^\n]*\n\s*)*(?:SELECT|INSERT|UPDATE|DELETE|WITH|VALUES)\b',
+        flags=re.I,
+    )
+
+    __slots__ = [
+
+        # Query in psycopg2's format, with literal percentage signs doubled
+        'query',
+
+        # How many times was the statement executed
+        'execution_count',
+
+        # Name of the server-side prepared statement; None if the statement is not prepared
+        'prepared_name',
+
+        # False if the statement can't be PREPAREd
+        'preparable',
+
+        # Query for PREPARE ("$1"-style placeholders, literal percentage signs)
+        '__prepare_query',
+
+        # Names of '%(name)s' placeholders in the order of "$n" placeholders in PREPARE query; None for '%s' style
+        '__parameter_names',
+
+        # Count of '%s' placeholders
+        '__parameter_count',
+    ]
+
+    def __init__(self, query: str):
+        self.query = query
+        self.execution_count = 0
+        self.prepared_name = None
+        self.preparable = False
+        self.__prepare_query = None
+        self.__parameter_names = None
+        self.__parameter_count = 0
+
+        if not self.__PREPARABLE_STATEMENT_REGEX.match(query):
+            return
+
+        parameter_names = []
+        parameter_count = 0
+        has_named = False
+        has_positional = False
+
+        def __replace_placeholder(match) -> str:
+            nonlocal parameter_count, has_named, has_positional
+
+            placeholder = match.group(0)
+            if placeholder == '%%':
+                return '%'
+
+            name = match.group('name')
+            if name is None:
+                has_positional = True
+                parameter_count += 1
+                return '$%d' % parameter_count
+            else:
+                has_named = True
+                if name not in parameter_names:
+                    parameter_names.append(name)
+                return '$%d' % (parameter_names.index(name) + 1)
+
+        prepare_query = self.__PLACEHOLDER_REGEX.sub(__replace_placeholder, query)
+
+        if has_named and has_positional:
+            # psycopg2 would refuse to run such a query anyway
+            return
+
+        # Any leftover percentage sign means that the query is not in a format that we understand
+        if '%' in self.__PLACEHOLDER_REGEX.sub('', query):
+            return
+
+        self.preparable = True
+        self.__prepare_query = prepare_query
+        self.__parameter_names = parameter_names if has_named else None
+        self.__parameter_count = len(parameter_names) if has_named else parameter_count
+
+    def prepare_query(self) -> str:
+        """Return query to be used for PREPARE."""
+        if not self.preparable:
+            raise McStatementCacheException("Statement is not preparable: %s" % self.query)
+        return self.__prepare_query
+
+    def parameter_values(self, query_params: Union[Dict[str, Any], tuple, list, None]) -> Optional[List[Any]]:
+        """Return list of parameter values to pass to EXECUTE; None if parameters can't be passed to a prepared
+        statement (e.g. tuples for "IN %s")."""
+
+        if self.__parameter_names is not None:
+            if not isinstance(query_params, dict):
+                return None
+            try:
+                values = [query_params[name] for name in self.__parameter_names]
+            except KeyError:
+                return None
+        else:
+            if query_params is None or isinstance(query_params, dict):
+                values = []
+            else:
+                values = list(query_params)
+
+        if len(values) != self.__parameter_count:
+            return None
+
+        # Tuples get adapted to "(a, b, c)" lists which don't make sense as values of EXECUTE
+        if any(isinstance(value, tuple) for value in values):
+            return None
+
+        return values
+
+
+class StatementCache(object):
+    """Bounded LRU cache of queries rewritten to psycopg2's format, keyed by raw query text.
+
+    Optionally, statements executed at least "prepare_threshold" times get promoted to server-side prepared statements
+    (PREPARE / EXECUTE) to skip re-planning them on every run. As prepared statements live within a single database
+    session, every connection should have its own cache.
+    """
+
+    # Default max. number of rewritten queries to keep
+    DEFAULT_MAX_SIZE = 1024
+
+    # Prefix of server-side prepared statement names
+    __PREPARED_NAME_PREFIX = '_mc_prepared_'
+
+    __slots__ = [
+        '__max_size',
+        '__prepare_threshold',
+
+        # Raw query -> CachedStatement
+        '__statements',
+
+        # Counter to generate prepared statement names
+        '__prepared_name_counter',
+
+        # Names of prepared statements to DEALLOCATE on the next chance
+        '__pending_deallocations',
+
+        # Statistics
+        '__hits',
+        '__misses',
+        '__evictions',
+        '__prepares',
+        '__prepared_executions',
+    ]
+
+    def __init__(self, max_size: int = DEFAULT_MAX_SIZE, prepare_threshold: Optional[int] = None):
+        """Constructor.
+
+        Arguments:
+        max_size - max. number of rewritten queries to keep
+        prepare_threshold - execution count after which the statement gets PREPAREd; None to never prepare statements
+        """
+        if max_size < 1:
+            raise McStatementCacheException("Max. size must be positive.")
+
+        self.__max_size = max_size
+        self.__prepare_threshold = None
+        self.set_prepare_threshold(prepare_threshold)
+
+        self.__statements = collections.OrderedDict()
+        self.__prepared_name_counter = 0
+        self.__pending_deallocations = []
+
+        self.__hits = 0
+        self.__misses = 0
+        self.__evictions = 0
+        self.__prepares = 0
+        self.__prepared_executions = 0
+
+    def set_prepare_threshold(self, prepare_threshold: Optional[int]) -> None:
+        """Set execution count after which the statement gets PREPAREd; None to never prepare statements."""
+        if prepare_threshold is not None:
+            prepare_threshold = int(prepare_threshold)
+            if prepare_threshold < 1:
+                raise McStatementCacheException("Prepare threshold must be positive.")
+        self.__prepare_threshold = prepare_threshold
+
+    def statement(self, raw_query: str, double_percentage_sign_marker: str) -> CachedStatement:
+        """Return cached statement for the raw query, rewriting and caching it if needed."""
+
+        statement = self.__statements.get(raw_query, None)
+        if statement is not None:
+            self.__hits += 1
+            self.__statements.move_to_end(raw_query)
+            return statement
+
+        self.__misses += 1
+
+        # Duplicate '%' everywhere except for psycopg2 parameter placeholders ('%s' and '%(...)s')
+        query = re.sub(r'%(?!(s|\(.*?\)s?))', '%%', raw_query)
+
+        # Replace percentage signs coming from quote()d strings with double percentage signs
+        query = query.replace(double_percentage_sign_marker, '%%')
+
+        statement = CachedStatement(query=query)
+
+        self.__statements[raw_query] = statement
+        while len(self.__statements) > self.__max_size:
+            (_, evicted_statement) = self.__statements.popitem(last=False)
+            self.__evictions += 1
+            if evicted_statement.prepared_name is not None:
+                self.__pending_deallocations.append(evicted_statement.prepared_name)
+
+        return statement
+
+    def execute_args(self,
+                     cursor: DictCursor,
+                     statement: CachedStatement,
+                     query_params: Union[Dict[str, Any], tuple, list, None],
+                     may_prepare: bool) -> tuple:
+        """Count the execution of the statement and return arguments to pass to cursor.execute().
+
+        If the statement is hot enough and "may_prepare" is True, PREPARE it first; if it is (or gets) prepared, return
+        EXECUTE statement and its parameters instead of the query itself.
+
+        "may_prepare" should be False within transactions because a failed PREPARE would abort the transaction."""
+
+        statement.execution_count += 1
+
+        if may_prepare:
+            self.__deallocate_pending(cursor=cursor)
+
+            prepare_threshold_reached = (
+                self.__prepare_threshold is not None and statement.execution_count >= self.__prepare_threshold
+            )
+            if statement.prepared_name is None and statement.preparable and prepare_threshold_reached:
+                self.__prepare(cursor=cursor, statement=statement)
+
+        if statement.prepared_name is not None:
+            values = statement.parameter_values(query_params)
+            if values is not None:
+                self.__prepared_executions += 1
+                if len(values):
+                    execute_query = 'EXECUTE %s (%s)' % (statement.prepared_name, ', '.join(['%s'] * len(values)))
+                    return execute_query, tuple(values)
+                else:
+                    return 'EXECUTE %s' % statement.prepared_name, None
+
+        return statement.query, query_params
+
+    def unprepare(self, statement: CachedStatement) -> None:
+        """Stop using server-side prepared statement for the statement (e.g. after it failed to EXECUTE)."""
+        if statement.prepared_name is not None:
+            self.__pending_deallocations.append(statement.prepared_name)
+            statement.prepared_name = None
+        statement.preparable = False
+
+    def forget_prepared(self) -> None:
+        """Forget about all server-side prepared statements, e.g. after "DISCARD ALL" or reconnecting."""
+        for statement in self.__statements.values():
+            statement.prepared_name = None
+        self.__pending_deallocations = []
+
+    def stats(self) -> Dict[str, int]:
+        """Return cache hit / miss and prepared statement counters."""
+        return {
+            'size': len(self.__statements),
+            'hits': self.__hits,
+            'misses': self.__misses,
+            'evictions': self.__evictions,
+            'prepares': self.__prepares,
+            'prepared_executions': self.__prepared_executions,
+        }
+
+    def __prepare(self, cursor: DictCursor, statement: CachedStatement) -> None:
+        """PREPARE the statement; mark it as not preparable on failure."""
+
+        self.__prepared_name_counter += 1
+        prepared_name = '%s%d' % (self.__PREPARED_NAME_PREFIX, self.__prepared_name_counter)
+
+        try:
+            # No parameters so that psycopg2 wouldn't try to interpolate anything
+            cursor.execute('PREPARE %s AS %s' % (prepared_name, statement.prepare_query()))
+        except Exception as ex:
+            log.debug("Unable to PREPARE statement, will run it as is: %s; query: %s" % (str(ex), statement.query))
+            statement.preparable = False
+        else:
+            log.debug("Prepared statement '%s': %s" % (prepared_name, statement.query))
+            statement.prepared_name = prepared_name
+            self.__prepares += 1
+
+    def __deallocate_pending(self, cursor: DictCursor) -> None:
+        """DEALLOCATE prepared statements that are not used anymore."""
+
+        while self.__pending_deallocations:
+            prepared_name = self.__pending_deallocations.pop()
+            try:
+                cursor.execute('DEALLOCATE %s' % prepared_name)
+            except Exception as ex:
+                log.warning("Unable to DEALLOCATE prepared statement '%s': %s" % (prepared_name, str(ex)))
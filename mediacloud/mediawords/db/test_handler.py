@@ -1,12 +1,19 @@
+import datetime
 import re
+import time
 
 import pytest
 
+from mediawords.db import connect_to_db
+from mediawords.db.copy.copy_from import McCopyFromException
 from mediawords.db.exceptions.handler import McPrimaryKeyColumnException
 from mediawords.db.exceptions.result import McDatabaseResultException
 from mediawords.db.handler import (
     McUpdateByIDException, McCreateException, McRequireByIDException, McUniqueConstraintException,
+    McInsertManyException,
 )
+from mediawords.db.profiler import QueryProfiler
+from mediawords.db.replicas import ReplicaRouter
 from mediawords.test.test_database import TestDatabaseTestCase
 from mediawords.util.config import (
     get_config as py_get_config,
@@ -327,6 +334,218 @@ class TestDatabaseHandler(TestDatabaseTestCase):
         assert isinstance(hashes[0]['dob'], str)
         assert isinstance(hashes[1]['dob'], str)
 
+    def test_query_iter(self):
+        # Outside of transaction (WITH HOLD cursor), batch size smaller than the number of rows
+        rows = list(self.db().query_iter("""
+            SELECT * FROM kardashians WHERE surname = %(surname)s ORDER BY id
+        """, {'surname': 'Kardashian'}, batch_size=2))
+        assert len(rows) == 4
+        assert [row['name'] for row in rows] == ['Kourtney', 'Kim', 'Khloé', 'Rob']
+
+        # MC_REWRITE_TO_PYTHON: remove after __convert_datetime_objects_to_strings() gets removed and database handler
+        # is made to return datetime.datetime objects again
+        assert isinstance(rows[0]['dob'], str)
+
+        # Other queries while iterating
+        names = []
+        for row in self.db().query_iter("SELECT * FROM kardashians ORDER BY id", batch_size=3):
+            surname = self.db().query("SELECT surname FROM kardashians WHERE id = %(id)s", {'id': row['id']}).flat()[0]
+            assert surname == row['surname']
+            names.append(row['name'])
+        assert len(names) == 8
+
+        # DBD::Pg style, within transaction
+        self.db().begin()
+        rows = list(self.db().query_iter("SELECT * FROM kardashians WHERE name = ?", 'Kim'))
+        self.db().commit()
+        assert len(rows) == 1
+        assert rows[0]['surname'] == 'Kardashian'
+
+        # Invalid query
+        with pytest.raises(McDatabaseResultException):
+            list(self.db().query_iter("SELECT * FROM nonexistent_table"))
+
+        # Tuples
+        rows = list(self.db().query_iter("SELECT name, dob FROM kardashians WHERE id < 3 ORDER BY id", as_tuples=True))
+        assert rows == [
+            ('Kris', datetime.date(1955, 11, 5),),
+            ('Caitlyn', datetime.date(1949, 10, 28),),
+        ]
+
+    def test_result_modes(self):
+        query = "SELECT id, name, dob FROM kardashians WHERE id < 3 ORDER BY id"
+
+        rows = self.db().query(query).tuples()
+        assert rows == [
+            (1, 'Kris', datetime.date(1955, 11, 5),),
+            (2, 'Caitlyn', datetime.date(1949, 10, 28),),
+        ]
+
+        records = self.db().query(query).records()
+        assert len(records) == 2
+        assert records[0].name == 'Kris'
+        assert records[1].dob == datetime.date(1949, 10, 28)
+        assert records[1] == (2, 'Caitlyn', datetime.date(1949, 10, 28),)
+
+        # Invalid identifiers get renamed
+        records = self.db().query("SELECT 1 AS \"class\", 2 AS \"foo bar\"").records()
+        assert records[0]._0 == 1
+        assert records[0]._1 == 2
+
+        columns = self.db().query(query).columnar()
+        assert columns == {
+            'id': [1, 2],
+            'name': ['Kris', 'Caitlyn'],
+            'dob': [datetime.date(1955, 11, 5), datetime.date(1949, 10, 28)],
+        }
+
+        columns = self.db().query(query).columnar(numpy_arrays=True)
+        assert columns['id'].tolist() == [1, 2]
+
+        columns = self.db().query("SELECT * FROM kardashians WHERE id = 0").columnar()
+        assert columns['name'] == []
+
+        with pytest.raises(McDatabaseResultException):
+            self.db().query("SELECT 1 AS a, 2 AS a").columnar()
+
+    def test_prepared_statements(self):
+        self.db().set_prepare_threshold(2)
+
+        for _ in range(5):
+            row = self.db().query("SELECT * FROM kardashians WHERE name = %(name)s", {'name': 'Kim'}).hash()
+            assert row['surname'] == 'Kardashian'
+            assert isinstance(row['dob'], str)
+
+        # Tuple parameters can't be passed to EXECUTE
+        rows = self.db().query("SELECT * FROM kardashians WHERE name IN %(names)s", {'names': ('Kim', 'Rob',)}).hashes()
+        assert len(rows) == 2
+
+        # Literal percentage signs
+        for _ in range(3):
+            rows = self.db().query("SELECT * FROM kardashians WHERE name LIKE %(prefix)s AND surname LIKE 'Kar%'", {
+                'prefix': 'K%',
+            }).hashes()
+            assert len(rows) == 3
+
+        # Prepared statements are not being created within transactions but might be executed
+        self.db().begin()
+        row = self.db().query("SELECT * FROM kardashians WHERE name = %(name)s", {'name': 'Rob'}).hash()
+        assert row['surname'] == 'Kardashian'
+        self.db().commit()
+
+        stats = self.db().statement_cache_stats()
+        assert stats['prepares'] >= 2
+        assert stats['prepared_executions'] >= 5
+        assert stats['hits'] > 0
+
+        self.db().set_prepare_threshold(None)
+
+    def test_read_replicas(self):
+        # Separate connection to the same database; temporary table is visible only on the "primary"
+        self.db().set_replica_router(ReplicaRouter(connectors=[lambda: connect_to_db()], max_lag=1))
+        self.db().query("CREATE TEMPORARY TABLE only_on_primary (id INT)")
+
+        # Just wrote something, replica might have not caught up yet
+        with self.db().read_only():
+            self.db().query("SELECT * FROM only_on_primary")
+
+        time.sleep(1.5)
+
+        # Not in read-only block
+        self.db().query("SELECT * FROM only_on_primary")
+
+        with self.db().read_only():
+            with pytest.raises(McDatabaseResultException):
+                self.db().query("SELECT * FROM only_on_primary")
+
+            assert len(list(self.db().query_iter("SELECT * FROM kardashians"))) == 8
+
+            # Within transaction
+            self.db().begin()
+            self.db().query("SELECT * FROM only_on_primary")
+            self.db().commit()
+
+        self.db().set_replica_router(None)
+
+    def test_query_profiler(self):
+        old_profiler = self.db().query_profiler()
+
+        profiler = QueryProfiler(explain_threshold=0)
+        self.db().set_query_profiler(profiler)
+
+        for name in ['Kim', 'Kris']:
+            row = self.db().query("SELECT * FROM kardashians WHERE name = '%s'" % name).hash()
+            assert row['name'] == name
+        rows = list(self.db().query_iter("SELECT * FROM kardashians"))
+        assert len(rows) == 8
+
+        self.db().set_query_profiler(old_profiler)
+
+        stats = {statement['statement']: statement for statement in profiler.stats()}
+
+        select_stats = stats['SELECT * FROM kardashians WHERE name = ?']
+        assert select_stats['calls'] == 2
+        assert select_stats['rows'] == 2
+        assert select_stats['fetched_bytes'] > 0
+        assert 'Seq Scan' in select_stats['explain']
+
+        assert stats['SELECT * FROM kardashians']['fetched_bytes'] > 0
+
+    def test_query_profiler_explain_side_effects(self):
+        old_profiler = self.db().query_profiler()
+
+        profiler = QueryProfiler(explain_threshold=0)
+        self.db().set_query_profiler(profiler)
+
+        lock_id = 12345
+
+        self.db().query("SELECT pg_advisory_lock(%(lock_id)s)", {'lock_id': lock_id})
+        self.db().query("SELECT pg_advisory_unlock(%(lock_id)s)", {'lock_id': lock_id})
+
+        self.db().set_query_profiler(old_profiler)
+
+        # Lock would still be held if pg_advisory_lock() got run once again by EXPLAIN ANALYZE
+        held_locks = self.db().query("""
+            SELECT 1
+            FROM pg_locks
+            WHERE locktype = 'advisory'
+              AND pid = pg_backend_pid()
+              AND objid = %(lock_id)s
+        """, {'lock_id': lock_id}).flat()
+        assert len(held_locks) == 0
+
+        stats = {statement['statement']: statement for statement in profiler.stats()}
+        lock_explain = stats['SELECT pg_advisory_lock(?)']['explain']
+        assert lock_explain is not None
+        assert 'actual time' not in lock_explain
+
+    def test_query_profiler_explain_function_call(self):
+        self.db().query("CREATE TEMPORARY TABLE test_function_calls (call_count INT NOT NULL)")
+        self.db().query("INSERT INTO test_function_calls (call_count) VALUES (0)")
+        self.db().query("""
+            CREATE FUNCTION pg_temp.test_count_call() RETURNS INT AS $$
+                UPDATE test_function_calls SET call_count = call_count + 1 RETURNING call_count
+            $$ LANGUAGE SQL VOLATILE
+        """)
+
+        old_profiler = self.db().query_profiler()
+
+        profiler = QueryProfiler(explain_threshold=0)
+        self.db().set_query_profiler(profiler)
+
+        self.db().query("SELECT pg_temp.test_count_call()")
+
+        self.db().set_query_profiler(old_profiler)
+
+        # Function would have been called twice if EXPLAIN ANALYZE ran the statement once again
+        call_count = self.db().query("SELECT call_count FROM test_function_calls").flat()[0]
+        assert call_count == 1
+
+        stats = {statement['statement']: statement for statement in profiler.stats()}
+        function_explain = stats['SELECT pg_temp.test_count_call()']['explain']
+        assert function_explain is not None
+        assert 'actual time' not in function_explain
+
     def test_execute_with_large_work_mem(self):
         normal_work_mem = 256  # MB
         large_work_mem = 512  # MB
@@ -592,6 +811,49 @@ class TestDatabaseHandler(TestDatabaseTestCase):
         with pytest.raises(McUniqueConstraintException):
             self.db().create('kardashians', insert_hash)
 
+    def test_insert_many(self):
+        rows = [
+            {'name': 'Lamar', 'surname': 'Odom', 'dob': '1979-11-06'},
+            {'name': 'Sam Brody', 'surname': 'Jenner\tTab', 'dob': '1983-08-21'},
+        ]
+
+        # Multi-row VALUES
+        ids = self.db().insert_many(table='kardashians', rows=rows)
+        assert len(ids) == 2
+        assert self.db().find_by_id(table='kardashians', object_id=ids[0])['name'] == 'Lamar'
+        assert self.db().find_by_id(table='kardashians', object_id=ids[1])['surname'] == 'Jenner\tTab'
+
+        # Unique constraint
+        with pytest.raises(McUniqueConstraintException):
+            self.db().insert_many(table='kardashians', rows=rows)
+
+        # Conflicts get skipped
+        ids = self.db().insert_many(table='kardashians', rows=rows, on_conflict='(name) DO NOTHING')
+        assert ids == []
+
+        # Different columns
+        with pytest.raises(McInsertManyException):
+            self.db().insert_many(table='kardashians', rows=[rows[0], {'name': 'Scott'}])
+
+        # COPY for bigger batches, returned IDs in input order
+        many_rows = [{
+            'name': 'Kardashian fan %d %%' % x,
+            'surname': 'Fan\\%d\n' % x,
+            'dob': datetime.date(2000, 1, 1),
+            'married_to_kanye': x % 2 == 0,
+        } for x in range(2000)]
+        ids = self.db().insert_many(table='kardashians', rows=many_rows)
+        assert len(ids) == len(many_rows)
+        for x in [0, 1, 1999]:
+            row = self.db().find_by_id(table='kardashians', object_id=ids[x])
+            assert row['name'] == many_rows[x]['name']
+            assert row['surname'] == many_rows[x]['surname']
+            assert row['dob'] == '2000-01-01'
+            assert row['married_to_kanye'] == many_rows[x]['married_to_kanye']
+
+        # Nothing to insert
+        assert self.db().insert_many(table='kardashians', rows=[]) == []
+
     def test_create_updatable_view(self):
         """Test create() against an updatable view that's in front of a partitioned table."""
 
@@ -820,6 +1082,55 @@ class TestDatabaseHandler(TestDatabaseTestCase):
         assert count == 8
         assert found_utf8_khloe is True
 
+    def test_copy_rows_from(self):
+        columns = ['name', 'surname', 'dob', 'married_to_kanye']
+
+        row_count = self.db().copy_rows_from(table='kardashians', columns=columns, rows=(row for row in [
+            ('Lamar', 'Odom', datetime.date(1979, 11, 6), False,),
+            ('Sam Brody', "𝐽𝑒𝑛𝑛𝑒𝑟\t\\\n", '1983-08-21', True,),  # UTF-8, escaping
+        ]))
+        assert row_count == 2
+
+        row = self.db().query("SELECT * FROM kardashians WHERE name = 'Sam Brody'").hash()
+        assert row['surname'] == "𝐽𝑒𝑛𝑛𝑒𝑟\t\\\n"
+        assert row['dob'] == '1983-08-21'
+        assert row['married_to_kanye'] is True
+
+        # Binary
+        row_count = self.db().copy_rows_from(table='kardashians', columns=columns, binary=True, rows=[
+            ['Scott', 'Disick', datetime.date(1983, 5, 26), True],
+        ])
+        assert row_count == 1
+
+        row = self.db().query("SELECT * FROM kardashians WHERE name = 'Scott'").hash()
+        assert row['surname'] == 'Disick'
+        assert row['dob'] == '1983-05-26'
+        assert row['married_to_kanye'] is True
+
+        # Values don't match column types
+        with pytest.raises(McCopyFromException):
+            self.db().copy_rows_from(table='kardashians', columns=columns, binary=True, rows=[
+                ['Scott', 'Disick', '1983-05-26', True],
+            ])
+
+        # Values don't match columns
+        with pytest.raises(McCopyFromException):
+            self.db().copy_rows_from(table='kardashians', columns=columns, rows=[('Scott',)])
+
+    def test_copy_rows_to(self):
+        self.db().query("UPDATE kardashians SET surname = %(surname)s WHERE name = 'Kim'", {'surname': "West\t\\\n"})
+
+        rows = list(self.db().copy_rows_to("""
+            SELECT id, name, surname, dob, married_to_kanye, NULL::TEXT AS nothing
+            FROM kardashians
+            WHERE id IN (4, 5)
+            ORDER BY id
+        """))
+        assert rows == [
+            (4, 'Kim', "West\t\\\n", '1980-10-21', True, None,),
+            (5, 'Khloé', 'Kardashian', '1984-06-27', False, None,),
+        ]
+
     def test_get_temporary_ids_table(self):
         ints = [1, 2, 3, 4, 5]
 
@@ -949,3 +1260,21 @@ class TestDatabaseHandler(TestDatabaseTestCase):
                 ]
             }
         ]
+
+        # Temporary table (reused between calls, also within transaction)
+        self.db().set_attach_child_query_max_array_ids(0)
+        self.db().begin()
+        for _ in range(2):
+            names_and_surnames = self.db().attach_child_query(
+                data=[{'id': 1, 'surname': 'Doe'}, {'id': 3, 'surname': 'Bloggs'}],
+                child_query='SELECT id, name FROM names',
+                child_field='name',
+                id_column='id',
+                single=True
+            )
+            assert names_and_surnames == [
+                {'id': 1, 'name': 'John', 'surname': 'Doe'},
+                {'id': 3, 'name': 'Joe', 'surname': 'Bloggs'},
+            ]
+        self.db().commit()
+        self.db().set_attach_child_query_max_array_ids(10000)
@@ -0,0 +1,96 @@
+import json
+import os
+import tempfile
+
+from mediawords.db.profiler import normalize_query, QueryProfiler
+
+
+# noinspection SqlResolve
+def test_normalize_query():
+    assert normalize_query("SELECT *\n  FROM foo\n  WHERE foo_id = 42 AND name = 'it''s' -- comment") == (
+        'SELECT * FROM foo WHERE foo_id = ? AND name = ?'
+    )
+    assert normalize_query("SELECT * FROM foo WHERE foo_id IN (1, 2, 3) AND bar = %(bar)s") == (
+        'SELECT * FROM foo WHERE foo_id IN (...) AND bar = ?'
+    )
+    assert normalize_query("SELECT * FROM foo_1 WHERE x = %s") == 'SELECT * FROM foo_1 WHERE x = ?'
+
+
+# noinspection SqlResolve
+def test_query_profiler_stats():
+    profiler = QueryProfiler()
+
+    for duration in range(1, 101):
+        profiler.record_query(query="SELECT * FROM foo WHERE foo_id = %d" % duration, duration=duration, rows=1)
+        profiler.record_fetch(query="SELECT * FROM foo WHERE foo_id = %d" % duration, fetched_bytes=10)
+    profiler.record_query(query="UPDATE foo SET bar = 1", duration=0.5, rows=-1)
+
+    stats = profiler.stats()
+    assert len(stats) == 2
+
+    select_stats = stats[0]
+    assert select_stats['statement'] == 'SELECT * FROM foo WHERE foo_id = ?'
+    assert select_stats['calls'] == 100
+    assert select_stats['total_seconds'] == 5050
+    assert select_stats['p50_seconds'] == 50
+    assert select_stats['p99_seconds'] == 99
+    assert select_stats['max_seconds'] == 100
+    assert select_stats['rows'] == 100
+    assert select_stats['fetched_bytes'] == 1000
+
+    update_stats = stats[1]
+    assert update_stats['calls'] == 1
+    assert update_stats['rows'] == 0
+
+    profiler.reset()
+    assert profiler.stats() == []
+
+
+# noinspection SqlResolve
+def test_query_profiler_max_statements():
+    profiler = QueryProfiler(max_statements=1)
+    profiler.record_query(query="SELECT 1 FROM foo", duration=1, rows=1)
+    profiler.record_query(query="SELECT 1 FROM bar", duration=1, rows=1)
+    assert len(profiler.stats()) == 1
+    assert json.loads(profiler.to_json())['dropped_calls'] == 1
+
+
+# noinspection SqlResolve
+def test_query_profiler_explain():
+    profiler = QueryProfiler(explain_threshold=1)
+
+    profiler.record_query(query="SELECT * FROM foo", duration=2, rows=1)
+    assert profiler.wants_explain(query="SELECT * FROM foo", duration=0.5) is False
+    assert profiler.wants_explain(query="SELECT * FROM foo", duration=2) is True
+
+    profiler.record_query(query="UPDATE foo SET bar = 1", duration=2, rows=1)
+    assert profiler.wants_explain(query="UPDATE foo SET bar = 1", duration=2) is False
+
+    profiler.record_query(query="WITH x AS (DELETE FROM foo RETURNING *) SELECT * FROM x", duration=2, rows=1)
+    assert profiler.wants_explain(query="WITH x AS (DELETE FROM foo RETURNING *) SELECT * FROM x", duration=2) is False
+
+    # Plan gets captured only once
+    profiler.record_explain(query="SELECT * FROM foo", plan="Seq Scan on foo")
+    assert profiler.wants_explain(query="SELECT * FROM foo", duration=2) is False
+    assert profiler.stats()[0]['explain'] == "Seq Scan on foo"
+
+
+# noinspection SqlResolve
+def test_query_profiler_dump():
+    profiler = QueryProfiler()
+    profiler.record_query(query='SELECT "quoted"\nFROM foo', duration=0.25, rows=3)
+
+    prometheus = profiler.to_prometheus()
+    assert '# TYPE mediawords_db_statement_calls_total counter' in prometheus
+    assert 'statement="SELECT \\"quoted\\" FROM foo"} 1' in prometheus
+    assert 'quantile="0.99"} 0.25' in prometheus
+
+    directory = tempfile.mkdtemp()
+    profiler.dump(directory=directory)
+
+    with open(os.path.join(directory, 'db_profile-%d.json' % os.getpid()), 'r') as f:
+        profile = json.load(f)
+    assert profile['pid'] == os.getpid()
+    assert profile['statements'][0]['rows'] == 3
+
+    assert os.path.isfile(os.path.join(directory, 'db_profile-%d.prom' % os.getpid()))
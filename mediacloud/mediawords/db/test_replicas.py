@@ -0,0 +1,113 @@
+import pytest
+
+from mediawords.db.replicas import (
+    McReplicaRouterException,
+    ReplicaRouter,
+    statement_is_routable,
+    statement_is_write,
+)
+
+
+class MockResult(object):
+    def __init__(self, value):
+        self.__value = value
+
+    def flat(self):
+        return [self.__value]
+
+
+class MockReplica(object):
+    """Replica that reports a preset replication lag."""
+
+    def __init__(self, lag: float = 0, healthy: bool = True):
+        self.lag = lag
+        self.healthy = healthy
+        self.lag_checks = 0
+        self.disconnected = False
+
+    def query(self, *query_params):
+        if not self.healthy:
+            raise Exception("Replica is down.")
+        self.lag_checks += 1
+        return MockResult(self.lag)
+
+    def disconnect(self):
+        self.disconnected = True
+
+
+# noinspection SqlResolve
+def test_statement_is_routable():
+    assert statement_is_routable("SELECT * FROM stories") is True
+    assert statement_is_routable("-- comment\n  with x AS (SELECT 1) SELECT * FROM x") is True
+    assert statement_is_routable("SELECT * FROM stories FOR UPDATE") is False
+    assert statement_is_routable("SELECT * INTO foo FROM stories") is False
+    assert statement_is_routable("SELECT nextval('stories_stories_id_seq')") is False
+    assert statement_is_routable("SELECT pg_advisory_lock(1)") is False
+    assert statement_is_routable("WITH x AS (DELETE FROM foo RETURNING *) SELECT * FROM x") is False
+    assert statement_is_routable("UPDATE stories SET title = 'x'") is False
+
+    # Built-in functions that don't write are fine
+    assert statement_is_routable("SELECT COUNT(*), MAX(publish_date) FROM stories WHERE media_id = ANY(%(a)s)") is True
+    assert statement_is_routable("SELECT * FROM stories WHERE title = 'foo(bar)'") is True
+
+    # Any other function might write
+    assert statement_is_routable("SELECT media_stats_flush_sentence_deltas()") is False
+    assert statement_is_routable("SELECT * FROM stories WHERE half_md5(title) = 'x'") is False
+    assert statement_is_routable("SELECT cache.purge_object_caches()") is False
+
+
+# noinspection SqlResolve
+def test_statement_is_write():
+    assert statement_is_write("INSERT INTO foo (bar) VALUES (1)") is True
+    assert statement_is_write("  -- comment\ndelete from foo") is True
+    assert statement_is_write("COMMIT") is True
+    assert statement_is_write("SELECT * FROM foo") is False
+    assert statement_is_write("SET statement_timeout TO 0") is False
+    assert statement_is_write("SELECT media_stats_reconcile_num_sentences('2017-01-01', '2017-01-02')") is True
+    assert statement_is_write("WITH x AS (DELETE FROM foo RETURNING *) SELECT * FROM x") is True
+
+
+def test_replica_router():
+    fresh_replica = MockReplica(lag=0)
+    stale_replica = MockReplica(lag=100)
+
+    router = ReplicaRouter(connectors=[lambda: stale_replica, lambda: fresh_replica], max_lag=10)
+
+    # Stale replica gets skipped
+    assert router.replica() is fresh_replica
+    assert router.replica() is fresh_replica
+
+    # Lag doesn't get rechecked on every call
+    assert fresh_replica.lag_checks == 1
+
+    router.disconnect()
+    assert fresh_replica.disconnected is True
+    assert stale_replica.disconnected is True
+
+
+def test_replica_router_failures():
+    replica = MockReplica(healthy=False)
+    connect_count = 0
+
+    def __connect():
+        nonlocal connect_count
+        connect_count += 1
+        return replica
+
+    router = ReplicaRouter(connectors=[__connect], max_lag=10)
+    assert router.replica() is None
+    assert replica.disconnected is True
+
+    # Failed replica doesn't get retried right away
+    replica.healthy = True
+    assert router.replica() is None
+    assert connect_count == 1
+
+    def __connect_fail():
+        raise Exception("Unable to connect.")
+
+    router = ReplicaRouter(connectors=[__connect_fail], max_lag=10)
+    assert router.replica() is None
+
+    with pytest.raises(McReplicaRouterException):
+        ReplicaRouter(connectors=[])
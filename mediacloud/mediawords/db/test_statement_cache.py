@@ -0,0 +1,95 @@
+from mediawords.db.statement_cache import CachedStatement, StatementCache
+
+__MARKER = '<DOUBLE PERCENTAGE SIGN: test>'
+
+
+class MockCursor(object):
+    """Cursor that just records the statements it was asked to execute."""
+
+    def __init__(self):
+        self.name = None
+        self.executed = []
+
+    def execute(self, query, params=None):
+        self.executed.append((query, params,))
+
+
+# noinspection SqlResolve
+def test_cached_statement():
+    statement = CachedStatement("SELECT * FROM foo WHERE a = %(a)s AND b LIKE 'b%%' AND c = %(a)s AND d = %(d)s")
+    assert statement.preparable is True
+    assert statement.prepare_query() == "SELECT * FROM foo WHERE a = $1 AND b LIKE 'b%' AND c = $1 AND d = $2"
+    assert statement.parameter_values({'a': 1, 'd': 2, 'unused': 3}) == [1, 2]
+    assert statement.parameter_values({'a': 1}) is None
+    assert statement.parameter_values({'a': (1, 2,), 'd': 2}) is None
+
+    statement = CachedStatement("-- comment\nINSERT INTO foo (a, b) VALUES (%s, %s)")
+    assert statement.preparable is True
+    assert statement.prepare_query() == "-- comment\nINSERT INTO foo (a, b) VALUES ($1, $2)"
+    assert statement.parameter_values((1, 2,)) == [1, 2]
+    assert statement.parameter_values((1,)) is None
+
+    assert CachedStatement("BEGIN").preparable is False
+    assert CachedStatement("SELECT %s, %(mixed)s").preparable is False
+
+
+# noinspection SqlResolve
+def test_statement_cache_rewrite():
+    cache = StatementCache(max_size=2)
+
+    statement = cache.statement(raw_query="SELECT 'foo%' || " + __MARKER + " || %(bar)s",
+                                double_percentage_sign_marker=__MARKER)
+    assert statement.query == "SELECT 'foo%%' || %% || %(bar)s"
+    assert cache.stats()['misses'] == 1
+
+    assert cache.statement(raw_query="SELECT 'foo%' || " + __MARKER + " || %(bar)s",
+                           double_percentage_sign_marker=__MARKER) is statement
+    assert cache.stats()['hits'] == 1
+
+    cache.statement(raw_query="SELECT 1", double_percentage_sign_marker=__MARKER)
+    cache.statement(raw_query="SELECT 2", double_percentage_sign_marker=__MARKER)
+    stats = cache.stats()
+    assert stats['size'] == 2
+    assert stats['evictions'] == 1
+
+
+# noinspection SqlResolve
+def test_statement_cache_prepare():
+    cursor = MockCursor()
+    cache = StatementCache(prepare_threshold=2)
+
+    statement = cache.statement(raw_query="SELECT * FROM foo WHERE a = %(a)s", double_percentage_sign_marker=__MARKER)
+
+    # Not hot enough yet
+    assert cache.execute_args(cursor=cursor, statement=statement, query_params={'a': 1}, may_prepare=True) == (
+        statement.query, {'a': 1},
+    )
+    assert cursor.executed == []
+
+    # Not allowed to prepare
+    assert cache.execute_args(cursor=cursor, statement=statement, query_params={'a': 1}, may_prepare=False) == (
+        statement.query, {'a': 1},
+    )
+    assert cursor.executed == []
+
+    query, params = cache.execute_args(cursor=cursor, statement=statement, query_params={'a': 1}, may_prepare=True)
+    assert cursor.executed == [('PREPARE %s AS SELECT * FROM foo WHERE a = $1' % statement.prepared_name, None,)]
+    assert query == 'EXECUTE %s (%%s)' % statement.prepared_name
+    assert params == (1,)
+
+    # Unsupported parameters
+    assert cache.execute_args(cursor=cursor, statement=statement, query_params={'a': (1, 2,)}, may_prepare=True) == (
+        statement.query, {'a': (1, 2,)},
+    )
+
+    prepared_name = statement.prepared_name
+    cache.unprepare(statement)
+    assert statement.prepared_name is None
+    assert statement.preparable is False
+
+    cache.execute_args(cursor=cursor, statement=statement, query_params={'a': 1}, may_prepare=True)
+    assert cursor.executed[-1] == ('DEALLOCATE %s' % prepared_name, None,)
+
+    stats = cache.stats()
+    assert stats['prepares'] == 1
+    assert stats['prepared_executions'] == 1
@@ -22,8 +22,11 @@ The default is 'postgresql', and the production system uses Amazon S3.
 This module also includes extract and related functions to handle download
 extraction.
 """
+import collections
+import concurrent.futures
 import re
-from typing import Optional
+import time
+from typing import Dict, List, Optional, Union
 
 from mediawords.db import DatabaseHandler
 from mediawords.dbi.download_texts import create
@@ -33,6 +36,7 @@ from mediawords.key_value_store import KeyValueStore
 from mediawords.key_value_store.amazon_s3 import AmazonS3Store
 from mediawords.key_value_store.cached_amazon_s3 import CachedAmazonS3Store
 from mediawords.key_value_store.database_inline import DatabaseInlineStore
+from mediawords.key_value_store.disk_cached import DiskCachedStore
 from mediawords.key_value_store.multiple_stores import MultipleStoresStore
 from mediawords.key_value_store.postgresql import PostgreSQLStore
 from mediawords.util.config import get_config
@@ -49,6 +53,9 @@ RAW_DOWNLOADS_POSTGRESQL_KVS_TABLE_NAME = 'raw_downloads'
 # PostgreSQL table name for storing the s3 raw downloads cache
 S3_RAW_DOWNLOADS_CACHE_TABLE_NAME = 'cache.s3_raw_downloads_cache'
 
+# Default max. size of the local disk cache of S3 downloads (in megabytes)
+S3_DOWNLOADS_DISK_CACHE_DEFAULT_MAX_SIZE_MB = 10 * 1024
+
 # Mininmum content length to extract (assuming that it has some HTML in it)
 MIN_CONTENT_LENGTH_TO_EXTRACT = 4096
 
@@ -121,6 +128,15 @@ def _get_amazon_s3_store() -> KeyValueStore:
     else:
         _amazon_s3_store = AmazonS3Store(**store_params)
 
+    disk_cache_directory = config['mediawords'].get('s3_downloads_disk_cache_directory', None)
+    if disk_cache_directory:
+        disk_cache_max_size_mb = int(config['mediawords'].get(
+            's3_downloads_disk_cache_max_size_mb', S3_DOWNLOADS_DISK_CACHE_DEFAULT_MAX_SIZE_MB,
+        ))
+        _amazon_s3_store = DiskCachedStore(store=_amazon_s3_store,
+                                           cache_directory=disk_cache_directory,
+                                           max_size=disk_cache_max_size_mb * 1024 * 1024)
+
     return _amazon_s3_store
 
 
@@ -229,12 +245,57 @@ def fetch_content(db: DatabaseHandler, download: dict) -> str:
 
     content_bytes = store.fetch_content(db, download['downloads_id'], download['path'])
 
+    return _decode_content(downloads_id=download['downloads_id'], content_bytes=content_bytes)
+
+
+def fetch_contents(db: DatabaseHandler, downloads: List[dict]) -> Dict[int, str]:
+    """Fetch the content of multiple downloads from the configured content stores.
+
+    Downloads get grouped by the store that they're to be read from, and every store then reads its downloads in a
+    single batch (e.g. a single query for PostgreSQL, concurrent GETs for Amazon S3).
+
+    Returns dict of download IDs and their content; downloads which content wasn't found are left out of the dict.
+    """
+
+    downloads = decode_object_from_bytes_if_needed(downloads)
+
+    store_downloads = collections.OrderedDict()
+
+    for download in downloads:
+        if 'downloads_id' not in download:
+            raise McDBIDownloadsException("downloads_id not in download")
+
+        if not download_successful(download):
+            raise McDBIDownloadsException(
+                "attempt to fetch content for unsuccessful download: %d" % (download['downloads_id']))
+
+        store = _get_store_for_reading(download)
+        store_downloads.setdefault(store, []).append(download)
+
+    contents = {}
+
+    for store, downloads_to_fetch in store_downloads.items():
+        content_bytes = store.fetch_contents(
+            db,
+            [download['downloads_id'] for download in downloads_to_fetch],
+            {download['downloads_id']: download['path'] for download in downloads_to_fetch},
+        )
+
+        for downloads_id, content in content_bytes.items():
+            contents[downloads_id] = _decode_content(downloads_id=downloads_id, content_bytes=content)
+
+    return contents
+
+
+def _decode_content(downloads_id: int, content_bytes: bytes) -> str:
+    """Decode download's content fetched from the content store."""
+
     content = content_bytes.decode()
 
     # horrible hack to fix old content that is not stored in unicode
     config = get_config()
     ascii_hack_downloads_id = config['mediawords'].get('ascii_hack_downloads_id', 0)
-    if download['downloads_id'] < ascii_hack_downloads_id:
+    if downloads_id < ascii_hack_downloads_id:
         # this matches all non-printable-ascii characters.  python re does not support POSIX character
         # classes like [[:ascii:]]
         content = re.sub(r'[^ -~]', ' ', content)
@@ -258,6 +319,9 @@ def store_content(db: DatabaseHandler, download: dict, content: str) -> dict:
     except Exception as ex:
         raise McDBIDownloadsException("error while trying to store download %d: %s" % (download['downloads_id'], ex))
 
+    # Extractor results of the previous content are stale now
+    __extractor_results_memory_cache.pop(int(download['downloads_id']), None)
+
     if new_state == 'success':
         download['error_message'] = ''
 
@@ -272,19 +336,97 @@ def store_content(db: DatabaseHandler, download: dict, content: str) -> dict:
     return download
 
 
+# Max. number of extractor results to keep in the in-process tier of the extractor results cache
+__EXTRACTOR_RESULTS_MEMORY_CACHE_SIZE = 1000
+
+# Max. number of seconds to keep extractor results in the in-process tier for; entries that got purged from (or
+# overwritten in) "cache.extractor_results_cache" by other processes can only be noticed after they expire
+__EXTRACTOR_RESULTS_MEMORY_CACHE_TTL = 10 * 60
+
+# In-process LRU tier of the extractor results cache in front of "cache.extractor_results_cache": downloads_id ->
+# (monotonic time when the entry expires, extractor results)
+__extractor_results_memory_cache = collections.OrderedDict()
+
+# Extractor results cache hit / miss counters
+__extractor_results_cache_counters = collections.Counter()
+
+# Default number of days to keep extractor results in "cache.extractor_results_cache" for
+__EXTRACTOR_RESULTS_CACHE_DEFAULT_MAX_AGE_DAYS = 3
+
+# Number of rows to purge from "cache.extractor_results_cache" in a single transaction
+__EXTRACTOR_RESULTS_CACHE_PURGE_BATCH_SIZE = 1000
+
+
+def _remember_extractor_results(downloads_id: int, results: dict) -> None:
+    """Add extractor results to the in-process tier of the extractor results cache."""
+    expires_at = time.monotonic() + __EXTRACTOR_RESULTS_MEMORY_CACHE_TTL
+    __extractor_results_memory_cache[downloads_id] = (expires_at, results)
+    __extractor_results_memory_cache.move_to_end(downloads_id)
+
+    while len(__extractor_results_memory_cache) > __EXTRACTOR_RESULTS_MEMORY_CACHE_SIZE:
+        __extractor_results_memory_cache.popitem(last=False)
+        __extractor_results_cache_counters['memory_evictions'] += 1
+
+
+def clear_extractor_results_memory_cache() -> None:
+    """Empty the in-process tier of the extractor results cache and reset its counters."""
+    __extractor_results_memory_cache.clear()
+    __extractor_results_cache_counters.clear()
+
+
+def extractor_results_cache_stats() -> Dict[str, Union[int, float]]:
+    """Return extractor results cache's hit / miss counters of this process."""
+    memory_hits = __extractor_results_cache_counters['memory_hits']
+    database_hits = __extractor_results_cache_counters['database_hits']
+    misses = __extractor_results_cache_counters['misses']
+    lookups = memory_hits + database_hits + misses
+
+    return {
+        'memory_size': len(__extractor_results_memory_cache),
+        'memory_hits': memory_hits,
+        'memory_evictions': __extractor_results_cache_counters['memory_evictions'],
+        'database_hits': database_hits,
+        'misses': misses,
+        'hit_rate': (memory_hits + database_hits) / lookups if lookups else 0.0,
+    }
+
+
 def _get_extractor_results_cache(db: DatabaseHandler, download: dict) -> Optional[dict]:
-    """Get extractor results from cache.
+    """Get extractor results from cache, trying the in-process tier first.
 
     Return:
     None if there is a miss or a dict in the form of extract_content() if there is a hit.
     """
     download = decode_object_from_bytes_if_needed(download)
 
+    downloads_id = int(download['downloads_id'])
+
+    memory_entry = __extractor_results_memory_cache.get(downloads_id, None)
+    if memory_entry is not None:
+        expires_at, r = memory_entry
+
+        if expires_at > time.monotonic():
+            __extractor_results_memory_cache.move_to_end(downloads_id)
+            __extractor_results_cache_counters['memory_hits'] += 1
+            log.debug("EXTRACTOR CACHE HIT (MEMORY)")
+
+            # Return a copy so that callers can't modify the cached results
+            return dict(r)
+
+        del __extractor_results_memory_cache[downloads_id]
+        __extractor_results_cache_counters['memory_evictions'] += 1
+
     r = db.query("""
         SELECT extracted_html, extracted_text
         FROM cache.extractor_results_cache
         WHERE downloads_id = %(a)s
-    """, {'a': download['downloads_id']}).hash()
+    """, {'a': downloads_id}).hash()
+
+    if r is not None:
+        __extractor_results_cache_counters['database_hits'] += 1
+        _remember_extractor_results(downloads_id=downloads_id, results=dict(r))
+    else:
+        __extractor_results_cache_counters['misses'] += 1
 
     log.debug("EXTRACTOR CACHE HIT" if r is not None else "EXTRACTOR CACHE MISS")
 
@@ -299,9 +441,16 @@ def _set_extractor_results_cache(db, download: dict, results: dict) -> None:
     # throw extraction jobs in chunks into the extractor job and cache the results.  Then if we re-extract
     # the same story shortly after, this cache will hit and the cost will be trivial.
 
+    # The cache table itself gets trimmed by purge_extractor_results_cache().
+
     download = decode_object_from_bytes_if_needed(download)
     results = decode_object_from_bytes_if_needed(results)
 
+    _remember_extractor_results(
+        downloads_id=int(download['downloads_id']),
+        results={'extracted_html': results['extracted_html'], 'extracted_text': results['extracted_text']},
+    )
+
     # Upsert cache entry
     db.query("""
         INSERT INTO cache.extractor_results_cache (
@@ -322,6 +471,81 @@ def _set_extractor_results_cache(db, download: dict, results: dict) -> None:
     })
 
 
+def purge_extractor_results_cache(db: DatabaseHandler,
+                                  max_age_days: Optional[int] = None,
+                                  max_rows: Optional[int] = None,
+                                  batch_size: int = __EXTRACTOR_RESULTS_CACHE_PURGE_BATCH_SIZE) -> int:
+    """Evict entries from "cache.extractor_results_cache" that are older than "max_age_days" days, and then the oldest
+    inserted entries for the table to have no more than "max_rows" rows; return the number of evicted entries.
+
+    Entries get deleted in batches of "batch_size" rows with every batch in its own transaction so that purging a large
+    cache doesn't hold locks for long.
+
+    If unset, "max_age_days" and "max_rows" are read from "extractor_results_cache_max_age_days" (3 days by default)
+    and "extractor_results_cache_max_rows" (unbounded by default) in mediawords.yml.
+    """
+    if db.in_transaction():
+        raise McDBIDownloadsException("Extractor results cache is to be purged outside of a transaction.")
+
+    config = get_config()
+    if max_age_days is None:
+        max_age_days = config['mediawords'].get(
+            'extractor_results_cache_max_age_days', __EXTRACTOR_RESULTS_CACHE_DEFAULT_MAX_AGE_DAYS,
+        )
+    if max_rows is None:
+        max_rows = config['mediawords'].get('extractor_results_cache_max_rows', None)
+
+    purged_rows = 0
+
+    while True:
+        deleted_rows = db.query("""
+            DELETE FROM cache.extractor_results_cache
+            WHERE extractor_results_cache_id IN (
+                SELECT extractor_results_cache_id
+                FROM cache.extractor_results_cache
+                WHERE db_row_last_updated <= NOW() - %(max_age_days)s * INTERVAL '1 day'
+                LIMIT %(batch_size)s
+            )
+        """, {'max_age_days': int(max_age_days), 'batch_size': batch_size}).rows()
+        purged_rows += deleted_rows
+        if deleted_rows < batch_size:
+            break
+
+    if max_rows is not None:
+
+        # Entries are inserted in "extractor_results_cache_id" order
+        max_purged_id = db.query("""
+            SELECT extractor_results_cache_id
+            FROM cache.extractor_results_cache
+            ORDER BY extractor_results_cache_id DESC
+            OFFSET %(max_rows)s
+            LIMIT 1
+        """, {'max_rows': int(max_rows)}).flat()
+
+        if max_purged_id:
+            while True:
+                deleted_rows = db.query("""
+                    DELETE FROM cache.extractor_results_cache
+                    WHERE extractor_results_cache_id IN (
+                        SELECT extractor_results_cache_id
+                        FROM cache.extractor_results_cache
+                        WHERE extractor_results_cache_id <= %(max_purged_id)s
+                        ORDER BY extractor_results_cache_id
+                        LIMIT %(batch_size)s
+                    )
+                """, {'max_purged_id': max_purged_id[0], 'batch_size': batch_size}).rows()
+                purged_rows += deleted_rows
+                if deleted_rows < batch_size:
+                    break
+
+    # In-process tier might be holding some of the purged entries
+    __extractor_results_memory_cache.clear()
+
+    log.info("Purged {} entries from extractor results cache.".format(purged_rows))
+
+    return purged_rows
+
+
 def extract(db: DatabaseHandler, download: dict, extractor_args: PyExtractorArguments = PyExtractorArguments()) -> dict:
     """Extract the content for the given download.
 
@@ -359,6 +583,112 @@ def extract(db: DatabaseHandler, download: dict, extractor_args: PyExtractorArgu
     return results
 
 
+def extract_downloads(
+        db: DatabaseHandler,
+        downloads: List[dict],
+        extractor_args: PyExtractorArguments = PyExtractorArguments(),
+        extractor_pool: Optional[concurrent.futures.Executor] = None) -> Dict[int, Union[dict, Exception]]:
+    """Extract the content of a batch of downloads.
+
+    Extractor results get read from the cache, content of the rest of the downloads gets fetched in a single batch
+    with fetch_contents(), and the extractor itself gets run in "extractor_pool" (e.g.
+    mediawords.util.extract_text.ExtractorPool which enforces per-document timeouts) if one is provided.
+
+    Arguments:
+    db - db handle
+    downloads - download dicts from db
+    extractor_args - extractor arguments
+    extractor_pool - executor to run extract_content() in; if None, the content gets extracted in this process
+
+    Returns:
+    dict of download IDs and either extraction results (see extract_content()) or the exception that was raised while
+    extracting the download; a failed download doesn't prevent the rest of the batch from getting extracted
+    """
+    downloads = decode_object_from_bytes_if_needed(downloads)
+
+    results = {}
+    contents = {}
+    downloads_by_id = {}
+
+    downloads_to_fetch = []
+
+    for download in downloads:
+        downloads_id = int(download['downloads_id'])
+        downloads_by_id[downloads_id] = download
+
+        try:
+            if extractor_args.use_cache():
+                cached_results = _get_extractor_results_cache(db, download)
+                if cached_results is not None:
+                    results[downloads_id] = cached_results
+                    continue
+
+            if not download_successful(download):
+                raise McDBIDownloadsException("attempt to fetch content for unsuccessful download: %d" % downloads_id)
+
+            downloads_to_fetch.append(download)
+
+        except Exception as ex:
+            log.warning("Unable to fetch content for download {}: {}".format(downloads_id, ex))
+            results[downloads_id] = ex
+
+    if downloads_to_fetch:
+        try:
+            contents = fetch_contents(db, downloads_to_fetch)
+        except Exception as ex:
+            # Batch fails as a whole (e.g. when a single download's content can't be decoded), so refetch downloads one
+            # by one for the rest of them to still get extracted
+            log.warning("Unable to fetch content for {} downloads, fetching them one by one: {}".format(
+                len(downloads_to_fetch), ex,
+            ))
+            contents = {}
+            for download in downloads_to_fetch:
+                downloads_id = int(download['downloads_id'])
+                try:
+                    contents[downloads_id] = fetch_content(db, download)
+                except Exception as download_ex:
+                    log.warning("Unable to fetch content for download {}: {}".format(downloads_id, download_ex))
+                    results[downloads_id] = download_ex
+
+        for download in downloads_to_fetch:
+            downloads_id = int(download['downloads_id'])
+            if downloads_id not in contents and downloads_id not in results:
+                results[downloads_id] = McDBIDownloadsException(
+                    "Unable to fetch content for download {}.".format(downloads_id)
+                )
+
+    log.debug("Extracting content of {} downloads...".format(len(contents)))
+
+    extracted_results = {}
+    if extractor_pool is None:
+        for downloads_id, content in contents.items():
+            try:
+                extracted_results[downloads_id] = extract_content(content)
+            except Exception as ex:
+                extracted_results[downloads_id] = ex
+
+    else:
+        futures = {
+            downloads_id: extractor_pool.submit(extract_content, content) for downloads_id, content in contents.items()
+        }
+        for downloads_id, future in futures.items():
+            try:
+                extracted_results[downloads_id] = future.result()
+            except Exception as ex:
+                extracted_results[downloads_id] = ex
+
+    for downloads_id, extracted_result in extracted_results.items():
+        if isinstance(extracted_result, Exception):
+            log.warning("Unable to extract download {}: {}".format(downloads_id, extracted_result))
+
+        elif extractor_args.use_cache():
+            _set_extractor_results_cache(db, downloads_by_id[downloads_id], extracted_result)
+
+        results[downloads_id] = extracted_result
+
+    return results
+
+
 def _call_extractor_on_html(content: str) -> dict:
     """Call extractor on the content."""
     content = decode_object_from_bytes_if_needed(content)
@@ -439,6 +769,25 @@ def extract_and_create_download_text(db: DatabaseHandler, download: dict, extrac
     extraction_result = extract(db=db, download=download, extractor_args=extractor_args)
     log.debug("Done extracting download {}.".format(downloads_id))
 
+    return create_download_text_for_extract(
+        db=db,
+        download=download,
+        extraction_result=extraction_result,
+        extractor_args=extractor_args,
+    )
+
+
+def create_download_text_for_extract(db: DatabaseHandler,
+                                     download: dict,
+                                     extraction_result: dict,
+                                     extractor_args: PyExtractorArguments) -> dict:
+    """Create a download_text from the already extracted download (or return an existing one if "use_existing" is
+    set)."""
+    download = decode_object_from_bytes_if_needed(download)
+    extraction_result = decode_object_from_bytes_if_needed(extraction_result)
+
+    downloads_id = download['downloads_id']
+
     download_text = None
     if extractor_args.use_existing():
         log.debug("Fetching download text for download {}...".format(downloads_id))
@@ -0,0 +1,116 @@
+import datetime
+from typing import Dict, List, Optional, Tuple, Union
+
+from mediawords.db import DatabaseHandler
+from mediawords.util.config import get_config as py_get_config
+from mediawords.util.log import create_logger
+from mediawords.util.perl import decode_object_from_bytes_if_needed
+
+log = create_logger(__name__)
+
+
+def media_stats_write_behind_is_enabled() -> bool:
+    """Return True if changes in media_stats sentence counts are to be written to "media_stats_sentence_deltas" to be
+    flushed later instead of updating "media_stats" directly ("media_stats_write_behind" in mediawords.yml)."""
+    config = py_get_config()
+    return bool(config['mediawords'].get('media_stats_write_behind', False))
+
+
+def update_media_stats_num_sentences(db: DatabaseHandler,
+                                     num_sentences_deltas: Dict[Tuple[int, str], int],
+                                     write_behind: Optional[bool] = None) -> None:
+    """Apply changes in sentence counts to media_stats with a single query.
+
+    "num_sentences_deltas" is a dictionary of (media ID, story publish date) keys and changes in sentence count for
+    that medium and date.
+
+    If "write_behind" is True (or None and "media_stats_write_behind" is enabled in mediawords.yml), changes get
+    appended to "media_stats_sentence_deltas" to be applied by flush_media_stats_sentence_deltas() later."""
+
+    num_sentences_deltas = {key: delta for key, delta in num_sentences_deltas.items() if delta != 0}
+    if not num_sentences_deltas:
+        return
+
+    if write_behind is None:
+        write_behind = media_stats_write_behind_is_enabled()
+
+    media_ids = []
+    publish_dates = []
+    deltas = []
+    for (media_id, publish_date), delta in num_sentences_deltas.items():
+        media_ids.append(media_id)
+        publish_dates.append(publish_date)
+        deltas.append(delta)
+
+    # Multiple publish dates might fall on the same stat_date so deltas get summed up in the query
+    aggregated_deltas_sql = """
+        SELECT media_id,
+               publish_date::date AS stat_date,
+               SUM(num_sentences)::BIGINT AS num_sentences
+        FROM UNNEST(%(media_ids)s::BIGINT[], %(publish_dates)s::TIMESTAMP[], %(deltas)s::BIGINT[])
+            AS deltas (media_id, publish_date, num_sentences)
+        GROUP BY media_id, publish_date::date
+    """
+
+    if write_behind:
+        # Dates get recorded in a logged table for the changes to be recounted if they get lost in a crash
+        db.query("""
+            WITH inserted_deltas AS (
+                INSERT INTO media_stats_sentence_deltas (media_id, stat_date, num_sentences)
+                {}
+                RETURNING stat_date
+            )
+            INSERT INTO media_stats_sentence_delta_dates (stat_date)
+                SELECT DISTINCT stat_date
+                FROM inserted_deltas
+            ON CONFLICT (stat_date) DO NOTHING
+        """.format(aggregated_deltas_sql), {'media_ids': media_ids, 'publish_dates': publish_dates, 'deltas': deltas})
+
+    else:
+        db.query("""
+            UPDATE media_stats
+            SET num_sentences = media_stats.num_sentences + deltas.num_sentences
+            FROM ({}) AS deltas
+            WHERE media_stats.media_id = deltas.media_id
+              AND media_stats.stat_date = deltas.stat_date
+        """.format(aggregated_deltas_sql), {'media_ids': media_ids, 'publish_dates': publish_dates, 'deltas': deltas})
+
+
+def flush_media_stats_sentence_deltas(db: DatabaseHandler) -> int:
+    """Apply pending sentence count changes from "media_stats_sentence_deltas" to "media_stats" in a single statement;
+    return the number of updated "media_stats" rows."""
+    return db.query("SELECT media_stats_flush_sentence_deltas()").flat()[0]
+
+
+def pending_media_stats_sentence_deltas_date_ranges(db: DatabaseHandler) -> List[Tuple[datetime.date, datetime.date]]:
+    """Return list of (start date, end date) ranges (inclusive) of consecutive dates with sentence count changes that
+    haven't been flushed yet; the dates are known even if the changes themselves got lost in a database crash."""
+
+    # Dates in a run of consecutive dates are all the same number of days away from their row number
+    return db.query("""
+        SELECT MIN(stat_date) AS start_date,
+               MAX(stat_date) AS end_date
+        FROM (
+            SELECT stat_date,
+                   stat_date - (ROW_NUMBER() OVER (ORDER BY stat_date))::INT AS range_start
+            FROM media_stats_sentence_delta_dates
+        ) AS dates
+        GROUP BY range_start
+        ORDER BY start_date
+    """).tuples()
+
+
+def reconcile_media_stats_num_sentences(db: DatabaseHandler,
+                                        start_date: Union[str, datetime.date],
+                                        end_date: Union[str, datetime.date]) -> None:
+    """Recount "media_stats.num_sentences" of a date range (inclusive) from "story_sentences", e.g. after pending
+    changes in the unlogged "media_stats_sentence_deltas" table got lost in a database crash."""
+    start_date = decode_object_from_bytes_if_needed(start_date)
+    end_date = decode_object_from_bytes_if_needed(end_date)
+
+    log.info("Reconciling media_stats sentence counts from {} to {}...".format(start_date, end_date))
+
+    db.query("SELECT media_stats_reconcile_num_sentences(%(start_date)s::date, %(end_date)s::date)", {
+        'start_date': str(start_date),
+        'end_date': str(end_date),
+    })
@@ -1,3 +1,5 @@
+from typing import List
+
 from mediawords.db import DatabaseHandler
 from mediawords.util.extract_text import extractor_name
 from mediawords.util.perl import decode_object_from_bytes_if_needed
@@ -9,10 +11,22 @@ def extractor_version_tag_sets_name() -> str:
 
 def update_extractor_version_tag(db: DatabaseHandler, story: dict) -> None:
     """Add extractor version tag to the story."""
+    story = decode_object_from_bytes_if_needed(story)
+
+    update_extractor_version_tags(db=db, stories=[story])
+
+
+def update_extractor_version_tags(db: DatabaseHandler, stories: List[dict]) -> None:
+    """Add extractor version tag to a batch of stories with a constant number of queries."""
     # FIXME no caching because unit tests run in the same process so a cached tag set / tag will not be recreated.
     # Purging such a cache manually is very error-prone.
 
-    story = decode_object_from_bytes_if_needed(story)
+    stories = decode_object_from_bytes_if_needed(stories)
+
+    if not stories:
+        return
+
+    stories_ids = [int(story['stories_id']) for story in stories]
 
     tag_set = db.find_or_create(table='tag_sets', insert_hash={'name': extractor_version_tag_sets_name()})
 
@@ -23,10 +37,10 @@ def update_extractor_version_tag(db: DatabaseHandler, story: dict) -> None:
                     ON ts.tag_sets_id = t.tag_sets_id
         WHERE t.tags_id = stm.tags_id
           AND ts.tag_sets_id = %(tag_sets_id)s
-          AND stm.stories_id = %(stories_id)s
+          AND stm.stories_id = ANY(%(stories_ids)s::BIGINT[])
     """, {
         'tag_sets_id': tag_set['tag_sets_id'],
-        'stories_id': story['stories_id'],
+        'stories_ids': stories_ids,
     })
 
     extractor_version = extractor_name()
@@ -35,5 +49,5 @@ def update_extractor_version_tag(db: DatabaseHandler, story: dict) -> None:
 
     db.query("""
         INSERT INTO stories_tags_map (stories_id, tags_id)
-        VALUES (%(stories_id)s, %(tags_id)s)
-    """, {'stories_id': story['stories_id'], 'tags_id': tags_id})
+        SELECT DISTINCT UNNEST(%(stories_ids)s::BIGINT[]), %(tags_id)s
+    """, {'stories_ids': stories_ids, 'tags_id': tags_id})
@@ -1,12 +1,14 @@
+from typing import List
+
 from mediawords.annotator.cliff import CLIFFAnnotator
 from mediawords.annotator.nyt_labels import NYTLabelsAnnotator
 from mediawords.db import DatabaseHandler
 from mediawords.dbi.stories.extractor_arguments import PyExtractorArguments
-from mediawords.dbi.stories.extractor_version import update_extractor_version_tag
+from mediawords.dbi.stories.extractor_version import update_extractor_version_tag, update_extractor_version_tags
 from mediawords.dbi.stories.postprocess import mark_as_processed
 from mediawords.job.cliff.fetch_annotation import CLIFFFetchAnnotationJob
 from mediawords.job.nyt_labels.fetch_annotation import NYTLabelsFetchAnnotationJob
-from mediawords.story_vectors import update_story_sentences_and_language
+from mediawords.story_vectors import update_story_sentences_and_language, update_stories_sentences_and_language
 from mediawords.util.log import create_logger
 from mediawords.util.perl import decode_object_from_bytes_if_needed
 
@@ -31,6 +33,31 @@ def process_extracted_story(db: DatabaseHandler, story: dict, extractor_args: Py
         log.debug("Updating extractor version tag for story {}...".format(stories_id))
         update_extractor_version_tag(db=db, story=story)
 
+    _send_story_to_annotators(db=db, stories_id=stories_id)
+
+
+def process_extracted_stories(db: DatabaseHandler, stories: List[dict], extractor_args: PyExtractorArguments) -> None:
+    """Do post extraction processing of a batch of stories, updating their sentences, languages and extractor version
+    tags set-wise with update_stories_sentences_and_language() and update_extractor_version_tags()."""
+    stories = decode_object_from_bytes_if_needed(stories)
+
+    if not stories:
+        return
+
+    log.debug("Updating sentences and language for {} stories...".format(len(stories)))
+    update_stories_sentences_and_language(db=db, stories=stories, extractor_args=extractor_args)
+
+    if not extractor_args.no_tag_extractor_version():
+        log.debug("Updating extractor version tags for {} stories...".format(len(stories)))
+        update_extractor_version_tags(db=db, stories=stories)
+
+    for story in stories:
+        _send_story_to_annotators(db=db, stories_id=story['stories_id'])
+
+
+def _send_story_to_annotators(db: DatabaseHandler, stories_id: int) -> None:
+    """Add extracted story to annotator queues, or mark it as processed if none of the annotators are enabled."""
+
     # Extract -> CLIFF -> NYTLabels -> mark_as_processed() chain
     cliff = CLIFFAnnotator()
     if cliff.annotator_is_enabled() and cliff.story_is_annotatable(db=db, stories_id=stories_id):
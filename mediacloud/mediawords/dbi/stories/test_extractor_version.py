@@ -1,7 +1,11 @@
 from typing import List, Dict, Any
 
 # noinspection PyProtectedMember
-from mediawords.dbi.stories.extractor_version import extractor_version_tag_sets_name, update_extractor_version_tag
+from mediawords.dbi.stories.extractor_version import (
+    extractor_version_tag_sets_name,
+    update_extractor_version_tag,
+    update_extractor_version_tags,
+)
 from mediawords.test.db.create import create_test_medium, create_test_feed, create_test_story
 from mediawords.test.test_database import TestDatabaseWithSchemaTestCase
 
@@ -34,3 +38,19 @@ class TestExtractorVersion(TestDatabaseWithSchemaTestCase):
 
         story_extractor_tags = self.__story_extractor_tags(stories_id=test_story['stories_id'])
         assert len(story_extractor_tags) == 1
+
+    def test_update_extractor_version_tags(self):
+        test_medium = create_test_medium(db=self.db(), label='test medium')
+        test_feed = create_test_feed(db=self.db(), label='test feed', medium=test_medium)
+        test_stories = [
+            create_test_story(db=self.db(), label='test story {}'.format(x), feed=test_feed) for x in range(3)
+        ]
+
+        update_extractor_version_tags(db=self.db(), stories=test_stories)
+
+        # Updating tags again shouldn't create duplicate tag mappings
+        update_extractor_version_tags(db=self.db(), stories=test_stories)
+
+        for test_story in test_stories:
+            story_extractor_tags = self.__story_extractor_tags(stories_id=test_story['stories_id'])
+            assert len(story_extractor_tags) == 1
@@ -1,7 +1,10 @@
 """Test mediawords.dbi.downloads."""
 
+import concurrent.futures
 import copy
 import os
+import shutil
+import tempfile
 from unittest import TestCase
 
 import mediawords.dbi.downloads
@@ -17,6 +20,7 @@ from mediawords.test.test_database import TestDatabaseWithSchemaTestCase
 from mediawords.key_value_store.amazon_s3 import AmazonS3Store
 from mediawords.key_value_store.cached_amazon_s3 import CachedAmazonS3Store
 from mediawords.key_value_store.database_inline import DatabaseInlineStore
+from mediawords.key_value_store.disk_cached import DiskCachedStore
 from mediawords.key_value_store.postgresql import PostgreSQLStore
 from mediawords.key_value_store.multiple_stores import MultipleStoresStore
 from mediawords.test.text import TestCaseTextUtilities
@@ -77,6 +81,19 @@ class TestDownloads(TestCase, TestCaseTextUtilities):
 
         assert store is mediawords.dbi.downloads._get_amazon_s3_store()
 
+        mediawords.dbi.downloads._amazon_s3_store = None
+
+        disk_cache_directory = tempfile.mkdtemp()
+        self.config['mediawords']['s3_downloads_disk_cache_directory'] = disk_cache_directory
+        store = mediawords.dbi.downloads._get_amazon_s3_store()
+
+        assert isinstance(store, DiskCachedStore)
+
+        assert store is mediawords.dbi.downloads._get_amazon_s3_store()
+
+        del self.config['mediawords']['s3_downloads_disk_cache_directory']
+        shutil.rmtree(disk_cache_directory)
+
     def test_get_postgresql_store(self) -> None:
         """Test _get_postgresql_store."""
         self.config['mediawords']['fallback_postgresql_downloads_to_s3'] = False
@@ -204,6 +221,9 @@ class TestDownloadsDB(TestDatabaseWithSchemaTestCase):
         """Set config for tests."""
         super().setUp()
 
+        # Fresh database reuses download IDs so extractor results cached in memory would be stale
+        mediawords.dbi.downloads.clear_extractor_results_memory_cache()
+
         self.config = mediawords.util.config.get_config()
 
         self.test_medium = create_test_medium(self.db(), 'downloads test')
@@ -256,6 +276,39 @@ class TestDownloadsDB(TestDatabaseWithSchemaTestCase):
         got_content = mediawords.dbi.downloads.fetch_content(db, self.test_download)
         assert got_content == 'foo   bar'
 
+    def test_fetch_contents(self) -> None:
+        """Test fetch_contents by manually storing using the postgresql store and then trying to fetch it."""
+        db = self.db()
+
+        with self.assertRaises(mediawords.dbi.downloads.McDBIDownloadsException):
+            mediawords.dbi.downloads.fetch_contents(db, [{'downloads_id': 1, 'state': 'error'}])
+
+        assert mediawords.dbi.downloads.fetch_contents(db, []) == {}
+
+        self.config['mediawords']['read_all_downloads_from_s3'] = False
+        self.config['mediawords']['fallback_postgresql_downloads_to_s3'] = False
+
+        store = mediawords.dbi.downloads._get_store_for_reading(self.test_download)
+
+        content = 'foo bar'
+        store.store_content(db, self.test_download['downloads_id'], content)
+
+        inline_download = copy.deepcopy(self.test_download)
+        inline_download['downloads_id'] = self.test_download['downloads_id'] + 1000
+        inline_download['path'] = 'content:inline foo'
+
+        missing_download = copy.deepcopy(self.test_download)
+        missing_download['downloads_id'] = self.test_download['downloads_id'] + 2000
+        missing_download['path'] = 'postgresql:missing'
+
+        got_contents = mediawords.dbi.downloads.fetch_contents(db, [
+            self.test_download, inline_download, missing_download,
+        ])
+        assert got_contents == {
+            self.test_download['downloads_id']: content,
+            inline_download['downloads_id']: 'inline foo',
+        }
+
     def test_store_content(self) -> None:
         """Test store_content by calling store_content and then calling fetch_content() on the postgresql store."""
         db = self.db()
@@ -292,6 +345,86 @@ class TestDownloadsDB(TestDatabaseWithSchemaTestCase):
         got_results = mediawords.dbi.downloads._get_extractor_results_cache(self.db(), self.test_download)
         assert got_results == extractor_results
 
+    def test_extractor_cache_tiers(self) -> None:
+        """Test in-process and database tiers of extract cache."""
+        db = self.db()
+
+        mediawords.dbi.downloads.clear_extractor_results_memory_cache()
+
+        assert mediawords.dbi.downloads._get_extractor_results_cache(db, self.test_download) is None
+
+        extractor_results = {'extracted_html': 'extracted html', 'extracted_text': 'extracted text'}
+        mediawords.dbi.downloads._set_extractor_results_cache(db, self.test_download, extractor_results)
+
+        # Served from memory
+        assert mediawords.dbi.downloads._get_extractor_results_cache(db, self.test_download) == extractor_results
+
+        # Served from database
+        mediawords.dbi.downloads.clear_extractor_results_memory_cache()
+        assert mediawords.dbi.downloads._get_extractor_results_cache(db, self.test_download) == extractor_results
+        assert mediawords.dbi.downloads._get_extractor_results_cache(db, self.test_download) == extractor_results
+
+        stats = mediawords.dbi.downloads.extractor_results_cache_stats()
+        assert stats['memory_size'] == 1
+        assert stats['memory_hits'] == 1
+        assert stats['database_hits'] == 1
+        assert stats['misses'] == 0
+        assert stats['hit_rate'] == 1.0
+
+    def test_extractor_cache_memory_invalidation(self) -> None:
+        """Test that in-process tier of extract cache doesn't serve stale results."""
+        db = self.db()
+
+        extractor_results = {'extracted_html': 'extracted html', 'extracted_text': 'extracted text'}
+        mediawords.dbi.downloads._set_extractor_results_cache(db, self.test_download, extractor_results)
+
+        # Storing new content drops the download's results from memory
+        mediawords.dbi.downloads.store_content(db, self.test_download, self.__TEST_CONTENT)
+        assert mediawords.dbi.downloads.extractor_results_cache_stats()['memory_size'] == 0
+
+        # Purged entries don't get served from memory either
+        assert mediawords.dbi.downloads._get_extractor_results_cache(db, self.test_download) == extractor_results
+        assert mediawords.dbi.downloads.extractor_results_cache_stats()['memory_size'] == 1
+
+        mediawords.dbi.downloads.purge_extractor_results_cache(db=db, max_age_days=3, max_rows=0)
+        assert mediawords.dbi.downloads._get_extractor_results_cache(db, self.test_download) is None
+
+    def test_purge_extractor_results_cache(self) -> None:
+        """Test purging extract cache table."""
+        db = self.db()
+
+        downloads = [self.test_download]
+        for _ in range(4):
+            downloads.append(create_download_for_story(db, feed=self.test_feed, story=self.test_story))
+
+        for download in downloads:
+            mediawords.dbi.downloads._set_extractor_results_cache(db, download, {
+                'extracted_html': 'extracted html',
+                'extracted_text': 'extracted text',
+            })
+
+        # Trigger resets "db_row_last_updated" on update so set it without the trigger
+        db.query("ALTER TABLE cache.extractor_results_cache DISABLE TRIGGER USER")
+        db.query("""
+            UPDATE cache.extractor_results_cache
+            SET db_row_last_updated = NOW() - INTERVAL '10 days'
+            WHERE downloads_id = %(downloads_id)s
+        """, {'downloads_id': downloads[-1]['downloads_id']})
+        db.query("ALTER TABLE cache.extractor_results_cache ENABLE TRIGGER USER")
+
+        purged_rows = mediawords.dbi.downloads.purge_extractor_results_cache(
+            db=db, max_age_days=3, max_rows=2, batch_size=1,
+        )
+        assert purged_rows == 3
+
+        # Newest entries get kept
+        cached_downloads_ids = db.query("""
+            SELECT downloads_id
+            FROM cache.extractor_results_cache
+            ORDER BY downloads_id
+        """).flat()
+        assert cached_downloads_ids == [downloads[2]['downloads_id'], downloads[3]['downloads_id']]
+
     def test_extract(self) -> None:
         """Test extract()."""
         db = self.db()
@@ -318,6 +451,48 @@ class TestDownloadsDB(TestDatabaseWithSchemaTestCase):
         assert result['extracted_html'].strip() == '<body id="readabilityBody"><p>foo</p></body>'
         assert result['extracted_text'].strip() == 'foo.'
 
+    def test_extract_downloads(self) -> None:
+        """Test extract_downloads()."""
+        db = self.db()
+
+        html = '<script>ignore</script><p>foo</p>'
+        mediawords.dbi.downloads.store_content(db, self.test_download, html)
+
+        missing_download = copy.deepcopy(self.test_download)
+        missing_download['downloads_id'] = self.test_download['downloads_id'] + 1000
+        missing_download['path'] = 'postgresql:missing'
+
+        for extractor_pool in [None, concurrent.futures.ThreadPoolExecutor(max_workers=2)]:
+            results = mediawords.dbi.downloads.extract_downloads(
+                db=db,
+                downloads=[self.test_download, missing_download],
+                extractor_pool=extractor_pool,
+            )
+
+            result = results[self.test_download['downloads_id']]
+            assert result['extracted_html'].strip() == '<body id="readabilityBody"><p>foo</p></body>'
+            assert result['extracted_text'].strip() == 'foo.'
+
+            # Failing download doesn't fail the whole batch
+            assert isinstance(results[missing_download['downloads_id']], Exception)
+
+        # Download with content that can't be decoded doesn't fail the whole batch either
+        undecodable_download = create_download_for_story(self.db(), feed=self.test_feed, story=self.test_story)
+        undecodable_download['path'] = 'postgresql:foo'
+        undecodable_download['state'] = 'success'
+        self.db().update_by_id('downloads', undecodable_download['downloads_id'], undecodable_download)
+
+        store = mediawords.dbi.downloads._get_store_for_reading(undecodable_download)
+        store.store_content(db, undecodable_download['downloads_id'], b'\xff\xfe')
+
+        results = mediawords.dbi.downloads.extract_downloads(
+            db=db,
+            downloads=[self.test_download, undecodable_download],
+        )
+
+        assert results[self.test_download['downloads_id']]['extracted_text'].strip() == 'foo.'
+        assert isinstance(results[undecodable_download['downloads_id']], UnicodeDecodeError)
+
     def test_get_media_id(self):
         media_id = mediawords.dbi.downloads.get_media_id(db=self.db(), download=self.test_download)
         assert media_id == self.test_medium['media_id']
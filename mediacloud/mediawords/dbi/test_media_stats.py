@@ -0,0 +1,122 @@
+from mediawords.dbi.media_stats import (
+    update_media_stats_num_sentences,
+    flush_media_stats_sentence_deltas,
+    pending_media_stats_sentence_deltas_date_ranges,
+    reconcile_media_stats_num_sentences,
+)
+from mediawords.test.db.create import create_test_medium, create_test_feed, create_test_story
+from mediawords.test.test_database import TestDatabaseWithSchemaTestCase
+
+
+class TestMediaStats(TestDatabaseWithSchemaTestCase):
+
+    def setUp(self) -> None:
+        super().setUp()
+
+        self.test_medium = create_test_medium(self.db(), 'media stats test')
+        self.test_feed = create_test_feed(self.db(), 'media stats test', self.test_medium)
+        self.test_story = create_test_story(self.db(), label='media stats test', feed=self.test_feed)
+
+    def __num_sentences(self) -> int:
+        return self.db().query("""
+            SELECT num_sentences
+            FROM media_stats
+            WHERE media_id = %(media_id)s
+              AND stat_date = %(publish_date)s::date
+        """, {
+            'media_id': self.test_medium['media_id'],
+            'publish_date': self.test_story['publish_date'],
+        }).flat()[0]
+
+    def test_update_media_stats_num_sentences(self):
+        num_sentences_before = self.__num_sentences()
+
+        update_media_stats_num_sentences(
+            db=self.db(),
+            num_sentences_deltas={(self.test_medium['media_id'], self.test_story['publish_date']): 3},
+            write_behind=False,
+        )
+        assert self.__num_sentences() == num_sentences_before + 3
+
+    def test_update_media_stats_num_sentences_write_behind(self):
+        num_sentences_before = self.__num_sentences()
+
+        media_id = self.test_medium['media_id']
+        publish_date = self.test_story['publish_date']
+
+        update_media_stats_num_sentences(db=self.db(), num_sentences_deltas={(media_id, publish_date): 3},
+                                         write_behind=True)
+        update_media_stats_num_sentences(db=self.db(), num_sentences_deltas={(media_id, publish_date): -1},
+                                         write_behind=True)
+
+        # Not applied until flushed
+        assert self.__num_sentences() == num_sentences_before
+
+        assert flush_media_stats_sentence_deltas(db=self.db()) == 1
+        assert self.__num_sentences() == num_sentences_before + 2
+
+        # Nothing to flush anymore
+        assert flush_media_stats_sentence_deltas(db=self.db()) == 0
+        assert self.__num_sentences() == num_sentences_before + 2
+
+    def test_reconcile_media_stats_num_sentences(self):
+        for sentence_number in range(4):
+            self.db().insert(table='story_sentences', insert_hash={
+                'stories_id': self.test_story['stories_id'],
+                'media_id': self.test_medium['media_id'],
+                'sentence_number': sentence_number,
+                'sentence': 'Sentence number {}.'.format(sentence_number),
+                'publish_date': self.test_story['publish_date'],
+                'language': 'en',
+            })
+
+        # Pending changes that got lost (or are wrong) don't matter after the recount
+        update_media_stats_num_sentences(
+            db=self.db(),
+            num_sentences_deltas={(self.test_medium['media_id'], self.test_story['publish_date']): 100},
+            write_behind=True,
+        )
+
+        publish_date = self.test_story['publish_date'][:10]
+        reconcile_media_stats_num_sentences(db=self.db(), start_date=publish_date, end_date=publish_date)
+
+        assert self.__num_sentences() == 4
+
+        assert flush_media_stats_sentence_deltas(db=self.db()) == 0
+        assert self.__num_sentences() == 4
+
+    def test_pending_media_stats_sentence_deltas_date_ranges(self):
+        assert pending_media_stats_sentence_deltas_date_ranges(db=self.db()) == []
+
+        media_id = self.test_medium['media_id']
+
+        update_media_stats_num_sentences(db=self.db(), num_sentences_deltas={
+            (media_id, '2017-01-03 12:00:00'): 1,
+            (media_id, '2017-01-01 12:00:00'): 1,
+            (media_id, '2010-06-01 12:00:00'): 1,
+        }, write_behind=True)
+        update_media_stats_num_sentences(db=self.db(), num_sentences_deltas={
+            (media_id, '2017-01-02 12:00:00'): 1,
+            (media_id, '2017-01-03 18:00:00'): 1,
+        }, write_behind=True)
+
+        # Simulate a crash which truncates the unlogged table
+        self.db().query("TRUNCATE media_stats_sentence_deltas")
+
+        # Consecutive dates get merged into ranges; an old date doesn't extend them
+        date_ranges = pending_media_stats_sentence_deltas_date_ranges(db=self.db())
+        assert [(str(start_date), str(end_date)) for start_date, end_date in date_ranges] == [
+            ('2010-06-01', '2010-06-01'),
+            ('2017-01-01', '2017-01-03'),
+        ]
+
+        for start_date, end_date in date_ranges:
+            reconcile_media_stats_num_sentences(db=self.db(), start_date=start_date, end_date=end_date)
+        assert pending_media_stats_sentence_deltas_date_ranges(db=self.db()) == []
+
+        # Flushing forgets the dates too
+        update_media_stats_num_sentences(db=self.db(), num_sentences_deltas={(media_id, '2017-01-01 12:00:00'): 1},
+                                         write_behind=True)
+        assert pending_media_stats_sentence_deltas_date_ranges(db=self.db()) != []
+        flush_media_stats_sentence_deltas(db=self.db())
+        assert pending_media_stats_sentence_deltas_date_ranges(db=self.db()) == []
@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 
 from mediawords.annotator.cliff import CLIFFAnnotator
-from mediawords.db import connect_to_db
+from mediawords.db import pooled_connection_to_db
 from mediawords.job import AbstractJob, McAbstractJobException, JobBrokerApp
 from mediawords.job.nyt_labels.fetch_annotation import NYTLabelsFetchAnnotationJob
 from mediawords.util.log import create_logger
@@ -36,26 +36,25 @@ class CLIFFUpdateStoryTagsJob(AbstractJob):
 
         stories_id = int(stories_id)
 
-        db = connect_to_db()
+        with pooled_connection_to_db() as db:
+            log.info("Updating tags for story ID %d..." % stories_id)
 
-        log.info("Updating tags for story ID %d..." % stories_id)
+            story = db.find_by_id(table='stories', object_id=stories_id)
+            if story is None:
+                raise McCLIFFUpdateStoryTagsJobException("Story with ID %d was not found." % stories_id)
 
-        story = db.find_by_id(table='stories', object_id=stories_id)
-        if story is None:
-            raise McCLIFFUpdateStoryTagsJobException("Story with ID %d was not found." % stories_id)
+            cliff = CLIFFAnnotator()
+            try:
+                cliff.update_tags_for_story(db=db, stories_id=stories_id)
+            except Exception as ex:
+                raise McCLIFFUpdateStoryTagsJobException(
+                    "Unable to process story ID %s with CLIFF: %s" % (stories_id, str(ex),)
+                )
 
-        cliff = CLIFFAnnotator()
-        try:
-            cliff.update_tags_for_story(db=db, stories_id=stories_id)
-        except Exception as ex:
-            raise McCLIFFUpdateStoryTagsJobException(
-                "Unable to process story ID %s with CLIFF: %s" % (stories_id, str(ex),)
-            )
+            log.info("Adding story ID %d to NYTLabels fetch queue..." % stories_id)
+            NYTLabelsFetchAnnotationJob.add_to_queue(stories_id=stories_id)
 
-        log.info("Adding story ID %d to NYTLabels fetch queue..." % stories_id)
-        NYTLabelsFetchAnnotationJob.add_to_queue(stories_id=stories_id)
-
-        log.info("Finished updating tags for story ID %d" % stories_id)
+            log.info("Finished updating tags for story ID %d" % stories_id)
 
     @classmethod
     def queue_name(cls) -> str:
@@ -2,11 +2,11 @@
 
 import time
 
-from mediawords.db import connect_to_db
+from mediawords.db import pooled_connection_to_db
 from mediawords.dbi.stories.extractor_arguments import PyExtractorArguments
 from mediawords.dbi.stories.stories import extract_and_process_story
 from mediawords.job import AbstractJob, McAbstractJobException, JobBrokerApp
-from mediawords.story_vectors import medium_is_locked
+from mediawords.story_vectors import medium_is_locked, sentence_dedup_is_lock_free
 from mediawords.util.log import create_logger
 from mediawords.util.perl import decode_object_from_bytes_if_needed
 
@@ -46,45 +46,46 @@ class ExtractAndVectorJob(AbstractJob):
         if not stories_id:
             raise McExtractAndVectorException("'stories_id' is not set.")
 
-        db = connect_to_db()
+        with pooled_connection_to_db() as db:
+            story = db.find_by_id(table='stories', object_id=stories_id)
+            if not story:
+                raise McExtractAndVectorException("Story with ID {} was not found.".format(stories_id))
 
-        story = db.find_by_id(table='stories', object_id=stories_id)
-        if not story:
-            raise McExtractAndVectorException("Story with ID {} was not found.".format(stories_id))
+            # Lock-free sentence deduplication doesn't lock media so there's no point in waiting for them
+            if (not sentence_dedup_is_lock_free()) and medium_is_locked(db=db, media_id=story['media_id']):
+                log.warning("Requeueing job for story {} in locked medium {}...".format(
+                    stories_id, story['media_id'],
+                ))
+                ExtractAndVectorJob._consecutive_requeues += 1
 
-        if medium_is_locked(db=db, media_id=story['media_id']):
-            log.warning("Requeueing job for story {} in locked medium {}...".format(stories_id, story['media_id']))
-            ExtractAndVectorJob._consecutive_requeues += 1
+                # Prevent spamming these requeue events if the locked media source is the only one in the queue
+                if ExtractAndVectorJob._consecutive_requeues > ExtractAndVectorJob._SLEEP_AFTER_REQUEUES:
+                    log.warning((
+                        "Story extraction job has been requeued more than {} times, "
+                        "waiting before requeueing..."
+                    ).format(ExtractAndVectorJob._consecutive_requeues))
+                    time.sleep(1)
 
-            # Prevent spamming these requeue events if the locked media source is the only one in the queue
-            if ExtractAndVectorJob._consecutive_requeues > ExtractAndVectorJob._SLEEP_AFTER_REQUEUES:
-                log.warning(
-                    "Story extraction job has been requeued more than {} times, waiting before requeueing...".format(
-                        ExtractAndVectorJob._consecutive_requeues
-                    )
-                )
-                time.sleep(1)
+                ExtractAndVectorJob.add_to_queue(stories_id=stories_id)
 
-            ExtractAndVectorJob.add_to_queue(stories_id=stories_id)
+                return
 
-            return
+            ExtractAndVectorJob._consecutive_requeues = 0
 
-        ExtractAndVectorJob._consecutive_requeues = 0
+            log.info("Extracting story {}...".format(stories_id))
 
-        log.info("Extracting story {}...".format(stories_id))
+            db.begin()
 
-        db.begin()
+            try:
+                extractor_args = PyExtractorArguments(use_cache=use_cache)
+                extract_and_process_story(db=db, story=story, extractor_args=extractor_args)
 
-        try:
-            extractor_args = PyExtractorArguments(use_cache=use_cache)
-            extract_and_process_story(db=db, story=story, extractor_args=extractor_args)
+            except Exception as ex:
+                raise McExtractAndVectorException("Extractor died while extracting story {}: {}".format(stories_id, ex))
 
-        except Exception as ex:
-            raise McExtractAndVectorException("Extractor died while extracting story {}: {}".format(stories_id, ex))
+            db.commit()
 
-        db.commit()
-
-        log.info("Done extracting story {}.".format(stories_id))
+            log.info("Done extracting story {}.".format(stories_id))
 
     @classmethod
     def queue_name(cls) -> str:
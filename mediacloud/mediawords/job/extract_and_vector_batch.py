@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+
+import collections
+from typing import Dict, List, Optional
+
+from mediawords.db import DatabaseHandler, pooled_connection_to_db
+from mediawords.dbi.downloads import extract_downloads, create_download_text_for_extract
+from mediawords.dbi.stories.extractor_arguments import PyExtractorArguments
+from mediawords.dbi.stories.process import process_extracted_stories
+from mediawords.job import AbstractJob, McAbstractJobException, JobBrokerApp
+from mediawords.story_vectors import medium_is_locked, sentence_dedup_is_lock_free
+from mediawords.util.extract_text import ExtractorPool
+from mediawords.util.log import create_logger
+from mediawords.util.perl import decode_object_from_bytes_if_needed
+
+log = create_logger(__name__)
+
+
+class McExtractAndVectorBatchException(McAbstractJobException):
+    """ExtractAndVectorBatchJob exception."""
+    pass
+
+
+class ExtractAndVectorBatchJob(AbstractJob):
+    """
+
+    Extract, vector and process a batch of stories.
+
+    Stories and their downloads get fetched with a few queries, downloads get extracted in a pool of worker processes
+    which enforces per-document timeouts and memory limits (a story with a document that times out gets reported as
+    failed), and download texts, sentences and extractor version tags get written in transactions of up to
+    _STORIES_PER_TRANSACTION stories each. A story that fails to get processed doesn't fail the whole batch; instead,
+    the job returns IDs of failed stories with their error messages.
+
+    Start this worker script by running:
+
+        ./script/run_in_env.sh ./mediacloud/mediawords/job/extract_and_vector_batch.py
+
+    """
+
+    # Max. number of stories to write in a single transaction
+    _STORIES_PER_TRANSACTION = 20
+
+    # Extractor pool kept warm between jobs
+    _extractor_pool = None
+
+    @classmethod
+    def _get_extractor_pool(cls, extractor_processes: int) -> Optional[ExtractorPool]:
+        """Return extractor pool with the requested number of worker processes, or None if extraction is to be done in
+        the job's own process."""
+        if cls._extractor_pool is not None and cls._extractor_pool[0] != extractor_processes:
+            cls._extractor_pool[1].shutdown()
+            cls._extractor_pool = None
+
+        if extractor_processes < 1:
+            return None
+
+        if cls._extractor_pool is None:
+            cls._extractor_pool = (extractor_processes, ExtractorPool(max_workers=extractor_processes),)
+
+        return cls._extractor_pool[1]
+
+    @classmethod
+    def run_job(cls, stories_ids: List[int], use_cache: bool = False, extractor_processes: int = 1) -> Dict[int, str]:
+        """Extract, vector and process a batch of stories; return dict of failed story IDs and error messages.
+
+        Arguments:
+        stories_ids - IDs of stories to extract
+        use_cache - get and set results in extractor cache
+        extractor_processes - number of extractor worker processes; 0 to extract in the job's own process without
+                              per-document limits
+        """
+
+        # MC_REWRITE_TO_PYTHON: remove after Python rewrite
+        stories_ids = decode_object_from_bytes_if_needed(stories_ids)
+        if isinstance(use_cache, bytes):
+            use_cache = decode_object_from_bytes_if_needed(use_cache)
+        if isinstance(extractor_processes, bytes):
+            extractor_processes = decode_object_from_bytes_if_needed(extractor_processes)
+
+        if not stories_ids:
+            raise McExtractAndVectorBatchException("'stories_ids' is not set.")
+
+        stories_ids = sorted(set(int(stories_id) for stories_id in stories_ids))
+        extractor_processes = int(extractor_processes)
+
+        extractor_args = PyExtractorArguments(use_cache=use_cache)
+
+        failures = {}
+
+        with pooled_connection_to_db() as db:
+            stories = db.query("""
+                SELECT *
+                FROM stories
+                WHERE stories_id = ANY(%(stories_ids)s::BIGINT[])
+                ORDER BY stories_id
+            """, {'stories_ids': stories_ids}).hashes()
+
+            found_stories_ids = set(story['stories_id'] for story in stories)
+            for stories_id in stories_ids:
+                if stories_id not in found_stories_ids:
+                    failures[stories_id] = "Story with ID {} was not found.".format(stories_id)
+
+            # Lock-free sentence deduplication doesn't lock media so there's no point in waiting for them
+            if not sentence_dedup_is_lock_free():
+                locked_media_ids = set(
+                    media_id for media_id in set(story['media_id'] for story in stories)
+                    if medium_is_locked(db=db, media_id=media_id)
+                )
+                if locked_media_ids:
+                    locked_stories_ids = [story['stories_id'] for story in stories
+                                          if story['media_id'] in locked_media_ids]
+
+                    log.warning("Requeueing {} stories in locked media {}...".format(
+                        len(locked_stories_ids), sorted(locked_media_ids),
+                    ))
+                    cls.add_to_queue(
+                        stories_ids=locked_stories_ids,
+                        use_cache=use_cache,
+                        extractor_processes=extractor_processes,
+                    )
+
+                    stories = [story for story in stories if story['media_id'] not in locked_media_ids]
+
+            if not stories:
+                return failures
+
+            log.info("Extracting {} stories...".format(len(stories)))
+
+            downloads = db.query("""
+                SELECT *
+                FROM downloads
+                WHERE stories_id = ANY(%(stories_ids)s::BIGINT[])
+                  AND type = 'content'
+                ORDER BY stories_id, downloads_id
+            """, {'stories_ids': [story['stories_id'] for story in stories]}).hashes()
+
+            story_downloads = collections.defaultdict(list)
+            for download in downloads:
+                story_downloads[download['stories_id']].append(download)
+
+            extraction_results = extract_downloads(
+                db=db,
+                downloads=downloads,
+                extractor_args=extractor_args,
+                extractor_pool=cls._get_extractor_pool(extractor_processes=extractor_processes),
+            )
+
+            extracted_stories = []
+            for story in stories:
+                stories_id = story['stories_id']
+
+                extraction_errors = [
+                    extraction_results[download['downloads_id']] for download in story_downloads[stories_id]
+                    if isinstance(extraction_results[download['downloads_id']], Exception)
+                ]
+                if extraction_errors:
+                    failures[stories_id] = "Extractor died while extracting story {}: {}".format(
+                        stories_id, extraction_errors[0],
+                    )
+                else:
+                    extracted_stories.append(story)
+
+            for offset in range(0, len(extracted_stories), cls._STORIES_PER_TRANSACTION):
+                chunk = extracted_stories[offset:offset + cls._STORIES_PER_TRANSACTION]
+
+                try:
+                    cls._write_extracted_stories(
+                        db=db,
+                        stories=chunk,
+                        story_downloads=story_downloads,
+                        extraction_results=extraction_results,
+                        extractor_args=extractor_args,
+                    )
+
+                except Exception as ex:
+                    # Retry stories one by one to find out which ones are failing
+                    log.warning("Unable to write {} extracted stories, retrying one by one: {}".format(len(chunk), ex))
+
+                    for story in chunk:
+                        try:
+                            cls._write_extracted_stories(
+                                db=db,
+                                stories=[story],
+                                story_downloads=story_downloads,
+                                extraction_results=extraction_results,
+                                extractor_args=extractor_args,
+                            )
+                        except Exception as story_ex:
+                            failures[story['stories_id']] = "Unable to process extracted story {}: {}".format(
+                                story['stories_id'], story_ex,
+                            )
+
+            if failures:
+                for stories_id, error in sorted(failures.items()):
+                    log.error(error)
+
+            log.info("Done extracting {} stories, {} failed.".format(len(stories), len(failures)))
+
+        return failures
+
+    @staticmethod
+    def _write_extracted_stories(db: DatabaseHandler,
+                                 stories: List[dict],
+                                 story_downloads: Dict[int, List[dict]],
+                                 extraction_results: Dict[int, dict],
+                                 extractor_args: PyExtractorArguments) -> None:
+        """Create download texts and process extracted stories in a single transaction."""
+
+        db.begin()
+
+        try:
+            for story in stories:
+                for download in story_downloads[story['stories_id']]:
+                    create_download_text_for_extract(
+                        db=db,
+                        download=download,
+                        extraction_result=extraction_results[download['downloads_id']],
+                        extractor_args=extractor_args,
+                    )
+
+            process_extracted_stories(db=db, stories=stories, extractor_args=extractor_args)
+
+        except Exception as ex:
+            db.rollback()
+            raise ex
+
+        db.commit()
+
+    @classmethod
+    def queue_name(cls) -> str:
+        return 'MediaWords::Job::ExtractAndVectorBatch'
+
+
+if __name__ == '__main__':
+    app = JobBrokerApp(job_class=ExtractAndVectorBatchJob)
+    app.start_worker()
@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 
 from mediawords.annotator.nyt_labels import NYTLabelsAnnotator
-from mediawords.db import connect_to_db
+from mediawords.db import pooled_connection_to_db
 from mediawords.job import AbstractJob, McAbstractJobException, JobBrokerApp
 from mediawords.job.nyt_labels.update_story_tags import NYTLabelsUpdateStoryTagsJob
 from mediawords.util.log import create_logger
@@ -36,26 +36,25 @@ class NYTLabelsFetchAnnotationJob(AbstractJob):
 
         stories_id = int(stories_id)
 
-        db = connect_to_db()
+        with pooled_connection_to_db() as db:
+            log.info("Fetching annotation for story ID %d..." % stories_id)
 
-        log.info("Fetching annotation for story ID %d..." % stories_id)
+            story = db.find_by_id(table='stories', object_id=stories_id)
+            if story is None:
+                raise McNYTLabelsFetchAnnotationJobException("Story with ID %d was not found." % stories_id)
 
-        story = db.find_by_id(table='stories', object_id=stories_id)
-        if story is None:
-            raise McNYTLabelsFetchAnnotationJobException("Story with ID %d was not found." % stories_id)
+            nytlabels = NYTLabelsAnnotator()
+            try:
+                nytlabels.annotate_and_store_for_story(db=db, stories_id=stories_id)
+            except Exception as ex:
+                raise McNYTLabelsFetchAnnotationJobException(
+                    "Unable to process story $stories_id with NYTLabels: %s" % str(ex)
+                )
 
-        nytlabels = NYTLabelsAnnotator()
-        try:
-            nytlabels.annotate_and_store_for_story(db=db, stories_id=stories_id)
-        except Exception as ex:
-            raise McNYTLabelsFetchAnnotationJobException(
-                "Unable to process story $stories_id with NYTLabels: %s" % str(ex)
-            )
+            log.info("Adding story ID %d to the update story tags queue..." % stories_id)
+            NYTLabelsUpdateStoryTagsJob.add_to_queue(stories_id=stories_id)
 
-        log.info("Adding story ID %d to the update story tags queue..." % stories_id)
-        NYTLabelsUpdateStoryTagsJob.add_to_queue(stories_id=stories_id)
-
-        log.info("Finished fetching annotation for story ID %d" % stories_id)
+            log.info("Finished fetching annotation for story ID %d" % stories_id)
 
     @classmethod
     def queue_name(cls) -> str:
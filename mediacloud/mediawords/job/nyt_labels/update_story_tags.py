@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 
 from mediawords.annotator.nyt_labels import NYTLabelsAnnotator
-from mediawords.db import connect_to_db
+from mediawords.db import pooled_connection_to_db
 from mediawords.dbi.stories.postprocess import mark_as_processed
 from mediawords.job import AbstractJob, McAbstractJobException, JobBrokerApp
 from mediawords.util.log import create_logger
@@ -36,26 +36,25 @@ class NYTLabelsUpdateStoryTagsJob(AbstractJob):
 
         stories_id = int(stories_id)
 
-        db = connect_to_db()
+        with pooled_connection_to_db() as db:
+            log.info("Updating tags for story ID %d..." % stories_id)
 
-        log.info("Updating tags for story ID %d..." % stories_id)
+            story = db.find_by_id(table='stories', object_id=stories_id)
+            if story is None:
+                raise McNYTLabelsUpdateStoryTagsJobException("Story with ID %d was not found." % stories_id)
 
-        story = db.find_by_id(table='stories', object_id=stories_id)
-        if story is None:
-            raise McNYTLabelsUpdateStoryTagsJobException("Story with ID %d was not found." % stories_id)
+            nytlabels = NYTLabelsAnnotator()
+            try:
+                nytlabels.update_tags_for_story(db=db, stories_id=stories_id)
+            except Exception as ex:
+                raise McNYTLabelsUpdateStoryTagsJobException(
+                    "Unable to process story ID %d with NYTLabels: %s" % (stories_id, str(ex),)
+                )
 
-        nytlabels = NYTLabelsAnnotator()
-        try:
-            nytlabels.update_tags_for_story(db=db, stories_id=stories_id)
-        except Exception as ex:
-            raise McNYTLabelsUpdateStoryTagsJobException(
-                "Unable to process story ID %d with NYTLabels: %s" % (stories_id, str(ex),)
-            )
+            log.info("Marking story ID %d as processed..." % stories_id)
+            mark_as_processed(db=db, stories_id=stories_id)
 
-        log.info("Marking story ID %d as processed..." % stories_id)
-        mark_as_processed(db=db, stories_id=stories_id)
-
-        log.info("Finished updating tags for story ID %d" % stories_id)
+            log.info("Finished updating tags for story ID %d" % stories_id)
 
     @classmethod
     def queue_name(cls) -> str:
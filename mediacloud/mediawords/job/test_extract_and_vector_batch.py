@@ -0,0 +1,152 @@
+"""Test mediawords.job.extract_and_vector_batch."""
+
+from typing import List
+
+import mediawords.dbi.downloads
+import mediawords.test.db.create
+import mediawords.test.test_database
+from mediawords.db import DatabaseHandler
+from mediawords.job.extract_and_vector_batch import ExtractAndVectorBatchJob
+
+
+class _TestExtractAndVectorBatchJob(ExtractAndVectorBatchJob):
+    """Batch job that records requeued stories instead of adding them to the queue and fails writing some stories."""
+
+    failing_stories_ids = set()
+    written_batches = []
+    requeued_stories_ids = []
+
+    @classmethod
+    def add_to_queue(cls, stories_ids: List[int], **kwargs) -> str:
+        cls.requeued_stories_ids.extend(stories_ids)
+        return 'dummy'
+
+    @classmethod
+    def _write_extracted_stories(cls, db: DatabaseHandler, stories: List[dict], **kwargs) -> None:
+        cls.written_batches.append([story['stories_id'] for story in stories])
+
+        for story in stories:
+            if story['stories_id'] in cls.failing_stories_ids:
+                raise Exception("Failing story {}".format(story['stories_id']))
+
+        super()._write_extracted_stories(db=db, stories=stories, **kwargs)
+
+
+class TestExtractAndVectorBatchJobDB(mediawords.test.test_database.TestDatabaseWithSchemaTestCase):
+    """Run tests that require database access."""
+
+    def setUp(self) -> None:
+        super().setUp()
+        db = self.db()
+
+        _TestExtractAndVectorBatchJob.failing_stories_ids = set()
+        _TestExtractAndVectorBatchJob.written_batches = []
+        _TestExtractAndVectorBatchJob.requeued_stories_ids = []
+
+        self.test_media = mediawords.test.db.create.create_test_story_stack(db, {
+            'A': {'B': [1, 2, 3]},
+            'C': {'D': [4]},
+        })
+
+        self.test_downloads = {}
+        for story_label in ['1', '2', '3', '4']:
+            story = self.test_media[story_label]
+            download = mediawords.test.db.create.create_download_for_story(
+                db=db,
+                feed=self.test_media['B' if story_label != '4' else 'D'],
+                story=story,
+            )
+
+            if story_label == '3':
+                # Story which content is missing
+                download['path'] = 'postgresql:missing'
+                download['state'] = 'success'
+                db.update_by_id('downloads', download['downloads_id'], download)
+            else:
+                mediawords.dbi.downloads.store_content(db, download, '<p>Story number {}.</p>'.format(story_label))
+
+            self.test_downloads[story_label] = download
+
+    def __story_got_extracted(self, story_label: str) -> bool:
+        download_text = self.db().query("""
+            SELECT 1
+            FROM download_texts
+            WHERE downloads_id = %(downloads_id)s
+        """, {'downloads_id': self.test_downloads[story_label]['downloads_id']}).hash()
+        return download_text is not None
+
+    def test_run_job(self) -> None:
+        """Test that extraction failures are returned without failing the rest of the batch."""
+
+        no_content_story = self.test_media['3']
+        nonexistent_stories_id = self.test_media['4']['stories_id'] + 1000
+
+        failures = _TestExtractAndVectorBatchJob.run_job(
+            stories_ids=[
+                self.test_media['1']['stories_id'],
+                self.test_media['2']['stories_id'],
+                no_content_story['stories_id'],
+                nonexistent_stories_id,
+            ],
+            extractor_processes=0,
+        )
+
+        assert sorted(failures.keys()) == sorted([no_content_story['stories_id'], nonexistent_stories_id])
+        assert 'was not found' in failures[nonexistent_stories_id]
+
+        assert self.__story_got_extracted('1')
+        assert self.__story_got_extracted('2')
+        assert not self.__story_got_extracted('3')
+
+        # Stories get written in a single batch
+        assert _TestExtractAndVectorBatchJob.written_batches == [
+            [self.test_media['1']['stories_id'], self.test_media['2']['stories_id']],
+        ]
+
+    def test_run_job_retry_one_by_one(self) -> None:
+        """Test that stories get retried one by one after a batch fails to get written."""
+
+        failing_stories_id = self.test_media['2']['stories_id']
+        _TestExtractAndVectorBatchJob.failing_stories_ids = {failing_stories_id}
+
+        stories_ids = [self.test_media['1']['stories_id'], failing_stories_id, self.test_media['4']['stories_id']]
+
+        failures = _TestExtractAndVectorBatchJob.run_job(stories_ids=stories_ids, extractor_processes=0)
+
+        assert list(failures.keys()) == [failing_stories_id]
+        assert 'Failing story' in failures[failing_stories_id]
+
+        assert _TestExtractAndVectorBatchJob.written_batches == [
+            stories_ids,
+            [stories_ids[0]],
+            [stories_ids[1]],
+            [stories_ids[2]],
+        ]
+
+        # Batch got rolled back but the rest of the stories got written one by one
+        assert self.__story_got_extracted('1')
+        assert not self.__story_got_extracted('2')
+        assert self.__story_got_extracted('4')
+
+    def test_run_job_locked_medium(self) -> None:
+        """Test that stories of locked media get requeued."""
+        db = self.db()
+
+        locked_media_id = self.test_media['A']['media_id']
+
+        # Job uses its own connection which won't be able to get the lock
+        db.query("SELECT pg_advisory_lock(%(media_id)s)", {'media_id': locked_media_id})
+
+        try:
+            failures = _TestExtractAndVectorBatchJob.run_job(
+                stories_ids=[self.test_media['1']['stories_id'], self.test_media['4']['stories_id']],
+                extractor_processes=0,
+            )
+        finally:
+            db.query("SELECT pg_advisory_unlock(%(media_id)s)", {'media_id': locked_media_id})
+
+        assert failures == {}
+        assert _TestExtractAndVectorBatchJob.requeued_stories_ids == [self.test_media['1']['stories_id']]
+
+        assert not self.__story_got_extracted('1')
+        assert self.__story_got_extracted('4')
@@ -6,7 +6,7 @@ import time
 import traceback
 import typing
 
-from mediawords.db import connect_to_db
+from mediawords.db import pooled_connection_to_db
 from mediawords.job import AbstractJob, McAbstractJobException, JobBrokerApp
 import mediawords.tm.fetch_link
 from mediawords.util.log import create_logger
@@ -63,45 +63,42 @@ class FetchLinkJob(AbstractJob):
 
         log.info("Start fetch for topic_fetch_url %d" % topic_fetch_urls_id)
 
-        db = connect_to_db()
-
-        try:
-            mediawords.tm.fetch_link.fetch_topic_url(
-                db=db,
-                topic_fetch_urls_id=topic_fetch_urls_id,
-                domain_timeout=domain_timeout)
-            cls._consecutive_requeues = 0
-
-        except McThrottledDomainException:
-            # if a domain has been throttled, just add it back to the end of the queue
-            log.info("Fetch for topic_fetch_url %d domain throttled.  Requeueing ..." % topic_fetch_urls_id)
-
-            db.update_by_id(
-                'topic_fetch_urls',
-                topic_fetch_urls_id,
-                {'state': mediawords.tm.fetch_link.FETCH_STATE_REQUEUED, 'fetch_date': datetime.datetime.now()})
-            if not dummy_requeue:
-                FetchLinkJob.add_to_queue(topic_fetch_urls_id)
-
-            cls._consecutive_requeues += 1
-            if cls._consecutive_requeues > REQUEUES_UNTIL_SLEEP:
-                log.info("sleeping after %d consecutive retries ..." % cls._consecutive_requeues)
-                time.sleep(1)
-
-        except Exception as ex:
-            # all non throttled errors should get caught by the try: about, but catch again here just in case
-            log.error("Error while fetching URL with ID {}: {}".format(topic_fetch_urls_id, str(ex)))
-            cls._consecutive_requeues = 0
-            update = {
-                'state': mediawords.tm.fetch_link.FETCH_STATE_PYTHON_ERROR,
-                'fetch_date': datetime.datetime.now(),
-                'message': traceback.format_exc(),
-            }
-            db.update_by_id('topic_fetch_urls', topic_fetch_urls_id, update)
-
-        db.disconnect()
-
-        log.info("Finished fetch for topic_fetch_url %d" % topic_fetch_urls_id)
+        with pooled_connection_to_db() as db:
+            try:
+                mediawords.tm.fetch_link.fetch_topic_url(
+                    db=db,
+                    topic_fetch_urls_id=topic_fetch_urls_id,
+                    domain_timeout=domain_timeout)
+                cls._consecutive_requeues = 0
+
+            except McThrottledDomainException:
+                # if a domain has been throttled, just add it back to the end of the queue
+                log.info("Fetch for topic_fetch_url %d domain throttled.  Requeueing ..." % topic_fetch_urls_id)
+
+                db.update_by_id(
+                    'topic_fetch_urls',
+                    topic_fetch_urls_id,
+                    {'state': mediawords.tm.fetch_link.FETCH_STATE_REQUEUED, 'fetch_date': datetime.datetime.now()})
+                if not dummy_requeue:
+                    FetchLinkJob.add_to_queue(topic_fetch_urls_id)
+
+                cls._consecutive_requeues += 1
+                if cls._consecutive_requeues > REQUEUES_UNTIL_SLEEP:
+                    log.info("sleeping after %d consecutive retries ..." % cls._consecutive_requeues)
+                    time.sleep(1)
+
+            except Exception as ex:
+                # all non throttled errors should get caught by the try: about, but catch again here just in case
+                log.error("Error while fetching URL with ID {}: {}".format(topic_fetch_urls_id, str(ex)))
+                cls._consecutive_requeues = 0
+                update = {
+                    'state': mediawords.tm.fetch_link.FETCH_STATE_PYTHON_ERROR,
+                    'fetch_date': datetime.datetime.now(),
+                    'message': traceback.format_exc(),
+                }
+                db.update_by_id('topic_fetch_urls', topic_fetch_urls_id, update)
+
+            log.info("Finished fetch for topic_fetch_url %d" % topic_fetch_urls_id)
 
     @classmethod
     def queue_name(cls) -> str:
@@ -0,0 +1,60 @@
+"""Make sure that topic mapper job workers start up quickly by not importing heavy modules until they're needed."""
+
+import json
+import subprocess
+import sys
+
+# Max. time (in seconds) that importing the job module is allowed to take; generous so that the test doesn't fail on
+# a busy machine, yet still catches heavy modules (which take way longer to load) getting imported eagerly
+IMPORT_TIME_BUDGET = 10.0
+
+# Heavy modules that are to be imported only on first use
+LAZILY_IMPORTED_MODULES = [
+    'MeCab',
+    'jieba',
+    'hunspell',
+    'nltk',
+    'gensim',
+    'readability',
+    'pip',
+    'Stemmer',
+    'sentence_splitter',
+]
+
+# Language modules that are to be imported only when the language gets used
+LAZILY_IMPORTED_LANGUAGE_MODULES = ['mediawords.languages.ja', 'mediawords.languages.zh']
+
+
+def test_fetch_link_job_import():
+    # Import in a fresh interpreter because modules imported by other tests are cached in this one
+    output = subprocess.check_output([sys.executable, '-c', """
+import json
+import sys
+import time
+
+start_time = time.time()
+import mediawords.job.tm.fetch_link_job
+import_time = time.time() - start_time
+
+print(json.dumps({
+    'import_time': import_time,
+    'modules': sorted(sys.modules.keys()),
+}))
+"""])
+
+    result = json.loads(output.decode('utf-8').strip().split("\n")[-1])
+
+    imported_modules = set(result['modules'])
+    imported_top_level_modules = set(name.split('.')[0] for name in imported_modules)
+
+    assert 'mediawords.job.tm.fetch_link_job' in imported_modules
+
+    for module in LAZILY_IMPORTED_MODULES:
+        assert module not in imported_top_level_modules, "Module '{}' got imported eagerly.".format(module)
+
+    for module in LAZILY_IMPORTED_LANGUAGE_MODULES:
+        assert module not in imported_modules, "Language module '{}' got imported eagerly.".format(module)
+
+    assert result['import_time'] < IMPORT_TIME_BUDGET, "Importing took {:.2f} s, budget is {:.2f} s.".format(
+        result['import_time'], IMPORT_TIME_BUDGET,
+    )
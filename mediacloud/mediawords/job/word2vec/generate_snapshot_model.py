@@ -1,6 +1,6 @@
 #!/usr/bin/env python3
 
-from mediawords.db import connect_to_db
+from mediawords.db import pooled_connection_to_db
 from mediawords.job import AbstractJob, McAbstractJobException, JobBrokerApp
 from mediawords.util.log import create_logger
 from mediawords.util.perl import decode_object_from_bytes_if_needed
@@ -39,16 +39,15 @@ class Word2vecGenerateSnapshotModelJob(AbstractJob):
 
         snapshots_id = int(snapshots_id)
 
-        db = connect_to_db()
+        with pooled_connection_to_db() as db:
+            log.info("Generating word2vec model for snapshot %d..." % snapshots_id)
 
-        log.info("Generating word2vec model for snapshot %d..." % snapshots_id)
+            sentence_iterator = SnapshotSentenceIterator(db=db, snapshots_id=snapshots_id)
+            model_store = SnapshotDatabaseModelStore(db=db, snapshots_id=snapshots_id)
+            train_word2vec_model(sentence_iterator=sentence_iterator,
+                                 model_store=model_store)
 
-        sentence_iterator = SnapshotSentenceIterator(db=db, snapshots_id=snapshots_id)
-        model_store = SnapshotDatabaseModelStore(db=db, snapshots_id=snapshots_id)
-        train_word2vec_model(sentence_iterator=sentence_iterator,
-                             model_store=model_store)
-
-        log.info("Finished generating word2vec model for snapshot %d." % snapshots_id)
+            log.info("Finished generating word2vec model for snapshot %d." % snapshots_id)
 
     @classmethod
     def queue_name(cls) -> str:
@@ -1,11 +1,29 @@
 import abc
+import io
 from enum import Enum
-from typing import Union
+from typing import BinaryIO, Dict, List, Optional, Union
 
 from mediawords.db import DatabaseHandler
-from mediawords.util.compress import gzip, gunzip, bzip2, bunzip2
+from mediawords.util.compress import (
+    gzip,
+    gunzip,
+    bzip2,
+    bunzip2,
+    zstd,
+    unzstd,
+    peek_stream,
+    gzip_stream,
+    gunzip_stream,
+    bzip2_stream,
+    bunzip2_stream,
+    zstd_stream,
+    unzstd_stream,
+)
+from mediawords.util.log import create_logger
 from mediawords.util.perl import decode_object_from_bytes_if_needed
 
+log = create_logger(__name__)
+
 
 class McKeyValueStoreException(Exception):
     """Key-value store exception."""
@@ -29,11 +47,69 @@ class KeyValueStore(metaclass=abc.ABCMeta):
         """Read object. Returns content (in bytes) on success, None if content is not found, raises on error."""
         raise NotImplementedError("Abstract method.")
 
+    def fetch_contents(self,
+                       db: DatabaseHandler,
+                       object_ids: List[int],
+                       object_paths: Optional[Dict[int, str]] = None) -> Dict[int, bytes]:
+        """Read multiple objects. Returns dict of object IDs and their content (in bytes); objects that were not found
+        (or failed to be read) are left out of the dict.
+
+        Default implementation reads objects one by one; stores that can do better should override it."""
+
+        object_ids = self._prepare_object_ids(object_ids)
+        object_paths = self._prepare_object_paths(object_paths)
+
+        contents = {}
+
+        for object_id in object_ids:
+            try:
+                # MC_REWRITE_TO_PYTHON: use named parameters after Python rewrite
+                contents[object_id] = self.fetch_content(db, object_id, object_paths.get(object_id, None))
+            except Exception as ex:
+                log.debug("Unable to fetch object ID %d: %s" % (object_id, str(ex),))
+
+        return contents
+
+    def fetch_stream(self, db: DatabaseHandler, object_id: int, object_path: str = None) -> BinaryIO:
+        """Read object as a readable file-like object which is to be closed by the caller; raises on error.
+
+        Default implementation reads the whole object into memory; stores that can do better should override it."""
+
+        object_id = self._prepare_object_id(object_id)
+
+        # MC_REWRITE_TO_PYTHON: use named parameters after Python rewrite
+        return io.BytesIO(self.fetch_content(db, object_id, object_path))
+
+    def initialize(self) -> None:
+        """Initialize store's connections (if any) ahead of the first call.
+
+        Stores are initialized lazily on first use which is not thread-safe, so stores that are about to be called from
+        multiple threads should get initialized from a single thread first."""
+        pass
+
+    # noinspection PyMethodMayBeStatic
+    def uses_database(self) -> bool:
+        """Return True if store uses the passed database handler, i.e. if it's unsafe to call the store from some other
+        thread while the caller keeps using the handler."""
+        return True
+
     @abc.abstractmethod
     def store_content(self, db: DatabaseHandler, object_id: int, content: Union[str, bytes]) -> str:
         """Write object (str or bytes). Returns path to the object on success, raises on error."""
         raise NotImplementedError("Abstract method.")
 
+    def store_stream(self, db: DatabaseHandler, object_id: int, stream: BinaryIO) -> str:
+        """Write object that gets read from a readable file-like object until EOF (the stream doesn't get closed).
+        Returns path to the object on success, raises on error.
+
+        Default implementation reads the whole stream into memory; stores that can do better should override it."""
+
+        object_id = self._prepare_object_id(object_id)
+        stream = self._prepare_stream(stream)
+
+        # MC_REWRITE_TO_PYTHON: use named parameters after Python rewrite
+        return self.store_content(db, object_id, stream.read())
+
     @abc.abstractmethod
     def remove_content(self, db: DatabaseHandler, object_id: int, object_path: str = None) -> None:
         """Delete object. Raises on error."""
@@ -49,6 +125,7 @@ class KeyValueStore(metaclass=abc.ABCMeta):
         NONE = 'mc-kvs-compression-none'
         GZIP = 'mc-kvs-compression-gzip'
         BZIP2 = 'mc-kvs-compression-bzip2'
+        ZSTD = 'mc-kvs-compression-zstd'
 
     @staticmethod
     def _compression_method_is_valid(compression_method: Compression) -> bool:
@@ -61,8 +138,35 @@ class KeyValueStore(metaclass=abc.ABCMeta):
         return False
 
     @staticmethod
-    def _compress_data_for_method(data: Union[bytes, str], compression_method: Compression) -> bytes:
-        """Compress data."""
+    def _compression_dictionary_is_valid(compression_method: Compression, compression_dictionary: bytes) -> bool:
+        """Helper for validating compression dictionary (only Zstandard supports dictionaries)."""
+
+        if compression_dictionary is None:
+            return True
+
+        if not isinstance(compression_dictionary, bytes) or len(compression_dictionary) == 0:
+            return False
+
+        return compression_method == KeyValueStore.Compression.ZSTD
+
+    @staticmethod
+    def _compression_method_for_data(data: bytes) -> Optional[Compression]:
+        """Detect compression method of data by its magic bytes; return None if data doesn't look compressed."""
+
+        if data.startswith(b'\x1f\x8b'):
+            return KeyValueStore.Compression.GZIP
+        elif data.startswith(b'BZh'):
+            return KeyValueStore.Compression.BZIP2
+        elif data.startswith(b'\x28\xb5\x2f\xfd'):
+            return KeyValueStore.Compression.ZSTD
+        else:
+            return None
+
+    @staticmethod
+    def _compress_data_for_method(data: Union[bytes, str],
+                                  compression_method: Compression,
+                                  compression_dictionary: Optional[bytes] = None) -> bytes:
+        """Compress data (using Zstandard dictionary if one is set)."""
 
         if data is None:
             raise McKeyValueStoreCompressionException("Data is None.")
@@ -79,14 +183,22 @@ class KeyValueStore(metaclass=abc.ABCMeta):
             data = gzip(data)
         elif compression_method == KeyValueStore.Compression.BZIP2:
             data = bzip2(data)
+        elif compression_method == KeyValueStore.Compression.ZSTD:
+            data = zstd(data, dictionary=compression_dictionary)
         else:
             raise McKeyValueStoreCompressionException("Invalid compression method: %s" % compression_method)
 
         return data
 
     @staticmethod
-    def _uncompress_data_for_method(data: bytes, compression_method: Compression) -> bytes:
-        """Uncompress data."""
+    def _uncompress_data_for_method(data: bytes,
+                                    compression_method: Compression,
+                                    compression_dictionary: Optional[bytes] = None) -> bytes:
+        """Uncompress data.
+
+        If the store compresses its objects, the actual compression method gets detected by data's magic bytes so that
+        objects written before store's compression method got changed remain readable; uncompressed stores return the
+        data as-is because their objects might start with any bytes."""
 
         if data is None:
             raise McKeyValueStoreCompressionException("Data is None.")
@@ -94,6 +206,11 @@ class KeyValueStore(metaclass=abc.ABCMeta):
         if not isinstance(data, bytes):
             raise McKeyValueStoreCompressionException("Compressed data is not str or bytes: %s" % str(data))
 
+        if compression_method != KeyValueStore.Compression.NONE:
+            detected_compression_method = KeyValueStore._compression_method_for_data(data)
+            if detected_compression_method is not None:
+                compression_method = detected_compression_method
+
         if compression_method == KeyValueStore.Compression.NONE:
             pass
 
@@ -101,11 +218,67 @@ class KeyValueStore(metaclass=abc.ABCMeta):
             data = gunzip(data)
         elif compression_method == KeyValueStore.Compression.BZIP2:
             data = bunzip2(data)
+        elif compression_method == KeyValueStore.Compression.ZSTD:
+            data = unzstd(data, dictionary=compression_dictionary)
         else:
             raise McKeyValueStoreCompressionException("Invalid compression method: %s" % compression_method)
 
         return data
 
+    @staticmethod
+    def _compress_stream_for_method(stream: BinaryIO,
+                                    compression_method: Compression,
+                                    compression_dictionary: Optional[bytes] = None) -> BinaryIO:
+        """Return readable stream of data that gets read from another stream and compressed on the fly."""
+
+        if stream is None:
+            raise McKeyValueStoreCompressionException("Stream is None.")
+
+        if compression_method == KeyValueStore.Compression.NONE:
+            pass
+        elif compression_method == KeyValueStore.Compression.GZIP:
+            stream = gzip_stream(stream)
+        elif compression_method == KeyValueStore.Compression.BZIP2:
+            stream = bzip2_stream(stream)
+        elif compression_method == KeyValueStore.Compression.ZSTD:
+            stream = zstd_stream(stream, dictionary=compression_dictionary)
+        else:
+            raise McKeyValueStoreCompressionException("Invalid compression method: %s" % compression_method)
+
+        return stream
+
+    @staticmethod
+    def _uncompress_stream_for_method(stream: BinaryIO,
+                                      compression_method: Compression,
+                                      compression_dictionary: Optional[bytes] = None) -> BinaryIO:
+        """Return readable stream of data that gets read from another stream and uncompressed on the fly; closing the
+        returned stream closes the source stream too.
+
+        Compression method gets detected the same way as in _uncompress_data_for_method()."""
+
+        if stream is None:
+            raise McKeyValueStoreCompressionException("Stream is None.")
+
+        if compression_method == KeyValueStore.Compression.NONE:
+            return stream
+
+        magic_bytes, stream = peek_stream(stream=stream, size=4, close_source=True)
+
+        detected_compression_method = KeyValueStore._compression_method_for_data(magic_bytes)
+        if detected_compression_method is not None:
+            compression_method = detected_compression_method
+
+        if compression_method == KeyValueStore.Compression.GZIP:
+            stream = gunzip_stream(stream, close_source=True)
+        elif compression_method == KeyValueStore.Compression.BZIP2:
+            stream = bunzip2_stream(stream, close_source=True)
+        elif compression_method == KeyValueStore.Compression.ZSTD:
+            stream = unzstd_stream(stream, dictionary=compression_dictionary, close_source=True)
+        else:
+            raise McKeyValueStoreCompressionException("Invalid compression method: %s" % compression_method)
+
+        return stream
+
     @staticmethod
     def _prepare_object_id(object_id: int) -> int:
         """Prepare object ID by validating and decoding it."""
@@ -123,6 +296,36 @@ class KeyValueStore(metaclass=abc.ABCMeta):
 
         return object_id
 
+    @staticmethod
+    def _prepare_object_ids(object_ids: List[int]) -> List[int]:
+        """Prepare list of object IDs by validating, decoding and deduplicating it."""
+
+        if object_ids is None:
+            raise McKeyValueStoreException("Object IDs is None.")
+
+        object_ids = decode_object_from_bytes_if_needed(object_ids)
+
+        prepared_object_ids = []
+        seen_object_ids = set()
+        for object_id in object_ids:
+            object_id = KeyValueStore._prepare_object_id(object_id)
+            if object_id not in seen_object_ids:
+                seen_object_ids.add(object_id)
+                prepared_object_ids.append(object_id)
+
+        return prepared_object_ids
+
+    @staticmethod
+    def _prepare_object_paths(object_paths: Optional[Dict[int, str]]) -> Dict[int, str]:
+        """Prepare dict of object IDs and their paths by decoding it."""
+
+        if object_paths is None:
+            return {}
+
+        object_paths = decode_object_from_bytes_if_needed(object_paths)
+
+        return {int(object_id): object_path for object_id, object_path in object_paths.items()}
+
     @staticmethod
     def _prepare_content(content: Union[str, bytes]) -> bytes:
         """Prepare content to store by validating and decoding it."""
@@ -137,3 +340,15 @@ class KeyValueStore(metaclass=abc.ABCMeta):
             raise McKeyValueStoreException("Content is not bytes: %s" % str(content))
 
         return content
+
+    @staticmethod
+    def _prepare_stream(stream: BinaryIO) -> BinaryIO:
+        """Prepare stream to store by validating it."""
+
+        if stream is None:
+            raise McKeyValueStoreException("Stream to store is None.")
+
+        if not hasattr(stream, 'read'):
+            raise McKeyValueStoreException("Stream is not readable: %s" % str(stream))
+
+        return stream
@@ -1,7 +1,10 @@
+import concurrent.futures
+import io
 import os
-from typing import Union
+from typing import BinaryIO, Dict, List, Optional, Union
 
 import boto3
+from boto3.s3.transfer import TransferConfig
 from botocore.config import Config as BotoCoreConfig
 from botocore.exceptions import ClientError
 
@@ -18,6 +21,89 @@ class McAmazonS3StoreException(McKeyValueStoreException):
     pass
 
 
+class _AmazonS3ObjectStream(io.RawIOBase):
+    """Readable stream of S3 object's body which resumes reading with a ranged GET if the connection breaks."""
+
+    __slots__ = [
+        '__s3_client',
+        '__bucket_name',
+        '__key',
+        '__etag',
+        '__read_attempts',
+        '__body',
+        '__offset',
+    ]
+
+    def __init__(self, s3_client, bucket_name: str, key: str, get_object_response: dict, read_attempts: int):
+        """Constructor.
+
+        Arguments:
+        s3_client - Boto3 S3 client
+        bucket_name - bucket name
+        key - object's key
+        get_object_response - get_object() response to start reading the body of
+        read_attempts - number of attempts to read every chunk
+        """
+        super().__init__()
+
+        self.__s3_client = s3_client
+        self.__bucket_name = bucket_name
+        self.__key = key
+        self.__etag = get_object_response.get('ETag', None)
+        self.__read_attempts = read_attempts
+        self.__body = get_object_response['Body']
+        self.__offset = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        for retry in range(self.__read_attempts):
+
+            if retry > 0:
+                log.warning("Retrying (#%d) from offset %d..." % (retry, self.__offset,))
+
+                try:
+                    self.__body.close()
+                except Exception as ex:
+                    log.debug("Unable to close broken body of %s: %s" % (self.__key, str(ex),))
+
+                try:
+                    get_object_args = {
+                        'Bucket': self.__bucket_name,
+                        'Key': self.__key,
+                        'Range': 'bytes=%d-' % self.__offset,
+                    }
+                    if self.__etag:
+                        # Make sure that the rest of the very same object gets read
+                        get_object_args['IfMatch'] = self.__etag
+
+                    self.__body = self.__s3_client.get_object(**get_object_args)['Body']
+
+                except Exception as ex:
+                    log.error("Attempt to resume reading %s didn't succeed because: %s" % (self.__key, str(ex),))
+                    continue
+
+            try:
+                chunk = self.__body.read(len(b))
+            except Exception as ex:
+                log.error("Attempt to read %s didn't succeed because: %s" % (self.__key, str(ex),))
+                continue
+
+            size = len(chunk)
+            b[:size] = chunk
+            self.__offset += size
+
+            return size
+
+        raise McAmazonS3StoreException("Unable to read %s after %d retries." % (self.__key, self.__read_attempts,))
+
+    def close(self) -> None:
+        if not self.closed:
+            self.__body.close()
+        super().close()
+
+
 class AmazonS3Store(KeyValueStore):
     """Amazon S3 key-value store."""
 
@@ -46,6 +132,15 @@ class AmazonS3Store(KeyValueStore):
     __READ_ATTEMPTS = 3
     __WRITE_ATTEMPTS = 3
 
+    # Max. number of concurrent GETs to do when fetching multiple objects (also the size of Boto's connection pool)
+    __FETCH_CONTENTS_MAX_WORKERS = 16
+
+    # Size of parts to upload streams in (uploaded part gets held in memory until it gets uploaded)
+    __MULTIPART_CHUNK_SIZE = 8 * 1024 * 1024
+
+    # Max. number of parts to upload concurrently
+    __MULTIPART_MAX_CONCURRENCY = 4
+
     __slots__ = [
         '__access_key_id',
         '__secret_access_key',
@@ -54,6 +149,9 @@ class AmazonS3Store(KeyValueStore):
 
         '__compression_method',
 
+        # Zstandard dictionary to compress objects with (if any)
+        '__compression_dictionary',
+
         # Boto3 objects
         '__s3',
 
@@ -66,8 +164,12 @@ class AmazonS3Store(KeyValueStore):
                  secret_access_key: str,
                  bucket_name: str,
                  directory_name: str,
-                 compression_method: KeyValueStore.Compression = _DEFAULT_COMPRESSION_METHOD):
-        """Constructor."""
+                 compression_method: KeyValueStore.Compression = _DEFAULT_COMPRESSION_METHOD,
+                 compression_dictionary: Optional[bytes] = None):
+        """Constructor.
+
+        Objects get compressed with "compression_method" (and with Zstandard dictionary "compression_dictionary" if it's
+        set); the dictionary has to be kept around for as long as there are objects compressed with it."""
 
         access_key_id = decode_object_from_bytes_if_needed(access_key_id)
         secret_access_key = decode_object_from_bytes_if_needed(secret_access_key)
@@ -90,6 +192,10 @@ class AmazonS3Store(KeyValueStore):
         if not self._compression_method_is_valid(compression_method):
             raise McAmazonS3StoreException("Unsupported compression method: %s" % compression_method)
 
+        if not self._compression_dictionary_is_valid(compression_method=compression_method,
+                                                     compression_dictionary=compression_dictionary):
+            raise McAmazonS3StoreException("Compression dictionary is only supported with Zstandard compression.")
+
         if not directory_name.endswith('/'):
             directory_name = directory_name + '/'
 
@@ -98,6 +204,7 @@ class AmazonS3Store(KeyValueStore):
         self.__bucket_name = bucket_name
         self.__directory_name = directory_name
         self.__compression_method = compression_method
+        self.__compression_dictionary = compression_dictionary
 
         self.__pid = os.getpid()
         self.__s3 = None
@@ -116,7 +223,8 @@ class AmazonS3Store(KeyValueStore):
             raise McAmazonS3StoreException("Amazon S3 request timeout is too small: %d" % request_timeout)
 
         config = BotoCoreConfig(connect_timeout=request_timeout,
-                                read_timeout=request_timeout)
+                                read_timeout=request_timeout,
+                                max_pool_connections=self.__FETCH_CONTENTS_MAX_WORKERS)
 
         try:
             self.__s3 = boto3.resource(service_name='s3',
@@ -149,6 +257,14 @@ class AmazonS3Store(KeyValueStore):
         return self.__s3.Object(bucket_name=self.__bucket_name,
                                 key=self.__s3_key_for_object_id(object_id=object_id))
 
+    def uses_database(self) -> bool:
+        """Amazon S3 store doesn't use the database handler."""
+        return False
+
+    def initialize(self) -> None:
+        """Create S3 client."""
+        self.__initialize_s3()
+
     def fetch_content(self, db: DatabaseHandler, object_id: int, object_path: str = None) -> bytes:
         """Read object from Amazon S3."""
 
@@ -160,6 +276,9 @@ class AmazonS3Store(KeyValueStore):
             if not self.content_exists(db=db, object_id=object_id, object_path=object_path):
                 raise McAmazonS3StoreException("Object ID %d does not exist." % object_id)
 
+        # Boto3 resources are not thread-safe but their clients are
+        s3_client = self.__s3.meta.client
+
         content = None
 
         # S3 sometimes times out when reading, so we'll try to read several times
@@ -169,8 +288,8 @@ class AmazonS3Store(KeyValueStore):
                 log.warning("Retrying (#%d)..." % retry)
 
             try:
-                o = self.__object_for_object_id(object_id)
-                o_get = o.get()
+                o_get = s3_client.get_object(Bucket=self.__bucket_name,
+                                             Key=self.__s3_key_for_object_id(object_id=object_id))
                 content = o_get['Body'].read()
 
             except Exception as ex:
@@ -188,7 +307,9 @@ class AmazonS3Store(KeyValueStore):
             raise McAmazonS3StoreException("Content is not bytes for object ID %d." % object_id)
 
         try:
-            content = self._uncompress_data_for_method(data=content, compression_method=self.__compression_method)
+            content = self._uncompress_data_for_method(data=content,
+                                                       compression_method=self.__compression_method,
+                                                       compression_dictionary=self.__compression_dictionary)
         except Exception as ex:
             raise McAmazonS3StoreException("Unable to uncompress data for object ID %d: %s" % (object_id, str(ex),))
 
@@ -199,6 +320,140 @@ class AmazonS3Store(KeyValueStore):
 
         return content
 
+    def fetch_stream(self, db: DatabaseHandler, object_id: int, object_path: str = None) -> BinaryIO:
+        """Read object from Amazon S3 as a stream, uncompress it while it's being read."""
+
+        object_id = self._prepare_object_id(object_id)
+
+        self.__initialize_s3()
+
+        if self.__CHECK_IF_EXISTS_BEFORE_FETCHING:
+            if not self.content_exists(db=db, object_id=object_id, object_path=object_path):
+                raise McAmazonS3StoreException("Object ID %d does not exist." % object_id)
+
+        s3_client = self.__s3.meta.client
+        key = self.__s3_key_for_object_id(object_id=object_id)
+
+        get_object_response = None
+
+        for retry in range(self.__READ_ATTEMPTS):
+
+            if retry > 0:
+                log.warning("Retrying (#%d)..." % retry)
+
+            try:
+                get_object_response = s3_client.get_object(Bucket=self.__bucket_name, Key=key)
+
+            except Exception as ex:
+                log.error("Attempt to read object ID %d didn't succeed because: %s" % (object_id, str(ex),))
+
+            else:
+                break
+
+        if get_object_response is None:
+            raise McAmazonS3StoreException(
+                "Unable to read object ID %d after %d retries." % (object_id, self.__READ_ATTEMPTS,)
+            )
+
+        stream = io.BufferedReader(_AmazonS3ObjectStream(s3_client=s3_client,
+                                                         bucket_name=self.__bucket_name,
+                                                         key=key,
+                                                         get_object_response=get_object_response,
+                                                         read_attempts=self.__READ_ATTEMPTS))
+
+        try:
+            stream = self._uncompress_stream_for_method(stream=stream,
+                                                        compression_method=self.__compression_method,
+                                                        compression_dictionary=self.__compression_dictionary)
+        except Exception as ex:
+            stream.close()
+            raise McAmazonS3StoreException("Unable to uncompress data for object ID %d: %s" % (object_id, str(ex),))
+
+        return stream
+
+    def __fetch_content_if_exists(self, object_id: int) -> Optional[bytes]:
+        """Read object from Amazon S3 using a thread-safe client; return None if object doesn't exist."""
+
+        # Boto3 resources are not thread-safe but their clients are
+        s3_client = self.__s3.meta.client
+
+        content = None
+
+        for retry in range(self.__READ_ATTEMPTS):
+
+            if retry > 0:
+                log.warning("Retrying (#%d)..." % retry)
+
+            try:
+                o_get = s3_client.get_object(Bucket=self.__bucket_name,
+                                             Key=self.__s3_key_for_object_id(object_id=object_id))
+                content = o_get['Body'].read()
+
+            except ClientError as ex:
+                if ex.response['Error']['Code'] in ('404', 'NoSuchKey'):
+                    return None
+                log.error("Attempt to read object ID %d didn't succeed because: %s" % (object_id, str(ex),))
+
+            except Exception as ex:
+                log.error("Attempt to read object ID %d didn't succeed because: %s" % (object_id, str(ex),))
+
+            else:
+                break
+
+        if content is None:
+            raise McAmazonS3StoreException(
+                "Unable to read object ID %d after %d retries." % (object_id, self.__READ_ATTEMPTS,)
+            )
+
+        if not isinstance(content, bytes):
+            raise McAmazonS3StoreException("Content is not bytes for object ID %d." % object_id)
+
+        try:
+            content = self._uncompress_data_for_method(data=content,
+                                                       compression_method=self.__compression_method,
+                                                       compression_dictionary=self.__compression_dictionary)
+        except Exception as ex:
+            raise McAmazonS3StoreException("Unable to uncompress data for object ID %d: %s" % (object_id, str(ex),))
+
+        if not isinstance(content, bytes):
+            raise McAmazonS3StoreException("Content is not bytes after uncompression for object ID %d" % object_id)
+
+        return content
+
+    def fetch_contents(self,
+                       db: DatabaseHandler,
+                       object_ids: List[int],
+                       object_paths: Optional[Dict[int, str]] = None) -> Dict[int, bytes]:
+        """Read multiple objects from Amazon S3 with a bounded number of concurrent GETs."""
+
+        object_ids = self._prepare_object_ids(object_ids)
+
+        if len(object_ids) == 0:
+            return {}
+
+        self.__initialize_s3()
+
+        contents = {}
+
+        max_workers = min(self.__FETCH_CONTENTS_MAX_WORKERS, len(object_ids))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {
+                executor.submit(self.__fetch_content_if_exists, object_id): object_id for object_id in object_ids
+            }
+
+            for future in concurrent.futures.as_completed(futures):
+                object_id = futures[future]
+
+                try:
+                    content = future.result()
+                except Exception as ex:
+                    log.error("Unable to fetch object ID %d: %s" % (object_id, str(ex),))
+                else:
+                    if content is not None:
+                        contents[object_id] = content
+
+        return contents
+
     def store_content(self, db: DatabaseHandler, object_id: int, content: Union[str, bytes]) -> str:
         """Write object to Amazon S3."""
 
@@ -216,7 +471,9 @@ class AmazonS3Store(KeyValueStore):
                     ) % object_id)
 
         try:
-            content = self._compress_data_for_method(data=content, compression_method=self.__compression_method)
+            content = self._compress_data_for_method(data=content,
+                                                     compression_method=self.__compression_method,
+                                                     compression_dictionary=self.__compression_dictionary)
         except Exception as ex:
             raise McAmazonS3StoreException("Unable to compress data for object ID %d: %s" % (object_id, str(ex),))
 
@@ -251,6 +508,39 @@ class AmazonS3Store(KeyValueStore):
         path = 's3:%s' % self.__s3_key_for_object_id(object_id=object_id)
         return path
 
+    def store_stream(self, db: DatabaseHandler, object_id: int, stream: BinaryIO) -> str:
+        """Write object to Amazon S3 using multipart upload, compressing it while it's being read from the stream.
+
+        Individual parts get retried by Boto3; the upload as a whole doesn't get retried because the stream might not
+        be rewindable."""
+
+        object_id = self._prepare_object_id(object_id)
+        stream = self._prepare_stream(stream)
+
+        self.__initialize_s3()
+
+        try:
+            compressed_stream = self._compress_stream_for_method(stream=stream,
+                                                                 compression_method=self.__compression_method,
+                                                                 compression_dictionary=self.__compression_dictionary)
+        except Exception as ex:
+            raise McAmazonS3StoreException("Unable to compress data for object ID %d: %s" % (object_id, str(ex),))
+
+        transfer_config = TransferConfig(multipart_threshold=self.__MULTIPART_CHUNK_SIZE,
+                                         multipart_chunksize=self.__MULTIPART_CHUNK_SIZE,
+                                         max_concurrency=self.__MULTIPART_MAX_CONCURRENCY)
+
+        try:
+            self.__s3.meta.client.upload_fileobj(Fileobj=compressed_stream,
+                                                 Bucket=self.__bucket_name,
+                                                 Key=self.__s3_key_for_object_id(object_id=object_id),
+                                                 Config=transfer_config)
+        except Exception as ex:
+            raise McAmazonS3StoreException("Unable to write object ID %d: %s" % (object_id, str(ex),))
+
+        path = 's3:%s' % self.__s3_key_for_object_id(object_id=object_id)
+        return path
+
     def remove_content(self, db: DatabaseHandler, object_id: int, object_path: str = None) -> None:
         """Remove object from Amazon S3."""
 
@@ -277,8 +567,9 @@ class AmazonS3Store(KeyValueStore):
         self.__initialize_s3()
 
         try:
-            o = self.__object_for_object_id(object_id)
-            o.load()
+            # Boto3 resources are not thread-safe but their clients are
+            self.__s3.meta.client.head_object(Bucket=self.__bucket_name,
+                                              Key=self.__s3_key_for_object_id(object_id=object_id))
         except ClientError as ex:
             if ex.response['Error']['Code'] == '404':
                 return False
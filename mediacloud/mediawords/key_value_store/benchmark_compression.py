@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+
+"""Compare key-value store compression methods' ratio and speed on sampled downloads and annotations.
+
+Samples of recent raw downloads and CLIFF / NYTLabels annotations get compressed and uncompressed with Gzip, Bzip2,
+Zstandard and Zstandard with a dictionary. The dictionary gets trained on one half of every sample and evaluated on
+the other half so that it doesn't get to "remember" the very objects that it compresses.
+
+Usage:
+
+    python3 -m mediawords.key_value_store.benchmark_compression --samples 1000 --rounds 3 [--dictionary-dir dir/]
+
+If --dictionary-dir is set, trained dictionaries get written to that directory to be passed to stores as
+"compression_dictionary".
+"""
+
+import argparse
+import os
+import time
+from typing import Callable, Dict, List, Optional
+
+from mediawords.db import connect_to_db
+from mediawords.db.handler import DatabaseHandler
+from mediawords.dbi.downloads import fetch_contents
+from mediawords.key_value_store.postgresql import PostgreSQLStore
+from mediawords.util.compress import bzip2, bunzip2, gzip, gunzip, zstd, unzstd, train_zstd_dictionary
+
+# Annotation tables to sample
+__ANNOTATION_TABLES = ['cliff_annotations', 'nytlabels_annotations']
+
+# Min. number of objects to train Zstandard dictionary on
+__MIN_DICTIONARY_TRAINING_OBJECTS = 10
+
+
+def __sample_downloads(db: DatabaseHandler, samples: int) -> List[bytes]:
+    """Return content of recent successful content downloads."""
+    downloads = db.query("""
+        SELECT *
+        FROM downloads
+        WHERE type = 'content'
+          AND state = 'success'
+        ORDER BY downloads_id DESC
+        LIMIT %(samples)s
+    """, {'samples': samples}).hashes()
+
+    return [content.encode('utf-8') for content in fetch_contents(db, downloads).values()]
+
+
+def __sample_annotations(db: DatabaseHandler, table: str, samples: int) -> List[bytes]:
+    """Return recent JSON annotations from annotation table."""
+    object_ids = db.query("""
+        SELECT object_id
+        FROM %s
+        ORDER BY object_id DESC
+        LIMIT %%(samples)s
+    """ % table, {'samples': samples}).flat()
+
+    # Compression method doesn't matter much for reading as it gets detected from the data itself
+    store = PostgreSQLStore(table=table)
+
+    return list(store.fetch_contents(db=db, object_ids=object_ids).values())
+
+
+def __best_time(function: Callable[[bytes], bytes], objects: List[bytes], rounds: int) -> float:
+    """Return best time (in seconds) of running function on all objects."""
+    best_time = None
+
+    for _ in range(rounds):
+        start_time = time.time()
+        for obj in objects:
+            function(obj)
+        elapsed_time = time.time() - start_time
+
+        if best_time is None or elapsed_time < best_time:
+            best_time = elapsed_time
+
+    return best_time
+
+
+def benchmark_compression(objects: List[bytes],
+                          dictionary: Optional[bytes] = None,
+                          rounds: int = 3) -> Dict[str, Dict[str, float]]:
+    """Return compression ratio and compression / decompression speed (MB/s) of every method.
+
+    Zstandard with a dictionary gets benchmarked only if "dictionary" is set."""
+
+    methods = {
+        'gzip': (gzip, gunzip,),
+        'bzip2': (bzip2, bunzip2,),
+        'zstd': (zstd, unzstd,),
+    }
+    if dictionary is not None:
+        methods['zstd_dictionary'] = (
+            lambda data: zstd(data, dictionary=dictionary),
+            lambda data: unzstd(data, dictionary=dictionary),
+        )
+
+    uncompressed_mb = sum(len(obj) for obj in objects) / 1024 / 1024
+
+    results = {}
+
+    for method, (compress, uncompress) in sorted(methods.items()):
+        compressed_objects = [compress(obj) for obj in objects]
+        compressed_mb = sum(len(obj) for obj in compressed_objects) / 1024 / 1024
+
+        compress_time = __best_time(function=compress, objects=objects, rounds=rounds)
+        uncompress_time = __best_time(function=uncompress, objects=compressed_objects, rounds=rounds)
+
+        results[method] = {
+            'ratio': uncompressed_mb / compressed_mb if compressed_mb else 0.0,
+            'compress_mb_per_sec': uncompressed_mb / compress_time if compress_time else 0.0,
+            'uncompress_mb_per_sec': uncompressed_mb / uncompress_time if uncompress_time else 0.0,
+        }
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare key-value store compression methods.")
+    parser.add_argument('--samples', type=int, default=1000, help="Number of objects to sample from every source.")
+    parser.add_argument('--rounds', type=int, default=3, help="Number of rounds to run.")
+    parser.add_argument('--dictionary-dir', type=str, default=None,
+                        help="Directory to write trained Zstandard dictionaries to.")
+    args = parser.parse_args()
+
+    db = connect_to_db()
+
+    sources = {'downloads': __sample_downloads(db=db, samples=args.samples)}
+    for table in __ANNOTATION_TABLES:
+        sources[table] = __sample_annotations(db=db, table=table, samples=args.samples)
+
+    db.disconnect()
+
+    for source, objects in sorted(sources.items()):
+        if len(objects) < 2:
+            print("%s: too few objects (%d), skipping" % (source, len(objects),))
+            continue
+
+        # Train on every other object, evaluate on the rest
+        training_objects = objects[0::2]
+        evaluated_objects = objects[1::2]
+
+        dictionary = None
+        if len(training_objects) >= __MIN_DICTIONARY_TRAINING_OBJECTS:
+            dictionary = train_zstd_dictionary(samples=training_objects)
+
+        results = benchmark_compression(objects=evaluated_objects, dictionary=dictionary, rounds=args.rounds)
+
+        print("%s: %d objects, %.1f KB on average" % (
+            source, len(objects), sum(len(obj) for obj in objects) / len(objects) / 1024,
+        ))
+        print("%-20s %8s %18s %18s" % ('Method', 'Ratio', 'Compress (MB/s)', 'Uncompress (MB/s)'))
+        for method, method_results in sorted(results.items()):
+            print("%-20s %8.2f %18.1f %18.1f" % (
+                method,
+                method_results['ratio'],
+                method_results['compress_mb_per_sec'],
+                method_results['uncompress_mb_per_sec'],
+            ))
+        print()
+
+        if args.dictionary_dir and dictionary is not None:
+            dictionary_path = os.path.join(args.dictionary_dir, '%s.zstd-dictionary' % source)
+            with open(dictionary_path, mode='wb') as f:
+                f.write(dictionary)
+            print("Wrote %s dictionary to %s" % (source, dictionary_path,))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,5 @@
-from typing import Union
+import io
+from typing import BinaryIO, Dict, List, Optional, Union
 
 from mediawords.db import DatabaseHandler
 from mediawords.key_value_store import KeyValueStore, McKeyValueStoreException
@@ -34,13 +35,15 @@ class CachedAmazonS3Store(AmazonS3Store):
                  directory_name: str,
                  cache_table: str,
                  compression_method: KeyValueStore.Compression = AmazonS3Store._DEFAULT_COMPRESSION_METHOD,
-                 cache_compression_method: KeyValueStore.Compression = _DEFAULT_CACHE_COMPRESSION_METHOD):
+                 cache_compression_method: KeyValueStore.Compression = _DEFAULT_CACHE_COMPRESSION_METHOD,
+                 compression_dictionary: Optional[bytes] = None):
         """Constructor."""
         super().__init__(access_key_id=access_key_id,
                          secret_access_key=secret_access_key,
                          bucket_name=bucket_name,
                          directory_name=directory_name,
-                         compression_method=compression_method)
+                         compression_method=compression_method,
+                         compression_dictionary=compression_dictionary)
 
         cache_table = decode_object_from_bytes_if_needed(cache_table)
         if cache_table is None or len(cache_table) == 0:
@@ -96,37 +99,95 @@ class CachedAmazonS3Store(AmazonS3Store):
             if content is None or len(content) == 0:
                 raise McCachedAmazonS3StoreException("Object with ID %d was not found." % object_id)
 
-            content = content['raw_data']
+            content = self.__uncompress_cached_raw_data(object_id=object_id, raw_data=content['raw_data'])
 
-            # MC_REWRITE_TO_PYTHON: Perl database handler returns value as array of bytes
-            if isinstance(content, list):
-                content = b''.join(content)
+        except Exception as ex:
+            log.debug("Unable to retrieve object ID %d from cache: %s" % (object_id, str(ex),))
+            return None
 
-            if isinstance(content, memoryview):
-                content = content.tobytes()
+        else:
+            return content
 
-            if not isinstance(content, bytes):
-                raise McCachedAmazonS3StoreException("Content is not bytes for object %d." % object_id)
+    def __uncompress_cached_raw_data(self, object_id: int, raw_data: Union[bytes, memoryview, list]) -> bytes:
+        """Uncompress cache table's "raw_data" column value."""
 
-            try:
-                content = self._uncompress_data_for_method(data=content,
-                                                           compression_method=self.__cache_compression_method)
-            except Exception as ex:
-                raise McCachedAmazonS3StoreException(
-                    "Unable to uncompress data for object ID %d: %s" % (object_id, str(ex),))
+        content = raw_data
+
+        # MC_REWRITE_TO_PYTHON: Perl database handler returns value as array of bytes
+        if isinstance(content, list):
+            content = b''.join(content)
+
+        if isinstance(content, memoryview):
+            content = content.tobytes()
 
-            if content is None:
-                raise McCachedAmazonS3StoreException("Content is None after uncompression for object ID %d" % object_id)
-            if not isinstance(content, bytes):
-                raise McCachedAmazonS3StoreException(
-                    "Content is not bytes after uncompression for object ID %d" % object_id)
+        if not isinstance(content, bytes):
+            raise McCachedAmazonS3StoreException("Content is not bytes for object %d." % object_id)
 
+        try:
+            content = self._uncompress_data_for_method(data=content,
+                                                       compression_method=self.__cache_compression_method)
         except Exception as ex:
-            log.debug("Unable to retrieve object ID %d from cache: %s" % (object_id, str(ex),))
-            return None
+            raise McCachedAmazonS3StoreException(
+                "Unable to uncompress data for object ID %d: %s" % (object_id, str(ex),))
 
-        else:
-            return content
+        if content is None:
+            raise McCachedAmazonS3StoreException("Content is None after uncompression for object ID %d" % object_id)
+        if not isinstance(content, bytes):
+            raise McCachedAmazonS3StoreException(
+                "Content is not bytes after uncompression for object ID %d" % object_id)
+
+        return content
+
+    def __try_storing_objects_in_cache(self, db: DatabaseHandler, contents: Dict[int, bytes]) -> None:
+        """Attempt to store multiple objects to cache with a single query, don't worry too much if it fails."""
+
+        if len(contents) == 0:
+            return
+
+        try:
+            object_ids = []
+            raw_data = []
+            for object_id, content in contents.items():
+                object_ids.append(object_id)
+                raw_data.append(
+                    self._compress_data_for_method(data=content, compression_method=self.__cache_compression_method)
+                )
+
+            sql = "INSERT INTO %s " % self.__cache_table  # interpolated by Python
+            sql += "(object_id, raw_data) "
+            sql += "SELECT * FROM UNNEST(%(object_ids)s::BIGINT[], %(raw_data)s::BYTEA[]) "  # interpolated by psycopg2
+            sql += "ON CONFLICT (object_id) DO UPDATE "
+            sql += "    SET raw_data = EXCLUDED.raw_data"
+
+            db.query(sql, {'object_ids': object_ids, 'raw_data': raw_data})
+
+        except Exception as ex:
+            log.warning("Unable to cache %d objects: %s" % (len(contents), str(ex),))
+
+    def __try_retrieving_objects_from_cache(self, db: DatabaseHandler, object_ids: List[int]) -> Dict[int, bytes]:
+        """Attempt to retrieve multiple objects from cache with a single query, don't worry too much if it fails."""
+
+        contents = {}
+
+        try:
+            sql = "SELECT object_id, raw_data "
+            sql += "FROM %s " % self.__cache_table  # interpolated by Python
+            sql += "WHERE object_id = ANY(%(object_ids)s::BIGINT[])"  # interpolated by psycopg2
+
+            rows = db.query(sql, {'object_ids': object_ids}).hashes()
+
+        except Exception as ex:
+            log.debug("Unable to retrieve %d objects from cache: %s" % (len(object_ids), str(ex),))
+            return contents
+
+        for row in rows:
+            object_id = int(row['object_id'])
+            try:
+                contents[object_id] = self.__uncompress_cached_raw_data(object_id=object_id, raw_data=row['raw_data'])
+            except Exception as ex:
+                log.debug("Unable to retrieve object ID %d from cache: %s" % (object_id, str(ex),))
+
+        return contents
 
     def __remove_object_from_cache(self, db: DatabaseHandler, object_id: int) -> None:
         """Attempt to remove object from cache.
@@ -140,6 +201,10 @@ class CachedAmazonS3Store(AmazonS3Store):
 
         db.query(sql, {'object_id': object_id})
 
+    def uses_database(self) -> bool:
+        """Cache is stored in a database table."""
+        return True
+
     def fetch_content(self, db: DatabaseHandler, object_id: int, object_path: str = None) -> bytes:
         """Read object from Amazon S3, try local cache first."""
 
@@ -155,6 +220,43 @@ class CachedAmazonS3Store(AmazonS3Store):
 
         return content
 
+    def fetch_contents(self,
+                       db: DatabaseHandler,
+                       object_ids: List[int],
+                       object_paths: Optional[Dict[int, str]] = None) -> Dict[int, bytes]:
+        """Read multiple objects from local cache, fetch the rest from Amazon S3."""
+
+        object_ids = self._prepare_object_ids(object_ids)
+
+        if len(object_ids) == 0:
+            return {}
+
+        contents = self.__try_retrieving_objects_from_cache(db=db, object_ids=object_ids)
+
+        uncached_object_ids = [object_id for object_id in object_ids if object_id not in contents]
+        if len(uncached_object_ids) > 0:
+            s3_contents = super().fetch_contents(db=db, object_ids=uncached_object_ids, object_paths=object_paths)
+
+            # Cache the retrieved objects because we might need them soon
+            self.__try_storing_objects_in_cache(db=db, contents=s3_contents)
+
+            contents.update(s3_contents)
+
+        return contents
+
+    def fetch_stream(self, db: DatabaseHandler, object_id: int, object_path: str = None) -> BinaryIO:
+        """Read object from local cache, stream it from Amazon S3 if it's not cached.
+
+        Streamed objects are expected to be large so they don't get cached."""
+
+        object_id = self._prepare_object_id(object_id)
+
+        content = self.__try_retrieving_object_from_cache(db=db, object_id=object_id)
+        if content is not None:
+            return io.BytesIO(content)
+
+        return super().fetch_stream(db=db, object_id=object_id, object_path=object_path)
+
     def store_content(self, db: DatabaseHandler, object_id: int, content: Union[str, bytes]) -> str:
         """Write object to Amazon S3, cache it locally too."""
 
@@ -169,6 +271,18 @@ class CachedAmazonS3Store(AmazonS3Store):
 
         return path
 
+    def store_stream(self, db: DatabaseHandler, object_id: int, stream: BinaryIO) -> str:
+        """Write object to Amazon S3, remove its previous version from local cache."""
+
+        object_id = self._prepare_object_id(object_id)
+
+        path = super().store_stream(db=db, object_id=object_id, stream=stream)
+
+        # Streamed objects are expected to be large so instead of caching them, just get rid of the stale copy
+        self.__remove_object_from_cache(db=db, object_id=object_id)
+
+        return path
+
     def remove_content(self, db: DatabaseHandler, object_id: int, object_path: str = None) -> None:
         """Remove object from Amazon S3 and local cache."""
 
@@ -1,4 +1,4 @@
-from typing import Union
+from typing import Dict, List, Optional, Union
 
 from mediawords.db import DatabaseHandler
 from mediawords.key_value_store import KeyValueStore, McKeyValueStoreException
@@ -15,6 +15,10 @@ class DatabaseInlineStore(KeyValueStore):
 
     __CONTENT_PREFIX = 'content:'
 
+    def uses_database(self) -> bool:
+        """Inline content comes from the object path so the database handler doesn't get used."""
+        return False
+
     def fetch_content(self, db: DatabaseHandler, object_id: int, object_path: str = None) -> bytes:
         """Read object from PostgreSQL's 'path' row."""
 
@@ -36,6 +40,24 @@ class DatabaseInlineStore(KeyValueStore):
 
         return content
 
+    def fetch_contents(self,
+                       db: DatabaseHandler,
+                       object_ids: List[int],
+                       object_paths: Optional[Dict[int, str]] = None) -> Dict[int, bytes]:
+        """Read multiple objects from their PostgreSQL's 'path' rows."""
+
+        object_ids = self._prepare_object_ids(object_ids)
+        object_paths = self._prepare_object_paths(object_paths)
+
+        contents = {}
+
+        for object_id in object_ids:
+            object_path = object_paths.get(object_id, None)
+            if object_path is not None and object_path.startswith(self.__CONTENT_PREFIX):
+                contents[object_id] = object_path[len(self.__CONTENT_PREFIX):].encode('utf-8')
+
+        return contents
+
     def store_content(self, db: DatabaseHandler, object_id: int, content: Union[str, bytes]) -> None:
         """Write object to PostgreSQL's 'path' row."""
 
@@ -0,0 +1,526 @@
+import collections
+import fcntl
+import io
+import os
+import tempfile
+import time
+from typing import BinaryIO, Dict, List, Optional, Tuple, Union
+
+from mediawords.db import DatabaseHandler
+from mediawords.key_value_store import KeyValueStore, McKeyValueStoreException
+from mediawords.util.log import create_logger
+from mediawords.util.perl import decode_object_from_bytes_if_needed
+
+log = create_logger(__name__)
+
+
+class McDiskCachedStoreException(McKeyValueStoreException):
+    """Disk cached key-value store exception."""
+    pass
+
+
+class _TeeStream(io.RawIOBase):
+    """Readable stream that copies everything that gets read from a source stream to a file.
+
+    Errors writing the copy don't interrupt reading but get remembered in "copy_failed"."""
+
+    __slots__ = [
+        '__source',
+        '__copy_file',
+        'copy_failed',
+    ]
+
+    def __init__(self, source: BinaryIO, copy_file: BinaryIO):
+        super().__init__()
+        self.__source = source
+        self.__copy_file = copy_file
+        self.copy_failed = False
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        chunk = self.__source.read(len(b))
+
+        size = len(chunk)
+        b[:size] = chunk
+
+        if not self.copy_failed:
+            try:
+                self.__copy_file.write(chunk)
+            except Exception as ex:
+                log.warning("Unable to copy stream to file: %s" % str(ex))
+                self.copy_failed = True
+
+        return size
+
+
+class DiskCachedStore(KeyValueStore):
+    """Key-value store that caches objects of another store in a size-bounded directory on a local disk.
+
+    Objects get written to "<cache_directory>/<shard>/<object_id>" uncompressed, the shard being the last byte of the
+    object ID in hex. Every object gets written to a temporary file first and then renamed over the cached file, so
+    readers (in any process) see either the old or the new object but never a partially written one.
+
+    Eviction is LRU by file modification time which gets bumped on every cache hit. Whenever a process has written
+    another __EVICTION_CHECK_FRACTION of "max_size" bytes, it scans the cache directory and, if the cache is over its
+    max. size, removes the least recently used objects until the cache is down to __EVICT_TO_FRACTION of "max_size".
+    Scans are serialized between processes with a lock file; objects that get removed while being read stay readable
+    for the reader that has them open.
+
+    Cache is write-through: objects that get stored get cached too."""
+
+    # Default max. size of cached objects (in bytes)
+    _DEFAULT_MAX_SIZE = 10 * 1024 * 1024 * 1024
+
+    # Number of shard subdirectories to spread objects between
+    __SHARD_COUNT = 256
+
+    # Run eviction check after every this fraction of max. size written by this process
+    __EVICTION_CHECK_FRACTION = 0.05
+
+    # Evict objects down to this fraction of max. size
+    __EVICT_TO_FRACTION = 0.9
+
+    # Temporary files older than this (in seconds) are considered to be leftovers from crashed writers
+    __STALE_TEMPORARY_FILE_AGE = 60 * 60
+
+    __TEMPORARY_FILE_PREFIX = '.tmp-'
+
+    # Size of chunks to copy streams in
+    __STREAM_CHUNK_SIZE = 64 * 1024
+    __EVICTION_LOCK_FILE = '.eviction.lock'
+
+    __slots__ = [
+        '__store',
+        '__cache_directory',
+        '__max_size',
+
+        # Bytes written to cache by this process since the last eviction check
+        '__bytes_written_since_eviction_check',
+
+        # Cache size as of the last eviction check, or None if unknown
+        '__cache_size',
+
+        # Hits, misses, writes, etc. of this process
+        '__counters',
+    ]
+
+    def __init__(self, store: KeyValueStore, cache_directory: str, max_size: int = _DEFAULT_MAX_SIZE):
+        """Constructor.
+
+        Arguments:
+        store - key-value store to cache objects of
+        cache_directory - directory to cache objects in; should be used for caching a single store only
+        max_size - max. size of cached objects (in bytes)
+        """
+
+        cache_directory = decode_object_from_bytes_if_needed(cache_directory)
+
+        if store is None:
+            raise McDiskCachedStoreException("Store to cache is unset.")
+
+        if cache_directory is None or len(cache_directory) == 0:
+            raise McDiskCachedStoreException("Cache directory is unset.")
+
+        max_size = int(max_size)
+        if max_size < 1:
+            raise McDiskCachedStoreException("Max. size must be positive.")
+
+        try:
+            os.makedirs(cache_directory, exist_ok=True)
+        except Exception as ex:
+            raise McDiskCachedStoreException("Unable to create cache directory '%s': %s" % (cache_directory, str(ex),))
+
+        self.__store = store
+        self.__cache_directory = cache_directory
+        self.__max_size = max_size
+
+        self.__bytes_written_since_eviction_check = 0
+        self.__cache_size = None
+        self.__counters = collections.Counter()
+
+    def __shard_directory(self, object_id: int) -> str:
+        """Return shard directory for object ID."""
+        return os.path.join(self.__cache_directory, '%02x' % (object_id % self.__SHARD_COUNT))
+
+    def __path_for_object_id(self, object_id: int) -> str:
+        """Return cached file path for object ID."""
+        return os.path.join(self.__shard_directory(object_id=object_id), str(object_id))
+
+    def __open_from_cache(self, object_id: int) -> Optional[BinaryIO]:
+        """Open cached object for reading; return None on cache miss."""
+
+        path = self.__path_for_object_id(object_id=object_id)
+
+        try:
+            f = open(path, mode='rb')
+
+        except FileNotFoundError:
+            self.__counters['misses'] += 1
+            return None
+
+        except Exception as ex:
+            log.warning("Unable to open object ID %d in disk cache: %s" % (object_id, str(ex),))
+            self.__counters['misses'] += 1
+            return None
+
+        # Mark the object as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            # Might have just been evicted by some other process
+            pass
+
+        self.__counters['hits'] += 1
+
+        return f
+
+    def __read_from_cache(self, object_id: int) -> Optional[bytes]:
+        """Read object from cache; return None on cache miss."""
+
+        f = self.__open_from_cache(object_id=object_id)
+        if f is None:
+            return None
+
+        try:
+            with f:
+                return f.read()
+
+        except Exception as ex:
+            log.warning("Unable to read object ID %d from disk cache: %s" % (object_id, str(ex),))
+            return None
+
+    def __create_temporary_file(self, object_id: int) -> Optional[Tuple[BinaryIO, str]]:
+        """Create temporary file to write object to; return file and its path, or None if it can't be created."""
+
+        shard_directory = self.__shard_directory(object_id=object_id)
+
+        try:
+            os.makedirs(shard_directory, exist_ok=True)
+
+            temp_fd, temp_path = tempfile.mkstemp(dir=shard_directory, prefix=self.__TEMPORARY_FILE_PREFIX)
+
+        except Exception as ex:
+            log.warning("Unable to create temporary file for object ID %d in disk cache: %s" % (object_id, str(ex),))
+            return None
+
+        return os.fdopen(temp_fd, mode='w+b'), temp_path
+
+    @staticmethod
+    def __discard_temporary_file(temp_file: BinaryIO, temp_path: str) -> None:
+        """Close and remove temporary file."""
+
+        try:
+            temp_file.close()
+        except OSError:
+            pass
+
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+
+    def __commit_temporary_file(self, object_id: int, temp_file: BinaryIO, temp_path: str) -> bool:
+        """Move written temporary file in place of the cached object, leave it open; return False if that fails."""
+
+        try:
+            temp_file.flush()
+            size = temp_file.tell()
+
+            os.replace(temp_path, self.__path_for_object_id(object_id=object_id))
+
+        except Exception as ex:
+            log.warning("Unable to write object ID %d to disk cache: %s" % (object_id, str(ex),))
+            self.__discard_temporary_file(temp_file=temp_file, temp_path=temp_path)
+            return False
+
+        self.__counters['writes'] += 1
+        self.__counters['bytes_written'] += size
+
+        self.__bytes_written_since_eviction_check += size
+        if self.__bytes_written_since_eviction_check >= self.__max_size * self.__EVICTION_CHECK_FRACTION:
+            self.evict()
+
+        return True
+
+    def __write_to_cache(self, object_id: int, content: bytes) -> None:
+        """Write object to cache atomically, don't worry too much if it fails."""
+
+        temp = self.__create_temporary_file(object_id=object_id)
+        if temp is None:
+            return
+
+        temp_file, temp_path = temp
+
+        try:
+            temp_file.write(content)
+        except Exception as ex:
+            log.warning("Unable to write object ID %d to disk cache: %s" % (object_id, str(ex),))
+            self.__discard_temporary_file(temp_file=temp_file, temp_path=temp_path)
+            return
+
+        if self.__commit_temporary_file(object_id=object_id, temp_file=temp_file, temp_path=temp_path):
+            temp_file.close()
+
+    def __remove_from_cache(self, object_id: int) -> None:
+        """Remove object from cache."""
+        try:
+            os.unlink(self.__path_for_object_id(object_id=object_id))
+        except FileNotFoundError:
+            pass
+
+    def evict(self) -> int:
+        """Remove least recently used objects if cache is over its max. size; return number of evicted objects.
+
+        Returns 0 without doing anything if some other process is evicting objects at the same time."""
+
+        self.__bytes_written_since_eviction_check = 0
+
+        lock_path = os.path.join(self.__cache_directory, self.__EVICTION_LOCK_FILE)
+
+        with open(lock_path, mode='a') as lock_file:
+
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                log.debug("Some other process is evicting objects from %s" % self.__cache_directory)
+                return 0
+
+            try:
+                now = time.time()
+
+                cached_files = []
+                cache_size = 0
+
+                for shard in os.scandir(self.__cache_directory):
+                    if not shard.is_dir():
+                        continue
+
+                    for entry in os.scandir(shard.path):
+                        try:
+                            stat = entry.stat()
+                        except FileNotFoundError:
+                            continue
+
+                        if entry.name.startswith(self.__TEMPORARY_FILE_PREFIX):
+                            if now - stat.st_mtime > self.__STALE_TEMPORARY_FILE_AGE:
+                                try:
+                                    os.unlink(entry.path)
+                                except OSError:
+                                    pass
+                            continue
+
+                        cached_files.append((stat.st_mtime, stat.st_size, entry.path,))
+                        cache_size += stat.st_size
+
+                evicted_count = 0
+
+                if cache_size > self.__max_size:
+                    evict_to_size = self.__max_size * self.__EVICT_TO_FRACTION
+
+                    # Least recently used first
+                    cached_files.sort()
+
+                    for mtime, size, path in cached_files:
+                        if cache_size <= evict_to_size:
+                            break
+
+                        try:
+                            os.unlink(path)
+                        except FileNotFoundError:
+                            pass
+
+                        cache_size -= size
+                        evicted_count += 1
+
+                    log.info("Evicted %d objects from %s" % (evicted_count, self.__cache_directory,))
+
+                self.__cache_size = cache_size
+                self.__counters['evictions'] += evicted_count
+
+                return evicted_count
+
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def stats(self) -> Dict[str, Union[int, float, None]]:
+        """Return this process's cache hit rate statistics and cache size as of the last eviction check."""
+        lookups = self.__counters['hits'] + self.__counters['misses']
+        return {
+            'hits': self.__counters['hits'],
+            'misses': self.__counters['misses'],
+            'hit_rate': self.__counters['hits'] / lookups if lookups else 0.0,
+            'writes': self.__counters['writes'],
+            'bytes_written': self.__counters['bytes_written'],
+            'evictions': self.__counters['evictions'],
+            'size': self.__cache_size,
+            'max_size': self.__max_size,
+        }
+
+    def uses_database(self) -> bool:
+        """Cache misses get read from the cached store."""
+        return self.__store.uses_database()
+
+    def initialize(self) -> None:
+        """Initialize the cached store."""
+        self.__store.initialize()
+
+    def fetch_content(self, db: DatabaseHandler, object_id: int, object_path: str = None) -> bytes:
+        """Read object from disk cache, fetch it from the cached store on cache miss."""
+
+        object_id = self._prepare_object_id(object_id)
+
+        content = self.__read_from_cache(object_id=object_id)
+
+        if content is None:
+            # MC_REWRITE_TO_PYTHON: use named parameters after Python rewrite
+            content = self.__store.fetch_content(db, object_id, object_path)
+
+            self.__write_to_cache(object_id=object_id, content=content)
+
+        return content
+
+    def fetch_contents(self,
+                       db: DatabaseHandler,
+                       object_ids: List[int],
+                       object_paths: Optional[Dict[int, str]] = None) -> Dict[int, bytes]:
+        """Read multiple objects from disk cache, fetch the rest from the cached store in a single batch."""
+
+        object_ids = self._prepare_object_ids(object_ids)
+
+        contents = {}
+        for object_id in object_ids:
+            content = self.__read_from_cache(object_id=object_id)
+            if content is not None:
+                contents[object_id] = content
+
+        uncached_object_ids = [object_id for object_id in object_ids if object_id not in contents]
+        if len(uncached_object_ids) > 0:
+            # MC_REWRITE_TO_PYTHON: use named parameters after Python rewrite
+            store_contents = self.__store.fetch_contents(db, uncached_object_ids, object_paths)
+
+            for object_id, content in store_contents.items():
+                self.__write_to_cache(object_id=object_id, content=content)
+
+            contents.update(store_contents)
+
+        return contents
+
+    def fetch_stream(self, db: DatabaseHandler, object_id: int, object_path: str = None) -> BinaryIO:
+        """Open object from disk cache; on cache miss, copy it from the cached store's stream to disk cache first."""
+
+        object_id = self._prepare_object_id(object_id)
+
+        cached_file = self.__open_from_cache(object_id=object_id)
+        if cached_file is not None:
+            return cached_file
+
+        # MC_REWRITE_TO_PYTHON: use named parameters after Python rewrite
+        store_stream = self.__store.fetch_stream(db, object_id, object_path)
+
+        temp = self.__create_temporary_file(object_id=object_id)
+        if temp is None:
+            return store_stream
+
+        temp_file, temp_path = temp
+
+        try:
+            tee_stream = _TeeStream(source=store_stream, copy_file=temp_file)
+            while tee_stream.read(self.__STREAM_CHUNK_SIZE):
+                pass
+
+        except Exception as ex:
+            self.__discard_temporary_file(temp_file=temp_file, temp_path=temp_path)
+            raise ex
+
+        finally:
+            store_stream.close()
+
+        if not tee_stream.copy_failed:
+            if self.__commit_temporary_file(object_id=object_id, temp_file=temp_file, temp_path=temp_path):
+                temp_file.seek(0)
+                return temp_file
+        else:
+            self.__discard_temporary_file(temp_file=temp_file, temp_path=temp_path)
+
+        # Stream has been read already but it couldn't be cached, so fetch it again
+        log.warning("Unable to cache object ID %d, streaming it from the cached store" % object_id)
+
+        # MC_REWRITE_TO_PYTHON: use named parameters after Python rewrite
+        return self.__store.fetch_stream(db, object_id, object_path)
+
+    def store_content(self, db: DatabaseHandler, object_id: int, content: Union[str, bytes]) -> str:
+        """Write object to the cached store, cache it on disk too."""
+
+        object_id = self._prepare_object_id(object_id)
+        content = self._prepare_content(content)
+
+        # MC_REWRITE_TO_PYTHON: use named parameters after Python rewrite
+        path = self.__store.store_content(db, object_id, content)
+
+        # If we got to this point, object got stored successfully
+        self.__write_to_cache(object_id=object_id, content=content)
+
+        return path
+
+    def store_stream(self, db: DatabaseHandler, object_id: int, stream: BinaryIO) -> str:
+        """Write object to the cached store, cache it on disk while it's being read from the stream."""
+
+        object_id = self._prepare_object_id(object_id)
+        stream = self._prepare_stream(stream)
+
+        temp = self.__create_temporary_file(object_id=object_id)
+
+        if temp is None:
+            # Don't leave the previous version in the cache
+            self.__remove_from_cache(object_id=object_id)
+
+            # MC_REWRITE_TO_PYTHON: use named parameters after Python rewrite
+            return self.__store.store_stream(db, object_id, stream)
+
+        temp_file, temp_path = temp
+
+        tee_stream = _TeeStream(source=stream, copy_file=temp_file)
+
+        try:
+            # MC_REWRITE_TO_PYTHON: use named parameters after Python rewrite
+            path = self.__store.store_stream(db, object_id, io.BufferedReader(tee_stream))
+
+        except Exception as ex:
+            self.__discard_temporary_file(temp_file=temp_file, temp_path=temp_path)
+            raise ex
+
+        # If we got to this point, object got stored successfully
+        if tee_stream.copy_failed:
+            self.__discard_temporary_file(temp_file=temp_file, temp_path=temp_path)
+            self.__remove_from_cache(object_id=object_id)
+
+        elif self.__commit_temporary_file(object_id=object_id, temp_file=temp_file, temp_path=temp_path):
+            temp_file.close()
+
+        else:
+            self.__remove_from_cache(object_id=object_id)
+
+        return path
+
+    def remove_content(self, db: DatabaseHandler, object_id: int, object_path: str = None) -> None:
+        """Remove object from disk cache and the cached store."""
+
+        object_id = self._prepare_object_id(object_id)
+
+        self.__remove_from_cache(object_id=object_id)
+
+        # MC_REWRITE_TO_PYTHON: use named parameters after Python rewrite
+        self.__store.remove_content(db, object_id, object_path)
+
+    def content_exists(self, db: DatabaseHandler, object_id: int, object_path: str = None) -> bool:
+        """Test if object exists in disk cache or the cached store."""
+
+        object_id = self._prepare_object_id(object_id)
+
+        if os.path.isfile(self.__path_for_object_id(object_id=object_id)):
+            return True
+
+        # MC_REWRITE_TO_PYTHON: use named parameters after Python rewrite
+        return self.__store.content_exists(db, object_id, object_path)
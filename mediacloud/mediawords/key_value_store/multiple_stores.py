@@ -1,27 +1,146 @@
-from typing import List, Union
+import bisect
+import concurrent.futures
+import os
+import shutil
+import tempfile
+import threading
+import time
+from typing import BinaryIO, Dict, List, Optional, Union
 
 from mediawords.db import DatabaseHandler
 from mediawords.key_value_store import KeyValueStore, McKeyValueStoreException
+from mediawords.util.log import create_logger
 from mediawords.util.perl import decode_object_from_bytes_if_needed
 
+log = create_logger(__name__)
+
 
 class McMultipleStoresStoreException(McKeyValueStoreException):
     """Multiple stores exception."""
     pass
 
 
+class LatencyHistogram(object):
+    """Thread-safe histogram of latencies with logarithmically spaced buckets.
+
+    Once the histogram holds __MAX_COUNT latencies, all bucket counts get halved so that recent latencies weigh more
+    than old ones."""
+
+    # Upper bounds of buckets (in seconds): 1 ms, 1.41 ms, 2 ms, ..., ~12 min.
+    __BUCKET_BOUNDS = [0.001 * (2 ** (i / 2)) for i in range(40)]
+
+    # Max. number of latencies to hold before halving bucket counts
+    __MAX_COUNT = 10 * 1000
+
+    __slots__ = [
+        '__lock',
+        '__buckets',
+        '__count',
+    ]
+
+    def __init__(self):
+        """Constructor."""
+        self.__lock = threading.Lock()
+
+        # Last bucket is for latencies over the last bound
+        self.__buckets = [0] * (len(self.__BUCKET_BOUNDS) + 1)
+        self.__count = 0
+
+    def add(self, seconds: float) -> None:
+        """Add latency (in seconds)."""
+        bucket = bisect.bisect_left(self.__BUCKET_BOUNDS, seconds)
+
+        with self.__lock:
+            self.__buckets[bucket] += 1
+            self.__count += 1
+
+            if self.__count >= self.__MAX_COUNT:
+                self.__buckets = [bucket_count // 2 for bucket_count in self.__buckets]
+                self.__count = sum(self.__buckets)
+
+    def count(self) -> int:
+        """Return number of latencies in the histogram."""
+        return self.__count
+
+    def percentile(self, percentile: float) -> Optional[float]:
+        """Return upper bound of the bucket that the nearest-rank percentile falls in; None if histogram is empty."""
+        with self.__lock:
+            if self.__count == 0:
+                return None
+
+            rank = max(1, int(percentile / 100.0 * self.__count + 0.5))
+
+            cumulative_count = 0
+            for bucket, bucket_count in enumerate(self.__buckets):
+                cumulative_count += bucket_count
+                if cumulative_count >= rank:
+                    if bucket < len(self.__BUCKET_BOUNDS):
+                        return self.__BUCKET_BOUNDS[bucket]
+                    else:
+                        return float('inf')
+
+            return float('inf')
+
+    def stats(self) -> Dict[str, Optional[float]]:
+        """Return count and p50 / p95 / p99 latencies (in seconds)."""
+        return {
+            'count': self.count(),
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+        }
+
+
 class MultipleStoresStore(KeyValueStore):
-    """Key-value store that reads from / writes to multiple stores."""
+    """Key-value store that reads from / writes to multiple stores.
+
+    By default, stores for reading get tried one after another. In hedged read mode (enabled by setting
+    "hedge_percentile"), if a store hasn't returned the object within its "hedge_percentile" latency, the next store
+    gets queried in parallel and whichever store returns the object first wins. Stores that use the database handler
+    (see uses_database()) are never run in parallel with the caller, so they get queried in the calling thread while
+    the previously started stores keep running in the background."""
+
+    # Min. number of latencies that a store's histogram should have before hedging reads to that store
+    __HEDGE_MIN_LATENCY_COUNT = 20
+
+    # Max. number of concurrent fetches in hedged read mode
+    __HEDGE_MAX_WORKERS = 32
+
+    # Max. size of stream to keep in memory (instead of a temporary file) while writing it to multiple stores
+    __STORE_STREAM_MAX_MEMORY_SIZE = 16 * 1024 * 1024
 
     __slots__ = [
         '__stores_for_reading',
         '__stores_for_writing',
+
+        '__hedge_percentile',
+        '__max_hedged_fraction',
+
+        # Read latency histograms of every store for reading
+        '__read_latencies',
+
+        # Number of fetch_content() calls and number of extra requests made by hedging
+        '__reads',
+        '__hedged_reads',
+
+        # (PID, thread pool) for running hedged fetches
+        '__hedge_executor',
     ]
 
     def __init__(self,
                  stores_for_reading: List[KeyValueStore] = None,
-                 stores_for_writing: List[KeyValueStore] = None):
-        """Constructor."""
+                 stores_for_writing: List[KeyValueStore] = None,
+                 hedge_percentile: Optional[float] = None,
+                 max_hedged_fraction: float = 0.05):
+        """Constructor.
+
+        Arguments:
+        stores_for_reading - stores to read from, in order of preference
+        stores_for_writing - stores to write to
+        hedge_percentile - if set, query the next store in parallel if a store hasn't returned the object within this
+                           percentile (e.g. 95) of its read latencies
+        max_hedged_fraction - max. number of extra requests made by hedging as a fraction of all reads
+        """
 
         if stores_for_reading is None:
             stores_for_reading = []
@@ -31,9 +150,26 @@ class MultipleStoresStore(KeyValueStore):
         if len(stores_for_reading) + len(stores_for_writing) == 0:
             raise McMultipleStoresStoreException("At least one store for reading / writing should be present.")
 
+        if hedge_percentile is not None:
+            hedge_percentile = float(hedge_percentile)
+            if not 0 < hedge_percentile < 100:
+                raise McMultipleStoresStoreException("Hedge percentile must be between 0 and 100.")
+
+        max_hedged_fraction = float(max_hedged_fraction)
+        if max_hedged_fraction < 0:
+            raise McMultipleStoresStoreException("Max. hedged fraction can't be negative.")
+
         self.__stores_for_reading = stores_for_reading
         self.__stores_for_writing = stores_for_writing
 
+        self.__hedge_percentile = hedge_percentile
+        self.__max_hedged_fraction = max_hedged_fraction
+
+        self.__read_latencies = [LatencyHistogram() for _ in stores_for_reading]
+        self.__reads = 0
+        self.__hedged_reads = 0
+        self.__hedge_executor = None
+
     def stores_for_reading(self) -> list:
         """Return list of stores for reading."""
         return self.__stores_for_reading
@@ -42,6 +178,164 @@ class MultipleStoresStore(KeyValueStore):
         """Return list of stores for writing."""
         return self.__stores_for_writing
 
+    def initialize(self) -> None:
+        """Initialize all stores for reading and writing."""
+        for store in self.__stores_for_reading + self.__stores_for_writing:
+            store.initialize()
+
+    def uses_database(self) -> bool:
+        """Return True if any of the stores use the database handler."""
+        return any(store.uses_database() for store in self.__stores_for_reading + self.__stores_for_writing)
+
+    def read_stats(self) -> Dict[str, Union[int, List[dict]]]:
+        """Return number of reads, number of extra requests made by hedging, and read latency statistics of every store
+        for reading (in the order of stores for reading)."""
+        return {
+            'reads': self.__reads,
+            'hedged_reads': self.__hedged_reads,
+            'stores': [
+                dict(store=str(store), **latencies.stats())
+                for store, latencies in zip(self.__stores_for_reading, self.__read_latencies)
+            ],
+        }
+
+    def __executor(self) -> concurrent.futures.ThreadPoolExecutor:
+        """Return thread pool for running hedged fetches (recreated in forked processes)."""
+        if self.__hedge_executor is None or self.__hedge_executor[0] != os.getpid():
+            self.__hedge_executor = (
+                os.getpid(),
+                concurrent.futures.ThreadPoolExecutor(max_workers=self.__HEDGE_MAX_WORKERS),
+            )
+        return self.__hedge_executor[1]
+
+    def __timed_fetch_content(self, store_index: int, db: DatabaseHandler, object_id: int, object_path: str) -> bytes:
+        """Fetch content from a store for reading, add latency of the fetch to the store's histogram."""
+
+        store = self.__stores_for_reading[store_index]
+
+        start_time = time.time()
+
+        try:
+            # MC_REWRITE_TO_PYTHON: use named parameters after Python rewrite
+            content = store.fetch_content(db, object_id, object_path)
+
+        finally:
+            # Failed fetches count too, as slow failures (e.g. timeouts) would otherwise skew the percentiles low
+            self.__read_latencies[store_index].add(time.time() - start_time)
+
+        if content is None:
+            raise McMultipleStoresStoreException("Fetching object ID %d from store %s succeeded, "
+                                                 "but the returned content is undefined." % (
+                                                     object_id, str(store),
+                                                 ))
+
+        return content
+
+    def __hedge_delay(self, store_index: int) -> Optional[float]:
+        """Return how long to wait for a store before querying the next store in parallel, or None if next store
+        shouldn't be queried in parallel."""
+
+        if self.__hedge_percentile is None:
+            return None
+
+        if store_index + 1 >= len(self.__stores_for_reading):
+            return None
+
+        if self.__hedged_reads + 1 > self.__max_hedged_fraction * self.__reads:
+            return None
+
+        latencies = self.__read_latencies[store_index]
+        if latencies.count() < self.__HEDGE_MIN_LATENCY_COUNT:
+            return None
+
+        return latencies.percentile(self.__hedge_percentile)
+
+    def __fetch_content_hedged(self, db: DatabaseHandler, object_id: int, object_path: str, errors: List[str]) -> bytes:
+        """Fetch content from stores for reading, querying the next store in parallel whenever the last started one is
+        slow to respond or has failed; return None and append to errors if none of the stores have the content."""
+
+        def append_error(store_: KeyValueStore, ex: Exception) -> None:
+            # Silently skip through errors and die() only if content wasn't found anywhere
+            errors.append("Error fetching object ID %(object_id)d from store %(store)s: %(exception)s" % {
+                'object_id': object_id,
+                'store': store_,
+                'exception': str(ex),
+            })
+
+        # Futures of fetches that are running in the background, and indexes of their stores
+        pending = {}
+
+        next_store_index = 0
+        last_submitted_store_index = None
+        start_next_store = True
+
+        while True:
+
+            has_next_store = next_store_index < len(self.__stores_for_reading)
+
+            if start_next_store and has_next_store:
+                start_next_store = False
+
+                store_index = next_store_index
+                next_store_index += 1
+
+                store = self.__stores_for_reading[store_index]
+
+                if store.uses_database():
+                    # Database handler can't be used from other threads, so query the store here while the previously
+                    # started stores (if any) keep running in the background
+                    try:
+                        return self.__timed_fetch_content(store_index=store_index,
+                                                          db=db,
+                                                          object_id=object_id,
+                                                          object_path=object_path)
+                    except Exception as ex:
+                        append_error(store_=store, ex=ex)
+                        start_next_store = True
+
+                else:
+                    try:
+                        # Lazy initialization on first use is not thread-safe
+                        store.initialize()
+                    except Exception as ex:
+                        append_error(store_=store, ex=ex)
+                        start_next_store = True
+                    else:
+                        future = self.__executor().submit(self.__timed_fetch_content,
+                                                          store_index=store_index,
+                                                          db=db,
+                                                          object_id=object_id,
+                                                          object_path=object_path)
+                        pending[future] = store_index
+                        last_submitted_store_index = store_index
+
+                continue
+
+            if len(pending) == 0:
+                return None
+
+            hedge_delay = self.__hedge_delay(store_index=last_submitted_store_index)
+
+            done, _ = concurrent.futures.wait(pending,
+                                              timeout=hedge_delay,
+                                              return_when=concurrent.futures.FIRST_COMPLETED)
+
+            if len(done) == 0:
+                # Last started store is being slow, query the next one in parallel
+                self.__hedged_reads += 1
+                start_next_store = True
+                continue
+
+            for future in done:
+                store_index = pending.pop(future)
+                try:
+                    return future.result()
+                except Exception as ex:
+                    append_error(store_=self.__stores_for_reading[store_index], ex=ex)
+
+                    # Try the next store right away instead of waiting for the slow ones
+                    start_next_store = True
+
     def fetch_content(self, db: DatabaseHandler, object_id: int, object_path: str = None) -> bytes:
         """Fetch content from any of the stores that might have it; raise if none of them do."""
 
@@ -52,31 +346,34 @@ class MultipleStoresStore(KeyValueStore):
         if len(self.__stores_for_reading) == 0:
             raise McMultipleStoresStoreException("List of stores for reading object ID %d is empty." % object_id)
 
+        self.__reads += 1
+
         errors = []
 
         content = None
-        for store in self.__stores_for_reading:
 
-            try:
+        if self.__hedge_percentile is not None:
+            content = self.__fetch_content_hedged(db=db, object_id=object_id, object_path=object_path, errors=errors)
 
-                # MC_REWRITE_TO_PYTHON: use named parameters after Python rewrite
-                content = store.fetch_content(db, object_id, object_path)
-                if content is None:
-                    raise McMultipleStoresStoreException("Fetching object ID %d from store %s succeeded, "
-                                                         "but the returned content is undefined." % (
-                                                             object_id, str(store),
-                                                         ))
+        else:
+            for store_index, store in enumerate(self.__stores_for_reading):
 
-            except Exception as ex:
-                # Silently skip through errors and die() only if content wasn't found anywhere
-                errors.append("Error fetching object ID %(object_id)d from store %(store)s: %(exception)s" % {
-                    'object_id': object_id,
-                    'store': store,
-                    'exception': str(ex),
-                })
+                try:
+                    content = self.__timed_fetch_content(store_index=store_index,
+                                                         db=db,
+                                                         object_id=object_id,
+                                                         object_path=object_path)
 
-            else:
-                break
+                except Exception as ex:
+                    # Silently skip through errors and die() only if content wasn't found anywhere
+                    errors.append("Error fetching object ID %(object_id)d from store %(store)s: %(exception)s" % {
+                        'object_id': object_id,
+                        'store': store,
+                        'exception': str(ex),
+                    })
+
+                else:
+                    break
 
         if content is None:
             raise McMultipleStoresStoreException(
@@ -88,6 +385,80 @@ class MultipleStoresStore(KeyValueStore):
 
         return content
 
+    def fetch_contents(self,
+                       db: DatabaseHandler,
+                       object_ids: List[int],
+                       object_paths: Optional[Dict[int, str]] = None) -> Dict[int, bytes]:
+        """Fetch multiple objects from the first store, then fetch the ones that weren't found there from the next
+        store, and so on; objects that weren't found in any of the stores are left out."""
+
+        object_ids = self._prepare_object_ids(object_ids)
+        object_paths = self._prepare_object_paths(object_paths)
+
+        if len(self.__stores_for_reading) == 0:
+            raise McMultipleStoresStoreException("List of stores for reading %d objects is empty." % len(object_ids))
+
+        contents = {}
+
+        remaining_object_ids = object_ids
+        for store in self.__stores_for_reading:
+
+            if len(remaining_object_ids) == 0:
+                break
+
+            try:
+                # MC_REWRITE_TO_PYTHON: use named parameters after Python rewrite
+                store_contents = store.fetch_contents(db, remaining_object_ids, object_paths)
+
+            except Exception as ex:
+                # Try the next store for all of the remaining objects
+                log.warning("Error fetching %(count)d objects from store %(store)s: %(exception)s" % {
+                    'count': len(remaining_object_ids),
+                    'store': store,
+                    'exception': str(ex),
+                })
+
+            else:
+                contents.update(store_contents)
+                remaining_object_ids = [object_id for object_id in remaining_object_ids if object_id not in contents]
+
+        return contents
+
+    def fetch_stream(self, db: DatabaseHandler, object_id: int, object_path: str = None) -> BinaryIO:
+        """Open stream of content from the first store that has it; raise if none of them do.
+
+        Stores get tried one after another even in hedged read mode as streams are expected to be of large objects."""
+
+        object_id = self._prepare_object_id(object_id)
+
+        object_path = decode_object_from_bytes_if_needed(object_path)
+
+        if len(self.__stores_for_reading) == 0:
+            raise McMultipleStoresStoreException("List of stores for reading object ID %d is empty." % object_id)
+
+        errors = []
+
+        for store in self.__stores_for_reading:
+
+            try:
+                # MC_REWRITE_TO_PYTHON: use named parameters after Python rewrite
+                return store.fetch_stream(db, object_id, object_path)
+
+            except Exception as ex:
+                # Silently skip through errors and die() only if content wasn't found anywhere
+                errors.append("Error fetching object ID %(object_id)d from store %(store)s: %(exception)s" % {
+                    'object_id': object_id,
+                    'store': store,
+                    'exception': str(ex),
+                })
+
+        raise McMultipleStoresStoreException(
+            "All stores failed while fetching object ID %(object_id)d; errors: %(errors)s" % {
+                'object_id': object_id,
+                'errors': "\n".join(errors),
+            }
+        )
+
     def store_content(self, db: DatabaseHandler, object_id: int, content: Union[str, bytes]) -> str:
         """Store content to all stores; raise if one of them fails."""
 
@@ -125,6 +496,57 @@ class MultipleStoresStore(KeyValueStore):
 
         return last_store_path
 
+    def store_stream(self, db: DatabaseHandler, object_id: int, stream: BinaryIO) -> str:
+        """Store stream to all stores; raise if one of them fails.
+
+        If there's more than one store to write to, stream gets spooled to a temporary file first so that it could be
+        read multiple times."""
+
+        object_id = self._prepare_object_id(object_id)
+        stream = self._prepare_stream(stream)
+
+        if len(self.__stores_for_writing) == 0:
+            raise McMultipleStoresStoreException("List of stores for writing object ID %d is empty." % object_id)
+
+        spooled_stream = None
+        if len(self.__stores_for_writing) > 1:
+            spooled_stream = tempfile.SpooledTemporaryFile(max_size=self.__STORE_STREAM_MAX_MEMORY_SIZE)
+            shutil.copyfileobj(stream, spooled_stream)
+
+        last_store_path = None
+
+        try:
+            for store in self.__stores_for_writing:
+
+                if spooled_stream is not None:
+                    spooled_stream.seek(0)
+                    stream = spooled_stream
+
+                try:
+                    # MC_REWRITE_TO_PYTHON: use named parameters after Python rewrite
+                    last_store_path = store.store_stream(db, object_id, stream)
+                    if last_store_path is None:
+                        raise McMultipleStoresStoreException(
+                            "Storing object ID %d to %s succeeded, but the returned path is empty." % (
+                                object_id, store,
+                            )
+                        )
+
+                except Exception as ex:
+                    raise McMultipleStoresStoreException(
+                        "Error while saving object ID %(object_id)d to store %(store)s: %(exception)s" % {
+                            'object_id': object_id,
+                            'store': str(store),
+                            'exception': str(ex)
+                        }
+                    )
+
+        finally:
+            if spooled_stream is not None:
+                spooled_stream.close()
+
+        return last_store_path
+
     def remove_content(self, db: DatabaseHandler, object_id: int, object_path: str = None) -> None:
         """Remove content from all stores; raise if one of them fails."""
 
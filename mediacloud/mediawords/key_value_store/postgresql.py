@@ -1,9 +1,13 @@
-from typing import Union
+import io
+from typing import BinaryIO, Dict, List, Optional, Union
 
 from mediawords.db import DatabaseHandler
 from mediawords.key_value_store import KeyValueStore, McKeyValueStoreException
+from mediawords.util.log import create_logger
 from mediawords.util.perl import decode_object_from_bytes_if_needed
 
+log = create_logger(__name__)
+
 
 class McPostgreSQLStoreException(McKeyValueStoreException):
     """PostgreSQL key-value store exception."""
@@ -11,7 +15,10 @@ class McPostgreSQLStoreException(McKeyValueStoreException):
 
 
 class PostgreSQLStore(KeyValueStore):
-    """PostgreSQL BYTEA key-value store"""
+    """PostgreSQL BYTEA key-value store
+
+    BYTEA values get read and written whole, so streams get (un)compressed on the fly but the compressed object still
+    gets held in memory."""
 
     # Default object compression method
     _DEFAULT_COMPRESSION_METHOD = KeyValueStore.Compression.GZIP
@@ -19,10 +26,19 @@ class PostgreSQLStore(KeyValueStore):
     __slots__ = [
         '__table',
         '__compression_method',
+
+        # Zstandard dictionary to compress objects with (if any)
+        '__compression_dictionary',
     ]
 
-    def __init__(self, table: str, compression_method: KeyValueStore.Compression = _DEFAULT_COMPRESSION_METHOD):
-        """Constructor."""
+    def __init__(self,
+                 table: str,
+                 compression_method: KeyValueStore.Compression = _DEFAULT_COMPRESSION_METHOD,
+                 compression_dictionary: Optional[bytes] = None):
+        """Constructor.
+
+        Objects get compressed with "compression_method" (and with Zstandard dictionary "compression_dictionary" if it's
+        set); the dictionary has to be kept around for as long as there are objects compressed with it."""
 
         table = decode_object_from_bytes_if_needed(table)
 
@@ -36,8 +52,13 @@ class PostgreSQLStore(KeyValueStore):
         if not self._compression_method_is_valid(compression_method):
             raise McPostgreSQLStoreException("Unsupported compression method: %s" % compression_method)
 
+        if not self._compression_dictionary_is_valid(compression_method=compression_method,
+                                                     compression_dictionary=compression_dictionary):
+            raise McPostgreSQLStoreException("Compression dictionary is only supported with Zstandard compression.")
+
         self.__table = table
         self.__compression_method = compression_method
+        self.__compression_dictionary = compression_dictionary
 
     def fetch_content(self, db: DatabaseHandler, object_id: int, object_path: str = None) -> bytes:
         """Read object from PostgreSQL table."""
@@ -54,7 +75,67 @@ class PostgreSQLStore(KeyValueStore):
             # Clients are expected to do content_exists() before attempting to fetch content that might not exist
             raise McPostgreSQLStoreException("Object with ID %d was not found." % object_id)
 
-        content = content['raw_data']
+        return self.__uncompress_raw_data(object_id=object_id, raw_data=content['raw_data'])
+
+    def fetch_stream(self, db: DatabaseHandler, object_id: int, object_path: str = None) -> BinaryIO:
+        """Read object from PostgreSQL table, uncompress it while it's being read from the returned stream."""
+
+        object_id = self._prepare_object_id(object_id)
+
+        sql = "SELECT raw_data "
+        sql += "FROM %s " % self.__table  # interpolated by Python
+        sql += "WHERE object_id = %(object_id)s"  # interpolated by psycopg2
+
+        content = db.query(sql, {'object_id': object_id}).hash()
+
+        if content is None or len(content) == 0:
+            raise McPostgreSQLStoreException("Object with ID %d was not found." % object_id)
+
+        raw_data = self.__raw_data_to_bytes(object_id=object_id, raw_data=content['raw_data'])
+
+        try:
+            stream = self._uncompress_stream_for_method(stream=io.BytesIO(raw_data),
+                                                        compression_method=self.__compression_method,
+                                                        compression_dictionary=self.__compression_dictionary)
+        except Exception as ex:
+            raise McPostgreSQLStoreException("Unable to uncompress data for object ID %d: %s" % (object_id, str(ex),))
+
+        return stream
+
+    def fetch_contents(self,
+                       db: DatabaseHandler,
+                       object_ids: List[int],
+                       object_paths: Optional[Dict[int, str]] = None) -> Dict[int, bytes]:
+        """Read multiple objects from PostgreSQL table with a single query; objects that fail to get uncompressed are
+        left out."""
+
+        object_ids = self._prepare_object_ids(object_ids)
+
+        if len(object_ids) == 0:
+            return {}
+
+        sql = "SELECT object_id, raw_data "
+        sql += "FROM %s " % self.__table  # interpolated by Python
+        sql += "WHERE object_id = ANY(%(object_ids)s::BIGINT[])"  # interpolated by psycopg2
+
+        rows = db.query(sql, {'object_ids': object_ids}).hashes()
+
+        contents = {}
+        for row in rows:
+            object_id = int(row['object_id'])
+            try:
+                contents[object_id] = self.__uncompress_raw_data(object_id=object_id, raw_data=row['raw_data'])
+            except Exception as ex:
+                # Don't fail the whole batch because of a single broken object
+                log.warning("Unable to fetch object ID %d: %s" % (object_id, str(ex),))
+
+        return contents
+
+    @staticmethod
+    def __raw_data_to_bytes(object_id: int, raw_data: Union[bytes, memoryview, list]) -> bytes:
+        """Return "raw_data" column's value as bytes."""
+
+        content = raw_data
 
         # MC_REWRITE_TO_PYTHON: Perl database handler returns value as array of bytes
         if isinstance(content, list):
@@ -66,8 +147,17 @@ class PostgreSQLStore(KeyValueStore):
         if not isinstance(content, bytes):
             raise McPostgreSQLStoreException("Content is not bytes for object %d." % object_id)
 
+        return content
+
+    def __uncompress_raw_data(self, object_id: int, raw_data: Union[bytes, memoryview, list]) -> bytes:
+        """Uncompress "raw_data" column's value."""
+
+        content = self.__raw_data_to_bytes(object_id=object_id, raw_data=raw_data)
+
         try:
-            content = self._uncompress_data_for_method(data=content, compression_method=self.__compression_method)
+            content = self._uncompress_data_for_method(data=content,
+                                                       compression_method=self.__compression_method,
+                                                       compression_dictionary=self.__compression_dictionary)
         except Exception as ex:
             raise McPostgreSQLStoreException("Unable to uncompress data for object ID %d: %s" % (object_id, str(ex),))
 
@@ -85,7 +175,9 @@ class PostgreSQLStore(KeyValueStore):
         content = self._prepare_content(content)
 
         try:
-            content = self._compress_data_for_method(data=content, compression_method=self.__compression_method)
+            content = self._compress_data_for_method(data=content,
+                                                     compression_method=self.__compression_method,
+                                                     compression_dictionary=self.__compression_dictionary)
         except Exception as ex:
             raise McPostgreSQLStoreException("Unable to compress data for object ID %d: %s" % (object_id, str(ex),))
 
@@ -94,13 +186,36 @@ class PostgreSQLStore(KeyValueStore):
         if not isinstance(content, bytes):
             raise McPostgreSQLStoreException("Content is not bytes after compression for object ID %d" % object_id)
 
+        return self.__store_raw_data(db=db, object_id=object_id, raw_data=content)
+
+    def store_stream(self, db: DatabaseHandler, object_id: int, stream: BinaryIO) -> str:
+        """Write object to PostgreSQL table, compressing it while it's being read from the stream."""
+
+        object_id = self._prepare_object_id(object_id)
+        stream = self._prepare_stream(stream)
+
+        try:
+            content = self._compress_stream_for_method(stream=stream,
+                                                       compression_method=self.__compression_method,
+                                                       compression_dictionary=self.__compression_dictionary).read()
+        except Exception as ex:
+            raise McPostgreSQLStoreException("Unable to compress data for object ID %d: %s" % (object_id, str(ex),))
+
+        if not isinstance(content, bytes):
+            raise McPostgreSQLStoreException("Content is not bytes after compression for object ID %d" % object_id)
+
+        return self.__store_raw_data(db=db, object_id=object_id, raw_data=content)
+
+    def __store_raw_data(self, db: DatabaseHandler, object_id: int, raw_data: bytes) -> str:
+        """Write (compressed) "raw_data" column's value, return path."""
+
         sql = "INSERT INTO %s " % self.__table  # interpolated by Python
         sql += "(object_id, raw_data) "
         sql += "VALUES (%(object_id)s, %(raw_data)s) "  # interpolated by psycopg2
         sql += "ON CONFLICT (object_id) DO UPDATE "
         sql += "    SET raw_data = EXCLUDED.raw_data"
 
-        db.query(sql, {'object_id': object_id, 'raw_data': content})
+        db.query(sql, {'object_id': object_id, 'raw_data': raw_data})
 
         path = 'postgresql:%s' % self.__table
 
@@ -27,3 +27,9 @@ class TestAmazonS3StoreTestCase(TestAmazonS3CredentialsTestCase):
 
     def test_key_value_store(self):
         self._test_key_value_store()
+
+    def test_fetch_contents(self):
+        self._test_fetch_contents()
+
+    def test_stream(self):
+        self._test_stream()
@@ -28,3 +28,9 @@ class TestCachedAmazonS3StoreTestCase(TestAmazonS3CredentialsTestCase):
 
     def test_key_value_store(self):
         self._test_key_value_store()
+
+    def test_fetch_contents(self):
+        self._test_fetch_contents()
+
+    def test_stream(self):
+        self._test_stream()
@@ -0,0 +1,95 @@
+import io
+
+import pytest
+
+from mediawords.key_value_store import KeyValueStore
+from mediawords.util.compress import gzip, bzip2, zstd, train_zstd_dictionary, McCompressException
+
+
+def test_compression_methods():
+    data = 'Media Cloud - pnoןɔ ɐıpǝɯ'.encode('utf-8')
+
+    for method in KeyValueStore.Compression:
+        compressed_data = KeyValueStore._compress_data_for_method(data=data, compression_method=method)
+        assert KeyValueStore._uncompress_data_for_method(data=compressed_data, compression_method=method) == data
+
+
+def test_uncompress_detects_compression_method():
+    data = b'{"foo": "bar"}'
+
+    # Objects stored with any compression method are readable after switching store's compression method
+    for compressed_data in [gzip(data), bzip2(data), zstd(data)]:
+        for method in [KeyValueStore.Compression.GZIP,
+                       KeyValueStore.Compression.BZIP2,
+                       KeyValueStore.Compression.ZSTD]:
+            assert KeyValueStore._uncompress_data_for_method(data=compressed_data, compression_method=method) == data
+
+    # Uncompressed stores don't try to detect anything
+    assert KeyValueStore._uncompress_data_for_method(
+        data=gzip(data),
+        compression_method=KeyValueStore.Compression.NONE,
+    ) == gzip(data)
+
+    # Data with no known magic bytes gets uncompressed with store's method
+    with pytest.raises(McCompressException):
+        KeyValueStore._uncompress_data_for_method(data=data, compression_method=KeyValueStore.Compression.GZIP)
+
+
+def test_compression_dictionary():
+    samples = [('{"stories_id": %d, "label": "politics and government"}' % x).encode('utf-8') for x in range(1000)]
+    dictionary = train_zstd_dictionary(samples=samples, dictionary_size=4096)
+
+    assert KeyValueStore._compression_dictionary_is_valid(
+        compression_method=KeyValueStore.Compression.ZSTD,
+        compression_dictionary=dictionary,
+    ) is True
+    assert KeyValueStore._compression_dictionary_is_valid(
+        compression_method=KeyValueStore.Compression.GZIP,
+        compression_dictionary=dictionary,
+    ) is False
+
+    data = b'{"stories_id": 12345, "label": "politics and government"}'
+    compressed_data = KeyValueStore._compress_data_for_method(data=data,
+                                                              compression_method=KeyValueStore.Compression.ZSTD,
+                                                              compression_dictionary=dictionary)
+    assert KeyValueStore._uncompress_data_for_method(data=compressed_data,
+                                                     compression_method=KeyValueStore.Compression.ZSTD,
+                                                     compression_dictionary=dictionary) == data
+
+
+def test_compression_stream_methods():
+    data = 'Media Cloud - pnoןɔ ɐıpǝɯ'.encode('utf-8') * 10000
+
+    for method in KeyValueStore.Compression:
+        compressed_data = KeyValueStore._compress_stream_for_method(stream=io.BytesIO(data),
+                                                                    compression_method=method).read()
+
+        # Streams are compatible with non-streaming compression
+        assert KeyValueStore._uncompress_data_for_method(data=compressed_data, compression_method=method) == data
+
+        uncompressed_stream = KeyValueStore._uncompress_stream_for_method(stream=io.BytesIO(compressed_data),
+                                                                          compression_method=method)
+        assert uncompressed_stream.read() == data
+
+    # Compression method gets detected from the stream too
+    for compressed_data in [gzip(data), bzip2(data), zstd(data)]:
+        uncompressed_stream = KeyValueStore._uncompress_stream_for_method(
+            stream=io.BytesIO(compressed_data),
+            compression_method=KeyValueStore.Compression.GZIP,
+        )
+        assert uncompressed_stream.read() == data
+
+    # Uncompressed stores don't try to detect anything
+    uncompressed_stream = KeyValueStore._uncompress_stream_for_method(stream=io.BytesIO(gzip(data)),
+                                                                      compression_method=KeyValueStore.Compression.NONE)
+    assert uncompressed_stream.read() == gzip(data)
+
+    with pytest.raises(McCompressException):
+        KeyValueStore._uncompress_stream_for_method(stream=io.BytesIO(data),
+                                                    compression_method=KeyValueStore.Compression.GZIP).read()
+
+    # Closing uncompressed stream closes the source stream
+    source = io.BytesIO(gzip(data))
+    KeyValueStore._uncompress_stream_for_method(stream=source,
+                                                compression_method=KeyValueStore.Compression.GZIP).close()
+    assert source.closed is True
@@ -35,3 +35,16 @@ class TestDatabaseInlineStoreTestCase(TestKeyValueStoreTestCase):
         assert self.store().content_exists(db=self.db(),
                                            object_id=self._TEST_OBJECT_ID,
                                            object_path=test_content_path) is True
+
+    def test_fetch_contents(self):
+        test_content_path = '%s%s' % (self._expected_path_prefix(), self._TEST_CONTENT_UTF_8_STRING,)
+
+        contents = self.store().fetch_contents(
+            db=self.db(),
+            object_ids=[self._TEST_OBJECT_ID, self._TEST_OBJECT_ID_NONEXISTENT],
+            object_paths={
+                self._TEST_OBJECT_ID: test_content_path,
+                self._TEST_OBJECT_ID_NONEXISTENT: 'postgresql:raw_downloads',
+            },
+        )
+        assert contents == {self._TEST_OBJECT_ID: self._TEST_CONTENT_UTF_8}
@@ -0,0 +1,212 @@
+import concurrent.futures
+import io
+import os
+import shutil
+import tempfile
+from typing import Union
+
+import pytest
+
+from mediawords.db import DatabaseHandler
+from mediawords.key_value_store import KeyValueStore, McKeyValueStoreException
+from mediawords.key_value_store.disk_cached import DiskCachedStore, McDiskCachedStoreException
+from mediawords.key_value_store.postgresql import PostgreSQLStore
+from mediawords.key_value_store.test_mock_download import TestMockDownloadTestCase
+
+
+class TestDiskCachedStoreTestCase(TestMockDownloadTestCase):
+    __slots__ = [
+        '__cache_directory',
+    ]
+
+    def setUp(self):
+        self.__cache_directory = tempfile.mkdtemp()
+        super().setUp()
+
+    def tearDown(self):
+        super().tearDown()
+        shutil.rmtree(self.__cache_directory)
+
+    def _initialize_store(self) -> DiskCachedStore:
+        return DiskCachedStore(store=PostgreSQLStore(table='raw_downloads'), cache_directory=self.__cache_directory)
+
+    def _expected_path_prefix(self) -> str:
+        return 'postgresql:'
+
+    def test_key_value_store(self):
+        self._test_key_value_store()
+
+    def test_fetch_contents(self):
+        self._test_fetch_contents()
+
+    def test_stream(self):
+        self._test_stream()
+
+
+class _MemoryStore(KeyValueStore):
+    """In-memory store which counts fetches."""
+
+    def __init__(self):
+        self.objects = {}
+        self.fetches = 0
+
+    def fetch_content(self, db: DatabaseHandler, object_id: int, object_path: str = None) -> bytes:
+        self.fetches += 1
+        if object_id not in self.objects:
+            raise McKeyValueStoreException("Object ID %d was not found." % object_id)
+        return self.objects[object_id]
+
+    def store_content(self, db: DatabaseHandler, object_id: int, content: Union[str, bytes]) -> str:
+        self.objects[object_id] = self._prepare_content(content)
+        return 'memory:'
+
+    def remove_content(self, db: DatabaseHandler, object_id: int, object_path: str = None) -> None:
+        self.objects.pop(object_id, None)
+
+    def content_exists(self, db: DatabaseHandler, object_id: int, object_path: str = None) -> bool:
+        return object_id in self.objects
+
+
+def test_disk_cached_store_hits():
+    cache_directory = tempfile.mkdtemp()
+
+    backing_store = _MemoryStore()
+    backing_store.objects = {1: b'foo', 2: b'bar'}
+
+    store = DiskCachedStore(store=backing_store, cache_directory=cache_directory)
+
+    assert store.fetch_content(db=None, object_id=1) == b'foo'
+    assert store.fetch_content(db=None, object_id=1) == b'foo'
+    assert backing_store.fetches == 1
+
+    assert store.fetch_contents(db=None, object_ids=[1, 2, 3]) == {1: b'foo', 2: b'bar'}
+    assert store.fetch_contents(db=None, object_ids=[1, 2]) == {1: b'foo', 2: b'bar'}
+
+    stats = store.stats()
+    assert stats['hits'] == 4
+    assert stats['misses'] == 3
+    assert stats['writes'] == 2
+
+    # Write-through
+    store.store_content(db=None, object_id=3, content=b'baz')
+    assert store.fetch_content(db=None, object_id=3) == b'baz'
+    assert store.stats()['hits'] == 5
+
+    # Cache gets shared with other instances (e.g. other processes)
+    other_store = DiskCachedStore(store=_MemoryStore(), cache_directory=cache_directory)
+    assert other_store.fetch_content(db=None, object_id=3) == b'baz'
+
+    store.remove_content(db=None, object_id=3)
+    assert other_store.content_exists(db=None, object_id=3) is False
+    with pytest.raises(McKeyValueStoreException):
+        other_store.fetch_content(db=None, object_id=3)
+
+    shutil.rmtree(cache_directory)
+
+
+def test_disk_cached_store_eviction():
+    cache_directory = tempfile.mkdtemp()
+
+    backing_store = _MemoryStore()
+    backing_store.objects = {object_id: b'x' * 100 for object_id in range(1, 21)}
+
+    store = DiskCachedStore(store=backing_store, cache_directory=cache_directory, max_size=1000)
+
+    for object_id in range(1, 11):
+        store.fetch_content(db=None, object_id=object_id)
+
+    # Make object 1 the least recently used one and object 2 the most recently used one
+    for object_id in range(1, 11):
+        os.utime(os.path.join(cache_directory, '%02x' % object_id, str(object_id)), (object_id, object_id,))
+    store.fetch_content(db=None, object_id=2)
+
+    assert store.evict() == 0
+
+    store.fetch_content(db=None, object_id=11)
+
+    # Cache is over its max. size already after the write
+    assert store.stats()['size'] <= 900
+    assert store.stats()['evictions'] == 2
+
+    fetches = backing_store.fetches
+    store.fetch_content(db=None, object_id=2)
+    assert backing_store.fetches == fetches
+
+    store.fetch_content(db=None, object_id=1)
+    assert backing_store.fetches == fetches + 1
+
+    with pytest.raises(McDiskCachedStoreException):
+        DiskCachedStore(store=backing_store, cache_directory=cache_directory, max_size=0)
+
+    shutil.rmtree(cache_directory)
+
+
+def test_disk_cached_store_streams():
+    cache_directory = tempfile.mkdtemp()
+
+    backing_store = _MemoryStore()
+    backing_store.objects = {1: os.urandom(200 * 1024)}
+
+    store = DiskCachedStore(store=backing_store, cache_directory=cache_directory)
+
+    with store.fetch_stream(db=None, object_id=1) as stream:
+        assert stream.read() == backing_store.objects[1]
+    with store.fetch_stream(db=None, object_id=1) as stream:
+        assert stream.read() == backing_store.objects[1]
+    assert backing_store.fetches == 1
+    assert store.stats()['hits'] == 1
+
+    # Write-through
+    content = os.urandom(200 * 1024)
+    assert store.store_stream(db=None, object_id=2, stream=io.BytesIO(content)) == 'memory:'
+    assert backing_store.objects[2] == content
+    with store.fetch_stream(db=None, object_id=2) as stream:
+        assert stream.read() == content
+    assert backing_store.fetches == 1
+
+    # Overwritten object doesn't get served from cache
+    store.store_content(db=None, object_id=2, content=b'foo')
+    assert store.fetch_stream(db=None, object_id=2).read() == b'foo'
+    store.store_stream(db=None, object_id=2, stream=io.BytesIO(b'bar'))
+    assert store.fetch_content(db=None, object_id=2) == b'bar'
+
+    with pytest.raises(McKeyValueStoreException):
+        store.fetch_stream(db=None, object_id=3)
+
+    # No temporary files left behind
+    for shard in os.scandir(cache_directory):
+        if shard.is_dir():
+            assert not [entry.name for entry in os.scandir(shard.path) if entry.name.startswith('.tmp-')]
+
+    shutil.rmtree(cache_directory)
+
+
+def _fetch_objects_in_process(cache_directory: str, object_count: int, rounds: int) -> int:
+    """Fetch objects through a small disk cache; return number of objects with unexpected content."""
+    backing_store = _MemoryStore()
+    backing_store.objects = {object_id: str(object_id).encode() * 1000 for object_id in range(1, object_count + 1)}
+
+    store = DiskCachedStore(store=backing_store, cache_directory=cache_directory, max_size=object_count * 1000)
+
+    unexpected_count = 0
+    for _ in range(rounds):
+        for object_id in range(1, object_count + 1):
+            if store.fetch_content(db=None, object_id=object_id) != backing_store.objects[object_id]:
+                unexpected_count += 1
+
+    return unexpected_count
+
+
+def test_disk_cached_store_multiple_processes():
+    cache_directory = tempfile.mkdtemp()
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=4) as executor:
+        futures = [executor.submit(_fetch_objects_in_process, cache_directory, 50, 10) for _ in range(4)]
+        assert [future.result() for future in futures] == [0, 0, 0, 0]
+
+    # No temporary files left behind
+    for shard in os.scandir(cache_directory):
+        if shard.is_dir():
+            assert not [entry.name for entry in os.scandir(shard.path) if entry.name.startswith('.tmp-')]
+
+    shutil.rmtree(cache_directory)
@@ -1,4 +1,6 @@
 import abc
+import io
+import os
 
 import pytest
 
@@ -121,3 +123,62 @@ class TestKeyValueStoreTestCase(TestDatabaseWithSchemaTestCase, metaclass=abc.AB
             self.store().fetch_content(db=self.db(),
                                        object_id=self._TEST_OBJECT_ID,
                                        object_path=path)
+
+    def _test_fetch_contents(self):
+        """Test fetch_contents()."""
+
+        assert self.store().fetch_contents(db=self.db(), object_ids=[]) == {}
+
+        self.store().store_content(db=self.db(),
+                                   object_id=self._TEST_OBJECT_ID,
+                                   content=self._TEST_CONTENT_UTF_8)
+
+        # Nonexistent objects are left out; duplicate IDs are fetched once
+        contents = self.store().fetch_contents(
+            db=self.db(),
+            object_ids=[self._TEST_OBJECT_ID, self._TEST_OBJECT_ID_NONEXISTENT, self._TEST_OBJECT_ID],
+        )
+        assert contents == {self._TEST_OBJECT_ID: self._TEST_CONTENT_UTF_8}
+
+        # Second fetch might get served from the cache
+        contents = self.store().fetch_contents(db=self.db(), object_ids=[self._TEST_OBJECT_ID])
+        assert contents == {self._TEST_OBJECT_ID: self._TEST_CONTENT_UTF_8}
+
+        self.store().remove_content(db=self.db(), object_id=self._TEST_OBJECT_ID)
+
+        contents = self.store().fetch_contents(db=self.db(), object_ids=[self._TEST_OBJECT_ID])
+        assert contents == {}
+
+    def _test_stream(self):
+        """Test fetch_stream(), store_stream()."""
+
+        # Larger than a single chunk that streams get read in
+        content = os.urandom(100 * 1024) + self._TEST_CONTENT_UTF_8 * 10 * 1024
+
+        # Nonexistent item
+        with pytest.raises(McKeyValueStoreException):
+            self.store().fetch_stream(db=self.db(), object_id=self._TEST_OBJECT_ID_NONEXISTENT)
+
+        path = self.store().store_stream(db=self.db(), object_id=self._TEST_OBJECT_ID, stream=io.BytesIO(content))
+        assert path is not None
+        assert path.startswith(self._expected_path_prefix())
+
+        stream = self.store().fetch_stream(db=self.db(), object_id=self._TEST_OBJECT_ID, object_path=path)
+        assert stream.read() == content
+        stream.close()
+
+        # Streamed objects are readable without streaming and vice versa
+        assert self.store().fetch_content(db=self.db(), object_id=self._TEST_OBJECT_ID, object_path=path) == content
+
+        self.store().store_content(db=self.db(), object_id=self._TEST_OBJECT_ID, content=self._TEST_CONTENT_UTF_8)
+        with self.store().fetch_stream(db=self.db(), object_id=self._TEST_OBJECT_ID) as stream:
+            assert stream.read() == self._TEST_CONTENT_UTF_8
+
+        # Overwrite with a stream
+        self.store().store_stream(db=self.db(), object_id=self._TEST_OBJECT_ID, stream=io.BytesIO(content))
+        assert self.store().fetch_content(db=self.db(), object_id=self._TEST_OBJECT_ID) == content
+
+        self.store().remove_content(db=self.db(), object_id=self._TEST_OBJECT_ID)
+
+        with pytest.raises(McKeyValueStoreException):
+            self.store().fetch_stream(db=self.db(), object_id=self._TEST_OBJECT_ID)
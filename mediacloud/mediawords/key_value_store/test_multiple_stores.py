@@ -1,7 +1,18 @@
+import io
+import os
+import time
+from typing import Union
+
 import pytest
 
+from mediawords.db import DatabaseHandler
+from mediawords.key_value_store import KeyValueStore, McKeyValueStoreException
 from mediawords.key_value_store.amazon_s3 import AmazonS3Store
-from mediawords.key_value_store.multiple_stores import MultipleStoresStore
+from mediawords.key_value_store.multiple_stores import (
+    LatencyHistogram,
+    MultipleStoresStore,
+    McMultipleStoresStoreException,
+)
 from mediawords.key_value_store.postgresql import PostgreSQLStore
 from mediawords.key_value_store.test_amazon_s3_credentials import (
     TestAmazonS3CredentialsTestCase,
@@ -36,3 +47,195 @@ class TestMultipleStoresStoreTestCase(TestAmazonS3CredentialsTestCase, TestMockD
 
     def test_key_value_store(self):
         self._test_key_value_store()
+
+    def test_fetch_contents(self):
+        self._test_fetch_contents()
+
+    def test_stream(self):
+        self._test_stream()
+
+
+class _SlowStore(KeyValueStore):
+    """In-memory store which takes a set amount of time to fetch objects."""
+
+    def __init__(self, objects: dict, delay: float, uses_database: bool = False):
+        self.objects = objects
+        self.delay = delay
+        self.fetches = 0
+        self.__uses_database = uses_database
+
+    def uses_database(self) -> bool:
+        return self.__uses_database
+
+    def fetch_content(self, db: DatabaseHandler, object_id: int, object_path: str = None) -> bytes:
+        self.fetches += 1
+        time.sleep(self.delay)
+        if object_id not in self.objects:
+            raise McKeyValueStoreException("Object ID %d was not found." % object_id)
+        return self.objects[object_id]
+
+    def store_content(self, db: DatabaseHandler, object_id: int, content: Union[str, bytes]) -> str:
+        self.objects[object_id] = self._prepare_content(content)
+        return 'slow:'
+
+    def remove_content(self, db: DatabaseHandler, object_id: int, object_path: str = None) -> None:
+        self.objects.pop(object_id, None)
+
+    def content_exists(self, db: DatabaseHandler, object_id: int, object_path: str = None) -> bool:
+        return object_id in self.objects
+
+
+def test_latency_histogram():
+    histogram = LatencyHistogram()
+    assert histogram.percentile(50) is None
+
+    for _ in range(90):
+        histogram.add(0.01)
+    for _ in range(10):
+        histogram.add(1)
+
+    assert histogram.count() == 100
+    assert 0.01 <= histogram.percentile(50) < 0.015
+    assert 1 <= histogram.percentile(95) < 1.5
+
+    stats = histogram.stats()
+    assert stats['count'] == 100
+    assert stats['p99'] == histogram.percentile(99)
+
+
+def test_hedged_reads():
+    primary_store = _SlowStore(objects={1: b'foo'}, delay=0.001)
+    secondary_store = _SlowStore(objects={1: b'bar'}, delay=0.1)
+
+    store = MultipleStoresStore(stores_for_reading=[primary_store, secondary_store],
+                                stores_for_writing=[primary_store, secondary_store],
+                                hedge_percentile=90,
+                                max_hedged_fraction=0.5)
+
+    assert store.uses_database() is False
+
+    # Collect primary store's latencies
+    for _ in range(50):
+        assert store.fetch_content(db=None, object_id=1) == b'foo'
+    hedged_reads = store.read_stats()['hedged_reads']
+
+    # Primary store gets slow, secondary store wins
+    primary_store.delay = 1
+    secondary_store.delay = 0.001
+    start_time = time.time()
+    assert store.fetch_content(db=None, object_id=1) == b'bar'
+    assert time.time() - start_time < 0.5
+
+    stats = store.read_stats()
+    assert stats['reads'] == 51
+    assert stats['hedged_reads'] == hedged_reads + 1
+    assert stats['stores'][0]['count'] == 50
+    assert stats['stores'][1]['count'] >= 1
+
+    # Object missing from primary store gets read from the secondary one
+    primary_store.delay = 0.001
+    secondary_store.objects[2] = b'baz'
+    assert store.fetch_content(db=None, object_id=2) == b'baz'
+
+    with pytest.raises(McMultipleStoresStoreException):
+        store.fetch_content(db=None, object_id=3)
+
+
+def test_hedged_reads_cap():
+    primary_store = _SlowStore(objects={1: b'foo'}, delay=0.001)
+    secondary_store = _SlowStore(objects={1: b'bar'}, delay=0.001)
+
+    store = MultipleStoresStore(stores_for_reading=[primary_store, secondary_store],
+                                stores_for_writing=[primary_store, secondary_store],
+                                hedge_percentile=90,
+                                max_hedged_fraction=0.01)
+
+    for _ in range(50):
+        store.fetch_content(db=None, object_id=1)
+
+    # Extra requests would exceed 1% of all reads so primary store gets waited for
+    primary_store.delay = 0.2
+    assert store.fetch_content(db=None, object_id=1) == b'foo'
+    assert store.read_stats()['hedged_reads'] == 0
+    assert secondary_store.fetches == 0
+
+
+def test_hedged_reads_database_store():
+    database_store = _SlowStore(objects={}, delay=0.001, uses_database=True)
+    other_store = _SlowStore(objects={1: b'bar'}, delay=0.001)
+
+    store = MultipleStoresStore(stores_for_reading=[other_store, database_store],
+                                stores_for_writing=[other_store, database_store],
+                                hedge_percentile=90,
+                                max_hedged_fraction=0.5)
+
+    assert store.uses_database() is True
+
+    # Background fetch gets waited for if the store that uses the database handler fails
+    for _ in range(50):
+        assert store.fetch_content(db=None, object_id=1) == b'bar'
+
+    # Store that uses the database handler gets queried in the calling thread while the slow one keeps running
+    database_store.objects[1] = b'foo'
+    other_store.delay = 1
+    start_time = time.time()
+    assert store.fetch_content(db=None, object_id=1) == b'foo'
+    assert time.time() - start_time < 0.5
+
+    # Without hedging, stores get queried one after another
+    other_store.delay = 0.001
+    sequential_store = MultipleStoresStore(stores_for_reading=[database_store, other_store],
+                                           stores_for_writing=[database_store, other_store])
+    assert sequential_store.fetch_content(db=None, object_id=1) == b'foo'
+    assert sequential_store.read_stats()['hedged_reads'] == 0
+
+    with pytest.raises(McMultipleStoresStoreException):
+        MultipleStoresStore(stores_for_reading=[database_store], stores_for_writing=[], hedge_percentile=100)
+
+
+def test_hedged_reads_failing_store():
+    slow_store = _SlowStore(objects={1: b'foo'}, delay=0.001)
+    failing_store = _SlowStore(objects={}, delay=0.1)
+    fast_store = _SlowStore(objects={1: b'bar'}, delay=0.1)
+
+    store = MultipleStoresStore(stores_for_reading=[slow_store, failing_store, fast_store],
+                                stores_for_writing=[slow_store, failing_store, fast_store],
+                                hedge_percentile=90,
+                                max_hedged_fraction=0.5)
+
+    for _ in range(50):
+        assert store.fetch_content(db=None, object_id=1) == b'foo'
+
+    # Third store gets queried as soon as the second one fails instead of waiting for the first one
+    slow_store.delay = 1
+    failing_store.delay = 0.001
+    fast_store.delay = 0.001
+    start_time = time.time()
+    assert store.fetch_content(db=None, object_id=1) == b'bar'
+    assert time.time() - start_time < 0.5
+
+    # Failed fetches get their latencies recorded too
+    failing_store_stats = store.read_stats()['stores'][1]
+    assert failing_store_stats['count'] >= 1
+
+
+def test_store_stream_to_multiple_stores():
+    first_store = _SlowStore(objects={}, delay=0)
+    second_store = _SlowStore(objects={}, delay=0)
+
+    store = MultipleStoresStore(stores_for_reading=[first_store, second_store],
+                                stores_for_writing=[first_store, second_store])
+
+    # Larger than what gets spooled in memory
+    content = os.urandom(20 * 1024 * 1024)
+
+    assert store.store_stream(db=None, object_id=1, stream=io.BytesIO(content)) == 'slow:'
+    assert first_store.objects[1] == content
+    assert second_store.objects[1] == content
+
+    second_store.objects[2] = b'foo'
+    with store.fetch_stream(db=None, object_id=2) as stream:
+        assert stream.read() == b'foo'
+
+    with pytest.raises(McMultipleStoresStoreException):
+        store.fetch_stream(db=None, object_id=3)
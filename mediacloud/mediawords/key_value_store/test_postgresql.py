@@ -11,3 +11,23 @@ class TestPostgreSQLStoreTestCase(TestMockDownloadTestCase):
 
     def test_key_value_store(self):
         self._test_key_value_store()
+
+    def test_fetch_contents(self):
+        self._test_fetch_contents()
+
+    def test_fetch_contents_broken_object(self):
+        self.store().store_content(db=self.db(), object_id=self._TEST_OBJECT_ID, content=self._TEST_CONTENT_UTF_8)
+
+        # Object that fails to uncompress gets left out instead of failing the whole fetch
+        self.db().query("""
+            UPDATE raw_downloads
+            SET raw_data = 'not compressed'
+            WHERE object_id = %(object_id)s
+        """, {'object_id': self._TEST_OBJECT_ID})
+
+        contents = self.store().fetch_contents(db=self.db(),
+                                               object_ids=[self._TEST_OBJECT_ID, self._TEST_OBJECT_ID_NONEXISTENT])
+        assert contents == {}
+
+    def test_stream(self):
+        self._test_stream()
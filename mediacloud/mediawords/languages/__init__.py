@@ -28,10 +28,6 @@ import os
 import re
 from typing import Dict, List
 
-from nltk import TweetTokenizer
-from sentence_splitter import SentenceSplitter
-from Stemmer import Stemmer as PyStemmer
-
 from mediawords.util.log import create_logger
 from mediawords.util.perl import decode_object_from_bytes_if_needed
 
@@ -109,7 +105,9 @@ class SpaceSeparatedWordsMixIn(AbstractLanguage, metaclass=abc.ABCMeta):
 
     def __init__(self):
         super().__init__()
-        self.__tokenizer = TweetTokenizer(preserve_case=False)
+
+        # TweetTokenizer instance (lazy initialized because importing "nltk" is slow)
+        self.__tokenizer = None
 
     def split_sentence_to_words(self, sentence: str) -> List[str]:
         """Splits a sentence into words using spaces (for Latin languages)."""
@@ -121,6 +119,10 @@ class SpaceSeparatedWordsMixIn(AbstractLanguage, metaclass=abc.ABCMeta):
         # Normalize apostrophe so that "it’s" and "it's" get treated identically
         sentence = sentence.replace("’", "'")
 
+        if self.__tokenizer is None:
+            from nltk import TweetTokenizer
+            self.__tokenizer = TweetTokenizer(preserve_case=False)
+
         tokens = self.__tokenizer.tokenize(text=sentence)
 
         def is_word(token_: str) -> bool:
@@ -159,6 +161,7 @@ class SentenceSplitterMixIn(AbstractLanguage, metaclass=abc.ABCMeta):
 
         if self.__sentence_splitter is None:
             try:
+                from sentence_splitter import SentenceSplitter
                 self.__sentence_splitter = SentenceSplitter(language=language_code)
             except Exception as ex:
                 raise McLanguageException(
@@ -257,6 +260,7 @@ class PyStemmerMixIn(AbstractLanguage, metaclass=abc.ABCMeta):
         if self.__pystemmer is None:
 
             try:
+                from Stemmer import Stemmer as PyStemmer
                 self.__pystemmer = PyStemmer(language_code)
             except Exception as ex:
                 raise McLanguageException(
@@ -1,27 +1,7 @@
-from typing import Union
+import importlib
+from typing import Type, Union
 
 from mediawords.languages import AbstractLanguage
-from mediawords.languages.ca import CatalanLanguage
-from mediawords.languages.da import DanishLanguage
-from mediawords.languages.de import GermanLanguage
-from mediawords.languages.en import EnglishLanguage
-from mediawords.languages.es import SpanishLanguage
-from mediawords.languages.fi import FinnishLanguage
-from mediawords.languages.fr import FrenchLanguage
-from mediawords.languages.ha import HausaLanguage
-from mediawords.languages.hi import HindiLanguage
-from mediawords.languages.hu import HungarianLanguage
-from mediawords.languages.it import ItalianLanguage
-from mediawords.languages.ja import JapaneseLanguage
-from mediawords.languages.lt import LithuanianLanguage
-from mediawords.languages.nl import DutchLanguage
-from mediawords.languages.no import NorwegianLanguage
-from mediawords.languages.pt import PortugueseLanguage
-from mediawords.languages.ro import RomanianLanguage
-from mediawords.languages.ru import RussianLanguage
-from mediawords.languages.sv import SwedishLanguage
-from mediawords.languages.tr import TurkishLanguage
-from mediawords.languages.zh import ChineseLanguage
 from mediawords.util.log import create_logger
 from mediawords.util.perl import decode_object_from_bytes_if_needed
 
@@ -31,31 +11,35 @@ log = create_logger(__name__)
 class LanguageFactory(object):
     """Language instance factory."""
 
-    # Supported + enabled language codes and their corresponding classes
+    # Supported + enabled language codes and their corresponding class names; language modules get imported only on
+    # first use because some of them load heavy dependencies (MeCab, jieba, Hunspell, ...)
     __ENABLED_LANGUAGES = {
-        CatalanLanguage.language_code(): CatalanLanguage,
-        ChineseLanguage.language_code(): ChineseLanguage,
-        DanishLanguage.language_code(): DanishLanguage,
-        DutchLanguage.language_code(): DutchLanguage,
-        EnglishLanguage.language_code(): EnglishLanguage,
-        FinnishLanguage.language_code(): FinnishLanguage,
-        FrenchLanguage.language_code(): FrenchLanguage,
-        GermanLanguage.language_code(): GermanLanguage,
-        HausaLanguage.language_code(): HausaLanguage,
-        HindiLanguage.language_code(): HindiLanguage,
-        HungarianLanguage.language_code(): HungarianLanguage,
-        ItalianLanguage.language_code(): ItalianLanguage,
-        JapaneseLanguage.language_code(): JapaneseLanguage,
-        LithuanianLanguage.language_code(): LithuanianLanguage,
-        NorwegianLanguage.language_code(): NorwegianLanguage,
-        PortugueseLanguage.language_code(): PortugueseLanguage,
-        RomanianLanguage.language_code(): RomanianLanguage,
-        RussianLanguage.language_code(): RussianLanguage,
-        SpanishLanguage.language_code(): SpanishLanguage,
-        SwedishLanguage.language_code(): SwedishLanguage,
-        TurkishLanguage.language_code(): TurkishLanguage,
+        'ca': 'mediawords.languages.ca.CatalanLanguage',
+        'zh': 'mediawords.languages.zh.ChineseLanguage',
+        'da': 'mediawords.languages.da.DanishLanguage',
+        'nl': 'mediawords.languages.nl.DutchLanguage',
+        'en': 'mediawords.languages.en.EnglishLanguage',
+        'fi': 'mediawords.languages.fi.FinnishLanguage',
+        'fr': 'mediawords.languages.fr.FrenchLanguage',
+        'de': 'mediawords.languages.de.GermanLanguage',
+        'ha': 'mediawords.languages.ha.HausaLanguage',
+        'hi': 'mediawords.languages.hi.HindiLanguage',
+        'hu': 'mediawords.languages.hu.HungarianLanguage',
+        'it': 'mediawords.languages.it.ItalianLanguage',
+        'ja': 'mediawords.languages.ja.JapaneseLanguage',
+        'lt': 'mediawords.languages.lt.LithuanianLanguage',
+        'no': 'mediawords.languages.no.NorwegianLanguage',
+        'pt': 'mediawords.languages.pt.PortugueseLanguage',
+        'ro': 'mediawords.languages.ro.RomanianLanguage',
+        'ru': 'mediawords.languages.ru.RussianLanguage',
+        'es': 'mediawords.languages.es.SpanishLanguage',
+        'sv': 'mediawords.languages.sv.SwedishLanguage',
+        'tr': 'mediawords.languages.tr.TurkishLanguage',
     }
 
+    # Default language code
+    __DEFAULT_LANGUAGE_CODE = 'en'
+
     # Static language object instances ({'language code': language object, ... })
     __language_instances = dict()
 
@@ -86,16 +70,30 @@ class LanguageFactory(object):
             return None
 
         if language_code not in LanguageFactory.__language_instances:
-            language_class = LanguageFactory.__ENABLED_LANGUAGES[language_code]
+            language_class = LanguageFactory.language_class_for_code(language_code)
             language = language_class()
             LanguageFactory.__language_instances[language_code] = language
 
         return LanguageFactory.__language_instances[language_code]
 
+    @staticmethod
+    def language_class_for_code(language_code: str) -> Union[Type[AbstractLanguage], None]:
+        """Return language class (importing its module) for the language code, None if language is not supported."""
+
+        language_code = decode_object_from_bytes_if_needed(language_code)
+
+        if not LanguageFactory.language_is_enabled(language_code):
+            return None
+
+        module_name, class_name = LanguageFactory.__ENABLED_LANGUAGES[language_code].rsplit('.', 1)
+        module = importlib.import_module(module_name)
+
+        return getattr(module, class_name)
+
     @staticmethod
     def default_language_code() -> str:
         """Return default language code ('en' for English)."""
-        return EnglishLanguage.language_code()
+        return LanguageFactory.__DEFAULT_LANGUAGE_CODE
 
     @staticmethod
     def default_language() -> AbstractLanguage:
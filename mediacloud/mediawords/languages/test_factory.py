@@ -35,3 +35,11 @@ class TestLanguageFactory(TestCase):
 
     def test_default_language(self):
         assert isinstance(LanguageFactory.default_language(), EnglishLanguage)
+
+    def test_language_class_for_code(self):
+        assert LanguageFactory.language_class_for_code('en') is EnglishLanguage
+        assert LanguageFactory.language_class_for_code('xx') is None
+
+        # Lazily imported classes have to match their language codes
+        for language_code in LanguageFactory.enabled_languages():
+            assert LanguageFactory.language_class_for_code(language_code).language_code() == language_code
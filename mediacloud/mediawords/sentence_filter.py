@@ -0,0 +1,168 @@
+"""Per-worker filter of recently seen duplicate sentences."""
+
+import collections
+import datetime
+import hashlib
+import os
+from typing import Dict, List, Optional, Tuple, Union
+
+from mediawords.util.config import get_config as py_get_config
+from mediawords.util.log import create_logger
+from mediawords.util.perl import decode_object_from_bytes_if_needed
+
+log = create_logger(__name__)
+
+
+class McRecentSentenceFilterException(Exception):
+    """Recent sentence filter exception."""
+    pass
+
+
+def sentence_week_start_date(publish_date: Union[str, datetime.date]) -> datetime.date:
+    """Return start date of the week of a story's publish date, the same way SQL's week_start_date() does."""
+    if isinstance(publish_date, datetime.datetime):
+        publish_date = publish_date.date()
+    elif not isinstance(publish_date, datetime.date):
+        publish_date = datetime.datetime.strptime(str(publish_date)[:10], '%Y-%m-%d').date()
+
+    return publish_date - datetime.timedelta(days=publish_date.weekday())
+
+
+def sentence_half_md5(sentence: str) -> bytes:
+    """Return first half of sentence's MD5 hash, the same way SQL's half_md5() does."""
+    return hashlib.md5(sentence.encode('utf-8', errors='replace')).digest()[:8]
+
+
+class RecentSentenceFilter(object):
+    """Bounded LRU set of (media_id, week_start_date, half_md5(sentence)) keys of sentences which were recently found to
+    be duplicates, i.e. which have an earlier sentence in "story_sentences" with is_dup = 't' set already.
+
+    Boilerplate sentences (bylines, footers, etc.) repeat within the same medium and week over and over again, so the
+    filter lets _insert_story_sentences() verify such likely duplicates with a read-only lookup instead of rewriting
+    is_dup = 't' of their original sentences every time. The filter is only a hint: likely duplicates still get
+    verified against the database, and sentences not in the filter get deduplicated as usual."""
+
+    # Default max. number of sentence keys to keep
+    DEFAULT_MAX_SIZE = 100 * 1000
+
+    __slots__ = [
+        '__max_size',
+
+        # Sentence keys in LRU order
+        '__keys',
+
+        # Number of sentences looked up
+        '__lookups',
+
+        # Number of sentences found in the filter
+        '__hits',
+
+        # Number of sentences found in the filter that turned out to be not duplicates anymore
+        '__stale_hits',
+
+        # Number of sentence keys evicted from the filter due to the max. size
+        '__evictions',
+    ]
+
+    def __init__(self, max_size: int = DEFAULT_MAX_SIZE):
+        """Constructor.
+
+        Arguments:
+        max_size - max. number of sentence keys to keep
+        """
+        if max_size < 1:
+            raise McRecentSentenceFilterException("Max. size must be positive.")
+
+        self.__max_size = max_size
+        self.__keys = collections.OrderedDict()
+
+        self.__lookups = 0
+        self.__hits = 0
+        self.__stale_hits = 0
+        self.__evictions = 0
+
+    @staticmethod
+    def __sentence_keys(media_id: int,
+                        publish_date: Union[str, datetime.date],
+                        sentences: List[str]) -> List[Tuple[int, datetime.date, bytes]]:
+        media_id = int(media_id)
+        week_start_date = sentence_week_start_date(publish_date)
+        return [(media_id, week_start_date, sentence_half_md5(sentence)) for sentence in sentences]
+
+    def likely_duplicates(self,
+                          media_id: int,
+                          publish_date: Union[str, datetime.date],
+                          sentences: List[str]) -> List[str]:
+        """Return sentences of a story that are likely to be duplicates of sentences already in the database."""
+        sentences = decode_object_from_bytes_if_needed(sentences)
+
+        likely_duplicates = []
+
+        keys = self.__sentence_keys(media_id=media_id, publish_date=publish_date, sentences=sentences)
+        for (sentence, key) in zip(sentences, keys):
+            self.__lookups += 1
+            if key in self.__keys:
+                self.__hits += 1
+                self.__keys.move_to_end(key)
+                likely_duplicates.append(sentence)
+
+        return likely_duplicates
+
+    def add_duplicates(self, media_id: int, publish_date: Union[str, datetime.date], sentences: List[str]) -> None:
+        """Add sentences of a story that were found to be duplicates (and got is_dup = 't' set on their originals)."""
+        sentences = decode_object_from_bytes_if_needed(sentences)
+
+        for key in self.__sentence_keys(media_id=media_id, publish_date=publish_date, sentences=sentences):
+            self.__keys[key] = True
+            self.__keys.move_to_end(key)
+
+        while len(self.__keys) > self.__max_size:
+            self.__keys.popitem(last=False)
+            self.__evictions += 1
+
+    def discard_stale(self, media_id: int, publish_date: Union[str, datetime.date], sentences: List[str]) -> None:
+        """Remove likely duplicates that turned out to be not duplicates anymore (e.g. their originals got deleted)."""
+        sentences = decode_object_from_bytes_if_needed(sentences)
+
+        for key in self.__sentence_keys(media_id=media_id, publish_date=publish_date, sentences=sentences):
+            if self.__keys.pop(key, None) is not None:
+                self.__stale_hits += 1
+
+    def stats(self) -> Dict[str, Union[int, float]]:
+        """Return filter's size and hit rate statistics."""
+        return {
+            'size': len(self.__keys),
+            'max_size': self.__max_size,
+            'lookups': self.__lookups,
+            'hits': self.__hits,
+            'stale_hits': self.__stale_hits,
+            'evictions': self.__evictions,
+            'hit_rate': self.__hits / self.__lookups if self.__lookups else 0.0,
+        }
+
+
+# Process-wide filter created from configuration: (PID, filter)
+__default_recent_sentence_filter = None
+
+
+def default_recent_sentence_filter() -> Optional[RecentSentenceFilter]:
+    """Return process-wide recent sentence filter if it's enabled in mediawords.yml, None otherwise.
+
+    Filter gets enabled by setting "recent_sentence_filter_size" under "mediawords" to the max. number of sentences to
+    keep in the filter."""
+    global __default_recent_sentence_filter
+
+    pid = os.getpid()
+    if __default_recent_sentence_filter is not None and __default_recent_sentence_filter[0] == pid:
+        return __default_recent_sentence_filter[1]
+
+    sentence_filter = None
+
+    config = py_get_config()
+    max_size = config['mediawords'].get('recent_sentence_filter_size', None)
+    if max_size:
+        sentence_filter = RecentSentenceFilter(max_size=int(max_size))
+
+    __default_recent_sentence_filter = (pid, sentence_filter)
+
+    return sentence_filter
@@ -1,12 +1,16 @@
 import re
-from typing import List, Dict
+from collections import Counter
+from typing import List, Dict, Optional, Tuple
 
 from mediawords.db import DatabaseHandler
+from mediawords.dbi.media_stats import update_media_stats_num_sentences
 from mediawords.dbi.stories.ap import is_syndicated
 from mediawords.dbi.stories.extract import get_text_for_word_counts
 from mediawords.dbi.stories.extractor_arguments import PyExtractorArguments
 from mediawords.languages.factory import LanguageFactory
-from mediawords.util.identify_language import language_code_for_text, identification_would_be_reliable
+from mediawords.sentence_filter import RecentSentenceFilter, default_recent_sentence_filter
+from mediawords.util.config import get_config as py_get_config
+from mediawords.util.identify_language import language_code_for_text, language_codes_for_sentences
 from mediawords.util.log import create_logger
 from mediawords.util.perl import decode_object_from_bytes_if_needed
 
@@ -25,6 +29,13 @@ class McUpdateStorySentencesAndLanguageException(Exception):
     pass
 
 
+def sentence_dedup_is_lock_free() -> bool:
+    """Return True if sentences are to be deduplicated without locking the whole medium ("lock_free_sentence_dedup" in
+    mediawords.yml)."""
+    config = py_get_config()
+    return bool(config['mediawords'].get('lock_free_sentence_dedup', False))
+
+
 def medium_is_locked(db: DatabaseHandler, media_id: int) -> bool:
     """Use a new blocking check to see if the given media_id is locked by a postgres advisory lock (used within
     _insert_story_sentences below). Return True if it is locked, False otherwise."""
@@ -51,15 +62,11 @@ def _get_db_escaped_story_sentence_dicts(
 
     sentence_dicts = []
 
-    sentence_num = 0
-    for sentence in sentences:
+    # Identify the language of each of the sentences
+    sentence_langs = language_codes_for_sentences(sentences=sentences, story_language=story['language'])
 
-        # Identify the language of each of the sentences
-        sentence_lang = language_code_for_text(sentence)
-        if (sentence_lang or '') != (story['language'] or ''):
-            # Mark the language as unknown if the results for the sentence are not reliable
-            if not identification_would_be_reliable(text=sentence):
-                sentence_lang = ''
+    sentence_num = 0
+    for sentence, sentence_lang in zip(sentences, sentence_langs):
 
         sentence_dicts.append({
             'sentence': db.quote_varchar(sentence),
@@ -95,10 +102,19 @@ def _insert_story_sentences(
         story: dict,
         sentences: List[str],
         no_dedup_sentences: bool = False,
+        lock_free_dedup: Optional[bool] = None,
+        recent_sentence_filter: Optional[RecentSentenceFilter] = None,
 ) -> List[str]:
     """Insert the story sentences into story_sentences, optionally skipping duplicate sentences by setting is_dup = 't'
     to the found duplicates that are already in the table.
 
+    If "lock_free_dedup" is True (or None and "lock_free_sentence_dedup" is enabled in mediawords.yml), duplicates get
+    found without locking the medium, using _insert_stories_sentences().
+
+    If "recent_sentence_filter" is set (or the default one is enabled in mediawords.yml), sentences that the filter
+    considers to be likely duplicates only get verified to be duplicates with a read-only lookup instead of having
+    is_dup = 't' of their originals rewritten.
+
     Returns list of sentences that were inserted into the table.
     """
 
@@ -118,6 +134,22 @@ def _insert_story_sentences(
         log.warning("Story sentences are empty for story {}.".format(stories_id))
         return []
 
+    if lock_free_dedup is None:
+        lock_free_dedup = sentence_dedup_is_lock_free()
+
+    if lock_free_dedup and not no_dedup_sentences:
+        return _insert_stories_sentences(
+            db=db,
+            stories=[story],
+            sentences={stories_id: sentences},
+            lock_free_dedup=True,
+        )[int(stories_id)]
+
+    if recent_sentence_filter is None:
+        recent_sentence_filter = default_recent_sentence_filter()
+
+    likely_duplicate_sentences = []
+
     if no_dedup_sentences:
         log.debug("Won't de-duplicate sentences for story {} because 'no_dedup_sentences' is set.".format(stories_id))
 
@@ -134,6 +166,13 @@ def _insert_story_sentences(
         # Limit to unique sentences within a story
         sentences = _get_unique_sentences_in_story(sentences)
 
+        if recent_sentence_filter is not None:
+            likely_duplicate_sentences = recent_sentence_filter.likely_duplicates(
+                media_id=media_id,
+                publish_date=story['publish_date'],
+                sentences=sentences,
+            )
+
         # Set is_dup = 't' to sentences already in the table, return those to be later skipped on INSERT of new
         # sentences
         dedup_sentences_statement = """
@@ -145,10 +184,53 @@ def _insert_story_sentences(
             WHERE half_md5(story_sentences.sentence) = half_md5(new_sentences.sentence)
               AND week_start_date(story_sentences.publish_date::date) = week_start_date({})
               AND story_sentences.media_id = new_sentences.media_id
+              AND new_sentences.sentence NOT IN (
+                -- No need to set is_dup = 't' again
+                SELECT sentence
+                FROM verified_duplicate_sentences
+              )
             RETURNING story_sentences.sentence
 
         """.format(escaped_story_publish_date)
 
+    if likely_duplicate_sentences:
+        str_likely_duplicate_sentences_sql = ",\n".join(
+            '({})'.format(db.quote_varchar(sentence)) for sentence in likely_duplicate_sentences
+        )
+
+        # Likely duplicates which are known to be duplicates already, i.e. all of their earlier sentences have
+        # is_dup = 't' set
+        verified_duplicate_sentences_statement = """
+
+            -- noinspection SqlResolve
+            SELECT likely_duplicate_sentences.sentence
+            FROM (VALUES
+                {str_likely_duplicate_sentences_sql}
+            ) AS likely_duplicate_sentences (sentence)
+            WHERE (
+                SELECT BOOL_AND(story_sentences.is_dup IS TRUE)
+                FROM story_sentences
+                WHERE half_md5(story_sentences.sentence) = half_md5(likely_duplicate_sentences.sentence)
+                  AND week_start_date(story_sentences.publish_date::date) = week_start_date({publish_date})
+                  AND story_sentences.media_id = {media_id}
+            ) IS TRUE
+
+        """.format(
+            str_likely_duplicate_sentences_sql=str_likely_duplicate_sentences_sql,
+            publish_date=escaped_story_publish_date,
+            media_id=int(media_id),
+        )
+
+    else:
+
+        verified_duplicate_sentences_statement = """
+
+            -- No likely duplicates, return empty list
+            SELECT NULL::TEXT AS sentence
+            WHERE 1 = 0
+
+        """
+
     # Convert to list of dicts (values escaped for insertion into database)
     sentence_dicts = _get_db_escaped_story_sentence_dicts(db=db, story=story, sentences=sentences)
 
@@ -172,6 +254,11 @@ def _insert_story_sentences(
             -- New sentences to potentially insert
             {str_new_sentences_sql}
         ),
+        verified_duplicate_sentences AS (
+            -- Either a list of likely duplicate sentences (according to the recent sentence filter) verified to be
+            -- duplicates already or an empty list
+            {verified_duplicate_sentences_statement}
+        ),
         duplicate_sentences AS (
             -- Either a list of duplicate sentences already found in the table or an empty list if deduplication is
             -- disabled
@@ -187,12 +274,18 @@ def _insert_story_sentences(
             -- Skip the ones for which we've just set is_dup = 't'
             SELECT sentence
             FROM duplicate_sentences
+        )
+          AND sentence NOT IN (
+            -- Skip the ones that are known to be duplicates already
+            SELECT sentence
+            FROM verified_duplicate_sentences
         )
         RETURNING story_sentences.sentence
 
     """.format(
         str_story_sentences_columns=str_story_sentences_columns,
         str_new_sentences_sql=str_new_sentences_sql,
+        verified_duplicate_sentences_statement=verified_duplicate_sentences_statement,
         dedup_sentences_statement=dedup_sentences_statement,
     )
 
@@ -207,20 +300,358 @@ def _insert_story_sentences(
     log.debug("Removing advisory lock on media ID {}...".format(media_id))
     db.query("SELECT pg_advisory_unlock(%(media_id)s)", {'media_id': media_id})
 
-    db.query("""
-        UPDATE media_stats
-        SET num_sentences = num_sentences + %(inserted_sentence_count)s
-        WHERE media_id = %(media_id)s
-          AND stat_date = %(publish_date)s::date
-    """, {
-        'inserted_sentence_count': len(inserted_sentences),
-        'media_id': media_id,
-        'publish_date': story['publish_date'],
+    if recent_sentence_filter is not None and not no_dedup_sentences:
+        inserted_sentence_lookup = set(inserted_sentences)
+
+        # Likely duplicates that got inserted after all
+        recent_sentence_filter.discard_stale(
+            media_id=media_id,
+            publish_date=story['publish_date'],
+            sentences=[sentence for sentence in likely_duplicate_sentences if sentence in inserted_sentence_lookup],
+        )
+
+        # Every sentence that didn't get inserted now has is_dup = 't' set on its earlier sentences
+        recent_sentence_filter.add_duplicates(
+            media_id=media_id,
+            publish_date=story['publish_date'],
+            sentences=[sentence for sentence in sentences if sentence not in inserted_sentence_lookup],
+        )
+
+        log.debug("Recent sentence filter stats: {}".format(recent_sentence_filter.stats()))
+
+    update_media_stats_num_sentences(db=db, num_sentences_deltas={
+        (int(media_id), story['publish_date']): len(inserted_sentences),
     })
 
     return inserted_sentences
 
 
+# Temporary table into which sentences of a batch of stories get COPYed before getting deduplicated and inserted
+__STORY_SENTENCES_STAGING_TABLE = '_story_sentences_staging'
+
+
+def _insert_stories_sentences(
+        db: DatabaseHandler,
+        stories: List[dict],
+        sentences: Dict[int, List[str]],
+        no_dedup_sentences: bool = False,
+        lock_free_dedup: Optional[bool] = None,
+) -> Dict[int, List[str]]:
+    """Insert sentences of multiple stories into story_sentences, optionally skipping duplicate sentences like
+    _insert_story_sentences() does.
+
+    Sentences of all the stories get COPYed into a temporary staging table first, and then get deduplicated and
+    inserted with a single statement per media ID. A sentence repeated within the same medium and week in multiple
+    stories of the batch gets inserted only for the first of those stories (with is_dup = 't'), as if the stories were
+    inserted one by one.
+
+    If "lock_free_dedup" is True (or None and "lock_free_sentence_dedup" is enabled in mediawords.yml), sentences get
+    deduplicated with _insert_staged_sentences_lock_free() instead of under advisory locks of their media.
+
+    "sentences" is a dictionary of story IDs and lists of every story's sentences.
+
+    Returns dictionary of story IDs and lists of sentences that were inserted into the table for every story.
+    """
+
+    stories = decode_object_from_bytes_if_needed(stories)
+    sentences = decode_object_from_bytes_if_needed(sentences)
+    if isinstance(no_dedup_sentences, bytes):
+        no_dedup_sentences = decode_object_from_bytes_if_needed(no_dedup_sentences)
+    no_dedup_sentences = bool(int(no_dedup_sentences))
+
+    stories_by_id = {int(story['stories_id']): story for story in stories}
+    sentences = {int(stories_id): story_sentences for stories_id, story_sentences in sentences.items()}
+
+    inserted_sentences = {stories_id: [] for stories_id in stories_by_id.keys()}
+
+    staging_rows = []
+    for stories_id, story in stories_by_id.items():
+        story_sentences = sentences.get(stories_id, [])
+
+        if len(story_sentences) == 0:
+            log.warning("Story sentences are empty for story {}.".format(stories_id))
+            continue
+
+        if not no_dedup_sentences:
+            # Limit to unique sentences within a story
+            story_sentences = _get_unique_sentences_in_story(story_sentences)
+
+        # Identify the language of each of the sentences
+        sentence_langs = language_codes_for_sentences(sentences=story_sentences, story_language=story['language'])
+
+        for sentence_number, (sentence, sentence_lang) in enumerate(zip(story_sentences, sentence_langs)):
+            staging_rows.append((
+                len(staging_rows),
+                stories_id,
+                sentence_number,
+                sentence,
+                sentence_lang,
+                int(story['media_id']),
+                story['publish_date'],
+            ))
+
+    if len(staging_rows) == 0:
+        return inserted_sentences
+
+    staging_table = __STORY_SENTENCES_STAGING_TABLE
+
+    # Might have been rolled back together with the transaction in which it was created
+    db.query("""
+        CREATE TEMPORARY TABLE IF NOT EXISTS {} (
+            ordinal         BIGINT      NOT NULL,
+            stories_id      BIGINT      NOT NULL,
+            sentence_number INT         NOT NULL,
+            sentence        TEXT        NOT NULL,
+            language        VARCHAR(3)  NULL,
+            media_id        BIGINT      NOT NULL,
+            publish_date    TIMESTAMP   NULL
+        )
+    """.format(staging_table))
+    db.query("TRUNCATE {}".format(staging_table))
+
+    db.copy_rows_from(
+        table=staging_table,
+        columns=['ordinal', 'stories_id', 'sentence_number', 'sentence', 'language', 'media_id', 'publish_date'],
+        rows=staging_rows,
+    )
+
+    if lock_free_dedup is None:
+        lock_free_dedup = sentence_dedup_is_lock_free()
+
+    if lock_free_dedup and not no_dedup_sentences:
+        inserted_rows = _insert_staged_sentences_lock_free(db=db, staging_table=staging_table)
+
+    else:
+        inserted_rows = _insert_staged_sentences_locked(
+            db=db,
+            staging_table=staging_table,
+            media_ids=sorted(set(row[5] for row in staging_rows)),
+            no_dedup_sentences=no_dedup_sentences,
+        )
+
+    num_sentences_deltas = Counter()
+
+    for stories_id, sentence in inserted_rows:
+        inserted_sentences[stories_id].append(sentence)
+
+        story = stories_by_id[stories_id]
+        num_sentences_deltas[(int(story['media_id']), story['publish_date'])] += 1
+
+    update_media_stats_num_sentences(db=db, num_sentences_deltas=num_sentences_deltas)
+
+    return inserted_sentences
+
+
+def _insert_staged_sentences_locked(db: DatabaseHandler,
+                                    staging_table: str,
+                                    media_ids: List[int],
+                                    no_dedup_sentences: bool) -> List[Tuple[int, str]]:
+    """Deduplicate and insert sentences from the staging table with a single statement per media ID while holding an
+    advisory lock of the medium.
+
+    Returns list of (stories_id, sentence) tuples of inserted sentences.
+    """
+
+    if no_dedup_sentences:
+        log.debug("Won't de-duplicate sentences because 'no_dedup_sentences' is set.")
+
+        new_sentences_statement = """
+            SELECT *,
+                   1 AS occurrence,
+                   1 AS occurrences
+            FROM {staging_table}
+            WHERE media_id = %(media_id)s
+        """.format(staging_table=staging_table)
+
+        dedup_sentences_statement = """
+
+            -- Nothing to deduplicate, return empty list
+            SELECT NULL::TEXT AS sentence, NULL::DATE AS week_start_date
+            WHERE 1 = 0
+
+        """
+
+    else:
+
+        # Number occurrences of every sentence within the same week in the batch to insert only the first one
+        new_sentences_statement = """
+            SELECT *,
+                   ROW_NUMBER() OVER (sentence_week ORDER BY ordinal) AS occurrence,
+                   COUNT(*) OVER sentence_week AS occurrences
+            FROM {staging_table}
+            WHERE media_id = %(media_id)s
+            WINDOW sentence_week AS (PARTITION BY sentence, week_start_date(publish_date::date))
+        """.format(staging_table=staging_table)
+
+        # Set is_dup = 't' to sentences already in the table, return those to be later skipped on INSERT of new
+        # sentences
+        dedup_sentences_statement = """
+
+            -- noinspection SqlResolve
+            UPDATE story_sentences
+            SET is_dup = 't'
+            FROM new_sentences
+            WHERE half_md5(story_sentences.sentence) = half_md5(new_sentences.sentence)
+              AND week_start_date(story_sentences.publish_date::date)
+                = week_start_date(new_sentences.publish_date::date)
+              AND story_sentences.media_id = new_sentences.media_id
+              AND new_sentences.occurrence = 1
+            RETURNING story_sentences.sentence, week_start_date(story_sentences.publish_date::date) AS week_start_date
+
+        """
+
+    sql = """
+
+        -- noinspection SqlType,SqlResolve
+        WITH new_sentences AS (
+            -- New sentences of a single medium to potentially insert
+            {new_sentences_statement}
+        ),
+        duplicate_sentences AS (
+            -- Either a list of duplicate sentences already found in the table or an empty list if deduplication is
+            -- disabled
+            --
+            -- The query assumes that there are no existing sentences for these stories in the "story_sentences" table,
+            -- so if you are reextracting stories, DELETE their sentences from "story_sentences" before running this
+            -- query.
+            {dedup_sentences_statement}
+        )
+        INSERT INTO story_sentences (stories_id, sentence_number, sentence, language, media_id, publish_date, is_dup)
+        SELECT stories_id,
+               sentence_number,
+               sentence,
+               language,
+               media_id,
+               publish_date,
+
+               -- Sentence repeated in other stories of the batch is a duplicate too
+               CASE WHEN occurrences > 1 THEN 't'::BOOLEAN ELSE NULL END
+        FROM new_sentences
+        WHERE occurrence = 1
+          AND NOT EXISTS (
+            -- Skip the ones for which we've just set is_dup = 't'
+            SELECT 1
+            FROM duplicate_sentences
+            WHERE duplicate_sentences.sentence = new_sentences.sentence
+              AND duplicate_sentences.week_start_date = week_start_date(new_sentences.publish_date::date)
+          )
+        ORDER BY ordinal
+        RETURNING story_sentences.stories_id, story_sentences.sentence
+
+    """.format(
+        new_sentences_statement=new_sentences_statement,
+        dedup_sentences_statement=dedup_sentences_statement,
+    )
+
+    inserted_rows = []
+
+    # Lock media in the same order in every process to avoid deadlocks
+    for media_id in media_ids:
+        log.debug("Adding advisory lock on media ID {}...".format(media_id))
+        db.query("SELECT pg_advisory_lock(%(media_id)s)", {'media_id': media_id})
+
+        log.debug("Running sentence insertion + deduplication query for media ID {}...".format(media_id))
+
+        # Insert sentences
+        inserted_rows.extend(db.query(sql, {'media_id': media_id}).tuples())
+
+        log.debug("Removing advisory lock on media ID {}...".format(media_id))
+        db.query("SELECT pg_advisory_unlock(%(media_id)s)", {'media_id': media_id})
+
+    return inserted_rows
+
+
+def _insert_staged_sentences_lock_free(db: DatabaseHandler, staging_table: str) -> List[Tuple[int, str]]:
+    """Deduplicate and insert sentences from the staging table without locking their media.
+
+    First occurrence of every sentence within a medium and a week gets claimed in "story_sentences_dedup" with
+    INSERT ... ON CONFLICT DO NOTHING, and only the claimed sentences get inserted into "story_sentences", so
+    concurrent workers have to wait for each other only when inserting the very same sentences. Then, the earlier
+    inserted sentences that the rest of the sentences turned out to be duplicates of get is_dup = 't' set.
+
+    Returns list of (stories_id, sentence) tuples of inserted sentences.
+    """
+
+    inserted_rows = db.query("""
+
+        -- noinspection SqlType,SqlResolve
+        WITH new_sentences AS (
+            -- Number occurrences of every sentence within the same week in the batch to claim only the first one
+            SELECT *,
+                   ROW_NUMBER() OVER (sentence_week ORDER BY ordinal) AS occurrence,
+                   COUNT(*) OVER sentence_week AS occurrences
+            FROM (
+                SELECT *,
+                       week_start_date(publish_date::date) AS week_start_date,
+                       half_md5(sentence) AS sentence_md5
+                FROM {staging_table}
+            ) AS staged_sentences
+            WINDOW sentence_week AS (PARTITION BY media_id, week_start_date, sentence_md5)
+        ),
+        claimed_sentences AS (
+            -- Sentences already claimed by earlier (or concurrent) transactions won't get returned
+            INSERT INTO story_sentences_dedup (media_id, week_start_date, sentence_md5, stories_id, sentence_number)
+            SELECT media_id, week_start_date, sentence_md5, stories_id, sentence_number
+            FROM new_sentences
+            WHERE occurrence = 1
+
+            -- Claim sentences in the same order in every transaction to avoid deadlocks
+            ORDER BY media_id, week_start_date, sentence_md5
+
+            ON CONFLICT (media_id, week_start_date, sentence_md5) DO NOTHING
+            RETURNING stories_id, sentence_number
+        )
+        INSERT INTO story_sentences (stories_id, sentence_number, sentence, language, media_id, publish_date, is_dup)
+        SELECT new_sentences.stories_id,
+               new_sentences.sentence_number,
+               new_sentences.sentence,
+               new_sentences.language,
+               new_sentences.media_id,
+               new_sentences.publish_date,
+
+               -- Sentence repeated in other stories of the batch is a duplicate too
+               CASE WHEN new_sentences.occurrences > 1 THEN 't'::BOOLEAN ELSE NULL END
+        FROM new_sentences
+            INNER JOIN claimed_sentences
+                ON new_sentences.stories_id = claimed_sentences.stories_id
+               AND new_sentences.sentence_number = claimed_sentences.sentence_number
+        ORDER BY new_sentences.ordinal
+        RETURNING story_sentences.stories_id, story_sentences.sentence
+
+    """.format(staging_table=staging_table)).tuples()
+
+    # Has to be a separate statement to see sentences of transactions that the claims above had to wait for
+    db.query("""
+
+        -- noinspection SqlResolve
+        UPDATE story_sentences_p
+        SET is_dup = 't'
+        FROM (
+            SELECT original_sentences_p.stories_id,
+                   original_sentences_p.sentence_number
+            FROM {staging_table} AS staged_sentences
+                INNER JOIN story_sentences_dedup
+                    ON staged_sentences.media_id = story_sentences_dedup.media_id
+                   AND week_start_date(staged_sentences.publish_date::date) = story_sentences_dedup.week_start_date
+                   AND half_md5(staged_sentences.sentence) = story_sentences_dedup.sentence_md5
+                INNER JOIN story_sentences_p AS original_sentences_p
+                    ON story_sentences_dedup.stories_id = original_sentences_p.stories_id
+                   AND story_sentences_dedup.sentence_number = original_sentences_p.sentence_number
+            WHERE story_sentences_dedup.stories_id != staged_sentences.stories_id
+              AND original_sentences_p.is_dup IS NOT TRUE
+
+            -- Locked sentence is being marked as a duplicate (or deleted) by some other worker already, so there's no
+            -- need to wait for it
+            FOR UPDATE OF original_sentences_p SKIP LOCKED
+        ) AS original_sentences
+        WHERE story_sentences_p.stories_id = original_sentences.stories_id
+          AND story_sentences_p.sentence_number = original_sentences.sentence_number
+
+    """.format(staging_table=staging_table))
+
+    return inserted_rows
+
+
 def _get_sentences_from_story_text(story_text: str, story_lang: str) -> List[str]:
     """Split story text to individual sentences."""
     story_text = decode_object_from_bytes_if_needed(story_text)
@@ -292,17 +723,46 @@ def _delete_story_sentences(db: DatabaseHandler, story: dict) -> None:
         WHERE stories_id = %(stories_id)s
     """, {'stories_id': story['stories_id']}).rows()
 
-    if num_deleted > 0:
+    # Let sentences get claimed again as first occurrences by lock-free deduplication
+    if sentence_dedup_is_lock_free():
         db.query("""
-            UPDATE media_stats
-            SET num_sentences = num_sentences - %(num_deleted)s
-            WHERE media_id = %(media_id)s
-              AND stat_date = %(publish_date)s::date
-        """, {
-            'num_deleted': num_deleted,
-            'media_id': story['media_id'],
-            'publish_date': story['publish_date'],
-        })
+            DELETE FROM story_sentences_dedup
+            WHERE stories_id = %(stories_id)s
+        """, {'stories_id': story['stories_id']})
+
+    update_media_stats_num_sentences(db=db, num_sentences_deltas={
+        (int(story['media_id']), story['publish_date']): -num_deleted,
+    })
+
+
+def _delete_stories_sentences(db: DatabaseHandler, stories: List[dict]) -> None:
+    """Delete any existing sentences for the given stories and also update media_stats (with a single query) to
+    adjust for the deletion."""
+    stories = decode_object_from_bytes_if_needed(stories)
+
+    stories_by_id = {int(story['stories_id']): story for story in stories}
+    if not stories_by_id:
+        return
+
+    deleted_stories_ids = db.query("""
+        DELETE FROM story_sentences
+        WHERE stories_id = ANY(%(stories_ids)s::BIGINT[])
+        RETURNING stories_id
+    """, {'stories_ids': list(stories_by_id.keys())}).flat()
+
+    # Let sentences get claimed again as first occurrences by lock-free deduplication
+    if sentence_dedup_is_lock_free():
+        db.query("""
+            DELETE FROM story_sentences_dedup
+            WHERE stories_id = ANY(%(stories_ids)s::BIGINT[])
+        """, {'stories_ids': list(stories_by_id.keys())})
+
+    num_sentences_deltas = Counter()
+    for stories_id in deleted_stories_ids:
+        story = stories_by_id[stories_id]
+        num_sentences_deltas[(int(story['media_id']), story['publish_date'])] -= 1
+
+    update_media_stats_num_sentences(db=db, num_sentences_deltas=num_sentences_deltas)
 
 
 def update_story_sentences_and_language(db: DatabaseHandler,
@@ -373,3 +833,87 @@ def update_story_sentences_and_language(db: DatabaseHandler,
 
     if use_transaction:
         db.commit()
+
+
+def update_stories_sentences_and_language(db: DatabaseHandler,
+                                          stories: List[dict],
+                                          extractor_args: PyExtractorArguments = PyExtractorArguments()) -> None:
+    """Update story vectors for a batch of stories, updating "story_sentences".
+
+    Does the same as update_story_sentences_and_language() for every story, but in a single transaction, and with
+    sentences of all the stories getting deleted, deduplicated and inserted set-wise instead of story by story.
+    """
+
+    stories = decode_object_from_bytes_if_needed(stories)
+
+    if not stories:
+        return
+
+    use_transaction = not db.in_transaction()
+
+    if use_transaction:
+        db.begin()
+
+    if not extractor_args.no_delete():
+        _delete_stories_sentences(db=db, stories=stories)
+
+    stories_with_sentences = []
+    stories_sentences = {}
+    stories_texts = {}
+    new_languages = {}
+
+    for story in stories:
+        stories_id = int(story['stories_id'])
+
+        story_text = story.get('story_text', None)
+        if not story_text:
+            story_text = get_text_for_word_counts(db=db, story=story)
+            if not story_text:
+                story_text = ''
+
+        story_lang = language_code_for_text(text=story_text)
+
+        sentences = _get_sentences_from_story_text(story_text=story_text, story_lang=story_lang)
+
+        if (not story.get('language', None)) or story.get('language', None) != story_lang:
+            new_languages[stories_id] = story_lang
+            story['language'] = story_lang
+
+        if sentences is None:
+            raise McUpdateStorySentencesAndLanguageException("Sentences for story {} are undefined.".format(stories_id))
+
+        if len(sentences) == 0:
+            log.debug("Story {} doesn't have any sentences.".format(stories_id))
+            continue
+
+        stories_with_sentences.append(story)
+        stories_sentences[stories_id] = _clean_sentences(sentences)
+        stories_texts[stories_id] = story_text
+
+    if new_languages:
+        db.query("""
+            UPDATE stories
+            SET language = new_languages.language
+            FROM UNNEST(%(stories_ids)s::BIGINT[], %(languages)s::TEXT[]) AS new_languages (stories_id, language)
+            WHERE stories.stories_id = new_languages.stories_id
+        """, {'stories_ids': list(new_languages.keys()), 'languages': list(new_languages.values())})
+
+    _insert_stories_sentences(
+        db=db,
+        stories=stories_with_sentences,
+        sentences=stories_sentences,
+        no_dedup_sentences=extractor_args.no_dedup_sentences(),
+    )
+
+    for story in stories_with_sentences:
+        stories_id = int(story['stories_id'])
+        story['ap_syndicated'] = _update_ap_syndicated(
+            db=db,
+            stories_id=stories_id,
+            story_title=story['title'],
+            story_text=stories_texts[stories_id],
+            story_language=story['language'],
+        )
+
+    if use_transaction:
+        db.commit()
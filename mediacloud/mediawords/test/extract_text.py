@@ -0,0 +1,16 @@
+import re
+
+import readability.readability
+
+from mediawords.util.text import replace_control_nonprintable_characters
+
+
+def extract_article_from_html_without_sanitizing(html: str) -> str:
+    """Reference extraction which runs Readability on the full document (with only the long runs of characters
+    removed) the way it was done before HTML got pre-sanitized; used to compare extract_article_from_html() against."""
+    html = replace_control_nonprintable_characters(html)
+    html = re.sub(r'(.)\1{256,}', '\1', html)
+    html = re.sub(r'\s{256,}', '\1', html)
+
+    doc = readability.readability.Document(html)
+    return "{}\n\n{}".format(doc.short_title().strip(), doc.summary().strip())
@@ -1,6 +1,6 @@
 import pytest
 
-from mediawords.db import connect_to_db, McConnectToDBException
+from mediawords.db import connect_to_db, pooled_connection_to_db, McConnectToDBException
 
 
 def test_connect_to_db():
@@ -17,3 +17,33 @@ def test_connect_to_db():
     # Invalid label
     with pytest.raises(McConnectToDBException):
         connect_to_db('NONEXISTENT_LABEL')
+
+
+def test_pooled_connection_to_db():
+    with pooled_connection_to_db(label='test') as db:
+        database_name = db.query('SELECT current_database()').hash()
+        assert database_name['current_database'] == 'mediacloud_test'
+
+        # Mess with the session state
+        db.query("SET enable_seqscan TO off")
+        db.query("CREATE TEMPORARY TABLE pooled_connection_temp_table (id INT)")
+        db.begin()
+        db.query("SELECT 1")
+        backend_pid = db.query("SELECT pg_backend_pid()").flat()[0]
+
+    with pooled_connection_to_db(label='test') as db:
+        # Same connection got reused
+        assert db.query("SELECT pg_backend_pid()").flat()[0] == backend_pid
+
+        # ...but its session state was reset
+        assert db.in_transaction() is False
+        assert db.query("SHOW enable_seqscan").flat()[0] == 'on'
+        assert len(db.query("""
+            SELECT 1
+            FROM pg_tables
+            WHERE tablename = 'pooled_connection_temp_table'
+        """).flat()) == 0
+
+        # Nested usage gets a different connection
+        with pooled_connection_to_db(label='test') as nested_db:
+            assert nested_db.query("SELECT pg_backend_pid()").flat()[0] != backend_pid
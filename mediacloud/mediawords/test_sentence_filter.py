@@ -0,0 +1,62 @@
+import datetime
+
+import pytest
+
+from mediawords.sentence_filter import (
+    McRecentSentenceFilterException,
+    RecentSentenceFilter,
+    sentence_half_md5,
+    sentence_week_start_date,
+)
+
+
+def test_sentence_week_start_date():
+    # Monday
+    assert sentence_week_start_date('2016-10-10 08:00:00') == datetime.date(2016, 10, 10)
+
+    # Saturday
+    assert sentence_week_start_date('2016-10-15 08:00:00') == datetime.date(2016, 10, 10)
+    assert sentence_week_start_date(datetime.datetime(2016, 10, 15, 8, 0, 0)) == datetime.date(2016, 10, 10)
+    assert sentence_week_start_date(datetime.date(2016, 10, 16)) == datetime.date(2016, 10, 10)
+
+
+def test_sentence_half_md5():
+    # SELECT half_md5('foo')
+    assert sentence_half_md5('foo') == bytes.fromhex('acbd18db4cc2f85c')
+
+
+def test_recent_sentence_filter():
+    sentence_filter = RecentSentenceFilter(max_size=3)
+
+    sentences = ['First sentence.', 'Second sentence.', 'Third sentence.']
+
+    assert sentence_filter.likely_duplicates(media_id=1, publish_date='2016-10-15', sentences=sentences) == []
+
+    sentence_filter.add_duplicates(media_id=1, publish_date='2016-10-15', sentences=sentences[:2])
+
+    # Same week
+    assert sentence_filter.likely_duplicates(media_id=1, publish_date='2016-10-11', sentences=sentences) \
+        == sentences[:2]
+
+    # Different week or medium
+    assert sentence_filter.likely_duplicates(media_id=1, publish_date='2016-10-17', sentences=sentences) == []
+    assert sentence_filter.likely_duplicates(media_id=2, publish_date='2016-10-15', sentences=sentences) == []
+
+    sentence_filter.discard_stale(media_id=1, publish_date='2016-10-15', sentences=sentences[:1])
+    assert sentence_filter.likely_duplicates(media_id=1, publish_date='2016-10-15', sentences=sentences) \
+        == sentences[1:2]
+
+    # Least recently used sentence gets evicted
+    sentence_filter.add_duplicates(media_id=3, publish_date='2016-10-15', sentences=sentences)
+    assert sentence_filter.likely_duplicates(media_id=1, publish_date='2016-10-15', sentences=sentences) == []
+
+    stats = sentence_filter.stats()
+    assert stats['size'] == 3
+    assert stats['lookups'] == 18
+    assert stats['hits'] == 3
+    assert stats['stale_hits'] == 1
+    assert stats['evictions'] == 1
+    assert stats['hit_rate'] == 3 / 18
+
+    with pytest.raises(McRecentSentenceFilterException):
+        RecentSentenceFilter(max_size=0)
@@ -1,6 +1,7 @@
 import re
 
 from mediawords.db import connect_to_db
+from mediawords.sentence_filter import RecentSentenceFilter
 # noinspection PyProtectedMember
 from mediawords.story_vectors import (
     medium_is_locked,
@@ -10,6 +11,8 @@ from mediawords.story_vectors import (
     _get_unique_sentences_in_story,
     _get_db_escaped_story_sentence_dicts,
     _insert_story_sentences,
+    _insert_stories_sentences,
+    _delete_stories_sentences,
 )
 from mediawords.test.db.create import (
     create_test_medium,
@@ -188,6 +191,180 @@ class TestStoryVectors(TestDatabaseWithSchemaTestCase):
         # Two sentences with no_dedup_sentences=False, plus three sentences with no_dedup_sentences=True
         assert len(db_sentences) == 5
 
+    def test_insert_stories_sentences(self):
+        story_a = self.test_story
+        story_b = create_test_story(self.db(), label='story b', feed=self.test_feed)
+
+        other_medium = create_test_medium(self.db(), 'other medium')
+        other_feed = create_test_feed(self.db(), 'other feed', other_medium)
+        story_c = create_test_story(self.db(), label='story c', feed=other_feed)
+
+        for story in [story_a, story_b, story_c]:
+            story['language'] = 'en'
+
+        existing_sentence = 'This sentence is already in the table.'
+        shared_sentence = 'This sentence is shared between the stories.'
+
+        existing_story = create_test_story(self.db(), label='existing story', feed=self.test_feed)
+        self.db().insert(table='story_sentences', insert_hash={
+            'stories_id': existing_story['stories_id'],
+            'media_id': self.test_medium['media_id'],
+            'sentence_number': 0,
+            'sentence': existing_sentence,
+            'publish_date': existing_story['publish_date'],
+            'language': 'en',
+        })
+
+        def medium_num_sentences(media_id: int) -> int:
+            return self.db().query("""
+                SELECT SUM(num_sentences)
+                FROM media_stats
+                WHERE media_id = %(media_id)s
+            """, {'media_id': media_id}).flat()[0]
+
+        num_sentences_before = medium_num_sentences(self.test_medium['media_id'])
+
+        inserted_sentences = _insert_stories_sentences(
+            db=self.db(),
+            stories=[story_a, story_b, story_c],
+            sentences={
+                story_a['stories_id']: [existing_sentence, shared_sentence, shared_sentence, 'Only in story A.'],
+                story_b['stories_id']: [shared_sentence, 'Only in story B.'],
+                story_c['stories_id']: [shared_sentence],
+            },
+        )
+
+        assert inserted_sentences == {
+            story_a['stories_id']: [shared_sentence, 'Only in story A.'],
+            story_b['stories_id']: ['Only in story B.'],
+            story_c['stories_id']: [shared_sentence],
+        }
+
+        db_sentences = self.db().query("""
+            SELECT stories_id, sentence, is_dup
+            FROM story_sentences
+            ORDER BY stories_id, sentence_number
+        """).hashes()
+        assert db_sentences == [
+            {'stories_id': story_a['stories_id'], 'sentence': shared_sentence, 'is_dup': True},
+            {'stories_id': story_a['stories_id'], 'sentence': 'Only in story A.', 'is_dup': None},
+            {'stories_id': story_b['stories_id'], 'sentence': 'Only in story B.', 'is_dup': None},
+            {'stories_id': story_c['stories_id'], 'sentence': shared_sentence, 'is_dup': None},
+            {'stories_id': existing_story['stories_id'], 'sentence': existing_sentence, 'is_dup': True},
+        ]
+
+        assert medium_num_sentences(self.test_medium['media_id']) == num_sentences_before + 3
+
+        _delete_stories_sentences(db=self.db(), stories=[story_a, story_b, story_c])
+
+        assert medium_num_sentences(self.test_medium['media_id']) == num_sentences_before
+        assert self.db().query("SELECT COUNT(*) FROM story_sentences").flat()[0] == 1
+
+    def test_insert_stories_sentences_lock_free(self):
+        story_a = self.test_story
+        story_b = create_test_story(self.db(), label='story b', feed=self.test_feed)
+        existing_story = create_test_story(self.db(), label='existing story', feed=self.test_feed)
+
+        for story in [story_a, story_b, existing_story]:
+            story['language'] = 'en'
+
+        existing_sentence = 'This sentence is already in the table.'
+        shared_sentence = 'This sentence is shared between the stories.'
+
+        inserted_sentences = _insert_stories_sentences(
+            db=self.db(),
+            stories=[existing_story],
+            sentences={existing_story['stories_id']: [existing_sentence]},
+            lock_free_dedup=True,
+        )
+        assert inserted_sentences == {existing_story['stories_id']: [existing_sentence]}
+
+        inserted_sentences = _insert_stories_sentences(
+            db=self.db(),
+            stories=[story_a, story_b],
+            sentences={
+                story_a['stories_id']: [existing_sentence, shared_sentence, shared_sentence, 'Only in story A.'],
+                story_b['stories_id']: [shared_sentence, 'Only in story B.'],
+            },
+            lock_free_dedup=True,
+        )
+
+        assert inserted_sentences == {
+            story_a['stories_id']: [shared_sentence, 'Only in story A.'],
+            story_b['stories_id']: ['Only in story B.'],
+        }
+
+        db_sentences = self.db().query("""
+            SELECT stories_id, sentence, is_dup
+            FROM story_sentences
+            ORDER BY stories_id, sentence_number
+        """).hashes()
+        assert db_sentences == [
+            {'stories_id': story_a['stories_id'], 'sentence': shared_sentence, 'is_dup': True},
+            {'stories_id': story_a['stories_id'], 'sentence': 'Only in story A.', 'is_dup': None},
+            {'stories_id': story_b['stories_id'], 'sentence': 'Only in story B.', 'is_dup': None},
+            {'stories_id': existing_story['stories_id'], 'sentence': existing_sentence, 'is_dup': True},
+        ]
+
+        # Deleted sentences can get inserted again
+        _delete_stories_sentences(db=self.db(), stories=[story_a, story_b])
+        assert self.db().query("SELECT COUNT(*) FROM story_sentences_dedup").flat()[0] == 1
+
+        inserted_sentences = _insert_story_sentences(
+            db=self.db(),
+            story=story_b,
+            sentences=[shared_sentence],
+            lock_free_dedup=True,
+        )
+        assert inserted_sentences == [shared_sentence]
+
+    def test_insert_story_sentences_recent_sentence_filter(self):
+        sentence_filter = RecentSentenceFilter()
+
+        sentences = ['This is a boilerplate sentence.', 'This is a footer sentence.']
+
+        stories = [
+            create_test_story(self.db(), label='story {}'.format(x), feed=self.test_feed) for x in range(4)
+        ]
+        for story in stories:
+            story['language'] = 'en'
+
+        def insert_sentences(story: dict) -> list:
+            return _insert_story_sentences(
+                db=self.db(),
+                story=story,
+                sentences=sentences,
+                recent_sentence_filter=sentence_filter,
+            )
+
+        assert insert_sentences(stories[0]) == sentences
+
+        # Duplicates get found in the database and added to the filter
+        assert insert_sentences(stories[1]) == []
+        assert sentence_filter.stats()['hits'] == 0
+        assert sentence_filter.stats()['size'] == 2
+
+        # Likely duplicates get verified to be duplicates
+        assert insert_sentences(stories[2]) == []
+        assert sentence_filter.stats()['hits'] == 2
+        assert sentence_filter.stats()['stale_hits'] == 0
+
+        db_sentences = self.db().query("""
+            SELECT stories_id, is_dup
+            FROM story_sentences
+            ORDER BY sentence_number
+        """).hashes()
+        assert db_sentences == [
+            {'stories_id': stories[0]['stories_id'], 'is_dup': True},
+            {'stories_id': stories[0]['stories_id'], 'is_dup': True},
+        ]
+
+        # Likely duplicates which are not duplicates anymore get inserted
+        _delete_story_sentences(db=self.db(), story=stories[0])
+        assert insert_sentences(stories[3]) == sentences
+        assert sentence_filter.stats()['stale_hits'] == 2
+        assert sentence_filter.stats()['size'] == 0
+
 
 def test_clean_sentences():
     good_sentences = [
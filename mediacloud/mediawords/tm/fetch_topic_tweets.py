@@ -170,16 +170,13 @@ def _add_tweets_to_ch_posts(twitter_class: typing.Type[AbstractTwitter], ch_post
             log.debug("no tweet fetched for url " + ch_post['url'])
 
 
-def _insert_tweet_urls(db: DatabaseHandler, topic_tweet: dict, urls: typing.List) -> typing.List:
+def _insert_tweet_urls(db: DatabaseHandler, topic_tweet: dict, urls: typing.List) -> None:
     """Insert list of urls into topic_tweet_urls."""
-    for url in urls:
-        db.query(
-            """
-            insert into topic_tweet_urls( topic_tweets_id, url )
-                values( %(a)s, %(b)s )
-                on conflict do nothing
-            """,
-            {'a': topic_tweet['topic_tweets_id'], 'b': url})
+    db.insert_many(
+        table='topic_tweet_urls',
+        rows=[{'topic_tweets_id': topic_tweet['topic_tweets_id'], 'url': url} for url in urls],
+        on_conflict='do nothing',
+        returning=False)
 
 
 def _store_tweet_and_urls(db: DatabaseHandler, topic_tweet_day: dict, ch_post: dict) -> None:
@@ -223,11 +220,11 @@ def _store_tweet_and_urls(db: DatabaseHandler, topic_tweet_day: dict, ch_post: d
     _insert_tweet_urls(db, topic_tweet, urls)
 
 
-def regenerate_tweet_urls(db: dict, topic: dict) -> None:
+def regenerate_tweet_urls(db: DatabaseHandler, topic: dict) -> None:
     """Reparse the tweet json for a given topic and try to reinsert all tweet urls."""
-    topic_tweets_ids = db.query(
+    (num_topic_tweets,) = db.query(
         """
-        select tt.topic_tweets_id
+        select count(*)
             from topic_tweets tt
                 join topic_tweet_days ttd using ( topic_tweet_days_id )
             where
@@ -235,11 +232,21 @@ def regenerate_tweet_urls(db: dict, topic: dict) -> None:
         """,
         {'a': topic['topics_id']}).flat()
 
-    for (i, topic_tweets_id) in enumerate(topic_tweets_ids):
+    # stream the tweets instead of loading them all into memory as big topics might have millions of them
+    topic_tweets = db.query_iter(
+        """
+        select tt.topic_tweets_id, tt.data
+            from topic_tweets tt
+                join topic_tweet_days ttd using ( topic_tweet_days_id )
+            where
+                topics_id = %(a)s
+        """,
+        {'a': topic['topics_id']})
+
+    for (i, topic_tweet) in enumerate(topic_tweets):
         if i % 1000 == 0:
-            log.info('regenerate tweet urls: %d/%d' % (i, len(topic_tweets_ids)))
+            log.info('regenerate tweet urls: %d/%d' % (i, num_topic_tweets))
 
-        topic_tweet = db.require_by_id('topic_tweets', topic_tweets_id)
         data = mediawords.util.parse_json.decode_json(topic_tweet['data'])
         urls = mediawords.util.twitter.get_tweet_urls(data['tweet'])
         _insert_tweet_urls(db, topic_tweet, urls)
@@ -740,15 +740,10 @@ def _merge_dup_stories(db, topic, stories):
             where stories_id = ANY(%(a)s)
             group by stories_id
         """,
-        {'a': stories_ids}).hashes()
+        {'a': stories_ids}).tuples()
 
-    ssc = {}
-
-    for s in stories:
-        ssc[s['stories_id']] = 0
-
-    for count in story_sentence_counts:
-        ssc[count['stories_id']] = count['sentence_count']
+    ssc = dict.fromkeys(stories_ids, 0)
+    ssc.update(story_sentence_counts)
 
     stories = sorted(stories, key=lambda x: ssc[x['stories_id']], reverse=True)
 
@@ -760,20 +755,23 @@ def _merge_dup_stories(db, topic, stories):
 
 
 def _get_topic_stories_by_medium(db: DatabaseHandler, topic: dict) -> dict:
-    """Return hash of { $media_id: stories } for the topic."""
+    """Return hash of { $media_id: stories } for the topic; stories are records (namedtuples) rather than dicts."""
 
-    stories = db.query(
-        """
-        select s.stories_id, s.media_id, s.title, s.url, s.publish_date
-            from snap.live_stories s
-            where s.topics_id = %(a)s
-        """,
-        {'a': topic['topics_id']}).hashes()
+    # Stories might number in millions, so skip building dicts and stringifying dates of hashes(); run the scan on a
+    # read replica if there's one that has caught up with our merges
+    with db.read_only():
+        stories = db.query(
+            """
+            select s.stories_id, s.media_id, s.title, s.url, s.publish_date
+                from snap.live_stories s
+                where s.topics_id = %(a)s
+            """,
+            {'a': topic['topics_id']}).records()
 
     media_lookup = {}
     for s in stories:
-        media_lookup.setdefault(s['media_id'], [])
-        media_lookup[s['media_id']].append(s)
+        media_lookup.setdefault(s.media_id, [])
+        media_lookup[s.media_id].append(s)
 
     return media_lookup
 
@@ -798,7 +796,9 @@ def find_and_merge_dup_stories(db: DatabaseHandler, topic: dict) -> None:
         for i, (media_id, stories) in enumerate(media_lookup.items()):
             if (i % 1000) == 0:
                 log.info("merging dup stories by %s: media [%d / %d]" % (f_name, i, num_media))
-            dup_stories = f(stories)
+
+            # Dup finders annotate stories so they need dicts, which get built for a single medium at a time
+            dup_stories = f([s._asdict() for s in stories])
             [_merge_dup_stories(db, topic, s) for s in dup_stories]
 
 
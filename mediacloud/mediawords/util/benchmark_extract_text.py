@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+
+"""Compare extractor throughput with and without pre-sanitizing HTML before passing it to Readability.
+
+Usage:
+
+    python3 -m mediawords.util.benchmark_extract_text --rounds 3 page1.html page2.html ...
+
+If no files are given, crawler test data gets used.
+"""
+
+import argparse
+import glob
+import os
+import time
+from typing import Callable, Dict, List
+
+from mediawords.test.data import get_path_to_data_files
+from mediawords.test.extract_text import extract_article_from_html_without_sanitizing
+from mediawords.util.extract_text import extract_article_from_html, sanitize_html_for_extraction
+
+
+def __best_time(function: Callable[[str], str], htmls: List[str], rounds: int) -> float:
+    """Return best time (in seconds) of running function on all HTML documents."""
+    best_time = None
+
+    for _ in range(rounds):
+        start_time = time.time()
+        for html in htmls:
+            function(html)
+        elapsed_time = time.time() - start_time
+
+        if best_time is None or elapsed_time < best_time:
+            best_time = elapsed_time
+
+    return best_time
+
+
+def benchmark_extract_text(htmls: List[str], rounds: int = 3) -> Dict[str, float]:
+    """Return best time (in seconds) of sanitizing only, and of extracting with and without pre-sanitizing."""
+    return {
+        'chars': sum(len(html) for html in htmls),
+        'sanitized_chars': sum(len(sanitize_html_for_extraction(html)) for html in htmls),
+        'sanitize_only': __best_time(function=sanitize_html_for_extraction, htmls=htmls, rounds=rounds),
+        'extract_without_sanitizing': __best_time(
+            function=extract_article_from_html_without_sanitizing, htmls=htmls, rounds=rounds,
+        ),
+        'extract_with_sanitizing': __best_time(function=extract_article_from_html, htmls=htmls, rounds=rounds),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare extractor throughput with and without pre-sanitizing HTML.")
+    parser.add_argument('--rounds', type=int, default=3, help="Number of rounds to run.")
+    parser.add_argument('files', nargs='*', help="HTML files to extract; defaults to crawler test data.")
+    args = parser.parse_args()
+
+    paths = args.files
+    if not paths:
+        paths = sorted(glob.glob(os.path.join(get_path_to_data_files(subdirectory='crawler'), '*', '*.html')))
+
+    htmls = []
+    for path in paths:
+        with open(path, mode='r', encoding='utf-8', errors='replace') as f:
+            htmls.append(f.read())
+
+    timings = benchmark_extract_text(htmls=htmls, rounds=args.rounds)
+
+    print("Documents: %d, characters: %d, characters after sanitizing: %d" % (
+        len(htmls), timings['chars'], timings['sanitized_chars'],
+    ))
+    print("%-30s %10s %15s" % ('Method', 'Time (ms)', 'Chars / s'))
+    for method in ['sanitize_only', 'extract_without_sanitizing', 'extract_with_sanitizing']:
+        print("%-30s %10.2f %15.0f" % (method, timings[method] * 1000, timings['chars'] / timings[method]))
+
+
+if __name__ == '__main__':
+    main()
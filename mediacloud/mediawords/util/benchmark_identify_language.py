@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+
+"""Compare per-sentence and batched sentence language identification on story texts.
+
+Usage:
+
+    python3 -m mediawords.util.benchmark_identify_language --rounds 3 story1.txt story2.txt ...
+
+Every file is expected to contain plain text of a single (preferably long, multi-thousand-sentence) story.
+"""
+
+import argparse
+import time
+from typing import Callable, Dict, List
+
+from mediawords.languages.factory import LanguageFactory
+from mediawords.util.identify_language import (
+    language_code_for_text,
+    identification_would_be_reliable,
+    language_codes_for_sentences,
+    clear_sentence_language_cache,
+)
+
+
+def __per_sentence_language_codes(sentences: List[str], story_language: str) -> List[str]:
+    """Identify sentence languages one by one, the way it used to be done before batching."""
+    language_codes = []
+    for sentence in sentences:
+        sentence_language = language_code_for_text(sentence)
+        if sentence_language != story_language and not identification_would_be_reliable(text=sentence):
+            sentence_language = ''
+        language_codes.append(sentence_language)
+    return language_codes
+
+
+def __best_time(identify: Callable[[List[str], str], List[str]],
+                stories: List[Dict[str, object]],
+                rounds: int,
+                clear_cache: bool) -> float:
+    """Return best time (in seconds) of identifying sentence languages of all stories."""
+    best_time = None
+
+    for _ in range(rounds):
+        if clear_cache:
+            clear_sentence_language_cache()
+
+        start_time = time.time()
+        for story in stories:
+            identify(story['sentences'], story['language'])
+        elapsed_time = time.time() - start_time
+
+        if best_time is None or elapsed_time < best_time:
+            best_time = elapsed_time
+
+    return best_time
+
+
+def benchmark_identify_language(story_texts: List[str], rounds: int = 3) -> Dict[str, float]:
+    """Return best time (in seconds) of per-sentence and batched (cold and warm cache) identification."""
+
+    stories = []
+    for story_text in story_texts:
+        story_language = language_code_for_text(story_text)
+
+        language = LanguageFactory.language_for_code(story_language)
+        if not language:
+            language = LanguageFactory.default_language()
+
+        stories.append({
+            'language': story_language,
+            'sentences': language.split_text_to_sentences(story_text),
+        })
+
+    return {
+        'sentences': sum(len(story['sentences']) for story in stories),
+        'per_sentence': __best_time(
+            identify=__per_sentence_language_codes, stories=stories, rounds=rounds, clear_cache=True,
+        ),
+        'batch_cold_cache': __best_time(
+            identify=language_codes_for_sentences, stories=stories, rounds=rounds, clear_cache=True,
+        ),
+        'batch_warm_cache': __best_time(
+            identify=language_codes_for_sentences, stories=stories, rounds=rounds, clear_cache=False,
+        ),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare per-sentence and batched sentence language identification.")
+    parser.add_argument('--rounds', type=int, default=3, help="Number of rounds to run.")
+    parser.add_argument('files', nargs='+', help="Plain text files with a single story's text each.")
+    args = parser.parse_args()
+
+    story_texts = []
+    for path in args.files:
+        with open(path, mode='r', encoding='utf-8', errors='replace') as f:
+            story_texts.append(f.read())
+
+    timings = benchmark_identify_language(story_texts=story_texts, rounds=args.rounds)
+
+    print("Sentences: %d" % timings['sentences'])
+    print("%-20s %10s" % ('Method', 'Time (ms)'))
+    for method in ['per_sentence', 'batch_cold_cache', 'batch_warm_cache']:
+        print("%-20s %10.2f" % (method, timings[method] * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,12 @@
 import bz2
+import functools
 import gzip as gzip_lib
+import io
 import os
-from typing import Union
+import zlib
+from typing import BinaryIO, Callable, List, Optional, Tuple, Union
+
+import zstandard
 
 from mediawords.util.log import create_logger
 from mediawords.util.paths import file_extension
@@ -46,6 +51,21 @@ class McGunzipException(McCompressException):
     pass
 
 
+class McZstdException(McCompressException):
+    """zstd() exception."""
+    pass
+
+
+class McUnzstdException(McCompressException):
+    """unzstd() exception."""
+    pass
+
+
+class McTrainZstdDictionaryException(McCompressException):
+    """train_zstd_dictionary() exception."""
+    pass
+
+
 def extract_tarball_to_directory(archive_file: str, dest_directory: str, strip_root: bool = False) -> None:
     """Extract Tar archive (.tar, .tar.gz or .tgz) to destination directory, optionally stripping the root directory
     first."""
@@ -201,3 +221,409 @@ def gunzip(data: bytes) -> bytes:
         raise McGunzipException("Gunzipped data is not bytes.")
 
     return gunzipped_data
+
+
+# Zstandard compression level (fast to compress while still compressing better than Gzip's level 9)
+__ZSTD_COMPRESSION_LEVEL = 9
+
+# Default size of trained Zstandard dictionaries (same as "zstd --train" default)
+__ZSTD_DEFAULT_DICTIONARY_SIZE = 112640
+
+
+@functools.lru_cache(maxsize=16)
+def __zstd_dictionary(dictionary: bytes) -> zstandard.ZstdCompressionDict:
+    """Return parsed (and cached) Zstandard dictionary.
+
+    Dictionary gets digested for the compression level only once instead of on every compression of a small object."""
+    zstd_dictionary = zstandard.ZstdCompressionDict(dictionary)
+    zstd_dictionary.precompute_compress(level=__ZSTD_COMPRESSION_LEVEL)
+    return zstd_dictionary
+
+
+def zstd(data: Union[str, bytes], dictionary: Optional[bytes] = None) -> bytes:
+    """Compress data with Zstandard, optionally using a dictionary trained with train_zstd_dictionary()."""
+
+    if data is None:
+        raise McZstdException("Data is None.")
+
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+
+    if not isinstance(data, bytes):
+        raise McZstdException("Data is not str or bytes: %s" % str(data))
+
+    try:
+        if dictionary:
+            compressor = zstandard.ZstdCompressor(level=__ZSTD_COMPRESSION_LEVEL,
+                                                  dict_data=__zstd_dictionary(dictionary))
+        else:
+            compressor = zstandard.ZstdCompressor(level=__ZSTD_COMPRESSION_LEVEL)
+
+        zstd_data = compressor.compress(data)
+    except Exception as ex:
+        raise McZstdException("Unable to compress data with Zstandard: %s" % str(ex))
+
+    if zstd_data is None:
+        raise McZstdException("Zstandard compressed data is None.")
+
+    if not isinstance(zstd_data, bytes):
+        raise McZstdException("Zstandard compressed data is not bytes.")
+
+    return zstd_data
+
+
+def unzstd(data: bytes, dictionary: Optional[bytes] = None) -> bytes:
+    """Decompress Zstandard data, optionally using a dictionary that the data was compressed with."""
+
+    if data is None:
+        raise McUnzstdException("Data is None.")
+
+    if not isinstance(data, bytes):
+        raise McUnzstdException("Data is not bytes: %s" % str(data))
+
+    if len(data) == 0:
+        raise McUnzstdException("Data is empty (no way an empty string is a valid Zstandard frame).")
+
+    try:
+        dictionary_id = zstandard.get_frame_parameters(data).dict_id
+    except Exception as ex:
+        raise McUnzstdException("Unable to read Zstandard frame parameters: %s" % str(ex))
+
+    if dictionary_id and not dictionary:
+        raise McUnzstdException("Data was compressed with dictionary ID %d but no dictionary was provided." % (
+            dictionary_id,
+        ))
+
+    try:
+        if dictionary_id:
+            decompressor = zstandard.ZstdDecompressor(dict_data=__zstd_dictionary(dictionary))
+        else:
+            decompressor = zstandard.ZstdDecompressor()
+
+        # Decompression object doesn't need the content size to be present in the frame header
+        unzstd_data = decompressor.decompressobj().decompress(data)
+    except Exception as ex:
+        raise McUnzstdException("Unable to decompress Zstandard data: %s" % str(ex))
+
+    if unzstd_data is None:
+        raise McUnzstdException("Zstandard decompressed data is None.")
+
+    if not isinstance(unzstd_data, bytes):
+        raise McUnzstdException("Zstandard decompressed data is not bytes.")
+
+    return unzstd_data
+
+
+def train_zstd_dictionary(samples: List[bytes], dictionary_size: int = __ZSTD_DEFAULT_DICTIONARY_SIZE) -> bytes:
+    """Train Zstandard dictionary on samples of small objects (e.g. HTML pages or JSON annotations).
+
+    Dictionaries make a difference for objects of up to a few dozen kilobytes; the same dictionary has to be kept
+    around and passed to unzstd() for as long as there is data compressed with it."""
+
+    if not samples:
+        raise McTrainZstdDictionaryException("Samples are empty.")
+
+    samples = [sample.encode('utf-8') if isinstance(sample, str) else sample for sample in samples]
+
+    try:
+        dictionary = zstandard.train_dictionary(dictionary_size, samples)
+    except Exception as ex:
+        raise McTrainZstdDictionaryException("Unable to train Zstandard dictionary: %s" % str(ex))
+
+    return dictionary.as_bytes()
+
+
+# Size of chunks to read from source streams when (de)compressing streams
+__STREAM_CHUNK_SIZE = 64 * 1024
+
+# Max. size of Zstandard frame header
+__ZSTD_MAX_FRAME_HEADER_SIZE = 18
+
+
+class _CodecStream(io.RawIOBase):
+    """Readable stream of data that gets read from a source stream in chunks and passed through a (de)compressor.
+
+    Only the current chunk is kept in memory, so arbitrarily large data can be (de)compressed."""
+
+    __slots__ = [
+        '__source',
+        '__process',
+        '__finish',
+        '__exception_class',
+        '__chunk_size',
+        '__close_source',
+        '__buffer',
+        '__buffer_offset',
+        '__finished',
+    ]
+
+    def __init__(self,
+                 source: BinaryIO,
+                 process: Callable[[bytes], bytes],
+                 finish: Callable[[], bytes],
+                 exception_class: type,
+                 chunk_size: int,
+                 close_source: bool = False,
+                 prefix: bytes = b''):
+        """Constructor.
+
+        Arguments:
+        source - readable stream to read data from
+        process - function that returns (de)compressed chunk of data
+        finish - function that returns whatever's left in the (de)compressor once source is read until EOF
+        exception_class - exception class to raise on (de)compression errors
+        chunk_size - size of chunks to read from source
+        close_source - whether to close source stream when this stream gets closed
+        prefix - data to return before any data that gets read from source
+        """
+        super().__init__()
+
+        self.__source = source
+        self.__process = process
+        self.__finish = finish
+        self.__exception_class = exception_class
+        self.__chunk_size = chunk_size
+        self.__close_source = close_source
+
+        self.__buffer = prefix
+        self.__buffer_offset = 0
+        self.__finished = False
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        while self.__buffer_offset >= len(self.__buffer):
+            if self.__finished:
+                return 0
+
+            chunk = self.__source.read(self.__chunk_size)
+
+            try:
+                if chunk:
+                    self.__buffer = self.__process(chunk)
+                else:
+                    self.__buffer = self.__finish()
+                    self.__finished = True
+            except self.__exception_class:
+                raise
+            except Exception as ex:
+                raise self.__exception_class("Unable to process stream: %s" % str(ex))
+
+            self.__buffer_offset = 0
+
+        size = min(len(b), len(self.__buffer) - self.__buffer_offset)
+        b[:size] = self.__buffer[self.__buffer_offset:self.__buffer_offset + size]
+        self.__buffer_offset += size
+
+        return size
+
+    def close(self) -> None:
+        if not self.closed and self.__close_source:
+            self.__source.close()
+        super().close()
+
+
+def __codec_stream(source: BinaryIO,
+                   process: Callable[[bytes], bytes],
+                   finish: Callable[[], bytes],
+                   exception_class: type,
+                   close_source: bool,
+                   prefix: bytes = b'') -> BinaryIO:
+    """Return buffered codec stream."""
+
+    if source is None:
+        raise exception_class("Stream is None.")
+
+    if not hasattr(source, 'read'):
+        raise exception_class("Stream is not readable: %s" % str(source))
+
+    return io.BufferedReader(_CodecStream(source=source,
+                                          process=process,
+                                          finish=finish,
+                                          exception_class=exception_class,
+                                          chunk_size=__STREAM_CHUNK_SIZE,
+                                          close_source=close_source,
+                                          prefix=prefix))
+
+
+def __decompress_multiple_members(decompressor_factory: Callable[[], object]) -> Tuple[Callable, Callable]:
+    """Return (process, finish) functions which decompress concatenated members (like "gunzip" and "bunzip2" do)."""
+
+    state = {
+        'decompressor': decompressor_factory(),
+        'read_anything': False,
+    }
+
+    def process(chunk: bytes) -> bytes:
+        state['read_anything'] = True
+
+        output = []
+        while chunk:
+            if state['decompressor'].eof:
+                state['decompressor'] = decompressor_factory()
+            output.append(state['decompressor'].decompress(chunk))
+            chunk = state['decompressor'].unused_data if state['decompressor'].eof else b''
+
+        return b''.join(output)
+
+    def finish() -> bytes:
+        if not state['read_anything']:
+            raise Exception("Stream is empty (no way an empty stream is valid compressed data).")
+        if not state['decompressor'].eof:
+            raise Exception("Stream ended before the end of compressed data.")
+        return b''
+
+    return process, finish
+
+
+def peek_stream(stream: BinaryIO, size: int, close_source: bool = False) -> Tuple[bytes, BinaryIO]:
+    """Read up to "size" first bytes of a stream; return them together with a stream that starts from the beginning.
+
+    Useful for detecting compression method of a stream that can't seek()."""
+
+    if stream is None:
+        raise McCompressException("Stream is None.")
+
+    prefix = b''
+    while len(prefix) < size:
+        chunk = stream.read(size - len(prefix))
+        if not chunk:
+            break
+        prefix += chunk
+
+    return prefix, __codec_stream(source=stream,
+                                  process=lambda chunk: chunk,
+                                  finish=lambda: b'',
+                                  exception_class=McCompressException,
+                                  close_source=close_source,
+                                  prefix=prefix)
+
+
+def gzip_stream(stream: BinaryIO, close_source: bool = False) -> BinaryIO:
+    """Return readable stream of gzipped data that gets read from another stream.
+
+    If "close_source" is set, closing the returned stream closes the source stream too."""
+
+    # wbits = 31: Gzip header and trailer
+    compressor = zlib.compressobj(9, zlib.DEFLATED, 31)
+
+    return __codec_stream(source=stream,
+                          process=compressor.compress,
+                          finish=compressor.flush,
+                          exception_class=McGzipException,
+                          close_source=close_source)
+
+
+def gunzip_stream(stream: BinaryIO, close_source: bool = False) -> BinaryIO:
+    """Return readable stream of gunzipped data that gets read from another stream.
+
+    If "close_source" is set, closing the returned stream closes the source stream too."""
+
+    process, finish = __decompress_multiple_members(decompressor_factory=lambda: zlib.decompressobj(31))
+
+    return __codec_stream(source=stream,
+                          process=process,
+                          finish=finish,
+                          exception_class=McGunzipException,
+                          close_source=close_source)
+
+
+def bzip2_stream(stream: BinaryIO, close_source: bool = False) -> BinaryIO:
+    """Return readable stream of bzipped data that gets read from another stream.
+
+    If "close_source" is set, closing the returned stream closes the source stream too."""
+
+    compressor = bz2.BZ2Compressor(9)
+
+    return __codec_stream(source=stream,
+                          process=compressor.compress,
+                          finish=compressor.flush,
+                          exception_class=McBzip2Exception,
+                          close_source=close_source)
+
+
+def bunzip2_stream(stream: BinaryIO, close_source: bool = False) -> BinaryIO:
+    """Return readable stream of bunzipped data that gets read from another stream.
+
+    If "close_source" is set, closing the returned stream closes the source stream too."""
+
+    process, finish = __decompress_multiple_members(decompressor_factory=bz2.BZ2Decompressor)
+
+    return __codec_stream(source=stream,
+                          process=process,
+                          finish=finish,
+                          exception_class=McBunzip2Exception,
+                          close_source=close_source)
+
+
+def zstd_stream(stream: BinaryIO, dictionary: Optional[bytes] = None, close_source: bool = False) -> BinaryIO:
+    """Return readable stream of Zstandard compressed data that gets read from another stream, optionally using a
+    dictionary trained with train_zstd_dictionary().
+
+    If "close_source" is set, closing the returned stream closes the source stream too."""
+
+    try:
+        if dictionary:
+            compressor = zstandard.ZstdCompressor(level=__ZSTD_COMPRESSION_LEVEL,
+                                                  dict_data=__zstd_dictionary(dictionary))
+        else:
+            compressor = zstandard.ZstdCompressor(level=__ZSTD_COMPRESSION_LEVEL)
+
+        compression_object = compressor.compressobj()
+    except Exception as ex:
+        raise McZstdException("Unable to create Zstandard compressor: %s" % str(ex))
+
+    return __codec_stream(source=stream,
+                          process=compression_object.compress,
+                          finish=compression_object.flush,
+                          exception_class=McZstdException,
+                          close_source=close_source)
+
+
+def unzstd_stream(stream: BinaryIO, dictionary: Optional[bytes] = None, close_source: bool = False) -> BinaryIO:
+    """Return readable stream of Zstandard decompressed data that gets read from another stream, optionally using a
+    dictionary that the data was compressed with.
+
+    If "close_source" is set, closing the returned stream closes the source stream too."""
+
+    if stream is None:
+        raise McUnzstdException("Stream is None.")
+
+    # Frame header has to be read first to find out whether the data was compressed with a dictionary
+    header, stream = peek_stream(stream=stream, size=__ZSTD_MAX_FRAME_HEADER_SIZE, close_source=close_source)
+
+    if len(header) == 0:
+        raise McUnzstdException("Stream is empty (no way an empty stream is a valid Zstandard frame).")
+
+    try:
+        dictionary_id = zstandard.get_frame_parameters(header).dict_id
+    except Exception as ex:
+        raise McUnzstdException("Unable to read Zstandard frame parameters: %s" % str(ex))
+
+    if dictionary_id and not dictionary:
+        raise McUnzstdException("Data was compressed with dictionary ID %d but no dictionary was provided." % (
+            dictionary_id,
+        ))
+
+    try:
+        if dictionary_id:
+            decompressor = zstandard.ZstdDecompressor(dict_data=__zstd_dictionary(dictionary))
+        else:
+            decompressor = zstandard.ZstdDecompressor()
+
+        decompression_object = decompressor.decompressobj()
+    except Exception as ex:
+        raise McUnzstdException("Unable to create Zstandard decompressor: %s" % str(ex))
+
+    def finish() -> bytes:
+        # Older "zstandard" versions don't tell whether the end of the frame has been reached
+        if not getattr(decompression_object, 'eof', True):
+            raise McUnzstdException("Stream ended before the end of Zstandard frame.")
+        return b''
+
+    return __codec_stream(source=stream,
+                          process=decompression_object.decompress,
+                          finish=finish,
+                          exception_class=McUnzstdException,
+                          close_source=True)
@@ -1,11 +1,19 @@
+import collections
+import concurrent.futures
 from io import StringIO
+import multiprocessing
+import multiprocessing.connection
+import os
+import queue
 import re
+import resource
 import sys
+import threading
+import time
+from typing import Callable, Optional
 
-# noinspection PyProtectedMember
-from pip._internal import main as pip_main
-
-import readability.readability
+from lxml import etree
+import lxml.html
 
 from mediawords.util.log import create_logger
 from mediawords.util.perl import decode_object_from_bytes_if_needed
@@ -27,6 +35,10 @@ def __get_pip_module_version(module_name):
 
     if module_name not in __module_version_cache:
 
+        # Importing Pip is slow so do it only when needed
+        # noinspection PyProtectedMember
+        from pip._internal import main as pip_main
+
         f = StringIO()
         sys.stdout = f
         pip_main(['show', module_name])
@@ -54,23 +66,86 @@ def extractor_name():
     return '%s-%s' % (readability_module, readability_version)
 
 
-def extract_article_from_html(html: str) -> str:
-    """Extract article HTML from a full HTML file."""
-    # FIXME move HTML stripping here too
+# Elements that never end up in the extracted article (Readability removes them itself) but make it slower
+__ELEMENTS_TO_STRIP = ['script', 'style', 'noscript', 'svg', etree.Comment, etree.ProcessingInstruction]
+
+# Runs of the same character or of whitespace that are too long to be natural language
+__REPEATED_CHARACTER_REGEX = re.compile(r'(.)\1{256,}', flags=re.DOTALL)
+__REPEATED_WHITESPACE_REGEX = re.compile(r'\s{256,}')
+
+# Shortest string that might contain a run to collapse
+__MIN_RUN_LENGTH = 257
+
+# Attributes that libxml2 URI-escapes when serializing HTML (e.g. a trailing space becomes "%20")
+__URI_ATTRIBUTES = ['href', 'src', 'action']
+
+
+def __collapse_runs(text: Optional[str]) -> Optional[str]:
+    """Collapse runs of the same character and of whitespace in a text node."""
+    if text is None or len(text) < __MIN_RUN_LENGTH:
+        return text
+
+    text = __REPEATED_CHARACTER_REGEX.sub(r'\1', text)
+    text = __REPEATED_WHITESPACE_REGEX.sub(' ', text)
+
+    return text
+
+
+def sanitize_html_for_extraction(html: str) -> str:
+    """Prepare HTML for Readability in a single parse: remove control characters, strip scripts, styles, <noscript>,
+    <svg>, comments and processing instructions, and collapse runs of repeated characters and whitespace in text.
+
+    Readability would remove most of the stripped elements itself, but only after parsing, scoring and cleaning them
+    up, so the pre-sanitized (and usually much smaller) document gets extracted faster."""
     html = decode_object_from_bytes_if_needed(html)
     if html is None or html == '':
         return ''
 
-    # Control characters will choke Readability
+    # Control characters will choke both lxml and Readability
     html = replace_control_nonprintable_characters(html)
 
+    try:
+        # Parse UTF-8 bytes (like Readability does) because lxml refuses Unicode strings with encoding declarations
+        doc = lxml.html.document_fromstring(
+            html.encode('utf-8', errors='replace'),
+            parser=lxml.html.HTMLParser(encoding='utf-8'),
+        )
+    except Exception as ex:
+        # lxml refuses to parse some documents (e.g. ones with only whitespace), so fall back to regexes
+        log.debug("Unable to parse HTML for sanitizing, collapsing runs only: {}".format(ex))
+        html = __REPEATED_CHARACTER_REGEX.sub(r'\1', html)
+        html = __REPEATED_WHITESPACE_REGEX.sub(' ', html)
+        return html
+
+    etree.strip_elements(doc, *__ELEMENTS_TO_STRIP, with_tail=False)
+
     # If any character (e.g. a space, or a NUL byte) repeats itself over and over again, it's not natural language and
     # we don't need it; also, it will make Readability really slow
-    html = re.sub(r'(.)\1{256,}', '\1', html)
+    for element in doc.iter():
+        element.text = __collapse_runs(element.text)
+        element.tail = __collapse_runs(element.tail)
+
+        # Readability strips surrounding whitespace from links itself, but serializing the sanitized document would
+        # escape it first
+        for attribute in __URI_ATTRIBUTES:
+            value = element.get(attribute)
+            if value is not None and value != value.strip():
+                element.set(attribute, value.strip())
+
+    return lxml.html.tostring(doc, encoding='unicode')
+
+
+def extract_article_from_html(html: str) -> str:
+    """Extract article HTML from a full HTML file."""
+    # FIXME move HTML stripping here too
+    html = decode_object_from_bytes_if_needed(html)
+    if html is None or html == '':
+        return ''
 
-    # Same with any kind of whitespace; the whitespace character might wary (e.g. "\r\n \r\n ..."), so this is a
-    # separate regex
-    html = re.sub(r'\s{256,}', '\1', html)
+    html = sanitize_html_for_extraction(html)
+
+    # Readability is slow to import so import it only when it's first needed (Python caches imported modules)
+    import readability.readability
 
     try:
         doc = readability.readability.Document(html)
@@ -85,3 +160,312 @@ def extract_article_from_html(html: str) -> str:
         extracted_text = ''
 
     return extracted_text
+
+
+class McExtractorPoolException(Exception):
+    """Extractor pool exception."""
+    pass
+
+
+class McExtractorTimeoutException(McExtractorPoolException):
+    """Document took too long to extract so the worker extracting it got killed."""
+    pass
+
+
+class McExtractorWorkerDiedException(McExtractorPoolException):
+    """Worker died (e.g. got killed by the OOM killer) while extracting a document."""
+    pass
+
+
+def __process_memory_size() -> int:
+    """Return current process's virtual memory size in bytes (0 if unknown)."""
+    try:
+        with open('/proc/self/statm', mode='r') as f:
+            return int(f.read().split()[0]) * resource.getpagesize()
+    except Exception as ex:
+        log.warning("Unable to determine process memory size: {}".format(ex))
+        return 0
+
+
+def _extractor_worker(connection: multiprocessing.connection.Connection, memory_limit: Optional[int]) -> None:
+    """Extractor pool's worker: run (function, args, kwargs) tasks received over the connection and send back
+    (succeeded, result or exception) tuples until None or EOF is received."""
+
+    if memory_limit:
+        # Limit memory that the worker can allocate on top of what it has inherited from the parent so that a
+        # pathological document makes extraction raise MemoryError instead of exhausting the host's memory
+        address_space_limit = __process_memory_size() + memory_limit
+        resource.setrlimit(resource.RLIMIT_AS, (address_space_limit, address_space_limit))
+
+    while True:
+        try:
+            task = connection.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+
+        if task is None:
+            break
+
+        function, args, kwargs = task
+
+        try:
+            result = (True, function(*args, **kwargs))
+        except BaseException as ex:
+            result = (False, ex)
+
+        try:
+            connection.send(result)
+        except Exception as ex:
+            # Result or exception might not be picklable
+            connection.send((False, McExtractorPoolException("Unable to send result back: {}".format(ex))))
+
+
+class _ExtractorWorker(object):
+    """Extractor pool's worker process and the task that it's currently running."""
+
+    __slots__ = [
+        'process',
+        'connection',
+        'future',
+        'deadline',
+        'task_count',
+    ]
+
+    def __init__(self, memory_limit: Optional[int]):
+        self.connection, child_connection = multiprocessing.Pipe(duplex=True)
+        self.process = multiprocessing.Process(
+            target=_extractor_worker,
+            args=(child_connection, memory_limit,),
+            daemon=True,
+        )
+        self.process.start()
+        child_connection.close()
+
+        self.future = None
+        self.deadline = None
+        self.task_count = 0
+
+    def stop(self, kill: bool = False) -> None:
+        """Stop the worker, either gracefully or by killing it."""
+        if kill:
+            self.process.kill()
+        else:
+            try:
+                self.connection.send(None)
+            except Exception as ex:
+                log.debug("Unable to ask extractor worker {} to stop: {}".format(self.process.pid, ex))
+        self.process.join()
+        self.connection.close()
+
+
+class ExtractorPool(concurrent.futures.Executor):
+    """Pool of warm worker processes to run extractor in with hard per-document limits.
+
+    Readability can get stuck for a very long time on pathological HTML, so every document gets extracted with a
+    wall-clock timeout and a memory limit. If a worker fails to extract a document in time, it gets killed and replaced
+    with a fresh one, and the document's future raises McExtractorTimeoutException which callers can log and skip.
+    Workers get recycled after a number of tasks too to contain memory leaks.
+
+    Usage:
+
+        pool = ExtractorPool(max_workers=4)
+        future = pool.submit(extract_content, html)
+        try:
+            result = future.result()
+        except McExtractorTimeoutException as ex:
+            log.warning("Skipping document: {}".format(ex))
+        pool.shutdown()
+
+    Functions and their arguments have to be picklable.
+    """
+
+    # Default max. time (in seconds) to spend extracting a single document
+    DEFAULT_TIMEOUT = 60
+
+    # Default max. memory (in bytes) that a worker can allocate while extracting
+    DEFAULT_MEMORY_LIMIT = 1024 * 1024 * 1024
+
+    # Default number of tasks after which a worker gets replaced with a fresh one
+    DEFAULT_MAX_TASKS_PER_WORKER = 1000
+
+    # How often (in seconds) to check for new tasks while waiting for workers to finish
+    _POLL_INTERVAL = 0.1
+
+    __slots__ = [
+        '__max_workers',
+        '__timeout',
+        '__memory_limit',
+        '__max_tasks_per_worker',
+
+        # Queue of (future, function, args, kwargs) tasks to be run by the manager thread
+        '__tasks',
+
+        '__manager',
+        '__shutdown',
+        '__lock',
+    ]
+
+    def __init__(self,
+                 max_workers: Optional[int] = None,
+                 timeout: float = DEFAULT_TIMEOUT,
+                 memory_limit: Optional[int] = DEFAULT_MEMORY_LIMIT,
+                 max_tasks_per_worker: Optional[int] = DEFAULT_MAX_TASKS_PER_WORKER):
+        """Constructor.
+
+        Arguments:
+        max_workers - max. number of worker processes; defaults to the number of CPUs
+        timeout - max. time (in seconds) to spend extracting a single document
+        memory_limit - max. memory (in bytes) that a worker can allocate while extracting; None for no limit
+        max_tasks_per_worker - number of tasks after which a worker gets replaced; None to never replace workers
+        """
+        if max_workers is None:
+            max_workers = os.cpu_count() or 1
+        if max_workers < 1:
+            raise McExtractorPoolException("Max. number of workers must be positive.")
+        if timeout <= 0:
+            raise McExtractorPoolException("Timeout must be positive.")
+
+        self.__max_workers = max_workers
+        self.__timeout = timeout
+        self.__memory_limit = memory_limit
+        self.__max_tasks_per_worker = max_tasks_per_worker
+
+        self.__tasks = queue.Queue()
+        self.__manager = None
+        self.__shutdown = False
+        self.__lock = threading.Lock()
+
+    def submit(self, fn: Callable, *args, **kwargs) -> concurrent.futures.Future:
+        """Schedule function to be run in one of the workers; return future of its result."""
+        with self.__lock:
+            if self.__shutdown:
+                raise McExtractorPoolException("Extractor pool has been shut down.")
+
+            future = concurrent.futures.Future()
+            self.__tasks.put((future, fn, args, kwargs))
+
+            if self.__manager is None:
+                self.__manager = threading.Thread(target=self.__manage_workers, daemon=True)
+                self.__manager.start()
+
+            return future
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Stop workers after all the submitted tasks are done."""
+        with self.__lock:
+            self.__shutdown = True
+            manager = self.__manager
+            if manager is not None:
+                self.__tasks.put(None)
+
+        if wait and manager is not None:
+            manager.join()
+
+    def __manage_workers(self) -> None:
+        """Manager thread: hand out tasks to workers, collect their results, kill and replace stuck workers."""
+
+        workers = []
+        pending_tasks = collections.deque()
+        shutting_down = False
+
+        while True:
+
+            # Collect newly submitted tasks, blocking if there's nothing else to do
+            busy_workers = [worker for worker in workers if worker.future is not None]
+            block = not (busy_workers or pending_tasks or shutting_down)
+            while True:
+                try:
+                    task = self.__tasks.get(block=block)
+                except queue.Empty:
+                    break
+                block = False
+                if task is None:
+                    shutting_down = True
+                else:
+                    pending_tasks.append(task)
+
+            # Hand out pending tasks to idle (or new) workers
+            while pending_tasks:
+                worker = None
+                for idle_worker in workers:
+                    if idle_worker.future is None:
+                        worker = idle_worker
+                        break
+                if worker is None:
+                    if len(workers) >= self.__max_workers:
+                        break
+                    worker = _ExtractorWorker(memory_limit=self.__memory_limit)
+                    workers.append(worker)
+
+                future, function, args, kwargs = pending_tasks.popleft()
+                if not future.set_running_or_notify_cancel():
+                    continue
+
+                try:
+                    worker.connection.send((function, args, kwargs,))
+                except Exception as ex:
+                    future.set_exception(McExtractorPoolException("Unable to send task to worker: {}".format(ex)))
+                    continue
+
+                worker.future = future
+                worker.deadline = time.monotonic() + self.__timeout
+                worker.task_count += 1
+
+            busy_workers = [worker for worker in workers if worker.future is not None]
+
+            if shutting_down and not busy_workers and not pending_tasks:
+                break
+
+            if not busy_workers:
+                continue
+
+            # Wait for results
+            wait_timeout = min(worker.deadline for worker in busy_workers) - time.monotonic()
+            wait_timeout = max(0, min(wait_timeout, self._POLL_INTERVAL))
+            ready_connections = multiprocessing.connection.wait(
+                [worker.connection for worker in busy_workers],
+                timeout=wait_timeout,
+            )
+
+            for worker in busy_workers:
+                replace_worker = False
+
+                if worker.connection in ready_connections:
+                    try:
+                        succeeded, result = worker.connection.recv()
+                    except (EOFError, OSError) as ex:
+                        worker.future.set_exception(McExtractorWorkerDiedException(
+                            "Extractor worker {} died with exit code {}: {}".format(
+                                worker.process.pid, worker.process.exitcode, ex,
+                            )
+                        ))
+                        replace_worker = True
+                    else:
+                        if succeeded:
+                            worker.future.set_result(result)
+                        else:
+                            worker.future.set_exception(result)
+
+                    if self.__max_tasks_per_worker and worker.task_count >= self.__max_tasks_per_worker:
+                        replace_worker = True
+
+                    worker.future = None
+
+                elif time.monotonic() >= worker.deadline:
+                    log.warning("Extractor worker {} timed out after {} seconds, killing it...".format(
+                        worker.process.pid, self.__timeout,
+                    ))
+                    worker.future.set_exception(McExtractorTimeoutException(
+                        "Extraction timed out after {} seconds.".format(self.__timeout)
+                    ))
+                    worker.future = None
+                    worker.stop(kill=True)
+                    workers.remove(worker)
+                    continue
+
+                if replace_worker:
+                    worker.stop(kill=worker.process.is_alive())
+                    workers.remove(worker)
+
+        for worker in workers:
+            worker.stop()
@@ -1,4 +1,6 @@
-from typing import Dict
+import collections
+import hashlib
+from typing import Dict, List, Optional, Tuple
 
 import cld2
 
@@ -11,6 +13,14 @@ __RELIABLE_IDENTIFICATION_MIN_TEXT_LENGTH = 10
 # Don't process strings longer than the following length
 __MAX_TEXT_LENGTH = 1024 * 1024
 
+# Max. number of sentences for which to keep language identification results cached
+__SENTENCE_LANGUAGE_CACHE_SIZE = 100 * 1000
+
+# ASCII characters that are not letters (to be deleted from ASCII-only text when counting letters)
+__ASCII_NON_LETTERS = bytes(c for c in range(128) if not chr(c).isalpha())
+
+__ASCII_DIGITS = b'0123456789'
+
 log = create_logger(__name__)
 
 
@@ -107,24 +117,115 @@ def identification_would_be_reliable(text: str) -> bool:
     text = __recode_utf8_string(text)
 
     # Not enough letters as opposed to non-letters?
-    word_character_count = 0
-    digit_count = 0
-    underscore_count = 0
-    for character in text:
-        if character.isalpha():
-            word_character_count += 1
-        if character.isdigit():
-            digit_count += 1
-        if character == '_':
-            underscore_count += 1
-
-    letter_count = word_character_count - digit_count - underscore_count
-    if letter_count < __RELIABLE_IDENTIFICATION_MIN_TEXT_LENGTH:
+    if __letter_count(text) < __RELIABLE_IDENTIFICATION_MIN_TEXT_LENGTH:
         return False
 
     return True
 
 
+def __letter_count(text: str) -> int:
+    """Return count of alphabetic characters minus count of digits and underscores in text."""
+
+    if text.isascii():
+        # Let bytes.translate() do the counting in C for the (most common) ASCII-only text
+        ascii_text = text.encode('ascii')
+        word_character_count = len(ascii_text.translate(None, __ASCII_NON_LETTERS))
+        digit_count = len(ascii_text) - len(ascii_text.translate(None, __ASCII_DIGITS))
+        underscore_count = ascii_text.count(b'_')
+
+    else:
+        word_character_count = sum(map(str.isalpha, text))
+        digit_count = sum(map(str.isdigit, text))
+        underscore_count = text.count('_')
+
+    return word_character_count - digit_count - underscore_count
+
+
+# Sentence's MD5 hash -> (language code, whether identification would be reliable) LRU cache
+__sentence_language_cache = collections.OrderedDict()
+
+
+def __cached_sentence_language(sentence: str) -> Optional[Tuple[str, bool]]:
+    """Return cached (language code, identification would be reliable) tuple for a sentence, or None if not cached."""
+    key = hashlib.md5(sentence.encode('utf-8', errors='replace')).digest()
+
+    result = __sentence_language_cache.get(key, None)
+    if result is not None:
+        __sentence_language_cache.move_to_end(key)
+
+    return result
+
+
+def __cache_sentence_language(sentence: str, result: Tuple[str, bool]) -> None:
+    """Cache (language code, identification would be reliable) tuple for a sentence."""
+    key = hashlib.md5(sentence.encode('utf-8', errors='replace')).digest()
+
+    __sentence_language_cache[key] = result
+    while len(__sentence_language_cache) > __SENTENCE_LANGUAGE_CACHE_SIZE:
+        __sentence_language_cache.popitem(last=False)
+
+
+def clear_sentence_language_cache() -> None:
+    """Clear language_codes_for_sentences() results cache."""
+    __sentence_language_cache.clear()
+
+
+def language_codes_for_sentences(sentences: List[str], story_language: str) -> List[str]:
+    """Returns ISO 690 language codes for a list of sentences of a single story.
+
+    If a sentence's language differs from the story's language and the identification is not likely to be reliable,
+    empty string ('') is returned for the sentence instead, i.e. for every sentence the result is the same as the one
+    of:
+
+        sentence_language = language_code_for_text(sentence)
+        if sentence_language != story_language and not identification_would_be_reliable(sentence):
+            sentence_language = ''
+
+    Identification results get cached (by sentence hash) so that sentences that are repeated often (e.g.
+    boilerplate) don't have to be identified again.
+
+    :param sentences: Sentences of a story that should be identified
+    :param story_language: ISO 690 language code of the whole story (e.g. 'en'), or empty string if unknown
+    :return: List of ISO 690 language codes (or empty strings) in the same order as the sentences
+    """
+    sentences = decode_object_from_bytes_if_needed(sentences)
+    story_language = decode_object_from_bytes_if_needed(story_language)
+
+    if not story_language:
+        story_language = ''
+
+    language_codes = []
+
+    for sentence in sentences:
+
+        if not sentence:
+            language_codes.append('')
+            continue
+
+        result = __cached_sentence_language(sentence)
+        if result is None:
+
+            reliable = identification_would_be_reliable(sentence)
+
+            # Unreliable identification result that differs from the (unknown) story's language would get discarded
+            # anyway, so don't bother running the identifier
+            if not (reliable or story_language):
+                language_codes.append('')
+                continue
+
+            result = (language_code_for_text(sentence), reliable)
+            __cache_sentence_language(sentence=sentence, result=result)
+
+        (language_code, reliable) = result
+
+        if language_code != story_language and not reliable:
+            language_code = ''
+
+        language_codes.append(language_code)
+
+    return language_codes
+
+
 def language_is_supported(code: str) -> bool:
     """Returns True if the language code if supported by the identifier.
 
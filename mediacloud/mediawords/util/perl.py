@@ -2,8 +2,9 @@
 # Perl (Inline::Perl) helpers
 #
 from enum import Enum
+import functools
 import re
-from typing import Union
+from typing import Tuple, Union
 
 from mediawords.util.log import create_logger
 
@@ -59,92 +60,134 @@ class McConvertDBDPgArgumentsToPsycopg2FormatException(Exception):
     pass
 
 
-def __replace_double_question_marks_or_return_none(q: str, q_args: list) -> Union[tuple, None]:
-    """Replace "??" parameters with psycopg2's "%s" and tuple parameter, or return None if not found."""
+# Max. number of DBD::Pg-style queries to keep converted psycopg2-style queries for
+__CONVERTED_QUERY_CACHE_SIZE = 1024
+
+# Matches 'PostgreSQL''s quoted literals'
+__QUOTED_LITERAL_REGEX = re.compile(r"('(?:[^']+|'')+')")
+
+__DOUBLE_QUESTION_MARK_REGEX = re.compile(r"""
+    (?P<in_statement>\sIN\s)    # "(WHERE) column IN"
+    \(\s*\?\?\s*\)              # "(??)" with optional spaces around
+""", flags=re.I | re.X)
+
+__QUESTION_MARK_REGEX = re.compile(r"""
+    (?P<char_before_question_mark>\s|,|\()      # Question mark preceded by whitespace, comma or bracket
+    \?                                          # Question mark
+    (?=(\s|,|\)|(::)|$))                        # Lookahead and make sure question mark is singled out
+""", flags=re.I | re.X)
+
+__DOLLAR_SIGN_REGEX = re.compile(r"""
+    (?P<char_before_dollar_sign>\s|,|\()    # Dollar sign preceded by whitespace, comma or bracket
+    \$(?P<param_index>\d)                   # Dollar sign with a single-digit index ("$1", "$2", ...)
+    (?=(\s|,|\)|(::)|$))                    # Lookahead and make sure dollar sign is singled out
+""", flags=re.I | re.X)
+
+
+class _PlaceholderType(Enum):
+    """DBD::Pg placeholder type."""
+    double_question_mark = 1
+    question_mark = 2
+    dollar_signs = 3
+
+
+def __replace_double_question_marks_or_return_none(q: str) -> Union[str, None]:
+    """Replace "??" parameters with psycopg2's "%s", or return None if not found."""
 
-    double_question_mark_regex = re.compile(r"""
-        (?P<in_statement>\sIN\s)    # "(WHERE) column IN"
-        \(\s*\?\?\s*\)              # "(??)" with optional spaces around
-    """, flags=re.I | re.X)
     double_question_mark_replacement = r'\g<in_statement>%s'
 
-    double_question_mark_count = len(re.findall(double_question_mark_regex, q))
+    double_question_mark_count = len(re.findall(__DOUBLE_QUESTION_MARK_REGEX, q))
     if double_question_mark_count > 0:
         if double_question_mark_count > 1:
             raise McConvertDBDPgArgumentsToPsycopg2FormatException("""
-                More than one double question mark found
-                in query "%(query)s" (arguments: %(query_args)s)
-            """ % {
-                'query': q,
-                'query_args': q_args,
-            })
-
-        q = re.sub(double_question_mark_regex, double_question_mark_replacement, q)
-
-        if not isinstance(q_args, tuple):  # might have been converted previously
-            # Convert arguments to first (and only) psycopg2's query parameter
-            # (which should be a tuple: http://stackoverflow.com/a/28117658/200603)
-            q_args = tuple(q_args)
-            q_args = (q_args,)
+                More than one double question mark found in query "%(query)s"
+            """ % {'query': q})
 
-        return q, q_args
+        return re.sub(__DOUBLE_QUESTION_MARK_REGEX, double_question_mark_replacement, q)
 
     else:
         return None
 
 
-def __replace_question_marks_or_return_none(q: str, q_args: list) -> Union[tuple, None]:
+def __replace_question_marks_or_return_none(q: str) -> Union[str, None]:
     """Replace "?" parameters with psycopg2's "%s", or return None if not found."""
 
-    question_mark_regex = re.compile(r"""
-        (?P<char_before_question_mark>\s|,|\()      # Question mark preceded by whitespace, comma or bracket
-        \?                                          # Question mark
-        (?=(\s|,|\)|(::)|$))                        # Lookahead and make sure question mark is singled out
-    """, flags=re.I | re.X)
     question_mark_replacement = r'\g<char_before_question_mark>%s'
 
-    question_mark_count = len(re.findall(question_mark_regex, q))
+    question_mark_count = len(re.findall(__QUESTION_MARK_REGEX, q))
     if question_mark_count > 0:
-
-        q = re.sub(question_mark_regex, question_mark_replacement, q)
-
-        # Convert arguments to psycopg2's argument tuple
-        if not isinstance(q_args, tuple):  # might have been converted previously
-            q_args = tuple(q_args)
-
-        return q, q_args
+        return re.sub(__QUESTION_MARK_REGEX, question_mark_replacement, q)
 
     else:
         return None
 
 
-def __replace_dollar_signs_or_return_none(q: str, q_args: list) -> Union[tuple, None]:
+def __replace_dollar_signs_or_return_none(q: str) -> Union[str, None]:
     """Replace "$1" parameters with psycopg2's "%(param_1)s", or return None if not found."""
 
-    dollar_sign_regex = re.compile(r"""
-        (?P<char_before_dollar_sign>\s|,|\()    # Dollar sign preceded by whitespace, comma or bracket
-        \$(?P<param_index>\d)                   # Dollar sign with a single-digit index ("$1", "$2", ...)
-        (?=(\s|,|\)|(::)|$))                    # Lookahead and make sure dollar sign is singled out
-    """, flags=re.I | re.X)
     dollar_sign_replacement = r'\g<char_before_dollar_sign>%(param_\g<param_index>)s'
 
-    dollar_sign_unique_indexes = set([x[1] for x in re.findall(dollar_sign_regex, q)])
+    dollar_sign_unique_indexes = set([x[1] for x in re.findall(__DOLLAR_SIGN_REGEX, q)])
     dollar_sign_unique_count = len(dollar_sign_unique_indexes)
     if dollar_sign_unique_count > 0:
+        return re.sub(__DOLLAR_SIGN_REGEX, dollar_sign_replacement, q)
 
-        q = re.sub(dollar_sign_regex, dollar_sign_replacement, q)
+    else:
+        return None
 
-        # Convert arguments to psycopg2's argument dictionary
-        if not isinstance(q_args, dict):  # might have been converted previously
-            q_args_dict = {}
-            for i in range(0, len(q_args)):
-                q_args_dict['param_%d' % (i + 1)] = q_args[i]
-            q_args = q_args_dict
 
-        return q, q_args
+@functools.lru_cache(maxsize=__CONVERTED_QUERY_CACHE_SIZE)
+def __convert_dbd_pg_query_to_psycopg2_format(query: str) -> Tuple[str, Union[_PlaceholderType, None]]:
+    """Convert DBD::Pg's question mark-style SQL query to psycopg2's syntax; return converted query and the placeholder
+    type that was found.
 
-    else:
-        return None
+    Conversion depends on the query text only so the results get cached as the same queries get run over and over
+    again."""
+
+    # Split SQL query into literals and not literals, iterate over all of them, replace parameters to psycopg2-style
+    # only for the non-literals parts
+    split_query = re.split(__QUOTED_LITERAL_REGEX, query)
+    converted_query = ""
+
+    placeholder_type = None
+
+    def __set_placeholder_type(new_placeholder_type: _PlaceholderType) -> None:
+        nonlocal placeholder_type
+        if placeholder_type is not None:
+            if placeholder_type != new_placeholder_type:
+                raise McConvertDBDPgArgumentsToPsycopg2FormatException("""
+                    Mixed placeholder types? Query: %(query)s
+                """ % {'query': query})
+        placeholder_type = new_placeholder_type
+
+    for query_part in split_query:
+        if __QUOTED_LITERAL_REGEX.fullmatch(query_part):
+            # Don't touch quoted literals
+            pass
+        else:
+
+            double_question_mark = __replace_double_question_marks_or_return_none(q=query_part)
+            if double_question_mark is not None:
+                __set_placeholder_type(_PlaceholderType.double_question_mark)
+                query_part = double_question_mark
+
+            else:
+
+                question_mark = __replace_question_marks_or_return_none(q=query_part)
+                if question_mark is not None:
+                    __set_placeholder_type(_PlaceholderType.question_mark)
+                    query_part = question_mark
+
+                else:
+
+                    dollar_signs = __replace_dollar_signs_or_return_none(q=query_part)
+                    if dollar_signs is not None:
+                        __set_placeholder_type(_PlaceholderType.dollar_signs)
+                        query_part = dollar_signs
+
+        converted_query += query_part
+
+    return converted_query, placeholder_type
 
 
 # MC_REWRITE_TO_PYTHON: remove after porting queries to named parameter style
@@ -181,71 +224,12 @@ def convert_dbd_pg_arguments_to_psycopg2_format(*query_parameters: Union[list, t
 
     else:
 
-        # Matches 'PostgreSQL''s quoted literals'
-        quoted_literal_regex = r"('(?:[^']+|'')+')"
-
-        # Split SQL query into literals and not literals, iterate over all of them, replace parameters to psycopg2-style
-        # only for the non-literals parts
-        split_query = re.split(quoted_literal_regex, query)
-        converted_query = ""
-
-        class PlaceholderType(Enum):
-            double_question_mark = 1
-            question_mark = 2
-            dollar_signs = 3
-
-        placeholder_type = None
-
-        for query_part in split_query:
-            if re.match("^" + quoted_literal_regex + "$", query_part):
-                # Don't touch quoted literals
-                pass
-            else:
-
-                double_question_mark = __replace_double_question_marks_or_return_none(q=query_part, q_args=query_args)
-                if double_question_mark is not None:
-
-                    if placeholder_type is not None:
-                        if placeholder_type != PlaceholderType.double_question_mark:
-                            raise McConvertDBDPgArgumentsToPsycopg2FormatException("""
-                                Mixed placeholder types? Query: %(query)s, arguments: %(query_args)s
-                            """ % {'query': query, 'query_args': query_args})
-                    placeholder_type = PlaceholderType.double_question_mark
-
-                    query_part = double_question_mark[0]
-                    query_args = double_question_mark[1]
-
-                else:
-
-                    question_mark = __replace_question_marks_or_return_none(q=query_part, q_args=query_args)
-                    if question_mark is not None:
-
-                        if placeholder_type is not None:
-                            if placeholder_type != PlaceholderType.question_mark:
-                                raise McConvertDBDPgArgumentsToPsycopg2FormatException("""
-                                    Mixed placeholder types? Query: %(query)s, arguments: %(query_args)s
-                                """ % {'query': query, 'query_args': query_args})
-                        placeholder_type = PlaceholderType.question_mark
-
-                        query_part = question_mark[0]
-                        query_args = question_mark[1]
-
-                    else:
-
-                        dollar_signs = __replace_dollar_signs_or_return_none(q=query_part, q_args=query_args)
-                        if dollar_signs is not None:
-
-                            if placeholder_type is not None:
-                                if placeholder_type != PlaceholderType.dollar_signs:
-                                    raise McConvertDBDPgArgumentsToPsycopg2FormatException("""
-                                        Mixed placeholder types? Query: %(query)s, arguments: %(query_args)s
-                                    """ % {'query': query, 'query_args': query_args})
-                            placeholder_type = PlaceholderType.dollar_signs
-
-                            query_part = dollar_signs[0]
-                            query_args = dollar_signs[1]
-
-            converted_query += query_part
+        try:
+            query, placeholder_type = __convert_dbd_pg_query_to_psycopg2_format(query)
+        except McConvertDBDPgArgumentsToPsycopg2FormatException as ex:
+            raise McConvertDBDPgArgumentsToPsycopg2FormatException(
+                "%(exception)s; arguments: %(query_args)s" % {'exception': str(ex).strip(), 'query_args': query_args}
+            )
 
         if placeholder_type is None:
             raise McConvertDBDPgArgumentsToPsycopg2FormatException("""
@@ -253,7 +237,21 @@ def convert_dbd_pg_arguments_to_psycopg2_format(*query_parameters: Union[list, t
                 were found. Query: %(query)s; arguments: %(query_args)s
             """ % {'query': query, 'query_args': query_args})
 
-        query = converted_query
+        if placeholder_type == _PlaceholderType.double_question_mark:
+            # Convert arguments to first (and only) psycopg2's query parameter
+            # (which should be a tuple: http://stackoverflow.com/a/28117658/200603)
+            query_args = (tuple(query_args),)
+
+        elif placeholder_type == _PlaceholderType.question_mark:
+            # Convert arguments to psycopg2's argument tuple
+            query_args = tuple(query_args)
+
+        else:
+            # Convert arguments to psycopg2's argument dictionary
+            query_args_dict = {}
+            for i in range(0, len(query_args)):
+                query_args_dict['param_%d' % (i + 1)] = query_args[i]
+            query_args = query_args_dict
 
     if query_args is None:
         query_parameters = (query,)
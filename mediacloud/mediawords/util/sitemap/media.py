@@ -21,18 +21,9 @@ def fetch_sitemap_pages_for_media_id(db: DatabaseHandler, media_id: int) -> None
 
     log.info("Storing {} sitemap pages for media ID {} ({})...".format(len(pages), media_id, media_url))
 
-    insert_counter = 0
+    rows = []
     for page in pages:
-        db.query("""
-            INSERT INTO media_sitemap_pages (
-                media_id, url, last_modified, change_frequency, priority,
-                news_title, news_publish_date
-            ) VALUES (
-                %(media_id)s, %(url)s, %(last_modified)s, %(change_frequency)s, %(priority)s,
-                %(news_title)s, %(news_publish_date)s
-            )
-            ON CONFLICT (url) DO NOTHING
-        """, {
+        rows.append({
             'media_id': media_id,
             'url': page.url,
             'last_modified': page.last_modified,
@@ -42,8 +33,6 @@ def fetch_sitemap_pages_for_media_id(db: DatabaseHandler, media_id: int) -> None
             'news_publish_date': page.news_story.publish_date if page.news_story is not None else None,
         })
 
-        insert_counter += 1
-        if insert_counter % 1000 == 0:
-            log.info("Inserted {} / {} URLs...".format(insert_counter, len(pages)))
+    db.insert_many(table='media_sitemap_pages', rows=rows, on_conflict='(url) DO NOTHING', returning=False)
 
     log.info("Done storing {} sitemap pages for media ID {} ({}).".format(len(pages), media_id, media_url))
@@ -1,3 +1,4 @@
+import io
 import os
 import tarfile
 import tempfile
@@ -15,7 +16,17 @@ from mediawords.util.compress import (
     gunzip,
     bzip2,
     bunzip2,
-    McBunzip2Exception, McGunzipException, McGzipException, McBzip2Exception)
+    zstd,
+    unzstd,
+    train_zstd_dictionary,
+    peek_stream,
+    gzip_stream,
+    gunzip_stream,
+    bzip2_stream,
+    bunzip2_stream,
+    zstd_stream,
+    unzstd_stream,
+    McBunzip2Exception, McGunzipException, McGzipException, McBzip2Exception, McUnzstdException, McCompressException)
 
 
 def test_extract_tarball_to_directory():
@@ -195,6 +206,52 @@ def test_bzip2_bad_input():
         bunzip2(b'No way this is valid Bzip2 data')
 
 
+def test_zstd():
+    def __inner_test_zstd(data_: bytes) -> None:
+        zstd_data = zstd(data_)
+        assert len(zstd_data) > 0
+        assert isinstance(zstd_data, bytes)
+        assert zstd_data != data_
+
+        unzstd_data = unzstd(zstd_data)
+        assert unzstd_data == data_
+
+    for data in __COMPRESS_TEST_DATA:
+        __inner_test_zstd(data_=data)
+
+
+def test_zstd_dictionary():
+    samples = [
+        ('{"stories_id": %d, "results": {"places": {"mentions": [{"source": {"string": "Boston"}}]}}}' % x).encode()
+        for x in range(1000)
+    ]
+    dictionary = train_zstd_dictionary(samples=samples, dictionary_size=4096)
+    assert len(dictionary) > 0
+
+    data = b'{"stories_id": 12345, "results": {"places": {"mentions": [{"source": {"string": "Cambridge"}}]}}}'
+
+    zstd_data = zstd(data, dictionary=dictionary)
+    assert len(zstd_data) < len(zstd(data))
+
+    assert unzstd(zstd_data, dictionary=dictionary) == data
+
+    # Dictionary is required to decompress data compressed with it
+    with pytest.raises(McUnzstdException):
+        unzstd(zstd_data)
+
+
+def test_zstd_bad_input():
+    with pytest.raises(McUnzstdException):
+        # noinspection PyTypeChecker
+        unzstd(None)
+
+    with pytest.raises(McUnzstdException):
+        unzstd(b'')
+
+    with pytest.raises(McUnzstdException):
+        unzstd(b'No way this is valid Zstandard data')
+
+
 def test_wrong_algorithm():
     def __inner_test_wrong_algorithm(data_: bytes) -> None:
         with pytest.raises(McBunzip2Exception):
@@ -204,3 +261,88 @@ def test_wrong_algorithm():
 
     for data in __COMPRESS_TEST_DATA:
         __inner_test_wrong_algorithm(data_=data)
+
+
+def test_compression_streams():
+    # Larger than a single chunk that streams get read in
+    large_data = os.urandom(100 * 1024) + b'Media Cloud' * 100 * 1024
+
+    methods = [
+        (gzip_stream, gunzip_stream, gzip, gunzip,),
+        (bzip2_stream, bunzip2_stream, bzip2, bunzip2,),
+        (zstd_stream, unzstd_stream, zstd, unzstd,),
+    ]
+
+    for compress_stream, uncompress_stream, compress, uncompress in methods:
+        for data in __COMPRESS_TEST_DATA + [large_data]:
+            compressed_data = compress_stream(io.BytesIO(data)).read()
+
+            # Streams are compatible with the non-streaming counterparts
+            assert uncompress(compressed_data) == data
+            assert uncompress_stream(io.BytesIO(compress(data))).read() == data
+
+            # Small reads
+            uncompressed_stream = uncompress_stream(io.BytesIO(compressed_data))
+            uncompressed_data = b''
+            while True:
+                chunk = uncompressed_stream.read(1000)
+                if not chunk:
+                    break
+                uncompressed_data += chunk
+            assert uncompressed_data == data
+
+        # Truncated data
+        compressed_data = compress(large_data)
+        with pytest.raises(McCompressException):
+            uncompress_stream(io.BytesIO(compressed_data[:len(compressed_data) // 2])).read()
+
+        with pytest.raises(McCompressException):
+            uncompress_stream(io.BytesIO(b'')).read()
+
+        with pytest.raises(McCompressException):
+            # noinspection PyTypeChecker
+            uncompress_stream(None)
+
+    # Concatenated members
+    assert gunzip_stream(io.BytesIO(gzip(b'foo') + gzip(b'bar'))).read() == b'foobar'
+    assert bunzip2_stream(io.BytesIO(bzip2(b'foo') + bzip2(b'bar'))).read() == b'foobar'
+
+    with pytest.raises(McGunzipException):
+        gunzip_stream(io.BytesIO(bzip2(b'foo'))).read()
+
+
+def test_compression_streams_close_source():
+    source = io.BytesIO(gzip(b'foo'))
+    gunzip_stream(source).close()
+    assert source.closed is False
+
+    gunzip_stream(source, close_source=True).close()
+    assert source.closed is True
+
+    source = io.BytesIO(zstd(b'foo'))
+    unzstd_stream(source, close_source=True).close()
+    assert source.closed is True
+
+
+def test_zstd_stream_dictionary():
+    samples = [('{"stories_id": %d, "label": "politics and government"}' % x).encode() for x in range(1000)]
+    dictionary = train_zstd_dictionary(samples=samples, dictionary_size=4096)
+
+    data = b'{"stories_id": 12345, "label": "politics and government"}'
+
+    zstd_data = zstd_stream(io.BytesIO(data), dictionary=dictionary).read()
+    assert unzstd(zstd_data, dictionary=dictionary) == data
+    assert unzstd_stream(io.BytesIO(zstd_data), dictionary=dictionary).read() == data
+
+    with pytest.raises(McUnzstdException):
+        unzstd_stream(io.BytesIO(zstd_data))
+
+
+def test_peek_stream():
+    prefix, stream = peek_stream(stream=io.BytesIO(b'foobar'), size=3)
+    assert prefix == b'foo'
+    assert stream.read() == b'foobar'
+
+    prefix, stream = peek_stream(stream=io.BytesIO(b'fo'), size=3)
+    assert prefix == b'fo'
+    assert stream.read() == b'fo'
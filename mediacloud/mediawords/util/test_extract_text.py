@@ -1,8 +1,21 @@
+import glob
+import os
 import re
+import time
 
+import pytest
 import timeout_decorator
 
-from mediawords.util.extract_text import extractor_name, extract_article_from_html
+from mediawords.test.data import get_path_to_data_files
+from mediawords.test.extract_text import extract_article_from_html_without_sanitizing
+from mediawords.util.extract_text import (
+    extractor_name,
+    extract_article_from_html,
+    sanitize_html_for_extraction,
+    ExtractorPool,
+    McExtractorPoolException,
+    McExtractorTimeoutException,
+)
 
 
 def test_extractor_name():
@@ -155,3 +168,91 @@ def test_extract_article_from_html_nonprintable_characters():
     extracted_text = extract_article_from_html(html)
 
     assert re.search(r'foo', extracted_text, flags=re.X)
+
+
+def test_sanitize_html_for_extraction():
+    assert sanitize_html_for_extraction('') == ''
+    # noinspection PyTypeChecker
+    assert sanitize_html_for_extraction(None) == ''
+
+    html = """
+        <html>
+        <head>
+            <title>Title</title>
+            <script>var foo = "<p>bar</p>";</script>
+            <style>p { color: red; }</style>
+        </head>
+        <body>
+            <!-- comment -->
+            <noscript><p>Enable JavaScript</p></noscript>
+            <svg><text>Vector</text></svg>
+            <p>Article <a href=" http://example.com/ ">text</a>.</p>
+            <p>Tail""" + '!' * 1000 + """</p>
+        </body>
+        </html>
+    """
+    sanitized_html = sanitize_html_for_extraction(html)
+
+    assert '<title>Title</title>' in sanitized_html
+    assert '<p>Article <a href="http://example.com/">text</a>.</p>' in sanitized_html
+    assert 'Tail!</p>' in sanitized_html
+    for stripped in ['var foo', 'color', 'comment', 'JavaScript', 'Vector']:
+        assert stripped not in sanitized_html
+
+
+def test_extract_article_from_html_sanitized_output_equivalence():
+    """Make sure that pre-sanitizing HTML doesn't change extractor's output for crawler test data."""
+    paths = glob.glob(os.path.join(get_path_to_data_files(subdirectory='crawler'), '*', '*.html'))
+    assert len(paths) > 0
+
+    for path in sorted(paths):
+        with open(path, mode='r', encoding='utf-8') as f:
+            html = f.read()
+
+        expected_text = extract_article_from_html_without_sanitizing(html)
+        extracted_text = extract_article_from_html(html)
+
+        assert extracted_text == expected_text, "Extracted text differs for {}".format(path)
+
+
+def _sleep_and_return(seconds: float, value: str) -> str:
+    time.sleep(seconds)
+    return value
+
+
+def _raise_exception(message: str) -> None:
+    raise Exception(message)
+
+
+def _allocate_memory(size: int) -> int:
+    return len(bytearray(size))
+
+
+def test_extractor_pool():
+    pool = ExtractorPool(max_workers=2, timeout=2, memory_limit=256 * 1024 * 1024, max_tasks_per_worker=2)
+
+    future = pool.submit(extract_article_from_html, '<p>Kim Kardashian</p>')
+    assert 'Kim Kardashian' in future.result()
+
+    # Stuck document gets timed out while the rest of the documents get extracted
+    stuck_future = pool.submit(_sleep_and_return, 60, 'stuck')
+    futures = [pool.submit(_sleep_and_return, 0, str(x)) for x in range(5)]
+    assert [f.result() for f in futures] == [str(x) for x in range(5)]
+    with pytest.raises(McExtractorTimeoutException):
+        stuck_future.result()
+
+    # Worker gets replaced after a timeout
+    assert pool.submit(_sleep_and_return, 0, 'after timeout').result() == 'after timeout'
+
+    with pytest.raises(Exception, match='Extraction failed'):
+        pool.submit(_raise_exception, 'Extraction failed').result()
+
+    # Memory limit
+    with pytest.raises(MemoryError):
+        pool.submit(_allocate_memory, 1024 * 1024 * 1024).result()
+    assert pool.submit(_allocate_memory, 1024).result() == 1024
+
+    pool.shutdown()
+
+    with pytest.raises(McExtractorPoolException):
+        pool.submit(_sleep_and_return, 0, 'after shutdown')
@@ -1,7 +1,7 @@
 from mediawords.languages.factory import LanguageFactory
 from mediawords.util.identify_language import (
     language_code_for_text, identification_would_be_reliable, language_is_supported,
-    language_name_for_code)
+    language_name_for_code, language_codes_for_sentences, clear_sentence_language_cache)
 
 
 def test_language_code_for_text():
@@ -68,6 +68,44 @@ def test_identification_would_be_reliable_digits():
     assert identification_would_be_reliable(text='000000000000000aaaaaaa') is False
 
 
+def test_identification_would_be_reliable_non_ascii():
+    assert identification_would_be_reliable(text='Įlinkdama fechtuotojo špaga') is True
+
+    # Digits and underscores get subtracted from the letter count
+    assert identification_would_be_reliable(text='ąčęėįšųūž_0123456789') is False
+    assert identification_would_be_reliable(text='ąčęėįšųūžą_0') is False
+    assert identification_would_be_reliable(text='ąčęėįšųūžąčę_') is True
+
+
+def test_language_codes_for_sentences():
+    assert language_codes_for_sentences(sentences=[], story_language='en') == []
+
+    sentences = [
+        '',
+        'Short.',
+        'This is a sentence in English.',
+        'Įlinkdama fechtuotojo špaga sublykčiojusi pragręžė apvalų arbūzą.',
+        '0000000000000000000000',
+    ]
+
+    for story_language in ['en', 'lt', '']:
+        expected_language_codes = []
+        for sentence in sentences:
+            sentence_language = language_code_for_text(sentence)
+            if sentence_language != story_language and not identification_would_be_reliable(sentence):
+                sentence_language = ''
+            expected_language_codes.append(sentence_language)
+
+        # Not cached
+        clear_sentence_language_cache()
+        assert language_codes_for_sentences(sentences=sentences, story_language=story_language) \
+            == expected_language_codes
+
+        # Cached
+        assert language_codes_for_sentences(sentences=sentences, story_language=story_language) \
+            == expected_language_codes
+
+
 def test_language_is_supported():
     assert language_is_supported(code='') is False
     # noinspection PyTypeChecker
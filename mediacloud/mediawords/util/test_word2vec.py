@@ -9,7 +9,7 @@ import shutil
 from mediawords.test.db.create import create_test_medium, create_test_feed, create_test_story, create_test_topic
 from mediawords.test.test_database import TestDatabaseWithSchemaTestCase
 from mediawords.util.paths import mc_root_path
-from mediawords.util.word2vec import train_word2vec_model, load_word2vec_model
+from mediawords.util.word2vec import train_word2vec_model, load_word2vec_model, load_word2vec_model_stream
 from mediawords.util.word2vec.exceptions import McWord2vecException
 from mediawords.util.word2vec.model_stores import SnapshotDatabaseModelStore
 from mediawords.util.word2vec.sentence_iterators import SnapshotSentenceIterator
@@ -112,6 +112,9 @@ class TestWord2vec(TestDatabaseWithSchemaTestCase):
         assert model_data is not None
         assert isinstance(model_data, bytes)
 
+        with load_word2vec_model_stream(model_store=model_store, models_id=models_id) as model_stream:
+            assert model_stream.read() == model_data
+
         # Save to file, make sure it loads
         temp_directory = tempfile.mkdtemp()
         temp_model_path = os.path.join(temp_directory, 'word2vec.pickle')
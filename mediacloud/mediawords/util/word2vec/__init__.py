@@ -1,8 +1,7 @@
 import os
 import shutil
 import tempfile
-
-import gensim
+from typing import BinaryIO
 
 from mediawords.util.log import create_logger
 from mediawords.util.word2vec.exceptions import McWord2vecException
@@ -31,6 +30,9 @@ def train_word2vec_model(sentence_iterator: AbstractSentenceIterator,
     word2vec_size = 100
     word2vec_max_vocab_size = 5000
 
+    # gensim is slow to import and is needed only for training
+    import gensim
+
     log.info("Creating model...")
     model = gensim.models.Word2Vec(
         sentences=sentence_iterator,
@@ -54,12 +56,9 @@ def train_word2vec_model(sentence_iterator: AbstractSentenceIterator,
     if not os.path.isfile(temp_model_path):
         raise McWord2vecException("word2vec model not found at path: %s" % temp_model_path)
 
-    log.info("Reading model from a temporary path...")
+    log.info("Storing model from a temporary path to a model store...")
     with open(temp_model_path, mode='rb') as model_file:
-        model_data = model_file.read()
-
-    log.info("Storing model to in a model store...")
-    models_id = model_store.store_model(model_data=model_data)
+        models_id = model_store.store_model_stream(model_stream=model_file)
 
     log.info("Cleaning up temporary directory '%s'..." % temp_directory)
     shutil.rmtree(temp_directory)
@@ -69,7 +68,7 @@ def train_word2vec_model(sentence_iterator: AbstractSentenceIterator,
     return models_id
 
 
-# MC_REWRITE_TO_PYTHON: make it return a file-like object instead of copying the whole model into 'bytes'
+# MC_REWRITE_TO_PYTHON: Perl API controller expects 'bytes'; switch it to load_word2vec_model_stream() after rewrite
 def load_word2vec_model(model_store: AbstractModelStore, models_id: int) -> bytes:
     """Load word2vec model.
 
@@ -77,3 +76,13 @@ def load_word2vec_model(model_store: AbstractModelStore, models_id: int) -> byte
     :param models_id: Model ID to load
     """
     return model_store.read_model(models_id=models_id)
+
+
+def load_word2vec_model_stream(model_store: AbstractModelStore, models_id: int) -> BinaryIO:
+    """Load word2vec model as a file-like object without copying the whole model into memory.
+
+    :param model_store: Model store to load the model from
+    :param models_id: Model ID to load
+    :return Readable stream of raw serialized model data (to be closed by the caller)
+    """
+    return model_store.read_model_stream(models_id=models_id)
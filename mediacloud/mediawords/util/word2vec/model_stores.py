@@ -1,4 +1,6 @@
 import abc
+import io
+from typing import BinaryIO
 
 from mediawords.db import DatabaseHandler
 from mediawords.key_value_store import KeyValueStore
@@ -30,6 +32,26 @@ class AbstractModelStore(object, metaclass=abc.ABCMeta):
         """
         raise NotImplementedError("Abstract method.")
 
+    def store_model_stream(self, model_stream: BinaryIO) -> int:
+        """Store model data that gets read from a stream to the store.
+
+        Default implementation reads the whole stream into memory.
+
+        :param model_stream: Readable stream of raw serialized model data to be stored
+        :return ID of a model that was just stored
+        """
+        return self.store_model(model_data=model_stream.read())
+
+    def read_model_stream(self, models_id: int) -> BinaryIO:
+        """Read model data from the store as a stream.
+
+        Default implementation reads the whole model into memory.
+
+        :param models_id: Model ID to load
+        :return Readable stream of raw serialized model data (to be closed by the caller)
+        """
+        return io.BytesIO(self.read_model(models_id=models_id))
+
 
 class AbstractDatabaseModelStore(AbstractModelStore, metaclass=abc.ABCMeta):
     """Class for storing model in a database."""
@@ -63,6 +85,9 @@ class AbstractDatabaseModelStore(AbstractModelStore, metaclass=abc.ABCMeta):
         return PostgreSQLStore(table=self.data_table())
 
     def store_model(self, model_data: bytes) -> int:
+        return self.store_model_stream(model_stream=io.BytesIO(model_data))
+
+    def store_model_stream(self, model_stream: BinaryIO) -> int:
         self.__db.begin()
 
         primary_key_column = self.__db.primary_key_column(self.model_table())
@@ -72,13 +97,17 @@ class AbstractDatabaseModelStore(AbstractModelStore, metaclass=abc.ABCMeta):
         models_id = model_metadata[primary_key_column]
 
         # Write model data
-        self.__key_value_store().store_content(db=self.__db, object_id=models_id, content=model_data)
+        self.__key_value_store().store_stream(db=self.__db, object_id=models_id, stream=model_stream)
 
         self.__db.commit()
 
         return models_id
 
     def read_model(self, models_id: int) -> bytes:
+        with self.read_model_stream(models_id=models_id) as model_stream:
+            return model_stream.read()
+
+    def read_model_stream(self, models_id: int) -> BinaryIO:
         self.__db.begin()
 
         primary_key_column = self.__db.primary_key_column(self.model_table())
@@ -94,11 +123,11 @@ class AbstractDatabaseModelStore(AbstractModelStore, metaclass=abc.ABCMeta):
         if not model_metadata:
             raise McWord2vecException("Model with object ID %d was not found." % self.__object_id)
 
-        model_data = self.__key_value_store().fetch_content(db=self.__db, object_id=models_id)
+        model_stream = self.__key_value_store().fetch_stream(db=self.__db, object_id=models_id)
 
         self.__db.commit()
 
-        return model_data
+        return model_stream
 
 
 class SnapshotDatabaseModelStore(AbstractDatabaseModelStore):
@@ -1,8 +1,7 @@
 import abc
 from abc import ABC
-from collections import deque
 from collections.abc import Iterator
-from typing import List, Optional
+from typing import Generator, List, Optional
 
 from mediawords.db import DatabaseHandler
 from mediawords.languages.factory import LanguageFactory
@@ -27,8 +26,8 @@ class SnapshotSentenceIterator(AbstractSentenceIterator, metaclass=abc.ABCMeta):
         '__db',
         '__snapshots_id',
 
-        # Deque of sentences
-        '__sentences_deque',
+        # Generator of sentences streamed from the database
+        '__sentences',
 
         # How many stories (and their sentences) to fetch in a single chunk
         '__stories_id_chunk_size',
@@ -49,69 +48,68 @@ class SnapshotSentenceIterator(AbstractSentenceIterator, metaclass=abc.ABCMeta):
         self.__snapshots_id = snapshots_id
         self.__stories_id_chunk_size = stories_id_chunk_size
 
-        self.__sentences_deque = deque()
+        self.__sentences = None
         self.__last_encountered_stories_id = 0
 
         # Verify that the snapshot exists
         if db.find_by_id(table='snapshots', object_id=snapshots_id) is None:
             raise McWord2vecException("Snapshot with ID %d does not exist." % snapshots_id)
 
-    def __fetch_next_sentences_chunk(self) -> List[str]:
-        """Fetch next chunk of story sentences of the current stories_id offset; might return an empty list.
+    def __iterate_sentences(self) -> Generator[str, None, None]:
+        """Yield all story sentences of the snapshot, streaming them from a server-side cursor.
 
         When a snapshot has many (300k+) stories, SELECTs from story_sentences with WHERE or INNER JOIN to snap.stories
         all lead to sequential scans which take forever. To prevent that, we fetch sentences for up to
-        "stories_id_chunk_size" stories at a time, feed them in __next__(), and then fetch another chunk.
+        "stories_id_chunk_size" stories at a time, stream them to __next__(), and then fetch another chunk.
         """
 
-        chunk = self.__db.query("""
-            SELECT stories_id, sentence
-            FROM story_sentences
-            WHERE stories_id IN (
-                SELECT stories_id
-                FROM snap.stories
-                WHERE snapshots_id = %(snapshots_id)s
+        while True:
 
-                  -- Reasonably fast, but maybe OFFSET would be even faster?
-                  AND stories_id > %(last_encountered_stories_id)s
-                ORDER BY stories_id
-                LIMIT %(stories_id_chunk_size)s
-            )
+            log.info("Fetching sentences with stories_id offset {} for up to {} stories...".format(
+                self.__last_encountered_stories_id,
+                self.__stories_id_chunk_size,
+            ))
 
-            -- Need ORDER to write down last fetched "stories_id"
-            ORDER BY stories_id, sentence_number
-        """, {
-            'snapshots_id': self.__snapshots_id,
-            'last_encountered_stories_id': self.__last_encountered_stories_id,
-            'stories_id_chunk_size': self.__stories_id_chunk_size,
-        }).hashes()
+            sentence_count = 0
 
-        if len(chunk):
-            self.__last_encountered_stories_id = chunk[-1]['stories_id']
+            for (stories_id, sentence,) in self.__db.query_iter("""
+                SELECT stories_id, sentence
+                FROM story_sentences
+                WHERE stories_id IN (
+                    SELECT stories_id
+                    FROM snap.stories
+                    WHERE snapshots_id = %(snapshots_id)s
 
-        sentences = [x['sentence'] for x in chunk]
+                      -- Reasonably fast, but maybe OFFSET would be even faster?
+                      AND stories_id > %(last_encountered_stories_id)s
+                    ORDER BY stories_id
+                    LIMIT %(stories_id_chunk_size)s
+                )
 
-        return sentences
+                -- Need ORDER to write down last fetched "stories_id"
+                ORDER BY stories_id, sentence_number
+            """, {
+                'snapshots_id': self.__snapshots_id,
+                'last_encountered_stories_id': self.__last_encountered_stories_id,
+                'stories_id_chunk_size': self.__stories_id_chunk_size,
+            }, as_tuples=True, read_only=True):
+                self.__last_encountered_stories_id = stories_id
+                sentence_count += 1
 
-    def __next_sentence(self) -> Optional[str]:
-        """(Fetch if needed and) return next sentence; return None if no more sentences are to be found."""
+                yield sentence
 
-        if len(self.__sentences_deque) == 0:
+            log.info("Fetched {} sentences".format(sentence_count))
 
-            log.info("Fetching sentences with stories_id offset {} for up to {} stories...".format(
-                self.__last_encountered_stories_id,
-                self.__stories_id_chunk_size,
-            ))
-            chunk = self.__fetch_next_sentences_chunk()
-            self.__sentences_deque.extend(chunk)
+            if sentence_count == 0:
+                break
 
-            log.info("Fetched {} sentences".format(len(chunk)))
+    def __next_sentence(self) -> Optional[str]:
+        """(Fetch if needed and) return next sentence; return None if no more sentences are to be found."""
 
-            # Still empty after a fetch?
-            if len(self.__sentences_deque) == 0:
-                return None
+        if self.__sentences is None:
+            self.__sentences = self.__iterate_sentences()
 
-        return self.__sentences_deque.popleft()
+        return next(self.__sentences, None)
 
     def __next__(self) -> List[str]:
         """Return list of next sentence's words to be added to the word2vec vector."""
@@ -24,7 +24,7 @@ CREATE OR REPLACE FUNCTION set_database_schema_version() RETURNS boolean AS $$
 DECLARE
     -- Database schema version number (same as a SVN revision number)
     -- Increase it by 1 if you make major database schema changes.
-    MEDIACLOUD_DATABASE_SCHEMA_VERSION CONSTANT INT := 4714;
+    MEDIACLOUD_DATABASE_SCHEMA_VERSION CONSTANT INT := 4718;
 BEGIN
 
     -- Update / set database schema version
@@ -1771,6 +1771,176 @@ CREATE TRIGGER story_sentences_view_insert_update_delete_trigger
     FOR EACH ROW EXECUTE PROCEDURE story_sentences_view_insert_update_delete();
 
 
+--
+-- First occurrence of every sentence within a medium and a week, used for
+-- lock-free sentence deduplication ("lock_free_sentence_dedup" in
+-- mediawords.yml)
+--
+-- "story_sentences_p" is partitioned by "stories_id" so a unique constraint
+-- over sentences of a medium can't be enforced on it directly; instead,
+-- workers claim the first occurrence of a sentence here with
+-- "INSERT ... ON CONFLICT DO NOTHING" and insert only the claimed sentences
+-- into "story_sentences".
+--
+CREATE TABLE story_sentences_dedup (
+    media_id            INT         NOT NULL REFERENCES media (media_id) ON DELETE CASCADE,
+    week_start_date     DATE        NOT NULL,
+
+    -- half_md5(sentence)
+    sentence_md5        BYTEA       NOT NULL,
+
+    -- Sentence in "story_sentences" that was inserted first
+    stories_id          INT         NOT NULL REFERENCES stories (stories_id) ON DELETE CASCADE,
+    sentence_number     INT         NOT NULL,
+
+    PRIMARY KEY (media_id, week_start_date, sentence_md5)
+);
+
+CREATE INDEX story_sentences_dedup_stories_id
+    ON story_sentences_dedup (stories_id);
+
+
+-- Fill "story_sentences_dedup" with existing sentences of a range of stories;
+-- run for the whole "stories_id" range (in chunks) before enabling lock-free
+-- sentence deduplication
+CREATE OR REPLACE FUNCTION story_sentences_dedup_backfill(start_stories_id INT, end_stories_id INT)
+RETURNS VOID AS
+$$
+
+    INSERT INTO story_sentences_dedup (media_id, week_start_date, sentence_md5, stories_id, sentence_number)
+        SELECT DISTINCT ON (media_id, week_start_date(publish_date::date), half_md5(sentence))
+            media_id,
+            week_start_date(publish_date::date),
+            half_md5(sentence),
+            stories_id,
+            sentence_number
+        FROM story_sentences_p
+        WHERE stories_id BETWEEN start_stories_id AND end_stories_id
+        ORDER BY media_id, week_start_date(publish_date::date), half_md5(sentence), story_sentences_p_id
+    ON CONFLICT (media_id, week_start_date, sentence_md5) DO NOTHING;
+
+$$
+LANGUAGE SQL;
+
+
+--
+-- Changes in "media_stats.num_sentences" waiting to be applied by
+-- media_stats_flush_sentence_deltas() ("media_stats_write_behind" in
+-- mediawords.yml)
+--
+-- Extractor workers append sentence count changes here instead of updating
+-- the (contended) "media_stats" rows of popular media and days directly. The
+-- table is unlogged so its contents get lost on a crash; in that case,
+-- media_stats_reconcile_num_sentences() recounts the sentences.
+--
+CREATE UNLOGGED TABLE media_stats_sentence_deltas (
+    media_id            INT         NOT NULL,
+    stat_date           DATE        NOT NULL,
+    num_sentences       INT         NOT NULL
+);
+
+
+--
+-- Stat dates of changes in "media_stats_sentence_deltas" that haven't been
+-- flushed yet
+--
+-- Unlike "media_stats_sentence_deltas", the table is logged so that it
+-- survives a crash, after which media_stats_reconcile_num_sentences() gets
+-- run for the dates found here. Extractor workers only add a row
+-- for every new date which doesn't contend much as there are few of those.
+--
+CREATE TABLE media_stats_sentence_delta_dates (
+    stat_date           DATE        NOT NULL PRIMARY KEY
+);
+
+
+-- Apply pending sentence count changes to "media_stats"; return the number of
+-- updated "media_stats" rows
+CREATE OR REPLACE FUNCTION media_stats_flush_sentence_deltas()
+RETURNS BIGINT AS
+$$
+
+    -- Wait for workers that are writing changes to commit so that dates of
+    -- the changes that are yet to become visible don't get removed
+    LOCK TABLE media_stats_sentence_deltas IN SHARE ROW EXCLUSIVE MODE;
+
+    WITH flushed_deltas AS (
+        DELETE FROM media_stats_sentence_deltas
+        RETURNING *
+    ),
+    flushed_dates AS (
+        DELETE FROM media_stats_sentence_delta_dates
+    ),
+    aggregated_deltas AS (
+        SELECT media_id,
+               stat_date,
+               SUM(num_sentences) AS num_sentences
+        FROM flushed_deltas
+        GROUP BY media_id, stat_date
+    ),
+    updated_media_stats AS (
+        UPDATE media_stats
+        SET num_sentences = media_stats.num_sentences + aggregated_deltas.num_sentences
+        FROM aggregated_deltas
+        WHERE media_stats.media_id = aggregated_deltas.media_id
+          AND media_stats.stat_date = aggregated_deltas.stat_date
+          AND aggregated_deltas.num_sentences != 0
+        RETURNING 1
+    )
+    SELECT COUNT(*) FROM updated_media_stats;
+
+$$
+LANGUAGE SQL;
+
+
+-- Recount "media_stats.num_sentences" of a date range from "story_sentences"
+-- (e.g. after pending changes in "media_stats_sentence_deltas" got lost in a
+-- crash); pending changes of the date range get discarded as they're included
+-- in the recount
+CREATE OR REPLACE FUNCTION media_stats_reconcile_num_sentences(start_date DATE, end_date DATE)
+RETURNS VOID AS
+$$
+
+    LOCK TABLE media_stats_sentence_deltas IN SHARE ROW EXCLUSIVE MODE;
+
+    WITH discarded_deltas AS (
+        DELETE FROM media_stats_sentence_deltas
+        WHERE stat_date BETWEEN start_date AND end_date
+    ),
+    discarded_dates AS (
+        DELETE FROM media_stats_sentence_delta_dates
+        WHERE stat_date BETWEEN start_date AND end_date
+    ),
+    sentence_counts AS (
+        SELECT story_sentences_p.media_id,
+               story_sentences_p.publish_date::date AS stat_date,
+               COUNT(*) AS num_sentences
+        FROM stories
+            INNER JOIN story_sentences_p
+                ON stories.stories_id = story_sentences_p.stories_id
+        WHERE stories.publish_date >= start_date
+          AND stories.publish_date < end_date + 1
+        GROUP BY story_sentences_p.media_id, story_sentences_p.publish_date::date
+    ),
+    -- Join instead of looking up every row's count in the (unindexed) CTE
+    recounted_media_stats AS (
+        SELECT media_stats.media_stats_id,
+               COALESCE(sentence_counts.num_sentences, 0) AS num_sentences
+        FROM media_stats
+            LEFT JOIN sentence_counts
+                ON media_stats.media_id = sentence_counts.media_id
+               AND media_stats.stat_date = sentence_counts.stat_date
+        WHERE media_stats.stat_date BETWEEN start_date AND end_date
+    )
+    UPDATE media_stats
+    SET num_sentences = recounted_media_stats.num_sentences
+    FROM recounted_media_stats
+    WHERE media_stats.media_stats_id = recounted_media_stats.media_stats_id;
+
+$$
+LANGUAGE SQL;
+
+
 -- update media stats table for new story. create the media / day row if needed.
 CREATE OR REPLACE FUNCTION insert_story_media_stats() RETURNS trigger AS $$
 BEGIN
@@ -3509,11 +3679,8 @@ BEGIN
         WHERE db_row_last_updated <= NOW() - INTERVAL ''3 days'';
     ';
 
-    RAISE NOTICE 'Purging "extractor_results_cache" table...';
-    EXECUTE '
-        DELETE FROM cache.extractor_results_cache
-        WHERE db_row_last_updated <= NOW() - INTERVAL ''3 days'';
-    ';
+    -- "extractor_results_cache" gets purged in batches by
+    -- purge_extractor_results_cache() in mediawords.dbi.downloads
 
 END;
 $$
@@ -3562,8 +3729,8 @@ CREATE UNLOGGED TABLE cache.extractor_results_cache (
     extracted_text              TEXT    NULL,
     downloads_id                BIGINT  NOT NULL,
 
-    -- Will be used to purge old cache objects;
-    -- don't forget to update cache.purge_object_caches()
+    -- Will be used to purge old cache objects by
+    -- purge_extractor_results_cache() in mediawords.dbi.downloads
     db_row_last_updated         TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT NOW()
 );
 CREATE UNIQUE INDEX extractor_results_cache_downloads_id
@@ -0,0 +1,94 @@
+--
+-- This is a Media Cloud PostgreSQL schema difference file (a "diff") between schema
+-- versions 4714 and 4715.
+--
+-- If you are running Media Cloud with a database that was set up with a schema version
+-- 4714, and you would like to upgrade both the Media Cloud and the
+-- database to be at version 4715, import this SQL file:
+--
+--     psql mediacloud < mediawords-4714-4715.sql
+--
+-- You might need to import some additional schema diff files to reach the desired version.
+--
+
+--
+-- 1 of 2. Import the output of 'apgdiff':
+--
+
+SET search_path = public, pg_catalog;
+
+
+--
+-- First occurrence of every sentence within a medium and a week, used for
+-- lock-free sentence deduplication ("lock_free_sentence_dedup" in
+-- mediawords.yml)
+--
+-- "story_sentences_p" is partitioned by "stories_id" so a unique constraint
+-- over sentences of a medium can't be enforced on it directly; instead,
+-- workers claim the first occurrence of a sentence here with
+-- "INSERT ... ON CONFLICT DO NOTHING" and insert only the claimed sentences
+-- into "story_sentences".
+--
+CREATE TABLE story_sentences_dedup (
+    media_id            INT         NOT NULL REFERENCES media (media_id) ON DELETE CASCADE,
+    week_start_date     DATE        NOT NULL,
+
+    -- half_md5(sentence)
+    sentence_md5        BYTEA       NOT NULL,
+
+    -- Sentence in "story_sentences" that was inserted first
+    stories_id          INT         NOT NULL REFERENCES stories (stories_id) ON DELETE CASCADE,
+    sentence_number     INT         NOT NULL,
+
+    PRIMARY KEY (media_id, week_start_date, sentence_md5)
+);
+
+CREATE INDEX story_sentences_dedup_stories_id
+    ON story_sentences_dedup (stories_id);
+
+
+-- Fill "story_sentences_dedup" with existing sentences of a range of stories;
+-- run for the whole "stories_id" range (in chunks) before enabling lock-free
+-- sentence deduplication
+CREATE OR REPLACE FUNCTION story_sentences_dedup_backfill(start_stories_id INT, end_stories_id INT)
+RETURNS VOID AS
+$$
+
+    INSERT INTO story_sentences_dedup (media_id, week_start_date, sentence_md5, stories_id, sentence_number)
+        SELECT DISTINCT ON (media_id, week_start_date(publish_date::date), half_md5(sentence))
+            media_id,
+            week_start_date(publish_date::date),
+            half_md5(sentence),
+            stories_id,
+            sentence_number
+        FROM story_sentences_p
+        WHERE stories_id BETWEEN start_stories_id AND end_stories_id
+        ORDER BY media_id, week_start_date(publish_date::date), half_md5(sentence), story_sentences_p_id
+    ON CONFLICT (media_id, week_start_date, sentence_md5) DO NOTHING;
+
+$$
+LANGUAGE SQL;
+
+
+--
+-- 2 of 2. Reset the database version.
+--
+
+CREATE OR REPLACE FUNCTION set_database_schema_version() RETURNS boolean AS $$
+DECLARE
+    -- Database schema version number (same as a SVN revision number)
+    -- Increase it by 1 if you make major database schema changes.
+    MEDIACLOUD_DATABASE_SCHEMA_VERSION CONSTANT INT := 4715;
+BEGIN
+
+    -- Update / set database schema version
+    DELETE FROM database_variables WHERE name = 'database-schema-version';
+    INSERT INTO database_variables (name, value) VALUES ('database-schema-version', MEDIACLOUD_DATABASE_SCHEMA_VERSION::int);
+
+    return true;
+
+END;
+$$
+LANGUAGE 'plpgsql';
+
+SELECT set_database_schema_version();
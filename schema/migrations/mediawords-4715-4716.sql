@@ -0,0 +1,127 @@
+--
+-- This is a Media Cloud PostgreSQL schema difference file (a "diff") between schema
+-- versions 4715 and 4716.
+--
+-- If you are running Media Cloud with a database that was set up with a schema version
+-- 4715, and you would like to upgrade both the Media Cloud and the
+-- database to be at version 4716, import this SQL file:
+--
+--     psql mediacloud < mediawords-4715-4716.sql
+--
+-- You might need to import some additional schema diff files to reach the desired version.
+--
+
+--
+-- 1 of 2. Import the output of 'apgdiff':
+--
+
+SET search_path = public, pg_catalog;
+
+
+--
+-- Changes in "media_stats.num_sentences" waiting to be applied by
+-- media_stats_flush_sentence_deltas() ("media_stats_write_behind" in
+-- mediawords.yml)
+--
+-- Extractor workers append sentence count changes here instead of updating
+-- the (contended) "media_stats" rows of popular media and days directly. The
+-- table is unlogged so its contents get lost on a crash; in that case,
+-- media_stats_reconcile_num_sentences() recounts the sentences.
+--
+CREATE UNLOGGED TABLE media_stats_sentence_deltas (
+    media_id            INT         NOT NULL,
+    stat_date           DATE        NOT NULL,
+    num_sentences       INT         NOT NULL
+);
+
+
+-- Apply pending sentence count changes to "media_stats"; return the number of
+-- updated "media_stats" rows
+CREATE OR REPLACE FUNCTION media_stats_flush_sentence_deltas()
+RETURNS BIGINT AS
+$$
+
+    WITH flushed_deltas AS (
+        DELETE FROM media_stats_sentence_deltas
+        RETURNING *
+    ),
+    aggregated_deltas AS (
+        SELECT media_id,
+               stat_date,
+               SUM(num_sentences) AS num_sentences
+        FROM flushed_deltas
+        GROUP BY media_id, stat_date
+    ),
+    updated_media_stats AS (
+        UPDATE media_stats
+        SET num_sentences = media_stats.num_sentences + aggregated_deltas.num_sentences
+        FROM aggregated_deltas
+        WHERE media_stats.media_id = aggregated_deltas.media_id
+          AND media_stats.stat_date = aggregated_deltas.stat_date
+          AND aggregated_deltas.num_sentences != 0
+        RETURNING 1
+    )
+    SELECT COUNT(*) FROM updated_media_stats;
+
+$$
+LANGUAGE SQL;
+
+
+-- Recount "media_stats.num_sentences" of a date range from "story_sentences"
+-- (e.g. after pending changes in "media_stats_sentence_deltas" got lost in a
+-- crash); pending changes of the date range get discarded as they're included
+-- in the recount
+CREATE OR REPLACE FUNCTION media_stats_reconcile_num_sentences(start_date DATE, end_date DATE)
+RETURNS VOID AS
+$$
+
+    WITH discarded_deltas AS (
+        DELETE FROM media_stats_sentence_deltas
+        WHERE stat_date BETWEEN start_date AND end_date
+    ),
+    sentence_counts AS (
+        SELECT story_sentences_p.media_id,
+               story_sentences_p.publish_date::date AS stat_date,
+               COUNT(*) AS num_sentences
+        FROM stories
+            INNER JOIN story_sentences_p
+                ON stories.stories_id = story_sentences_p.stories_id
+        WHERE stories.publish_date >= start_date
+          AND stories.publish_date < end_date + 1
+        GROUP BY story_sentences_p.media_id, story_sentences_p.publish_date::date
+    )
+    UPDATE media_stats
+    SET num_sentences = COALESCE((
+        SELECT sentence_counts.num_sentences
+        FROM sentence_counts
+        WHERE sentence_counts.media_id = media_stats.media_id
+          AND sentence_counts.stat_date = media_stats.stat_date
+    ), 0)
+    WHERE media_stats.stat_date BETWEEN start_date AND end_date;
+
+$$
+LANGUAGE SQL;
+
+
+--
+-- 2 of 2. Reset the database version.
+--
+
+CREATE OR REPLACE FUNCTION set_database_schema_version() RETURNS boolean AS $$
+DECLARE
+    -- Database schema version number (same as a SVN revision number)
+    -- Increase it by 1 if you make major database schema changes.
+    MEDIACLOUD_DATABASE_SCHEMA_VERSION CONSTANT INT := 4716;
+BEGIN
+
+    -- Update / set database schema version
+    DELETE FROM database_variables WHERE name = 'database-schema-version';
+    INSERT INTO database_variables (name, value) VALUES ('database-schema-version', MEDIACLOUD_DATABASE_SCHEMA_VERSION::int);
+
+    return true;
+
+END;
+$$
+LANGUAGE 'plpgsql';
+
+SELECT set_database_schema_version();
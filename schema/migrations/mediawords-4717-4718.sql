@@ -0,0 +1,143 @@
+--
+-- This is a Media Cloud PostgreSQL schema difference file (a "diff") between schema
+-- versions 4717 and 4718.
+--
+-- If you are running Media Cloud with a database that was set up with a schema version
+-- 4717, and you would like to upgrade both the Media Cloud and the
+-- database to be at version 4718, import this SQL file:
+--
+--     psql mediacloud < mediawords-4717-4718.sql
+--
+-- You might need to import some additional schema diff files to reach the desired version.
+--
+
+--
+-- 1 of 2. Import the output of 'apgdiff':
+--
+
+SET search_path = public, pg_catalog;
+
+
+--
+-- Stat dates of changes in "media_stats_sentence_deltas" that haven't been
+-- flushed yet
+--
+-- Unlike "media_stats_sentence_deltas", the table is logged so that it
+-- survives a crash, after which media_stats_reconcile_num_sentences() gets
+-- run for the dates found here. Extractor workers only add a row
+-- for every new date which doesn't contend much as there are few of those.
+--
+CREATE TABLE media_stats_sentence_delta_dates (
+    stat_date           DATE        NOT NULL PRIMARY KEY
+);
+
+
+-- Apply pending sentence count changes to "media_stats"; return the number of
+-- updated "media_stats" rows
+CREATE OR REPLACE FUNCTION media_stats_flush_sentence_deltas()
+RETURNS BIGINT AS
+$$
+
+    -- Wait for workers that are writing changes to commit so that dates of
+    -- the changes that are yet to become visible don't get removed
+    LOCK TABLE media_stats_sentence_deltas IN SHARE ROW EXCLUSIVE MODE;
+
+    WITH flushed_deltas AS (
+        DELETE FROM media_stats_sentence_deltas
+        RETURNING *
+    ),
+    flushed_dates AS (
+        DELETE FROM media_stats_sentence_delta_dates
+    ),
+    aggregated_deltas AS (
+        SELECT media_id,
+               stat_date,
+               SUM(num_sentences) AS num_sentences
+        FROM flushed_deltas
+        GROUP BY media_id, stat_date
+    ),
+    updated_media_stats AS (
+        UPDATE media_stats
+        SET num_sentences = media_stats.num_sentences + aggregated_deltas.num_sentences
+        FROM aggregated_deltas
+        WHERE media_stats.media_id = aggregated_deltas.media_id
+          AND media_stats.stat_date = aggregated_deltas.stat_date
+          AND aggregated_deltas.num_sentences != 0
+        RETURNING 1
+    )
+    SELECT COUNT(*) FROM updated_media_stats;
+
+$$
+LANGUAGE SQL;
+
+
+-- Recount "media_stats.num_sentences" of a date range from "story_sentences"
+-- (e.g. after pending changes in "media_stats_sentence_deltas" got lost in a
+-- crash); pending changes of the date range get discarded as they're included
+-- in the recount
+CREATE OR REPLACE FUNCTION media_stats_reconcile_num_sentences(start_date DATE, end_date DATE)
+RETURNS VOID AS
+$$
+
+    LOCK TABLE media_stats_sentence_deltas IN SHARE ROW EXCLUSIVE MODE;
+
+    WITH discarded_deltas AS (
+        DELETE FROM media_stats_sentence_deltas
+        WHERE stat_date BETWEEN start_date AND end_date
+    ),
+    discarded_dates AS (
+        DELETE FROM media_stats_sentence_delta_dates
+        WHERE stat_date BETWEEN start_date AND end_date
+    ),
+    sentence_counts AS (
+        SELECT story_sentences_p.media_id,
+               story_sentences_p.publish_date::date AS stat_date,
+               COUNT(*) AS num_sentences
+        FROM stories
+            INNER JOIN story_sentences_p
+                ON stories.stories_id = story_sentences_p.stories_id
+        WHERE stories.publish_date >= start_date
+          AND stories.publish_date < end_date + 1
+        GROUP BY story_sentences_p.media_id, story_sentences_p.publish_date::date
+    ),
+    -- Join instead of looking up every row's count in the (unindexed) CTE
+    recounted_media_stats AS (
+        SELECT media_stats.media_stats_id,
+               COALESCE(sentence_counts.num_sentences, 0) AS num_sentences
+        FROM media_stats
+            LEFT JOIN sentence_counts
+                ON media_stats.media_id = sentence_counts.media_id
+               AND media_stats.stat_date = sentence_counts.stat_date
+        WHERE media_stats.stat_date BETWEEN start_date AND end_date
+    )
+    UPDATE media_stats
+    SET num_sentences = recounted_media_stats.num_sentences
+    FROM recounted_media_stats
+    WHERE media_stats.media_stats_id = recounted_media_stats.media_stats_id;
+
+$$
+LANGUAGE SQL;
+
+
+--
+-- 2 of 2. Reset the database version.
+--
+
+CREATE OR REPLACE FUNCTION set_database_schema_version() RETURNS boolean AS $$
+DECLARE
+    -- Database schema version number (same as a SVN revision number)
+    -- Increase it by 1 if you make major database schema changes.
+    MEDIACLOUD_DATABASE_SCHEMA_VERSION CONSTANT INT := 4718;
+BEGIN
+
+    -- Update / set database schema version
+    DELETE FROM database_variables WHERE name = 'database-schema-version';
+    INSERT INTO database_variables (name, value) VALUES ('database-schema-version', MEDIACLOUD_DATABASE_SCHEMA_VERSION::int);
+
+    return true;
+
+END;
+$$
+LANGUAGE 'plpgsql';
+
+SELECT set_database_schema_version();
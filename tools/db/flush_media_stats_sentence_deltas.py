@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+#
+# Periodically apply pending "media_stats" sentence count changes (written by
+# extractor workers when "media_stats_write_behind" is enabled) and reconcile
+# sentence counts of dates with pending changes after a database restart
+#
+
+import time
+
+from mediawords.db import connect_to_db
+from mediawords.dbi.media_stats import (
+    flush_media_stats_sentence_deltas,
+    pending_media_stats_sentence_deltas_date_ranges,
+    reconcile_media_stats_num_sentences,
+)
+from mediawords.util.log import create_logger
+from mediawords.util.process import run_alone
+
+log = create_logger(__name__)
+
+
+def flush_media_stats():
+    """Flush "media_stats_sentence_deltas" every minute; recount sentences of dates with pending changes on startup and
+    whenever the database server gets restarted as the unlogged table might have lost its contents in a crash."""
+
+    # Wait for a minute between flushes
+    delay_between_attempts = 60
+
+    last_postmaster_start_time = None
+
+    log.info("Starting to flush media_stats sentence deltas...")
+    while True:
+        db = connect_to_db()
+
+        postmaster_start_time = db.query("SELECT pg_postmaster_start_time()").flat()[0]
+        if postmaster_start_time != last_postmaster_start_time:
+            # Dates of pending changes are kept in a logged table so they're known even if the changes got lost
+            # Recount only the recorded dates as a single old date would otherwise extend the recount over years
+            for start_date, end_date in pending_media_stats_sentence_deltas_date_ranges(db=db):
+                reconcile_media_stats_num_sentences(db=db, start_date=start_date, end_date=end_date)
+            last_postmaster_start_time = postmaster_start_time
+
+        updated_rows = flush_media_stats_sentence_deltas(db=db)
+
+        db.disconnect()
+
+        log.info("Updated %d media_stats rows, sleeping for %d seconds." % (updated_rows, delay_between_attempts))
+        time.sleep(delay_between_attempts)
+
+
+if __name__ == '__main__':
+    run_alone(flush_media_stats)
@@ -6,6 +6,7 @@
 import time
 
 from mediawords.db import connect_to_db
+from mediawords.dbi.downloads import purge_extractor_results_cache
 from mediawords.util.log import create_logger
 from mediawords.util.process import run_alone
 
@@ -24,6 +25,7 @@ def purge_object_caches():
 
         db = connect_to_db()
         db.query('SELECT cache.purge_object_caches()')
+        purge_extractor_results_cache(db=db)
         db.disconnect()
 
         log.info("Purged object caches, sleeping for %d seconds." % delay_between_attempts)